@@ -0,0 +1,97 @@
+"""
+DrillingAnalysisEngine 純函數的記憶化 (memoization)。
+
+interpolate_base_life、get_ld_sens_ijk、calculate_dri、calc_g66_segments、get_default_ijk 的結果
+只取決於參數與 ConfigManager.data；UI 每次訊號 (切換刀具、調整數值) 都會重新計算。
+以參數與設定檔版本 (ConfigManager.version，save_config / import_config / reset_to_defaults 時遞增)
+為鍵快取結果，設定變更後舊的項目自然不再命中，並以 LRU 淘汰限制項目數。
+
+參數中的 dict / list 依內容轉為可雜湊的鍵；仍無法雜湊的參數直接計算不快取。
+"""
+import copy
+import functools
+from collections import OrderedDict
+
+from config_manager import ConfigManager
+
+# 每個函數預設保留的項目數
+DEFAULT_MAXSIZE = 1024
+
+_MEMOS = []
+
+
+def _freeze(value):
+    """參數轉為可雜湊的鍵：設定檔以版本代表，dict / list 依內容展開。"""
+    if isinstance(value, ConfigManager):
+        return (ConfigManager, value.version)
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((k, _freeze(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(v) for v in value))
+    return value
+
+
+class ConfigMemo:
+    """以參數與設定檔版本為鍵、LRU 淘汰的結果快取 (附命中 / 未命中計數)。"""
+
+    def __init__(self, func, maxsize=DEFAULT_MAXSIZE, copy_result=False):
+        self.func = func
+        self.maxsize = maxsize
+        # 結果為可變物件 (如分段列表) 時回傳複本，避免呼叫端修改快取內容
+        self.copy_result = copy_result
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, *args, **kwargs):
+        try:
+            key = (_freeze(args), _freeze(kwargs))
+            result = self.entries[key]
+        except TypeError:
+            return self.func(*args, **kwargs)
+        except KeyError:
+            self.misses += 1
+            result = self.func(*args, **kwargs)
+            self.entries[key] = result
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return copy.deepcopy(result) if self.copy_result else result
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+
+def config_memoized(maxsize=DEFAULT_MAXSIZE, copy_result=False):
+    """
+    裝飾器：以 ConfigMemo 記憶化函數 (置於 staticmethod / classmethod 之下)。
+    被裝飾的函數提供 cache_info() 與 cache_clear()。
+    """
+    def decorate(func):
+        memo = ConfigMemo(func, maxsize, copy_result)
+        _MEMOS.append(memo)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return memo(*args, **kwargs)
+        wrapper.cache_info = memo.info
+        wrapper.cache_clear = memo.clear
+        wrapper.memo = memo
+        return wrapper
+    return decorate
+
+
+def cache_stats():
+    """各記憶化函數的 {名稱: {'hits', 'misses', 'size', 'maxsize'}}。"""
+    return {memo.func.__qualname__: memo.info() for memo in _MEMOS}
+
+
+def clear_caches():
+    for memo in _MEMOS:
+        memo.clear()
@@ -1,10 +1,62 @@
 import math
+from itertools import groupby
+
+import numpy as np
+
+from nc_peck import MAX_PECKS, PeckLimitError
+from analysis_cache import config_memoized
+
+
+def _abs_series(a, b, n):
+    """
+    等差數列絕對值和 Σ_{p=0}^{n-1} |a + b·p| 的封閉解 O(1)：
+    以 a + b·p = 0 的位置將數列分為正負兩段，各段為一般等差級數。
+    """
+    if n <= 0:
+        return 0.0
+    if b == 0:
+        return n * abs(a)
+
+    def partial(p0, p1):
+        m = p1 - p0
+        return m * a + b * (p0 + p1 - 1) * m / 2.0
+
+    root = -a / b
+    if b > 0:
+        # p >= k 為非負
+        k = min(max(math.ceil(root), 0), n)
+        return partial(k, n) - partial(0, k)
+    # p < k 為非負
+    k = min(max(math.floor(root) + 1, 0), n)
+    return partial(0, k) - partial(k, n)
+
+
+def _round_np(values, ndigits):
+    """
+    向量化取位 (ndigits 可為陣列)：乘 10^n 後以 np.rint 取整 (ties-to-even)。
+    與 Python round 的差異僅在進位邊界：round 依二進位的精確值判斷，
+    此處依乘 10^n 後的浮點數判斷，如 round(2.675, 2) 為 2.67 而此處為 2.68。
+    """
+    scale = 10.0 ** np.asarray(ndigits, dtype=np.float64)
+    return np.rint(values * scale) / scale
+
+
+def _lookup(keys, func):
+    """字串欄位查表：每個不同的鍵只呼叫 func 一次。"""
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    return np.array([func(k) for k in uniq.tolist()], dtype=np.float64)[inverse.ravel()]
+
 
 class DrillingAnalysisEngine:
     """
     專門處理加工效率分析與時間預估的邏輯引擎。
     將邏輯與 UI 分離。
     """
+    # 刀具材質對切速與進給的修正比例
+    TOOL_MATERIALS = {
+        'CARBIDE': {'speed_ratio': 1.0, 'feed_ratio': 1.0},
+        'HSS':     {'speed_ratio': 0.4, 'feed_ratio': 0.8}
+    }
     
     @staticmethod
     def _precision_for_dia(diameter):
@@ -12,6 +64,7 @@ class DrillingAnalysisEngine:
         return 3 if diameter < 0.5 else 2
 
     @staticmethod
+    @config_memoized()
     def interpolate_base_life(diameter, mat_config_dict):
         """
         以雙對數 (Log-Log) 插值計算基準壽命，實現真正的 Power-law (指數型) 分級。
@@ -73,36 +126,51 @@ class DrillingAnalysisEngine:
         """
         if feedrate <= 0:
             return float('inf')
-            
-        total_t = 0
-        current_z = r_point # 從 R 點開始計算
-        
+        if not ijk_list:
+            return 0
         # [FIX-8] 統一為單一啄鑽時間計算邏輯 (G83 專用)
         # G66 P9131 時間預估使用 calc_g66_drilling_time()
-        for idx, peck in enumerate(ijk_list):
-            # peck['I'] 是當次下鑽的增量深度 (通常為負值)
-            increment = peck.get('I', 0.0)
-            prev_z = current_z
-            target_z = prev_z + increment
-            
-            if idx == 0:
-                # 第一跳：從 R 點一路進給進刀
-                feed_dist = abs(target_z - r_point)
-                total_t += feed_dist / feedrate
-            else:
-                # 後續跳：快速回到 (上次深度 + 間隙)，再進給進刀
-                dist_g0_down = abs(r_point - (prev_z + clearance))
-                total_t += dist_g0_down / g0_speed
-                feed_dist = abs(target_z - (prev_z + clearance))
-                total_t += feed_dist / feedrate
-            
-            # 孔底快速退回 R
-            dist_g0_up = abs(target_z - r_point)
-            total_t += dist_g0_up / g0_speed
-            
-            current_z = target_z
-            
-        return total_t
+        # 連續相同增量的啄鑽合併為一段 (固定 Q 與 I/J/K 遞減後的 K)，各段以等差級數計算
+        runs = [(inc, sum(1 for _ in group)) for inc, group in groupby(peck.get('I', 0.0) for peck in ijk_list)]
+        return DrillingAnalysisEngine.calc_peck_runs_time(runs, feedrate, r_point, g0_speed, clearance)
+
+    @staticmethod
+    def calc_peck_runs_time(runs, feedrate, r_point, g0_speed, clearance=0.1):
+        """
+        G83 單孔時間 (分鐘)，啄鑽以連續段 [(增量, 次數), ...] 表示 (連續 次數 跳皆下鑽 增量)。
+        移動距離由 calc_peck_runs_distance 計算，計算量與段數成正比。
+        """
+        if feedrate <= 0:
+            return float('inf')
+        rapid, feed = DrillingAnalysisEngine.calc_peck_runs_distance(runs, r_point, clearance)
+        return rapid / g0_speed + feed / feedrate
+
+    @staticmethod
+    def calc_peck_runs_distance(runs, r_point, clearance=0.1):
+        """
+        G83 單孔的 (快速移動距離, 進給距離)，啄鑽以連續段 [(增量, 次數), ...] 表示。
+        與逐跳計算相同：第一跳由 R 點進給；之後每跳快速回到 (上次深度 + 間隙) 再進給，
+        每跳結束快速退回 R。每段的快速移動距離為等差數列的絕對值和。
+        """
+        rapid = feed = 0.0
+        current_z = r_point
+        first = True
+        for inc, count in runs:
+            if count <= 0:
+                continue
+            if first:
+                # 第一跳：從 R 點一路進給進刀，孔底快速退回 R
+                feed += abs(inc)
+                rapid += abs(inc)
+                current_z += inc
+                count -= 1
+                first = False
+            # 後續跳 (第 p 跳由 current_z + p * inc 開始)：快速回到 (上次深度 + 間隙)，進給進刀，快速退回 R
+            rapid += _abs_series(r_point - clearance - current_z, -inc, count)
+            rapid += _abs_series(current_z + inc - r_point, inc, count)
+            feed += count * abs(inc - clearance)
+            current_z += inc * count
+        return rapid, feed
 
     @classmethod
     def compare_efficiency(cls, current_params, initial_params, cycle_type='G83', g0_speed=5000):
@@ -110,7 +178,8 @@ class DrillingAnalysisEngine:
         比較兩組參數的加工效率 (支援 G83 與 G66)。
         
         Args:
-            current_params (dict): 參數字典 (G83: {ijk_list, feedrate, r_point, is_ijk_mode}, G66: {segments, r_point})
+            current_params (dict): 參數字典 (G83: {ijk_list, feedrate, r_point, is_ijk_mode}, G66: {segments, r_point})；
+                G83 可改傳 schedule (nc_peck.PeckSchedule) 取代 ijk_list，跳數超過展開上限時仍可比較
             initial_params (dict): 初始參數字典
             cycle_type (str): 'G83' 或 'G66'
             g0_speed (float): 機台快速速度
@@ -141,24 +210,18 @@ class DrillingAnalysisEngine:
             curr_pecks = count_g66_pecks(curr_segs, curr_r)
             init_pecks = count_g66_pecks(init_segs, init_r)
         else:
-            curr_t = cls.calc_drilling_time(
-                current_params['ijk_list'], 
-                current_params['feedrate'], 
-                current_params['r_point'], 
-                g0_speed, 
-                current_params['is_ijk_mode']
-            )
-            
-            init_t = cls.calc_drilling_time(
-                initial_params['ijk_list'], 
-                initial_params['feedrate'], 
-                initial_params['r_point'], 
-                g0_speed, 
-                initial_params['is_ijk_mode']
-            )
-            
-            curr_pecks = len(current_params['ijk_list'])
-            init_pecks = len(initial_params['ijk_list'])
+            def g83_time_pecks(params):
+                schedule = params.get('schedule')
+                if schedule is None:
+                    ijk_list = params['ijk_list']
+                    t = cls.calc_drilling_time(ijk_list, params['feedrate'], params['r_point'],
+                                               g0_speed, params['is_ijk_mode'])
+                    return t, len(ijk_list)
+                t = cls.calc_peck_runs_time(schedule.runs(), params['feedrate'], params['r_point'], g0_speed)
+                return t, schedule.count
+
+            curr_t, curr_pecks = g83_time_pecks(current_params)
+            init_t, init_pecks = g83_time_pecks(initial_params)
         
         save_pct = 0.0
         if init_t > 0 and init_t != float('inf') and curr_t != float('inf'):
@@ -173,6 +236,7 @@ class DrillingAnalysisEngine:
         }
 
     @staticmethod
+    @config_memoized()
     def calculate_dri(diameter, depth, material_key, coolant_mode, tool_mat_key, config=None):
         """計算鑽孔風險指數 (Drilling Risk Index, DRI)"""
         if diameter <= 0: return 999
@@ -207,19 +271,29 @@ class DrillingAnalysisEngine:
             return "DEEP_PROTECT" # 極高風險：深孔保護模式
 
     @staticmethod
-    def calc_g83_dynamic_pecks(i_val, k_val, target_depth, power=0.6):
-        """[G83 專用] 使用冪次衰減模型生成動態 Peck 序列"""
+    def calc_g83_dynamic_pecks(i_val, k_val, target_depth, power=0.6, max_pecks=MAX_PECKS):
+        """
+        [G83 專用] 使用冪次衰減模型生成動態 Peck 序列。
+        每跳不低於 min(I, K) (K 過小時以 1e-6 為下限)，跳數不超過 ceil(深度 / 最小跳)；
+        實際跳數超過 max_pecks 時引發 PeckLimitError (展開至上限即停止)。
+        """
+        if target_depth <= 1e-6 or i_val <= 1e-6:
+            return []
+        floor = max(k_val, 1e-6)
+        bound = math.ceil(target_depth / min(floor, i_val)) + 1
+
         pecks = []
         current_depth = 0.0
         last_peck = i_val
-        
-        while current_depth < target_depth - 1e-6:
+        while current_depth < target_depth - 1e-6 and len(pecks) < bound:
+            if max_pecks is not None and len(pecks) >= max_pecks:
+                raise PeckLimitError(f"啄鑽跳數超過上限 {max_pecks}")
             # 衰減因子
             decay = 1.0 - (current_depth / target_depth) ** power
             peck = k_val + (i_val - k_val) * decay
             
             # 安全限制：確保單調遞減 (Monotonicity) 且不低於最小值
-            peck = max(peck, k_val)
+            peck = max(peck, floor)
             peck = min(peck, last_peck)
             
             # 若剩餘深度不足一跳，則直達孔底
@@ -267,6 +341,7 @@ class DrillingAnalysisEngine:
         return min(raw_index, 10.0)
 
     @staticmethod
+    @config_memoized()
     def get_ld_sens_ijk(diameter, ld_ratio, material_key='SUS420', coolant_factor=1.0, config=None):
         """基於長徑比 L/D 與前置條件計算感應式 I, J, K 基礎值 (V6.2 高效首鑽版)"""
         r_eff = min(ld_ratio, 10.0)
@@ -310,6 +385,7 @@ class DrillingAnalysisEngine:
                 round(diameter * k_factor, prec))
 
     @classmethod
+    @config_memoized()
     def get_default_ijk(cls, diameter, mode='efficient', config=None):
         """
         整合比例比例常數法計算 G83 I/J/K 建議值。
@@ -357,6 +433,7 @@ class DrillingAnalysisEngine:
     # =========================================================================
 
     @classmethod
+    @config_memoized(copy_result=True)
     def calc_g66_segments(cls, tool_dia, target_z, base_feed, strategy='IJK_DYNAMIC',
                           config=None, material_key='SUS420', preset='balanced'):
         """
@@ -500,24 +577,18 @@ class DrillingAnalysisEngine:
             
             seg_depth = abs(seg_z - prev_seg_end)
             num_pecks = max(1, math.ceil(seg_depth / seg_q))
-            
-            current_z = prev_seg_end
-            for p in range(num_pecks):
-                peck_end = max(current_z - seg_q, seg_z) if seg_z < current_z else min(current_z + seg_q, seg_z)
-                actual_peck = abs(peck_end - current_z)
-                
-                if p == 0:
-                    # 段內首跳：從 R 點進給下壓
-                    total_t += abs(current_z - r_point) / g0_speed  # 快速接近
-                    total_t += actual_peck / seg_f                   # 進給切削
-                else:
-                    # 段內後續跳：退到 R → 快速接近 → 進給切削
-                    total_t += abs(current_z - clearance - r_point) / g0_speed  # 快速接近
-                    total_t += (actual_peck + clearance) / seg_f                # 進給切削
-                
-                # 退刀至 R
-                total_t += abs(peck_end - r_point) / g0_speed
-                current_z = peck_end
+            # 段內第 p 跳由 prev_seg_end + p * step 開始，最後一跳止於段終點 (不足 Q 的餘量)
+            step = -seg_q if seg_z < prev_seg_end else seg_q
+            rest = num_pecks - 1
+            
+            # 段內首跳：從 R 點進給下壓 (快速接近)
+            rapid = abs(prev_seg_end - r_point)
+            # 段內後續跳：退到 R → 快速接近 (上次深度 - 間隙)
+            rapid += _abs_series(prev_seg_end + step - clearance - r_point, step, rest)
+            # 每跳退刀至 R
+            rapid += _abs_series(prev_seg_end + step - r_point, step, rest) + abs(seg_z - r_point)
+            # 進給切削：各跳切削量總和為段深度，後續跳另含間隙
+            total_t += rapid / g0_speed + (seg_depth + rest * clearance) / seg_f
             
             prev_seg_end = seg_z
         
@@ -563,6 +634,20 @@ class DrillingAnalysisEngine:
             
         return current_peck
 
+    @staticmethod
+    def _optimize_harmonic_peck_batch(target_depth, current_peck, min_allowable_peck, precision):
+        """_optimize_harmonic_peck 的陣列版本 (precision 可為陣列)；一刀到底時的取位見 _round_np。"""
+        usable = (current_peck > 0) & (target_depth > 0)
+        through = usable & (current_peck >= target_depth)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n_steps = np.ceil(target_depth / current_peck)
+            exact_min_peck = target_depth / n_steps
+        multiplier = 10.0 ** precision
+        best_peck = np.ceil(exact_min_peck * multiplier) / multiplier
+        better = usable & ~through & (best_peck < current_peck) & (best_peck >= min_allowable_peck)
+        result = np.where(better, best_peck, current_peck)
+        return np.where(through, _round_np(target_depth, precision), result)
+
     @classmethod
     def calculate_optimized_params(cls, 
                                    tool_dia, 
@@ -579,7 +664,11 @@ class DrillingAnalysisEngine:
                                    prefer_ijk=None,
                                    preset='balanced',
                                    taylor_n=None):
-        """計算最佳化切削參數 (進階工業模型版)"""
+        """
+        計算最佳化切削參數 (進階工業模型版)。
+        數值以長度 1 的陣列交由 _optimize_columns 計算 (與批次版本同一套算式)，
+        此處另外產生 messages 與 IJK 模式的 g66_segments。
+        """
         result = {
             'S': 0.0, 'F': 0.0, 'Q': 0.0, 
             'I': 0.0, 'J': 0.0, 'K': 0.0, 'Z': target_z,
@@ -590,159 +679,44 @@ class DrillingAnalysisEngine:
         if tool_dia <= 0:
             result['messages'].append("錯誤：刀具直徑必須大於 0")
             return result
-            
-        depth = abs(target_z)
-        ld_ratio = depth / tool_dia
-        
-        # 0. 取得基礎配置
-        if config:
-            mat_data = config.get_material_data(material_key)
-            max_rpm = config.get_limit('max_rpm') or max_rpm
-        else:
-            mat_data = {'Vc': 50.0, 'fr_factor': 0.01} # 預留降級處置
-            
-        TOOL_MATERIALS = {
-            'CARBIDE': {'speed_ratio': 1.0, 'feed_ratio': 1.0},
-            'HSS':     {'speed_ratio': 0.4, 'feed_ratio': 0.8}
-        }
-        tool_data = TOOL_MATERIALS.get(tool_mat_key, TOOL_MATERIALS['CARBIDE'])
-        
-        # 1. 幾何感知修正 (倒角)
-        if exit_chamfer > 0 and tip_angle > 0:
-            half_angle_rad = math.radians(tip_angle / 2.0)
-            extra_depth = (exit_chamfer / 2.0) / math.tan(half_angle_rad)
-            calculated_z = - (material_thickness + extra_depth + 0.2)
-            if calculated_z < target_z:
-                result['Z'] = round(calculated_z, 4)
-                depth = abs(result['Z'])
-                ld_ratio = depth / tool_dia
-                result['messages'].append(f"幾何感知：自動補償 Z 深度至 {result['Z']} (含倒角)")
 
+        columns, detail = cls._optimize_columns(
+            tool_dia, target_z, material_key, tool_mat_key, max_rpm, current_s, material_thickness,
+            exit_chamfer, tip_angle, config, coolant_mode, prefer_ijk, taylor_n)
+        result.update((key, values[0].item()) for key, values in columns.items())
+        d = {key: values[0].item() for key, values in detail.items()}
+        messages = result['messages']
+        strategy = result['strategy']
+
+        # 1. 幾何感知修正 (倒角)
+        if d['geo']:
+            messages.append(f"幾何感知：自動補償 Z 深度至 {result['Z']} (含倒角)")
         # 2. DRI 風險評估與戰略選取
-        dri = cls.calculate_dri(tool_dia, depth, material_key, coolant_mode, tool_mat_key, config)
-        strategy = cls.select_strategy(dri)
-        result['dri'] = round(dri, 1)
-        result['strategy'] = strategy
-        result['messages'].append(f"風險評估：DRI={result['dri']} (戰略: {strategy})")
-        
-        # 3. 轉速與進給計算 (含二階深度修正)
-        coolant_factor = 1.0
-        if config:
-            coolant_factor = config.data.get('coolant_factors', {}).get(coolant_mode, 1.0)
-            
-            
-        vc_ref = mat_data['Vc'] * tool_data['speed_ratio']
-        # [L3 修復] 微鑽切速修正：D<1mm 時，教科書的參考切速是給大直徑鑽頭用的
-        # 微鑽散熱差、振動大，最佳切速要大幅折減
+        messages.append(f"風險評估：DRI={result['dri']} (戰略: {strategy})")
+        # 3. 轉速與進給
         if tool_dia < 1.0:
-            micro_vc_factor = max(0.3, tool_dia)  # D=0.65 → ×0.65, D=0.1 → ×0.3
-            vc_ref *= micro_vc_factor
-            result['messages'].append(f"微鑽修正：參考切速折減至 {round(vc_ref, 1)} m/min (×{micro_vc_factor:.2f})")
-        vc_base = vc_ref * coolant_factor
-        # [V6.0] 隨長徑比調整 RPM 與 Feed，修正系數優化為 0.035
-        rpm_adj_factor = 1.0 / (1.0 + 0.035 * ld_ratio)
-        feed_adj_factor = 1.0 / (1.0 + 0.02 * ld_ratio)
-        
-        vc_final = vc_base * rpm_adj_factor
-        
+            messages.append(f"微鑽修正：參考切速折減至 {round(d['vc_ref'], 1)} m/min (×{max(0.3, tool_dia):.2f})")
         if current_s > 0:
-            s_target = current_s
-            result['messages'].append(f"模式：固定轉速 {int(s_target)} RPM")
+            messages.append(f"模式：固定轉速 {int(d['s_target'])} RPM")
         else:
-            s_calc = (vc_final * 1000) / (math.pi * tool_dia)
-            s_target = min(s_calc, max_rpm)
-            if s_calc > max_rpm: result['messages'].append(f"機台限制：轉速已截斷至上限 {int(max_rpm)}")
-            result['messages'].append(f"深度修正：S 修正係數 {round(rpm_adj_factor, 2)}")
-            
-        result['S'] = round(s_target, 0)
-        
-        # [P1 修復] 進給計算：coolant 已透過 S 間接影響，此處不再重複乘入
-        fr_base = mat_data['fr_factor'] * tool_dia * tool_data['feed_ratio']
-        # 微鑽保護 (額外疊加)
-        micro_threshold = 1.0
-        micro_penalty = 0.8
-        if config:
-            micro_threshold = config.data.get('limits', {}).get('micro_drill_threshold', 1.0)
-            micro_penalty = config.data.get('limits', {}).get('micro_drill_penalty', 0.8)
-            
-        if tool_dia < micro_threshold:
-            fr_base *= micro_penalty
-            result['messages'].append(f"微鑽保護：F 加乘 {micro_penalty}")
-            
-        f_calc = s_target * (fr_base * feed_adj_factor)
-        
-        # [新增] 最低每轉進給率 (Min Feed per Tooth) 保障
-        # 避免 F 過低導致「只有摩擦沒有切削」而產生加工硬化 (特別針對不鏽鋼)
-        min_feed_per_rev = max(0.01, tool_dia * 0.01)  # 直徑的 1%，保底 0.01 mm/rev
-        f_rev = f_calc / s_target if s_target > 0 else 0
-        if f_rev < min_feed_per_rev and s_target > 0:
-            f_calc = s_target * min_feed_per_rev
-            result['messages'].append(f"進給保障：F 強制提升 (避免加工硬化)，每轉進給為 {min_feed_per_rev:.3f} mm/rev")
-            
-        result['F'] = round(f_calc, 1)
-        if ld_ratio > 3: result['messages'].append(f"深度修正：F 修正係數 {round(feed_adj_factor, 2)}")
+            if d['s_calc'] > d['max_rpm']: messages.append(f"機台限制：轉速已截斷至上限 {int(d['max_rpm'])}")
+            messages.append(f"深度修正：S 修正係數 {round(d['rpm_adj_factor'], 2)}")
+        if d['micro_feed']:
+            messages.append(f"微鑽保護：F 加乘 {d['micro_penalty']}")
+        if d['feed_guard']:
+            messages.append(f"進給保障：F 強制提升 (避免加工硬化)，每轉進給為 {d['min_feed_per_rev']:.3f} mm/rev")
+        if d['ld_ratio'] > 3: messages.append(f"深度修正：F 修正係數 {round(d['feed_adj_factor'], 2)}")
 
-        # 4. 啄鑽決策應用 (尊重手動鎖定)
-        # 決定最終模式：若使用者有明確偏好 (prefer_ijk)，則鎖定該模式
-        final_use_ijk = result['use_ijk'] = prefer_ijk if prefer_ijk is not None else (strategy in ["IJK_DYNAMIC", "DEEP_PROTECT"])
-        
-        # 即使被鎖定，仍需發出風險警告
-        if not final_use_ijk and strategy in ["IJK_DYNAMIC", "DEEP_PROTECT"]:
-            result['messages'].append(f"警告：當前 DRI={result['dri']} 風險較高，強烈建議手動開啟 IJK 模式")
-        
-        if not final_use_ijk:
-            # 強制進入 Q 模式或無啄鑽
-            if strategy == "DIRECT" and dri < 4: 
-                result['Q'] = 0.0
-            else:
-                # [P4 修復] Q 模式導入材質排屑因子 (peck_factors)
-                peck_mat_factor = 1.0
-                if config:
-                    peck_mat_factor = config.data.get('peck_factors', {}).get(material_key, 1.0)
-                q_val = tool_dia * 0.8 * peck_mat_factor
-                
-                # [連續型分級] Q 分級天花板平滑對數曲線 (D=1.0 時為 1.5D)
-                max_q_mult = 1.5 + 1.0 * math.log10(max(0.05, tool_dia))
-                max_q_mult = max(0.5, min(2.5, max_q_mult))
-                q_val = min(q_val, tool_dia * max_q_mult)
-                
-                min_q = config.get_limit('min_q') if config else 0.05
-                q_val = max(q_val, min_q)
-                
-                # [B 修復] 精度隨刀徑調整
-                prec = cls._precision_for_dia(tool_dia)
-                
-                # --- [新增] 諧波對齊優化 ---
-                # 在 G83 Q 模式，找尋能否整除總深度
-                optimized_q = cls._optimize_harmonic_peck(
-                    target_depth=depth, 
-                    current_peck=q_val, 
-                    min_allowable_peck=q_val * 0.85,
-                    precision=prec
-                )
-                if optimized_q < q_val:
-                    result['messages'].append(f"諧波對齊：Q 值由 {round(q_val, prec)} 微調至 {optimized_q} (除盡空行程)")
-                
-                result['Q'] = round(optimized_q, prec)
+        # 4. 啄鑽決策 (即使被鎖定為 Q 模式，仍需發出風險警告)
+        if not result['use_ijk']:
+            if strategy in ["IJK_DYNAMIC", "DEEP_PROTECT"]:
+                messages.append(f"警告：當前 DRI={result['dri']} 風險較高，強烈建議手動開啟 IJK 模式")
+            if not d['direct'] and d['optimized_q'] < d['q_val']:
+                messages.append(f"諧波對齊：Q 值由 {round(d['q_val'], d['prec'])} 微調至 {d['optimized_q']} (除盡空行程)")
         else:
-            # 進入 IJK 模式
-            # --- G83 專用：計算初始/遞減/最小值 ---
-            i, j, k = cls.get_ld_sens_ijk(
-                diameter=tool_dia, 
-                ld_ratio=ld_ratio,
-                material_key=material_key,
-                coolant_factor=coolant_factor,
-                config=config
-            )
-            # 冷卻影響已在 get_ld_sens_ijk 內考量，這裡不重複疊加
             if strategy == "DEEP_PROTECT":
-                i *= 0.8; k *= 0.8
-                result['messages'].append("保護模式：額外縮減 Peck 深度")
-            result['I'], result['J'], result['K'] = i, j, k
-            
-            # --- G66 P9131 專用：計算分段列表 ---
-            # 注意：G66 的 IJK 語意與上面的 G83 完全不同！
-            # G66 I=Z位置, J=啄鑽量, K=進給速度
+                messages.append("保護模式：額外縮減 Peck 深度")
+            # G66 P9131 專用分段列表 (G66 的 IJK 語意與 G83 不同：I=Z位置, J=啄鑽量, K=進給速度)
             result['g66_segments'] = cls.calc_g66_segments(
                 tool_dia=tool_dia,
                 target_z=target_z,
@@ -752,30 +726,187 @@ class DrillingAnalysisEngine:
                 material_key=material_key,
                 preset=preset
             )
-            
-        # 5. 壽命預估 (V6.0 $V_{ref}$ 對齊)
-        # [修復] 必須使用實際的運作切削速度 (vc_actual)，而不只是演算法中途算出的 vc_final
-        actual_vc = (s_target * math.pi * tool_dia) / 1000.0
-        life_idx = cls.estimate_tool_life_index(
-            vc_adj=actual_vc, 
-            vc_ref=vc_ref, 
-            tool_mat_key=tool_mat_key, 
-            ld_ratio=ld_ratio, 
-            feed_ratio=feed_adj_factor, 
-            config=config, 
-            coolant_factor=coolant_factor,
-            use_ijk=final_use_ijk,
-            taylor_n=taylor_n
-        )
-        result['life_index'] = round(life_idx, 2)
-        
-        # 針對 IJK 模式添加系統提醒
-        if final_use_ijk and ld_ratio > 3:
-            result['messages'].append("保護模式：啟用 IJK 動態啄鑽，深孔壽命獲得提昇")
-        
-        # 6. 綜合評分 (時間與壽命權重)
-        # 簡化評分：100 / (估計時間 * 0.7 + (1/壽命) * 0.3)
-        # 此處僅作為 UI 展示提示傾向
-        result['score'] = round(100.0 * (0.7 * (1.0/max(0.1, ld_ratio)) + 0.3 * (life_idx/1000.0)), 1)
+            # 5. 壽命預估已含 IJK 模式的深孔修正
+            if d['ld_ratio'] > 3:
+                messages.append("保護模式：啟用 IJK 動態啄鑽，深孔壽命獲得提昇")
         
         return result
+
+    @classmethod
+    def calculate_optimized_params_batch(cls,
+                                         tool_dia,
+                                         target_z,
+                                         material_key='SUS304',
+                                         tool_mat_key='CARBIDE',
+                                         max_rpm=40000,
+                                         current_s=0.0,
+                                         material_thickness=0.0,
+                                         exit_chamfer=0.0,
+                                         tip_angle=118.0,
+                                         config=None,
+                                         coolant_mode="Oil",
+                                         prefer_ijk=None,
+                                         taylor_n=None):
+        """
+        calculate_optimized_params 的批次版本：各參數為每個循環一筆的欄位陣列 (純量會廣播)，
+        DRI、切速與進給修正、戰略選取與啄鑽量以 NumPy 一次計算整份程式的所有循環。
+        純量版本以長度 1 的陣列呼叫同一套計算，數值完全相同；取位見 _round_np。
+        不產生 messages 與 g66_segments (需要時另呼叫 calc_g66_segments)。
+
+        Returns:
+            dict: 與純量版本相同的鍵 (S, F, Q, I, J, K, Z, use_ijk, dri, strategy, life_index, score)，
+                  值為 NumPy 陣列；直徑 <= 0 的列與純量版本相同回傳 0 與空字串戰略
+        """
+        return cls._optimize_columns(tool_dia, target_z, material_key, tool_mat_key, max_rpm, current_s,
+                                     material_thickness, exit_chamfer, tip_angle, config, coolant_mode,
+                                     prefer_ijk, taylor_n)[0]
+
+    @classmethod
+    def _optimize_columns(cls, tool_dia, target_z, material_key, tool_mat_key, max_rpm, current_s,
+                          material_thickness, exit_chamfer, tip_angle, config, coolant_mode, prefer_ijk, taylor_n):
+        """
+        calculate_optimized_params(_batch) 共用的陣列計算。
+        回傳 (結果欄位, 中間值)：中間值 (倒角補償、轉速截斷、進給保障、Q 諧波對齊等) 供純量版本產生訊息。
+        """
+        dia, target_z, current_s, thickness, chamfer, tip = np.broadcast_arrays(*(
+            np.atleast_1d(np.asarray(v, dtype=np.float64))
+            for v in (tool_dia, target_z, current_s, material_thickness, exit_chamfer, tip_angle)))
+        shape = dia.shape
+        materials, coolants, tools = (np.broadcast_to(np.asarray(v, dtype=object), shape)
+                                      for v in (material_key, coolant_mode, tool_mat_key))
+        valid = dia > 0
+        dia = np.where(valid, dia, 1.0)
+
+        # 0. 取得基礎配置
+        if config:
+            max_rpm = config.get_limit('max_rpm') or max_rpm
+            vc = _lookup(materials, lambda k: config.get_material_data(k)['Vc'])
+            fr_factor = _lookup(materials, lambda k: config.get_material_data(k)['fr_factor'])
+        else:
+            vc, fr_factor = np.full(shape, 50.0), np.full(shape, 0.01)
+        tool_default = cls.TOOL_MATERIALS['CARBIDE']
+        speed_ratio = _lookup(tools, lambda k: cls.TOOL_MATERIALS.get(k, tool_default)['speed_ratio'])
+        feed_ratio = _lookup(tools, lambda k: cls.TOOL_MATERIALS.get(k, tool_default)['feed_ratio'])
+
+        # 1. 幾何感知修正 (倒角)
+        geo = (chamfer > 0) & (tip > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            extra_depth = (chamfer / 2.0) / np.tan(np.radians(tip / 2.0))
+        calculated_z = np.where(geo, -(thickness + extra_depth + 0.2), 0.0)
+        geo &= calculated_z < target_z
+        z_out = np.where(geo, _round_np(calculated_z, 4), target_z)
+        depth = np.abs(z_out)
+        ld_ratio = depth / dia
+
+        # 2. DRI 風險評估與戰略選取
+        dri = 1.2 + ((depth / dia) ** 1.4)
+        coolant_factor = np.ones(shape)
+        peck_mat_factor = np.ones(shape)
+        if config:
+            factors = config.data.get('dri_factors', {})
+            dri = (dri * _lookup(materials, lambda k: factors.get('material', {}).get(k, 1.0))
+                   * _lookup(coolants, lambda k: factors.get('coolant', {}).get(k, 1.0))
+                   * _lookup(tools, lambda k: factors.get('tool', {}).get(k, 1.0)))
+            coolant_factor = _lookup(coolants, lambda k: config.data.get('coolant_factors', {}).get(k, 1.0))
+            peck_mat_factor = _lookup(materials, lambda k: config.data.get('peck_factors', {}).get(k, 1.0))
+        strategy = np.select([dri < 6, dri < 18, dri < 40], ["DIRECT", "Q_MODE", "IJK_DYNAMIC"], "DEEP_PROTECT")
+
+        # 3. 轉速與進給計算 (含二階深度修正)
+        vc_ref = vc * speed_ratio
+        vc_ref = np.where(dia < 1.0, vc_ref * np.maximum(0.3, dia), vc_ref)
+        vc_base = vc_ref * coolant_factor
+        rpm_adj_factor = 1.0 / (1.0 + 0.035 * ld_ratio)
+        feed_adj_factor = 1.0 / (1.0 + 0.02 * ld_ratio)
+        vc_final = vc_base * rpm_adj_factor
+        s_calc = (vc_final * 1000) / (math.pi * dia)
+        s_target = np.where(current_s > 0, current_s, np.minimum(s_calc, max_rpm))
+
+        fr_base = fr_factor * dia * feed_ratio
+        micro_threshold, micro_penalty = 1.0, 0.8
+        if config:
+            micro_threshold = config.data.get('limits', {}).get('micro_drill_threshold', 1.0)
+            micro_penalty = config.data.get('limits', {}).get('micro_drill_penalty', 0.8)
+        micro_feed = dia < micro_threshold
+        fr_base = np.where(micro_feed, fr_base * micro_penalty, fr_base)
+        f_calc = s_target * (fr_base * feed_adj_factor)
+        # 最低每轉進給率保障
+        min_feed_per_rev = np.maximum(0.01, dia * 0.01)
+        spinning = s_target > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f_rev = np.where(spinning, f_calc / s_target, 0.0)
+        feed_guard = (f_rev < min_feed_per_rev) & spinning
+        f_calc = np.where(feed_guard, s_target * min_feed_per_rev, f_calc)
+
+        # 4. 啄鑽決策
+        if prefer_ijk is None:
+            use_ijk = (strategy == "IJK_DYNAMIC") | (strategy == "DEEP_PROTECT")
+        else:
+            use_ijk = np.broadcast_to(np.asarray(prefer_ijk, dtype=bool), shape)
+        prec = np.where(dia < 0.5, 3, 2)
+
+        # Q 模式
+        q_val = dia * 0.8 * peck_mat_factor
+        max_q_mult = np.maximum(0.5, np.minimum(2.5, 1.5 + 1.0 * np.log10(np.maximum(0.05, dia))))
+        q_val = np.minimum(q_val, dia * max_q_mult)
+        q_val = np.maximum(q_val, config.get_limit('min_q') if config else 0.05)
+        optimized_q = cls._optimize_harmonic_peck_batch(depth, q_val, q_val * 0.85, prec)
+        direct = (strategy == "DIRECT") & (dri < 4)
+        q_out = np.where(use_ijk | direct, 0.0, _round_np(optimized_q, prec))
+
+        # IJK 模式 (同 get_ld_sens_ijk)
+        r = np.minimum(ld_ratio, 10.0)
+        env_bonus = peck_mat_factor * coolant_factor
+        base_i_mult = 2.0 * env_bonus
+        i_factor = np.maximum(0.5, np.minimum(base_i_mult, base_i_mult - 0.1 * r))
+        max_i_mult = np.maximum(0.8, np.minimum(3.0, 2.0 + 1.0 * np.log10(np.maximum(0.05, dia))))
+        i_val = _round_np(np.minimum(dia * i_factor, dia * max_i_mult), prec)
+        j_factor = np.maximum(0.02, np.minimum(0.15, 0.15 - 0.005 * r))
+        j_val = _round_np(dia * j_factor, prec)
+        k_floor = np.maximum(0.2, np.minimum(0.6, 0.4 - 0.2 * np.log10(np.maximum(0.05, dia))))
+        k_factor = np.maximum(k_floor, np.minimum(0.60 * env_bonus, 0.50 * env_bonus - 0.015 * r))
+        k_val = _round_np(dia * k_factor, prec)
+        protect = strategy == "DEEP_PROTECT"
+        i_val = np.where(protect, i_val * 0.8, i_val)
+        k_val = np.where(protect, k_val * 0.8, k_val)
+
+        # 5. 壽命預估 (同 estimate_tool_life_index)
+        actual_vc = (s_target * math.pi * dia) / 1000.0
+        if taylor_n is not None:
+            n = np.full(shape, float(taylor_n))
+        else:
+            def default_n(k):
+                n = 0.22 if k == 'CARBIDE' else 0.10
+                if config:
+                    n = config.data.get('taylor_params', {}).get(k, {}).get('n', n)
+                return n
+            n = _lookup(tools, default_n)
+        effective_vc_ref = vc_ref * coolant_factor
+        with np.errstate(divide='ignore', invalid='ignore'):
+            life_factor = np.where(actual_vc > 0, (effective_vc_ref / actual_vc) ** (1.0 / n - 1.0), 0.0)
+        severity = np.where(use_ijk & (ld_ratio > 3), 0.04, 0.08)
+        depth_penalty = 1.0 / (1.0 + severity * (ld_ratio ** 1.3))
+        load_penalty = np.where(feed_adj_factor > 0, (1.0 / feed_adj_factor) ** 0.4, 0.0)
+        life_idx = np.minimum(life_factor * depth_penalty * load_penalty, 10.0)
+
+        # 6. 綜合評分
+        score = 100.0 * (0.7 * (1.0 / np.maximum(0.1, ld_ratio)) + 0.3 * (life_idx / 1000.0))
+
+        def rows(values):
+            return np.where(valid, values, 0.0)
+
+        ijk = use_ijk & valid
+        columns = {
+            'S': rows(_round_np(s_target, 0)), 'F': rows(_round_np(f_calc, 1)), 'Q': rows(q_out),
+            'I': np.where(ijk, i_val, 0.0), 'J': np.where(ijk, j_val, 0.0), 'K': np.where(ijk, k_val, 0.0),
+            'Z': np.where(valid, z_out, target_z), 'use_ijk': ijk,
+            'dri': rows(_round_np(dri, 1)), 'strategy': np.where(valid, strategy, ''),
+            'life_index': rows(_round_np(life_idx, 2)), 'score': rows(_round_np(score, 1))
+        }
+        detail = {
+            'geo': geo, 'vc_ref': vc_ref, 's_calc': s_calc, 's_target': s_target, 'max_rpm': np.broadcast_to(float(max_rpm), shape),
+            'rpm_adj_factor': rpm_adj_factor, 'feed_adj_factor': feed_adj_factor, 'ld_ratio': ld_ratio,
+            'micro_feed': micro_feed, 'micro_penalty': np.broadcast_to(micro_penalty, shape),
+            'feed_guard': feed_guard, 'min_feed_per_rev': min_feed_per_rev,
+            'direct': direct, 'q_val': q_val, 'optimized_q': optimized_q, 'prec': prec,
+        }
+        return columns, detail
@@ -0,0 +1,124 @@
+"""
+無介面批次解析：以多程序同時解析多個 NC 檔案，每個檔案輸出一行 JSON (JSON Lines)。
+
+不載入 PyQt6 / matplotlib，可在伺服器或排程中掃描整個發行資料夾。
+
+用法：python batch_parse.py [檔案或資料夾 ...] [--workers N] [--recursive]
+      [--ext .nc .tap .txt] [--library 子程式資料夾]
+"""
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from nc_parser import RokuNCParser
+from nc_subprog import expand_program_time
+
+# 與主視窗「開啟 NC 檔案」對話框相同的副檔名
+DEFAULT_EXTENSIONS = ('.nc', '.tap', '.txt')
+
+
+def summarize_file(file_path, library_dir=None):
+    """
+    解析單一檔案並整理為可序列化為 JSON 的摘要：
+    循環清單 (行號、刀號、類型、孔數、偵測直徑、轉速、參數)、刀具清單、總孔數
+    與預估加工時間 (分鐘，含各刀號的明細；子程式呼叫依 library_dir 展開)。
+    """
+    with RokuNCParser() as parser:
+        # 已在多程序中平行處理各檔案，單一檔案內不再開啟程序池
+        tools_data = parser.parse_file(file_path, workers=1)
+        cycles = [{
+            'line': item['line_index'] + 1,
+            'tool_id': item['tool_id'],
+            'cycle_type': item['cycle_type'],
+            'hole_count': item.get('hole_count', 0),
+            'retract_mode': item.get('retract_mode'),
+            'detected_diameter': item.get('detected_diameter'),
+            'rpm': item.get('rpm', 0),
+            'static_params': item['static_params'],
+            'dynamic_params': item['dynamic_params'],
+        } for item in tools_data]
+        tools = []
+        for item in tools_data:
+            if item['tool_id'] not in tools:
+                tools.append(item['tool_id'])
+        return {
+            'file': file_path,
+            'encoding': parser.file_encoding,
+            'lines': len(parser.nc_lines),
+            'cycles': cycles,
+            'tools': tools,
+            'tool_diameters': parser.tool_diameters,
+            'total_holes': sum(c['hole_count'] for c in cycles),
+            'estimated_time': expand_program_time(parser, library_dir),
+        }
+
+
+def _summarize_or_error(file_path, library_dir=None):
+    try:
+        return summarize_file(file_path, library_dir)
+    except Exception as e:
+        return {'file': file_path, 'error': f"{type(e).__name__}: {e}"}
+
+
+def collect_files(paths, extensions=DEFAULT_EXTENSIONS, recursive=False):
+    """展開輸入路徑：檔案直接加入，資料夾內依副檔名 (不分大小寫) 篩選。"""
+    extensions = tuple(ext.lower() for ext in extensions)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                walker = ((root, names) for root, _, names in os.walk(path))
+            else:
+                walker = [(path, [n for n in os.listdir(path) if os.path.isfile(os.path.join(path, n))])]
+            for root, names in walker:
+                for name in sorted(names):
+                    if name.lower().endswith(extensions):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return files
+
+
+def iter_batch_parse(file_paths, workers=None, library_dir=None):
+    """
+    以 ProcessPoolExecutor 同時解析多個檔案，依完成順序逐一產出摘要 dict。
+    無法解析的檔案產出 {'file': 路徑, 'error': 訊息}，不中斷其他檔案。
+    """
+    if not file_paths:
+        return
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for path in file_paths:
+            yield _summarize_or_error(path, library_dir)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as pool:
+        futures = [pool.submit(_summarize_or_error, path, library_dir) for path in file_paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="批次解析 NC 檔案，每個檔案輸出一行 JSON。")
+    arg_parser.add_argument('paths', nargs='+', help="NC 檔案或資料夾")
+    arg_parser.add_argument('--workers', type=int, default=None, help="同時解析的程序數 (預設為 CPU 核心數)")
+    arg_parser.add_argument('--recursive', action='store_true', help="遞迴搜尋子資料夾")
+    arg_parser.add_argument('--ext', nargs='+', default=list(DEFAULT_EXTENSIONS), help="資料夾內要解析的副檔名")
+    arg_parser.add_argument('--library', default=None, help="M98 / G65 子程式資料夾 (O1234.nc 等)")
+    args = arg_parser.parse_args(argv)
+
+    files = collect_files(args.paths, args.ext, args.recursive)
+    failed = 0
+    for summary in iter_batch_parse(files, args.workers, args.library):
+        if 'error' in summary:
+            failed += 1
+        sys.stdout.write(json.dumps(summary) + '\n')
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+鑽孔時間計算效能基準測試。
+
+比較舊版逐跳迴圈 (calc_drilling_time 逐一處理每個啄鑽、calc_g66_drilling_time 在每段內
+逐跳累加) 與目前 DrillingAnalysisEngine 等差級數封閉解的每次呼叫時間，並檢查兩者結果一致。
+calc_peck_runs_time 直接以 (增量, 次數) 連續段計算，不需展開啄鑽列表。
+預設情境為 0.01 mm 啄鑽量鑽 20 mm 深 (每孔 2000 跳)。
+
+用法：python bench_analysis.py [啄鑽量，預設 0.01] [深度，預設 20]
+"""
+import math
+import sys
+import time
+
+from analysis_engine import DrillingAnalysisEngine
+from legacy_timing import legacy_drilling_time, legacy_g66_drilling_time
+
+
+def _per_call(func, repeat=5, number=20):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - t0) / number)
+    return best
+
+
+def main():
+    peck = float(sys.argv[1]) if len(sys.argv) > 1 else 0.01
+    depth = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    r_point, feed, g0 = 1.0, 50.0, 5000.0
+    n = int(math.ceil(depth / peck))
+    ijk_list = [{'I': -peck, 'J': 0.0, 'K': 0.0}] * (n - 1) + [{'I': -(depth - peck * (n - 1)), 'J': 0.0, 'K': 0.0}]
+    runs = [(-peck, n - 1), (-(depth - peck * (n - 1)), 1)]
+    segments = [{'I': -depth * 0.3, 'J': peck * 2, 'K': 80.0}, {'I': -depth, 'J': peck, 'K': 50.0}]
+
+    print(f"啄鑽量 {peck} mm，深度 {depth} mm ({n} 跳)")
+    for name, legacy, fast in (
+            ("G83 calc_drilling_time    ",
+             lambda: legacy_drilling_time(ijk_list, feed, r_point, g0, False),
+             lambda: DrillingAnalysisEngine.calc_drilling_time(ijk_list, feed, r_point, g0, False)),
+            ("G83 calc_peck_runs_time   ",
+             lambda: legacy_drilling_time(ijk_list, feed, r_point, g0, False),
+             lambda: DrillingAnalysisEngine.calc_peck_runs_time(runs, feed, r_point, g0)),
+            ("G66 calc_g66_drilling_time",
+             lambda: legacy_g66_drilling_time(segments, r_point, g0),
+             lambda: DrillingAnalysisEngine.calc_g66_drilling_time(segments, r_point, g0))):
+        t_before, t_after = _per_call(legacy), _per_call(fast)
+        diff = abs(legacy() - fast())
+        print(f"{name}: 逐跳 {t_before * 1e3:8.3f} ms  封閉解 {t_after * 1e3:8.3f} ms  "
+              f"加速 {t_before / t_after:6.1f}x  誤差 {diff:.1e} 分")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+NC 解析效能基準測試。
+
+以範例程式 TMIZ14-UD1_A008.NC 重複串接成大型程式，
+比較舊版逐行多次 re.search 的解析迴圈與目前 RokuNCParser.parse_file (單程序) 的每秒處理行數，
+另列出多程序平行解析的結果，並比較 list[str] 與 LineStore 保存程式內容的記憶體用量。
+舊版迴圈只計算孔數；parse_file 另外以模態插補器求出所有座標單節的絕對位置 (孔位)。
+
+用法：python bench_parser.py [重複次數，預設 30]
+"""
+import os
+import re
+import sys
+import time
+import tempfile
+
+from nc_parser import RokuNCParser
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TMIZ14-UD1_A008.NC")
+
+
+def legacy_scan(nc_lines):
+    """
+    舊版 parse_file 的逐行模態追蹤迴圈 (未預編譯 regex、每行最多 8 次搜尋)，
+    作為效能比較的基準。只保留掃描部分，循環行本身的參數解析不列入。
+    """
+    current_tool = "Unknown"
+    current_spindle_rpm = 0
+    in_cycle_mode = False
+    hole_count = 0
+    for idx, line in enumerate(nc_lines):
+        if 'G66' not in line:
+            s_state_match = re.search(r'S(\d+)', line)
+            if s_state_match:
+                current_spindle_rpm = int(s_state_match.group(1))
+        t_match = re.search(r'T(\d+)', line)
+        if t_match:
+            current_tool = t_match.group(1)
+            start, end = max(0, idx - 10), min(len(nc_lines), idx + 11)
+            for i in range(start, end):
+                re.findall(r'D\s*(\d*\.?\d+)', nc_lines[i])
+        if in_cycle_mode:
+            if re.search(r'(G80|G67|M06|M30)', line) or re.search(r'T\d+', line):
+                in_cycle_mode = False
+            elif re.search(r'G0?[0123]\b', line):
+                in_cycle_mode = False
+        is_cycle_line = ('G66' in line and 'P9131' in line) or 'G83' in line
+        if is_cycle_line:
+            re.findall(r'([RZSIJKT])\s*([-+]?(?:\d*\.\d+|\d+))', line)
+            in_cycle_mode = True
+            hole_count += 0 if re.search(r'\b[KL]0\.?\b', line) else 1
+        elif in_cycle_mode:
+            if not line.strip().startswith('(') and re.search(r'[XY]\s*[-+]?(?:\d*\.\d+|\d+)', line):
+                hole_count += 1
+    return hole_count, current_tool, current_spindle_rpm
+
+
+def _best_of(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    with open(SAMPLE_FILE, 'r', encoding='utf-8') as f:
+        sample = f.read()
+    program = sample * repeat
+
+    fd, path = tempfile.mkstemp(suffix='.nc')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(program)
+        with open(path, 'r', encoding='utf-8') as f:
+            nc_lines = f.readlines()
+        n_lines = len(nc_lines)
+
+        t_before = _best_of(lambda: legacy_scan(nc_lines))
+        t_after = _best_of(lambda: RokuNCParser().parse_file(path, workers=1))
+        workers = os.cpu_count() or 1
+        t_parallel = _best_of(lambda: RokuNCParser().parse_file(path, workers=workers)) if workers > 1 else None
+
+        print(f"程式行數: {n_lines}")
+        print(f"舊版逐行 regex  : {t_before:8.3f} s  ({n_lines / t_before:12,.0f} 行/秒)")
+        print(f"單次詞法分析    : {t_after:8.3f} s  ({n_lines / t_after:12,.0f} 行/秒)  [單程序，含檔案讀取]")
+        print(f"加速倍率        : {t_before / t_after:.1f}x")
+        if t_parallel is not None:
+            print(f"平行解析 ({workers:2d} 程序): {t_parallel:8.3f} s  ({n_lines / t_parallel:12,.0f} 行/秒)  "
+                  f"[相對單程序 {t_after / t_parallel:.1f}x]")
+
+        parser = RokuNCParser()
+        parser.parse_file(path, workers=1)
+        list_bytes = sys.getsizeof(nc_lines) + sum(sys.getsizeof(s) for s in nc_lines)
+        print(f"list[str] 記憶體: {list_bytes / 1e6:8.2f} MB")
+        print(f"LineStore 記憶體: {parser.nc_lines.nbytes / 1e6:8.2f} MB")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,15 @@
 import json
 import os
 import copy
+import itertools
+
+# 設定檔版本戳記：所有 ConfigManager 實例共用遞增序號，不同實例或修改前後的版本不會相同
+# (加上程序編號，傳入工作程序的設定檔不會與該程序自行建立的實例相同)
+_VERSIONS = itertools.count(1)
+
+
+def _next_version():
+    return (os.getpid(), next(_VERSIONS))
 
 class ConfigManager:
     """
@@ -29,7 +38,8 @@ class ConfigManager:
             'max_rpm': 40000.0,
             'min_q': 0.05,
             'micro_drill_threshold': 1.0,
-            'micro_drill_penalty': 0.8
+            'micro_drill_penalty': 0.8,
+            'max_pecks': 10000         # G83 每跳明細 (表格、圖形) 的展開上限
         },
         'dri_factors': {
             'material': {
@@ -46,6 +56,33 @@ class ConfigManager:
             'CARBIDE': {'n': 0.22},
             'HSS': {'n': 0.10}
         },
+        # 機台參數：整份程式加工時間預估用 (nc_timing)
+        'machine': {
+            'g0_speed': 5000.0,        # 快速位移速度 (mm/min)
+            'tool_change_sec': 6.0     # 每次 M06 換刀時間 (秒)
+        },
+        # 換刀合併 (nc_toolplan) 時必須保持的刀號先後關係，如 [["5", "1"]] 表示 T5 中心鑽先於 T1 鑽頭
+        'tool_precedence': [],
+        # 子程式 (M98 / G65) 資料夾：檔名為 O1234.nc 等；空白時使用 NC 檔案所在的資料夾
+        'subprogram_dir': '',
+        # 鑽孔巨集 (O9131) 本體使用的共用變數，如 {"953": 3000.0} (R → S 下降速度)
+        'macro_variables': {},
+        # 退刀高度最佳化 (nc_retract)：R / S 與工件上面 (或障礙物) 的安全距離 (mm)
+        # obstacles 為夾具等障礙物 [[x_min, y_min, x_max, y_max, z_top], ...]
+        'retract': {
+            'r_clearance': 0.3,
+            's_clearance': 0.1,
+            'obstacle_clearance': 1.0,
+            'obstacle_margin': 1.0,
+            'obstacles': []
+        },
+        # 空切削偵測 (nc_aircut)：clearance 為判定空切削時刀尖高於素材的距離，rapid_clearance 為改寫為 G0
+        # 時的安全距離 (mm)；stock_map 為素材高度圖檔案，空白時以原點設定的素材上面為平板
+        'air_cut': {
+            'clearance': 0.1,
+            'rapid_clearance': 1.0,
+            'stock_map': ''
+        },
         'optimization_weights': {
             'time': 0.7,
             'life': 0.3
@@ -109,6 +146,12 @@ class ConfigManager:
 
         self.config_path = self.ext_path # 預設存檔路徑設為外部，以便持久化
         self.data = self.load_config()
+        # 版本戳記：data 變更後儲存、匯入或重置時遞增，使 analysis_cache 的記憶化結果失效
+        self.version = _next_version()
+
+    def bump_version(self):
+        """標記設定已變更 (直接修改 data 後也可手動呼叫)。"""
+        self.version = _next_version()
 
     def load_config(self):
         """載入設定檔。優先順序：(1) 外部檔案 -> (2) 內部封裝檔案 -> (3) 代碼預設值"""
@@ -146,6 +189,8 @@ class ConfigManager:
     def save_config(self, file_path=None):
         """將目前設定儲存到指定的 JSON 檔案，預設為內建設定路徑。"""
         target_path = file_path if file_path else self.config_path
+        # data 可能已被直接修改 (設定對話框、壽命指數)，儲存即視為新版本
+        self.bump_version()
         try:
             with open(target_path, 'w', encoding='utf-8') as f:
                 json.dump(self.data, f, indent=4, ensure_ascii=False)
@@ -161,6 +206,7 @@ class ConfigManager:
                 user_data = json.load(f)
                 # 使用 merge_defaults 確保匯入的資料結構完整，避免版本衝突
                 self.data = self._merge_defaults(self.DEFAULT_CONFIG, user_data)
+            self.bump_version()
             # 匯入後自動存回預設的 config_path 讓程式下次啟動生效
             return self.save_config()
         except Exception as e:
@@ -170,6 +216,7 @@ class ConfigManager:
     def reset_to_defaults(self):
         """重置為原始預設值。"""
         self.data = copy.deepcopy(self.DEFAULT_CONFIG)
+        self.bump_version()
         return self.save_config()
 
     # Getters
@@ -0,0 +1,51 @@
+"""
+舊版鑽孔時間計算的逐跳迴圈，作為 DrillingAnalysisEngine 封閉解的正確性 (測試) 與效能 (bench_analysis) 基準。
+"""
+import math
+
+
+def legacy_drilling_time(ijk_list, feedrate, r_point, g0_speed, is_ijk_mode, clearance=0.1):
+    """舊版 calc_drilling_time 的逐跳迴圈 (效能比較與正確性的基準)。"""
+    if feedrate <= 0:
+        return float('inf')
+    total_t = 0
+    current_z = r_point
+    for idx, peck in enumerate(ijk_list):
+        increment = peck.get('I', 0.0)
+        prev_z = current_z
+        target_z = prev_z + increment
+        if idx == 0:
+            total_t += abs(target_z - r_point) / feedrate
+        else:
+            total_t += abs(r_point - (prev_z + clearance)) / g0_speed
+            total_t += abs(target_z - (prev_z + clearance)) / feedrate
+        total_t += abs(target_z - r_point) / g0_speed
+        current_z = target_z
+    return total_t
+
+
+def legacy_g66_drilling_time(segments, r_point, g0_speed=5000, clearance=0.1):
+    """舊版 calc_g66_drilling_time 的段內逐跳迴圈 (效能比較與正確性的基準)。"""
+    if not segments or g0_speed <= 0:
+        return 0.0
+    total_t = 0.0
+    prev_seg_end = r_point
+    for seg in segments:
+        seg_z, seg_q, seg_f = seg['I'], abs(seg['J']), seg['K']
+        if seg_q < 1e-6 or seg_f < 1e-6:
+            continue
+        num_pecks = max(1, math.ceil(abs(seg_z - prev_seg_end) / seg_q))
+        current_z = prev_seg_end
+        for p in range(num_pecks):
+            peck_end = max(current_z - seg_q, seg_z) if seg_z < current_z else min(current_z + seg_q, seg_z)
+            actual_peck = abs(peck_end - current_z)
+            if p == 0:
+                total_t += abs(current_z - r_point) / g0_speed
+                total_t += actual_peck / seg_f
+            else:
+                total_t += abs(current_z - clearance - r_point) / g0_speed
+                total_t += (actual_peck + clearance) / seg_f
+            total_t += abs(peck_end - r_point) / g0_speed
+            current_z = peck_end
+        prev_seg_end = seg_z
+    return total_t
@@ -1,5 +1,6 @@
 import sys
 import traceback
+import multiprocessing
 from PyQt6.QtWidgets import QApplication, QMessageBox
 from ui_main_window import MainWindow
 
@@ -20,4 +21,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # 打包後 (PyInstaller) 平行解析的工作程序需要 freeze_support
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,287 @@
+"""
+空切削偵測：G1/G2/G3 進給移動全程都在素材上方 (CAM 的進退刀餘裕) 時，以進給速度移動只是浪費時間。
+
+素材以 2D 高度圖 (StockMap) 表示：各 cell 的素材上面 Z (NaN 為沒有素材)，網格之外為 outside；
+由 UI 的原點設定建立時為素材上面 (stock_top_z) 的無限大平板，也可由檔案匯入。
+高度圖依刀具半徑 (parser.tool_diameters) 向外擴張；直線移動沿路徑取樣 (間距為半個 cell)，
+圓弧以涵蓋整個圓的矩形範圍保守判斷 (只處理 G17 平面)。移動全程的刀尖都高於素材 clearance 以上
+即為空切削，浪費的時間為進給時間減去以 G0 直線移動的時間。
+
+改寫為 G0 時，快速位移不一定走直線 (各軸可能獨立移動)，因此只改寫起點與終點圍成的 XY 範圍內
+素材最高處仍低於兩端較低的 Z 至少 rapid_clearance 的移動；改寫後下一個單節若沿用原本的
+G1/G2/G3 模態，於其行首補上原本的插補指令。
+"""
+import math
+import re
+
+import numpy as np
+
+from nc_lexer import tokenize_block
+from nc_timing import iter_move_windows, DEFAULT_G0_SPEED
+
+# 預設安全距離 (mm)：判定為空切削時刀尖高於素材的距離，與改寫為 G0 時的距離
+DEFAULT_CLEARANCE = 0.1
+DEFAULT_RAPID_CLEARANCE = 1.0
+
+_MOTION_WORD_RE = re.compile(r'G[ \t]*0*[0-3](?![\d.])')
+_ARC_WORD_RE = re.compile(r'[IJKR][ \t]*[-+]?(?:\d+\.?\d*|\.\d+)')
+# 這些 G 碼單節不補插補指令 (G01 群組的固定循環與宏呼叫)
+_NO_RESTORE_G = frozenset((65.0, 66.0, 67.0) + tuple(float(g) for g in range(73, 90)))
+
+
+class StockMap:
+    """
+    素材上面的高度圖：heights[j, i] 為 X = origin[0] + i * cell、Y = origin[1] + j * cell 起的 cell
+    的素材上面 Z (NaN 或 -inf 為沒有素材)；網格之外的高度為 outside (NaN 為沒有素材)。
+    """
+
+    def __init__(self, heights, origin=(0.0, 0.0), cell=1.0, outside=math.nan):
+        heights = np.asarray(heights, dtype=np.float64)
+        if not heights.size:
+            heights = np.empty((0, 0))
+        self.heights = np.where(np.isnan(heights), -np.inf, heights)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.cell = float(cell)
+        self.outside = -math.inf if outside != outside else float(outside)
+        if self.cell <= 0:
+            raise ValueError("cell must be positive")
+
+    @classmethod
+    def plate(cls, top_z):
+        """上面為 top_z 的無限大平板 (UI 的原點設定：top_z = nc_retract.stock_top_z(origin_z_shift))。"""
+        return cls(np.empty((0, 0)), outside=top_z)
+
+    @classmethod
+    def load(cls, path):
+        """
+        匯入高度圖文字檔：# 開頭為註解，第一列為 "原點X 原點Y cell大小 [網格外高度]"，
+        之後每列為一個 Y 的各 cell 高度 (由 Y 小到大、X 小到大)，nan 為沒有素材。
+        """
+        rows = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].replace(',', ' ').split()
+                if line:
+                    rows.append([float(v) for v in line])
+        if not rows or len(rows[0]) < 3:
+            raise ValueError("stock map header must be: origin_x origin_y cell [outside]")
+        header, grid = rows[0], rows[1:]
+        if any(len(row) != len(grid[0]) for row in grid):
+            raise ValueError("stock map rows must have the same number of cells")
+        return cls(np.array(grid) if grid else np.empty((0, 0)), header[:2], header[2],
+                   header[3] if len(header) > 3 else math.nan)
+
+    @property
+    def is_flat(self):
+        return not self.heights.size
+
+    def dilate(self, radius):
+        """依刀具半徑擴張的高度圖 (刀具範圍內任何位置有素材即視為有素材)。"""
+        k = int(math.ceil(radius / self.cell)) if radius > 0 else 0
+        if self.is_flat or k == 0:
+            return self
+        ny, nx = self.heights.shape
+        padded = np.pad(self.heights, 2 * k, constant_values=self.outside)
+        out = np.full((ny + 2 * k, nx + 2 * k), -np.inf)
+        for dy in range(-k, k + 1):
+            for dx in range(-k, k + 1):
+                # cell 之間的最近距離在半徑內
+                if (max(abs(dx) - 1, 0) ** 2 + max(abs(dy) - 1, 0) ** 2) * self.cell ** 2 > radius ** 2:
+                    continue
+                np.maximum(out, padded[k + dy:k + dy + ny + 2 * k, k + dx:k + dx + nx + 2 * k], out=out)
+        return StockMap(out, self.origin - k * self.cell, self.cell, self.outside)
+
+    def height_at(self, xy):
+        """(N, 2) 各點的素材上面 Z (沒有素材為 -inf)。"""
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        if self.is_flat:
+            return np.full(len(xy), self.outside)
+        ij = np.floor((xy - self.origin) / self.cell).astype(np.int64)
+        ny, nx = self.heights.shape
+        inside = (ij[:, 0] >= 0) & (ij[:, 0] < nx) & (ij[:, 1] >= 0) & (ij[:, 1] < ny)
+        out = np.full(len(xy), self.outside)
+        out[inside] = self.heights[ij[inside, 1], ij[inside, 0]]
+        return out
+
+    def max_in_box(self, lo, hi):
+        """XY 矩形 [lo, hi] 範圍內素材上面的最高 Z (沒有素材為 -inf)。"""
+        if self.is_flat:
+            return self.outside
+        ny, nx = self.heights.shape
+        i0, j0 = np.floor((np.asarray(lo) - self.origin) / self.cell).astype(np.int64).tolist()
+        i1, j1 = np.floor((np.asarray(hi) - self.origin) / self.cell).astype(np.int64).tolist()
+        top = self.outside if (i0 < 0 or j0 < 0 or i1 >= nx or j1 >= ny) else -math.inf
+        i0, j0, i1, j1 = max(i0, 0), max(j0, 0), min(i1, nx - 1), min(j1, ny - 1)
+        if i0 <= i1 and j0 <= j1:
+            top = max(top, float(self.heights[j0:j1 + 1, i0:i1 + 1].max()))
+        return top
+
+
+def _line_gaps(stock, p0, p1):
+    """各直線移動 p0[i] → p1[i] (XYZ) 沿路徑的刀尖與素材最小距離。"""
+    if stock.is_flat:
+        return np.minimum(p0[:, 2], p1[:, 2]) - stock.outside
+    dist = np.hypot(*(p1[:, :2] - p0[:, :2]).T)
+    counts = np.ceil(dist / (stock.cell * 0.5)).astype(np.int64) + 1
+    owner = np.repeat(np.arange(len(p0)), counts)
+    starts = np.cumsum(counts) - counts
+    t = (np.arange(counts.sum()) - starts[owner]) / np.maximum(counts[owner] - 1, 1)
+    pts = p0[owner] + (p1 - p0)[owner] * t[:, None]
+    gap = pts[:, 2] - stock.height_at(pts[:, :2])
+    return np.minimum.reduceat(gap, starts)
+
+
+def _arc_box(p0, p1, word, i):
+    """G17 圓弧可能經過的 XY 矩形：I/J 格式為整個圓，R 格式為距兩端 2R 內的範圍。"""
+    ci, cj, r = word['I'][i], word['J'][i], word['R'][i]
+    if r == r and ci != ci and cj != cj:
+        r = abs(r)
+        return np.maximum(p0[:2], p1[:2]) - 2 * r, np.minimum(p0[:2], p1[:2]) + 2 * r
+    center = p0[:2] + np.nan_to_num([ci, cj])
+    r = math.hypot(*(p0[:2] - center))
+    return center - r, center + r
+
+
+def plan_air_cuts(parser, stock, clearance=DEFAULT_CLEARANCE, rapid_clearance=DEFAULT_RAPID_CLEARANCE,
+                  g0_speed=DEFAULT_G0_SPEED, default_diameter=0.0):
+    """
+    找出全程不接觸素材的進給移動 (不修改程式)。stock 為 StockMap；刀具直徑未知時以 default_diameter 擴張。
+    回傳：
+        {'air_moves', 'air_time' (空切削的進給時間，分鐘), 'wasted_time' (相對於 G0 直線移動),
+         'saved_time' (可安全改寫為 G0 的部分), 'runs': [{'start', 'end' (行號，含), 'tool_id', 'moves',
+         'length', 'air_time', 'wasted_time', 'rapid' (整段皆可改寫)}, ...],
+         'rewrite': [改寫為 G0 的行號], 'arcs': [其中的圓弧行號], 'restore': {行號: 補上的插補 G 碼}}
+    """
+    if g0_speed <= 0:
+        raise ValueError("g0_speed must be positive")
+    dilated = {}
+
+    def stock_for(code):
+        name = str(int(code)) if code >= 0 else None
+        dia = parser.tool_diameters.get(name) if name is not None else None
+        radius = (dia if dia else default_diameter) / 2.0
+        if not stock.is_flat:
+            radius += stock.cell  # 取樣間距之間的 cell 也列入
+        if radius not in dilated:
+            dilated[radius] = stock.dilate(radius)
+        return dilated[radius]
+
+    plan = {'air_moves': 0, 'air_time': 0.0, 'wasted_time': 0.0, 'saved_time': 0.0,
+            'runs': [], 'rewrite': [], 'arcs': [], 'restore': {}}
+    run = None
+    pending = None  # 視窗最後一個單節被改寫：(原本的插補模態)，由下一個視窗的第一個單節處理
+    for win in iter_move_windows(parser):
+        rows = win.rows.tolist()
+        prev = np.vstack((win.start_pos[None, :], win.pos[:-1]))
+        known = np.isfinite(prev).all(axis=1) & np.isfinite(win.pos).all(axis=1)
+        cand = win.cutting & known
+        gap = np.full(len(rows), -np.inf)
+        boxes = {}
+        lines = cand & (win.motion == 1)
+        for code in np.unique(win.tool[lines]).tolist():
+            sel = np.flatnonzero(lines & (win.tool == code))
+            gap[sel] = _line_gaps(stock_for(code), prev[sel], win.pos[sel])
+        for i in np.flatnonzero(cand & (win.motion != 1) & (win.plane == 17)).tolist():
+            lo, hi = _arc_box(prev[i], win.pos[i], win.word, i)
+            boxes[i] = stock_for(win.tool[i]).max_in_box(lo, hi)
+            gap[i] = min(prev[i, 2], win.pos[i, 2]) - boxes[i]
+        air = cand & (gap >= clearance)
+
+        if pending is not None:
+            _restore(parser, plan, rows[0], win.g_motion[0], pending)
+            pending = None
+        moving = np.flatnonzero(win.rapid | win.cutting | win.unknown).tolist()
+        air_list = air.tolist()
+        for i in moving:
+            if not air_list[i]:
+                run = None
+                continue
+            p0, p1 = prev[i], win.pos[i]
+            feed_time = float(win.length[i] / win.feed[i])
+            wasted = feed_time - float(np.linalg.norm(p1 - p0)) / g0_speed
+            lo, hi = np.minimum(p0[:2], p1[:2]), np.maximum(p0[:2], p1[:2])
+            rapid_ok = min(p0[2], p1[2]) - stock_for(win.tool[i]).max_in_box(lo, hi) >= rapid_clearance
+            tool_id = str(int(win.tool[i])) if win.tool[i] >= 0 else "Unknown"
+            if run is None or run['tool_id'] != tool_id:
+                run = {'start': rows[i], 'end': rows[i], 'tool_id': tool_id, 'moves': 0, 'length': 0.0,
+                       'air_time': 0.0, 'wasted_time': 0.0, 'rapid': True}
+                plan['runs'].append(run)
+            run['end'] = rows[i]
+            run['moves'] += 1
+            run['length'] += float(win.length[i])
+            run['air_time'] += feed_time
+            run['wasted_time'] += wasted
+            run['rapid'] &= bool(rapid_ok)
+            plan['air_moves'] += 1
+            plan['air_time'] += feed_time
+            plan['wasted_time'] += wasted
+            if not rapid_ok:
+                continue
+            plan['saved_time'] += wasted
+            plan['rewrite'].append(rows[i])
+            if win.motion[i] != 1:
+                plan['arcs'].append(rows[i])
+            # 下一個單節若沿用原本的插補模態，改寫後須明確指定
+            if i + 1 < len(rows):
+                _restore(parser, plan, rows[i + 1], win.g_motion[i + 1], win.motion[i])
+            else:
+                pending = win.motion[i]
+    # 下一個單節也被改寫時不需補上 (改寫的單節本身指定 G0)
+    rewritten = set(plan['rewrite'])
+    plan['restore'] = {line: code for line, code in plan['restore'].items() if line not in rewritten}
+    return plan
+
+
+def _restore(parser, plan, line, g_motion, motion):
+    """第 line 行沒有指定插補模態時，記錄改寫後需補上的原插補指令 (固定循環與宏呼叫單節除外)。"""
+    if g_motion == g_motion or motion == 0:
+        return
+    if any(addr == 'G' and val in _NO_RESTORE_G for addr, val in tokenize_block(parser.nc_lines[line])):
+        return
+    plan['restore'][line] = f"G{int(motion)}"
+
+
+def _split_code(line):
+    """單節拆為 (程式碼部分, 註解部分)，皆不含行尾。"""
+    line = line.rstrip('\r\n')
+    cut = min([i for i in (line.find('('), line.find(';')) if i >= 0], default=len(line))
+    return line[:cut], line[cut:]
+
+
+def _join(words, comment):
+    return " ".join(words + ([comment.strip()] if comment.strip() else [])) + "\n"
+
+
+def _to_rapid(line, arc):
+    """將進給單節改為 G0 (圓弧另移除 I/J/K/R)，保留其餘位址字與註解。"""
+    body, comment = _split_code(line)
+    if arc:
+        body = _ARC_WORD_RE.sub('', body)
+    if _MOTION_WORD_RE.search(body):
+        body = _MOTION_WORD_RE.sub('G0', body, count=1)
+    else:
+        body = "G0 " + body
+    return _join(body.split(), comment)
+
+
+def apply_air_cuts(parser, plan):
+    """將 plan_air_cuts 的可改寫移動寫回程式 (G0 與補上的插補指令) 並重新解析受影響的範圍。"""
+    if not plan['rewrite']:
+        return False
+    lines = parser.nc_lines
+    arcs = set(plan['arcs'])
+    for line in plan['rewrite']:
+        lines[line] = _to_rapid(lines[line], line in arcs)
+    for line, code in plan['restore'].items():
+        body, comment = _split_code(lines[line])
+        lines[line] = _join([code] + body.split(), comment)
+    touched = plan['rewrite'] + list(plan['restore'])
+    parser.reparse_lines(min(touched), max(touched) + 1)
+    return True
+
+
+def optimize_air_cuts(parser, stock, **options):
+    """plan_air_cuts 後將可安全改寫的空切削改為 G0；回傳計畫。"""
+    plan = plan_air_cuts(parser, stock, **options)
+    apply_air_cuts(parser, plan)
+    return plan
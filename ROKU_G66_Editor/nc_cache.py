@@ -0,0 +1,137 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+# 快取總大小上限預設值
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+_ENTRY_SUFFIX = '.pkl'
+# 項目檔案開頭的標記；其後為一行 JSON 標頭 {'key', 'version'}，再來才是 pickle 內容
+_MAGIC = b'ROKU-PARSE-CACHE\n'
+_MAX_HEADER_BYTES = 4096
+
+
+def default_cache_dir():
+    """
+    預設快取目錄：目前使用者的本機快取位置 (Windows 為 %LOCALAPPDATA%，其他系統為
+    $XDG_CACHE_HOME 或 ~/.cache) 下的 ROKU_G66_Editor/parse_cache。
+    項目以 pickle 保存，載入時可執行任意程式碼，因此不放在 EXE 同級等可能與他人共用的目錄。
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ROKU_G66_Editor', 'parse_cache')
+
+
+class ParseCache:
+    """
+    NC 解析結果的磁碟快取。
+
+    以「檔案內容雜湊 + 解析器版本」為鍵，保存循環資料表、行 offset 索引、
+    刀具直徑與 D 字索引等解析結果；重新開啟內容未變更的檔案時直接載入。
+    快取總大小超過 max_bytes 時，依最近使用時間 (項目檔案的 mtime) 淘汰最舊的項目 (LRU)。
+    快取讀寫失敗只會略過快取，不影響解析。
+
+    快取目錄以 0700 建立；POSIX 上目錄不屬於目前使用者或可被其他使用者寫入時不使用快取。
+    每個項目的標頭記錄快取鍵與解析器版本，兩者皆與要求的相符才載入 pickle 內容。
+    """
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(data, version):
+        """以檔案位元組內容與解析器版本計算快取鍵。"""
+        h = hashlib.blake2b(data, digest_size=20)
+        h.update(f':v{version}'.encode('ascii'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + _ENTRY_SUFFIX)
+
+    def _check_dir(self, create=False):
+        """確認快取目錄只有目前使用者可寫入 (create 時先以 0700 建立)，否則引發 PermissionError。"""
+        if create:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        st = os.stat(self.cache_dir)
+        if os.name == 'posix' and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+            raise PermissionError(f"快取目錄不屬於目前使用者或可被其他使用者寫入: {self.cache_dir}")
+
+    @staticmethod
+    def _header(key, version):
+        return {'key': key, 'version': str(version)}
+
+    def get(self, key, version):
+        """
+        取得快取項目，不存在、無法讀取或標頭的鍵 / 版本不符時回傳 None。
+        命中時更新其最近使用時間。
+        """
+        path = self._path(key)
+        try:
+            self._check_dir()
+            with open(path, 'rb') as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    return None
+                header = json.loads(f.readline(_MAX_HEADER_BYTES))
+                if header != self._header(key, version):
+                    print(f"Ignoring parse cache {path}: key or parser version mismatch")
+                    return None
+                entry = pickle.load(f)
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error loading parse cache {path}: {e}")
+            return None
+
+    def put(self, key, version, entry):
+        """寫入快取項目 (先寫暫存檔再替換)，並淘汰超出大小上限的舊項目。"""
+        try:
+            self._check_dir(create=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(_MAGIC)
+                    f.write(json.dumps(self._header(key, version)).encode('ascii') + b'\n')
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._evict()
+        except Exception as e:
+            print(f"Error saving parse cache to {self.cache_dir}: {e}")
+
+    def _evict(self):
+        """總大小超過上限時，從最久未使用的項目開始刪除。"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for de in it:
+                if de.name.endswith(_ENTRY_SUFFIX):
+                    st = de.stat()
+                    entries.append((st.st_mtime, st.st_size, de.path))
+                    total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """刪除所有快取項目。"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(_ENTRY_SUFFIX):
+                os.remove(os.path.join(self.cache_dir, name))
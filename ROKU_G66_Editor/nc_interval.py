@@ -0,0 +1,48 @@
+"""
+行號 → 所屬循環的區間索引。
+
+每個循環 (CycleRecord) 的模態區間為 [line_index, end_line)：循環指令行至結束模態的單節 (不含)。
+新的循環指令會結束前一個循環，各區間互不重疊且依行號排序，
+因此起點與終點兩個排序列表以二分搜尋 (bisect) 即可在 O(log n) 內查詢某行所屬的循環，
+或與某個行範圍重疊的所有循環。
+"""
+import bisect
+
+
+class CycleIntervals:
+    """
+    已解析程式 (RokuNCParser.tools_data) 各循環的模態區間。
+
+        starts: 各循環的起始行 (循環指令行)
+        ends:   各循環的結束行 (不含)
+    """
+
+    def __init__(self, tools_data):
+        self.starts = []
+        self.ends = []
+        for rec in tools_data:
+            start = rec.line_index
+            end = rec.get('end_line')
+            self.starts.append(start)
+            # 尚未結束模態的循環至少包含循環指令行本身
+            self.ends.append(max(end, start + 1) if end is not None else start + 1)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def cycle_at(self, line_idx):
+        """第 line_idx 行所屬循環在 tools_data 中的索引 (不在任何循環模態中時為 None)。"""
+        k = bisect.bisect_right(self.starts, line_idx) - 1
+        if k >= 0 and line_idx < self.ends[k]:
+            return k
+        return None
+
+    def cycles_in(self, start, end):
+        """與第 [start, end) 行重疊的循環索引範圍 (range，依行號排序)。"""
+        lo = bisect.bisect_right(self.ends, start)
+        hi = bisect.bisect_left(self.starts, end)
+        return range(lo, max(lo, hi))
+
+    def span(self, data_index):
+        """第 data_index 個循環的 (起始行, 結束行 (不含))。"""
+        return self.starts[data_index], self.ends[data_index]
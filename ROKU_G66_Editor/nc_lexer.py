@@ -0,0 +1,327 @@
+import re
+import bisect
+from array import array
+
+import numpy as np
+
+# 註解：( ... ) 區段 (允許未閉合至行尾) 與 ; 之後的整段文字
+_COMMENT_RE = re.compile(r'\([^)\n]*\)?|;[^\n]*')
+
+# 位址字 (Address Word)：單一大寫字母 + 數值，允許字母與數值之間有空白
+# 數值支援 "10."、".45"、"-2.9"、"+3" 等 Fanuc 常見寫法
+_WORD_RE = re.compile(r'([A-Z])[ \t]*([-+]?(?:\d+\.?\d*|\.\d+))')
+
+# 模態相關位址：G (準備機能)、M (輔助機能)、S (主軸)、T (刀號)、P (宏程式號)
+# 以字元類別作為起始字元，讓 regex 引擎快速跳過座標字；註解整段吞掉不產生 word
+# group(1) 為數值，註解匹配時 group(1) 為 None
+_MODAL_SCAN_RE = re.compile(
+    r'[(;GMSTP](?:(?<=\()[^)\n]*\)?|(?<=;)[^\n]*|(?<=[GMSTP])[ \t]*([-+]?(?:\d+\.?\d*|\.\d+)))'
+)
+
+# 刀具直徑 D 字 (含註解內的 "D0.5" 標示，與舊版 _scan_for_diameter 相同不分位置)
+_D_WORD_RE = re.compile(r'D[ \t]*(\d*\.?\d+)')
+
+# 座標單節的種類 (MotionBlocks.flags)
+MOTION_NORMAL = 0   # 一般定位 / 鑽孔位置
+MOTION_IGNORE = 1   # 座標字不是位置：G04 暫停 (X 為秒數)、G10 資料設定、G52 區域座標、G65 宏引數
+MOTION_UNKNOWN = 2  # G28 / G30 回參考點、G53 機械座標：指定軸之後的工件座標位置未知
+MOTION_SET = 3      # G92 座標系設定：指定軸的目前位置即為該值
+_MOTION_FLAG_G = {4.0: MOTION_IGNORE, 10.0: MOTION_IGNORE, 52.0: MOTION_IGNORE, 65.0: MOTION_IGNORE,
+                  28.0: MOTION_UNKNOWN, 30.0: MOTION_UNKNOWN, 53.0: MOTION_UNKNOWN, 92.0: MOTION_SET}
+
+
+def tokenize_block(line):
+    """
+    將單一 NC 單節 (Block) 一次切分為 (位址字母, 數值) 的 word 列表。
+    註解會被略過，數值統一轉為 float。
+
+    例：'G66 P9131 R-.2 Z-2.9 (DRILL)' →
+        [('G', 66.0), ('P', 9131.0), ('R', -0.2), ('Z', -2.9)]
+    """
+    if '(' in line or ';' in line:
+        line = _COMMENT_RE.sub(' ', line)
+    return [(addr, float(val)) for addr, val in _WORD_RE.findall(line)]
+
+
+def iter_modal_blocks(text):
+    """
+    單次掃描整份程式文字，依行號產出模態相關的 word。
+
+    只有 G/M/S/T/P 會被切分成 word (其餘座標字不影響模態狀態)，
+    註解會被整段略過。對每個含有模態 word 的單節產出：
+        (行號, 該行起始 offset, [(位址, 數值), ...])
+    """
+    line_no = 0
+    pos = 0
+    block_line = -1
+    block_start = 0
+    words = []
+    count = text.count
+    for m in _MODAL_SCAN_RE.finditer(text):
+        val = m.group(1)
+        if val is None:
+            continue
+        start = m.start()
+        line_no += count('\n', pos, start)
+        pos = start
+        if line_no != block_line:
+            if words:
+                yield block_line, block_start, words
+                words = []
+            block_line = line_no
+            block_start = text.rfind('\n', 0, start) + 1
+        words.append((text[start], float(val)))
+    if words:
+        yield block_line, block_start, words
+
+
+class MotionBlocks:
+    """
+    一段程式內含 X/Y 座標字的單節 (依行號排序)，以 NumPy 陣列保存，
+    供模態插補器 (nc_modal.MotionState) 以向量運算計算絕對位置與孔位。
+
+        lines:   行號 (int64)
+        xy:      (N, 2) float64，未指定的軸為 NaN (模態沿用)
+        l_words / k_words: 重複次數 L / K，未指定為 NaN
+        flags:   MOTION_* 單節種類 (int8)
+    """
+    __slots__ = ('lines', 'xy', 'l_words', 'k_words', 'flags')
+
+    def __init__(self, lines, xy, l_words, k_words, flags):
+        self.lines = np.asarray(lines, dtype=np.int64)
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.l_words = np.asarray(l_words, dtype=np.float64)
+        self.k_words = np.asarray(k_words, dtype=np.float64)
+        self.flags = np.asarray(flags, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.lines)
+
+
+# 向量化詞法分析：每次處理的文字視窗大小 (字元)，限制暫存陣列的記憶體用量
+_MOTION_WINDOW_CHARS = 1 << 20
+
+
+def _last_before(sorted_pos, p):
+    """每個位置 p 之前最後一個 sorted_pos 中的位置，沒有則為 -1。"""
+    if not len(sorted_pos):
+        return np.full(len(p), -1)
+    k = np.searchsorted(sorted_pos, p) - 1
+    return np.where(k >= 0, sorted_pos[np.maximum(k, 0)], -1)
+
+
+def _skip_digits(c, pos):
+    """由各位置向後略過連續的數字，回傳第一個非數字字元的位置。"""
+    pos = pos.copy()
+    active = np.arange(len(pos))
+    while len(active):
+        ch = c[pos[active]]
+        active = active[(ch >= 48) & (ch <= 57)]
+        pos[active] += 1
+    return pos
+
+
+def _parse_numbers(c, q, num_start, int_end, num_end):
+    """
+    向量化解析數值字串 c[q:num_end] (已確認符合 [-+]?(\\d+\\.?\\d*|\\.\\d+))。
+    以整數尾數除以 10 的次方計算：尾數 < 2**53 時兩者皆可精確表示，
+    IEEE 除法的正確捨入使結果與 float() 逐位元相同；位數過多的數值才逐一以 float() 解析。
+    """
+    mantissa = np.zeros(len(q), dtype=np.int64)
+    frac_digits = np.maximum(num_end - int_end - 1, 0)
+    max_len = int((num_end - num_start).max()) if len(q) else 0
+    for offset in range(max_len):
+        pos = num_start + offset
+        ch = c[np.minimum(pos, len(c) - 1)].astype(np.int64)
+        digit = (pos < num_end) & (ch != 46)
+        mantissa = np.where(digit, mantissa * 10 + (ch - 48), mantissa)
+    values = mantissa / np.power(10.0, frac_digits)
+    values = np.where(c[q] == 45, -values, values)
+    long_numbers = np.flatnonzero((num_end - num_start) > 15)
+    if len(long_numbers):
+        raw = c.tobytes()
+        for i in long_numbers.tolist():
+            values[i] = float(raw[q[i]:num_end[i]])
+    return values
+
+
+def _first_per_line(token_lines, values, rows):
+    """每個 rows 行號中第一個 token 的值 (沒有則為 NaN)。token_lines 已依序排列。"""
+    out = np.full(len(rows), np.nan)
+    if not len(token_lines):
+        return out
+    first = np.flatnonzero(np.r_[True, token_lines[1:] != token_lines[:-1]])
+    lines = token_lines[first]
+    k = np.searchsorted(rows, lines)
+    hit = k < len(rows)
+    hit[hit] = rows[k[hit]] == lines[hit]
+    out[k[hit]] = values[first[hit]]
+    return out
+
+
+def _lex_words_window(text, base_line, letters):
+    """
+    以 NumPy 對一段文字做向量化詞法分析 (與 tokenize_block 相同的註解與數值規則)：
+    找出註解外屬於 letters 的位址字與其數值，回傳 (字母碼, 數值, 行號) 三個陣列 (依出現順序)。
+    """
+    # 非 ASCII 字元 (只會出現在註解內) 以 '?' 取代，字元位置不變；尾端補兩個 0 作為哨兵
+    c = np.frombuffer(text.encode('ascii', 'replace') + b'\0\0', dtype=np.uint8)
+    p = np.flatnonzero(_letter_table(letters)[c])
+    newlines = np.flatnonzero(c == 10)
+    if '(' in text or ';' in text:
+        # ( ... ) 註解：同一行最後一個 '(' 之後沒有 ')'；; 註解：註解外的 ';' 至行尾
+        opens, closes = np.flatnonzero(c == 40), np.flatnonzero(c == 41)
+
+        def in_paren(pos, last_nl):
+            return _last_before(opens, pos) > np.maximum(_last_before(closes, pos), last_nl)
+
+        semis = np.flatnonzero(c == 59)
+        semis = semis[~in_paren(semis, _last_before(newlines, semis))]
+        last_nl = _last_before(newlines, p)
+        p = p[~(in_paren(p, last_nl) | (_last_before(semis, p) > last_nl))]
+
+    # 數值：位址字之後可有空白，[-+]? 後接 \d+\.?\d* 或 \.\d+
+    q = p + 1
+    while True:
+        blank = (c[q] == 32) | (c[q] == 9)
+        if not blank.any():
+            break
+        q = q + blank
+    num_start = q + ((c[q] == 43) | (c[q] == 45))
+    e = _skip_digits(c, num_start)
+    has_dot = c[e] == 46
+    num_end = np.where(has_dot, _skip_digits(c, e + has_dot), e)
+    valid = (e > num_start) | (num_end > e + 1)
+    p, q, num_start, e, num_end = p[valid], q[valid], num_start[valid], e[valid], num_end[valid]
+
+    values = _parse_numbers(c, q, num_start, e, num_end)
+    return c[p], values, np.searchsorted(newlines, p) + base_line
+
+
+_LETTER_TABLES = {}
+
+
+def _letter_table(letters):
+    """字元碼 → 是否為 letters 中的位址字母 (查表用的 256 長度布林陣列)。"""
+    table = _LETTER_TABLES.get(letters)
+    if table is None:
+        table = np.zeros(256, dtype=bool)
+        table[np.frombuffer(letters.encode('ascii'), dtype=np.uint8)] = True
+        _LETTER_TABLES[letters] = table
+    return table
+
+
+def lex_words(text, letters, base_line=0):
+    """
+    擷取一段以行邊界切齊的程式文字中，註解外所有屬於 letters (如 'GXY') 的位址字。
+    回傳 (字母碼 uint8, 數值 float64, 行號 int64) 三個等長陣列，依出現順序排列；
+    以向量化方式處理，長文字依行邊界分成多個視窗。
+    """
+    if len(text) <= _MOTION_WINDOW_CHARS:
+        return _lex_words_window(text, base_line, letters)
+    parts = []
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start + _MOTION_WINDOW_CHARS)
+        end = len(text) if end < 0 else end + 1
+        parts.append(_lex_words_window(text[start:end], base_line, letters))
+        base_line += text.count('\n', start, end)
+        start = end
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def words_per_line(letters, values, token_lines, letter, rows):
+    """lex_words 的結果中，每個 rows 行號 (已排序) 第一個 letter 位址字的值 (沒有則為 NaN)。"""
+    mask = letters == ord(letter)
+    return _first_per_line(token_lines[mask], values[mask], rows)
+
+
+def lex_motion_blocks(text, base_line=0):
+    """
+    擷取一段以行邊界切齊的程式文字中所有含 X/Y 座標字的單節 (註解內的不算)。
+    每個單節只取第一個 X / Y / L / K 值；座標的絕對位置由模態插補器依 G90/G91 計算。
+    """
+    return motion_blocks(*lex_words(text, 'GKLXY', base_line))
+
+
+def motion_blocks(letters, values, token_lines):
+    """由 lex_words 的結果建立 MotionBlocks (letters 可包含 G/K/L/X/Y 以外的位址字，會被略過)。"""
+    is_xy = (letters == 88) | (letters == 89)
+    rows = token_lines[is_xy]
+    if len(rows):
+        rows = rows[np.r_[True, rows[1:] != rows[:-1]]]
+    xy = np.column_stack((words_per_line(letters, values, token_lines, 'X', rows),
+                          words_per_line(letters, values, token_lines, 'Y', rows)))
+    l_words = words_per_line(letters, values, token_lines, 'L', rows)
+    k_words = words_per_line(letters, values, token_lines, 'K', rows)
+
+    flags = np.zeros(len(rows), dtype=np.int8)
+    is_g = letters == 71
+    g_vals, g_lines = values[is_g], token_lines[is_g]
+    g_flags = np.zeros(len(g_vals), dtype=np.int8)
+    for val, flag in _MOTION_FLAG_G.items():
+        g_flags[g_vals == val] = flag
+    special = g_flags > 0
+    if special.any():
+        g_lines, g_flags = g_lines[special], g_flags[special]
+        k = np.searchsorted(rows, g_lines)
+        hit = k < len(rows)
+        hit[hit] = rows[k[hit]] == g_lines[hit]
+        np.maximum.at(flags, k[hit], g_flags[hit])
+    return MotionBlocks(rows, xy, l_words, k_words, flags)
+
+
+class DWordIndex:
+    """
+    D 字 (刀具直徑) 位置索引：依行號排序，每行只記錄第一個大於 0 的 D 值。
+    於詞法分析時逐段建立，查詢「某行 +/- N 行內第一個 D 值」只需一次 bisect。
+    """
+    __slots__ = ('lines', 'values', 'end_line')
+
+    def __init__(self):
+        self.lines = array('Q')
+        self.values = array('d')
+        self.end_line = 0  # 已建立索引的行數 (串流模式下逐區塊增加)
+
+    def index_text(self, text, base_line=0):
+        """索引一段以行邊界切齊的文字 (base_line 為其首行行號，須依序呼叫)。"""
+        lines, values = self.lines, self.values
+        line_no = base_line
+        pos = 0
+        count = text.count
+        for m in _D_WORD_RE.finditer(text):
+            start = m.start()
+            line_no += count('\n', pos, start)
+            pos = start
+            if lines and lines[-1] == line_no:
+                continue
+            val = float(m.group(1))
+            if val > 0:
+                lines.append(line_no)
+                values.append(val)
+        line_no += count('\n', pos)
+        if text and not text.endswith('\n'):
+            line_no += 1
+        self.end_line = max(self.end_line, line_no)
+
+    def extend(self, other):
+        """接續另一個 (其後行號範圍的) 索引，用於合併平行解析的分區塊結果。"""
+        self.lines.extend(other.lines)
+        self.values.extend(other.values)
+        self.end_line = max(self.end_line, other.end_line)
+
+    def reindex_lines(self, start, end, text):
+        """行號 [start, end) 修改後，以其新文字重建該範圍的索引 (行數不變)。"""
+        part = DWordIndex()
+        part.index_text(text, start)
+        lo = bisect.bisect_left(self.lines, start)
+        hi = bisect.bisect_left(self.lines, end)
+        self.lines[lo:hi] = part.lines
+        self.values[lo:hi] = part.values
+
+    def first_in_range(self, start, end):
+        """行號 [start, end) 範圍內第一個 D 值，無則回傳 None。"""
+        k = bisect.bisect_left(self.lines, start)
+        if k < len(self.lines) and self.lines[k] < end:
+            return self.values[k]
+        return None
@@ -0,0 +1,350 @@
+import os
+import re
+import mmap
+import bisect
+import tempfile
+from array import array
+
+import numpy as np
+
+
+# 支援的檔案編碼 (依序嘗試)：UTF-8 與 Big5 (cp950，常見於中文註解)
+ENCODINGS = ('utf-8', 'cp950')
+# 編碼偵測只檢查檔案開頭這個大小範圍內含非 ASCII 字元的行
+DETECT_PREFIX_BYTES = 1 << 20
+_DETECT_SAMPLE_LINES = 64
+
+_NON_ASCII_RE = re.compile(rb'[\x80-\xff]')
+# 建立行 offset 索引時每次以 NumPy 搜尋換行字元的範圍 (位元組)，限制暫存陣列的記憶體用量
+_OFFSET_WINDOW_BYTES = 1 << 24
+
+
+def _iter_non_ascii_lines(buf, start=0, end=None):
+    """依序產出 [start, end) 範圍內含非 ASCII 位元組的行範圍 (行起點, 行尾含換行)。"""
+    if end is None:
+        end = len(buf)
+    m = _NON_ASCII_RE.search(buf, start, end)
+    while m:
+        line_start = max(buf.rfind(b'\n', start, m.start()) + 1, start)
+        line_end = buf.find(b'\n', m.start(), end)
+        line_end = end if line_end < 0 else line_end + 1
+        yield line_start, line_end
+        m = _NON_ASCII_RE.search(buf, line_end, end)
+
+
+def detect_encoding(buf):
+    """
+    由檔案開頭 (DETECT_PREFIX_BYTES 內) 含非 ASCII 字元的行判斷主要編碼：
+    多數取樣行是合法 UTF-8 (或完全沒有非 ASCII 字元) 時為 'utf-8'，否則為 'cp950'。
+    """
+    valid = total = 0
+    for start, end in _iter_non_ascii_lines(buf, 0, min(len(buf), DETECT_PREFIX_BYTES)):
+        total += 1
+        try:
+            bytes(buf[start:end]).decode('utf-8')
+            valid += 1
+        except UnicodeDecodeError:
+            pass
+        if total >= _DETECT_SAMPLE_LINES:
+            break
+    return 'utf-8' if valid * 2 >= total else 'cp950'
+
+
+def line_encoding(raw, encoding):
+    """單行實際使用的編碼：先試主要編碼，再試其他支援的編碼；皆失敗時回傳 None。"""
+    for enc in (encoding,) + tuple(e for e in ENCODINGS if e != encoding):
+        try:
+            raw.decode(enc)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def decode_line(raw, encoding):
+    """
+    解碼單行：主要編碼失敗時改用其他支援的編碼 (混合編碼檔案)，
+    都不合法的位元組以 U+FFFD 取代而不是略過。
+    """
+    enc = line_encoding(raw, encoding)
+    return raw.decode(enc) if enc else raw.decode(encoding, 'replace')
+
+
+def decode_text(buf, encoding):
+    """
+    一次解碼整段內容 (encoding 為 detect_encoding 判斷的主要編碼)。
+    單一編碼的檔案直接整段解碼；含有其他編碼或不合法位元組時，ASCII 區段直接解碼，
+    只有含非 ASCII 位元組的行才逐行以 decode_line 判斷編碼。
+    """
+    if buf.isascii():
+        return buf.decode('ascii')
+    try:
+        return buf.decode(encoding)
+    except UnicodeDecodeError:
+        pass
+    parts = []
+    pos = 0
+    for start, end in _iter_non_ascii_lines(buf):
+        parts.append(buf[pos:start].decode('ascii'))
+        parts.append(decode_line(buf[start:end], encoding))
+        pos = end
+    parts.append(buf[pos:].decode('ascii'))
+    return ''.join(parts)
+
+
+def build_line_offsets(buf):
+    """
+    掃描位元組緩衝區中的換行字元，建立每行起始位置的 offset 索引。
+    回傳 array('Q')，長度為行數 + 1 (最後一個元素為緩衝區結尾)。
+    """
+    offsets = array('Q', [0])
+    size = len(buf)
+    view = np.frombuffer(buf, dtype=np.uint8)
+    for start in range(0, size, _OFFSET_WINDOW_BYTES):
+        newlines = np.flatnonzero(view[start:start + _OFFSET_WINDOW_BYTES] == 0x0A)
+        offsets.frombytes((newlines + (start + 1)).astype(np.uint64).tobytes())
+    # 釋放緩衝區的 buffer 參照 (bytearray 之後仍需可改變長度、mmap 需可關閉)
+    del view
+    if offsets[-1] != size:
+        offsets.append(size)
+    return offsets
+
+
+def _normalize_eol(text):
+    """與文字模式 readlines() 一致：行尾 CRLF 統一回傳為 LF。"""
+    if text.endswith('\r\n'):
+        return text[:-2] + '\n'
+    return text
+
+
+def _encode_line(text, orig_raw, encoding):
+    """
+    將修改後的行編碼為位元組，並沿用原始行的編碼 (混合編碼檔案逐行不同)
+    與行尾格式 (CRLF / LF)。
+    """
+    if orig_raw.endswith(b'\r\n') and text.endswith('\n') and not text.endswith('\r\n'):
+        text = text[:-1] + '\r\n'
+    return text.encode(line_encoding(orig_raw, encoding) or encoding, 'replace')
+
+
+class _OffsetLines:
+    """
+    以「連續位元組緩衝區 + 行起點 offset 索引」表示的程式內容。
+    介面與 list[str] 相容 (len / 索引 / 迭代)，可直接作為 RokuNCParser.nc_lines。
+    子類別需提供 self._buf、self._offsets、self.encoding (主要編碼)。
+    """
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _index(self, idx):
+        n = len(self._offsets) - 1
+        if idx < 0:
+            idx += n
+        if idx < 0 or idx >= n:
+            raise IndexError("line index out of range")
+        return idx
+
+    def _start(self, idx):
+        """第 idx 行在緩衝區中的起始位置 (idx == 行數時為緩衝區結尾)。"""
+        return self._offsets[idx]
+
+    def raw_line(self, idx):
+        """取得指定行的原始位元組 (含行尾)。"""
+        idx = self._index(idx)
+        return self._buf[self._start(idx):self._start(idx + 1)]
+
+    def encode_line(self, idx, text):
+        """以第 idx 行原始的編碼與行尾格式 (CRLF / LF) 將 text 編碼為位元組。"""
+        return _encode_line(text, _OffsetLines.raw_line(self, idx), self.encoding)
+
+    def __getitem__(self, idx):
+        idx = self._index(idx)
+        raw = self._buf[self._start(idx):self._start(idx + 1)]
+        return _normalize_eol(decode_line(raw, self.encoding))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def text_range(self, start, end):
+        """第 [start, end) 行的文字 (保留原始行尾，供重新掃描用)。"""
+        return decode_text(self._buf[self._start(start):self._start(end)], self.encoding)
+
+    def iter_text_chunks(self, chunk_bytes=4 << 20):
+        """
+        依行邊界將內容切成約 chunk_bytes 大小的區塊並逐塊解碼。
+        產出 (區塊首行行號, 區塊文字)；僅在記憶體中保留目前區塊。
+        """
+        offsets = self._offsets
+        n = len(offsets) - 1
+        line = 0
+        while line < n:
+            target = offsets[line] + chunk_bytes
+            end_line = max(line + 1, bisect.bisect_left(offsets, target, line + 1, n))
+            yield line, decode_text(self._buf[offsets[line]:offsets[end_line]], self.encoding)
+            line = end_line
+
+
+class LineStore(_OffsetLines):
+    """
+    記憶體內的精簡行儲存：整份程式保存在單一 bytearray，
+    搭配 array('Q') 行起點索引，O(1) 取得任意行。
+
+    修改行時直接在 bytearray 上做 splice 替換；長度改變造成的後續 offset 位移
+    先記錄為少量的延遲位移 (以 bisect 套用)，累積過多時才重建索引。
+    存檔時整個緩衝區一次寫出。
+    """
+    _MAX_PENDING_SHIFTS = 64
+
+    def __init__(self, data=b'', encoding='utf-8', offsets=None):
+        self.encoding = encoding
+        self._buf = bytearray(data)
+        # offsets 可由解析快取提供，省去重新掃描換行字元
+        self._offsets = offsets if offsets is not None else build_line_offsets(self._buf)
+        # 延遲位移：_shift_lines[k] (含) 之後的行起點需加上 _shift_sums[k]
+        self._shift_lines = []
+        self._shift_sums = []
+
+    def _start(self, idx):
+        off = self._offsets[idx]
+        if self._shift_lines:
+            k = bisect.bisect_right(self._shift_lines, idx)
+            if k:
+                off += self._shift_sums[k - 1]
+        return off
+
+    def iter_text_chunks(self, chunk_bytes=4 << 20):
+        self._compact()
+        return super().iter_text_chunks(chunk_bytes)
+
+    def __setitem__(self, idx, text):
+        idx = self._index(idx)
+        start, end = self._start(idx), self._start(idx + 1)
+        new_raw = _encode_line(text, self._buf[start:end], self.encoding)
+        self._buf[start:end] = new_raw
+        delta = len(new_raw) - (end - start)
+        if delta:
+            self._add_shift(idx + 1, delta)
+
+    def _add_shift(self, line, delta):
+        lines, sums = self._shift_lines, self._shift_sums
+        k = bisect.bisect_left(lines, line)
+        if k < len(lines) and lines[k] == line:
+            start_k = k
+        else:
+            lines.insert(k, line)
+            sums.insert(k, sums[k - 1] if k else 0)
+            start_k = k
+        for j in range(start_k, len(sums)):
+            sums[j] += delta
+        if len(lines) > self._MAX_PENDING_SHIFTS:
+            self._compact()
+
+    def _compact(self):
+        """將延遲位移併入索引 (重新掃描換行字元)。"""
+        if self._shift_lines:
+            self._offsets = build_line_offsets(self._buf)
+            self._shift_lines = []
+            self._shift_sums = []
+
+    @property
+    def offsets(self):
+        """行起點 offset 索引 (先併入延遲位移)。"""
+        self._compact()
+        return self._offsets
+
+    @property
+    def nbytes(self):
+        """緩衝區與索引佔用的位元組數 (估算記憶體用量)。"""
+        return len(self._buf) + self._offsets.itemsize * len(self._offsets)
+
+    def save(self, output_path, encoding=None):
+        """整個緩衝區一次寫出 (內容已是檔案編碼，未修改的行保持原始位元組)。"""
+        with open(output_path, 'wb') as f:
+            f.write(self._buf)
+
+
+class MappedLines(_OffsetLines):
+    """
+    以 mmap 映射 NC 檔案的唯讀行存取器 (串流模式用)。
+
+    記憶體中只保留每行的 byte offset，行內容在存取時才從映射區解碼。
+    修改過的行暫存於 overlay，存檔時才與原始內容合併寫出。
+    """
+    def __init__(self, file_path, encoding=None):
+        self.file_path = file_path
+        self._overlay = {}
+        self._open()
+        # 未指定編碼時由檔案開頭偵測
+        self.encoding = encoding or detect_encoding(self._buf)
+
+    def _open(self):
+        self._file = open(self.file_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # 空檔案無法建立 mmap，以空 bytes 代替
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        self._offsets = build_line_offsets(self._buf)
+
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._file.close()
+
+    def __getitem__(self, idx):
+        idx = self._index(idx)
+        if idx in self._overlay:
+            return self._overlay[idx]
+        return super().__getitem__(idx)
+
+    def __setitem__(self, idx, text):
+        self._overlay[self._index(idx)] = text
+
+    def raw_line(self, idx):
+        """取得指定行的位元組 (含行尾)；修改過的行依原始行的編碼與行尾格式編碼。"""
+        idx = self._index(idx)
+        if idx in self._overlay:
+            return self.encode_line(idx, self._overlay[idx])
+        return super().raw_line(idx)
+
+    def text_range(self, start, end):
+        edited = sorted(i for i in self._overlay if start <= i < end)
+        if not edited:
+            return super().text_range(start, end)
+        parts = []
+        pos = start
+        for i in edited:
+            parts.append(super().text_range(pos, i))
+            parts.append(self._overlay[i])
+            pos = i + 1
+        parts.append(super().text_range(pos, end))
+        return ''.join(parts)
+
+    def save(self, output_path, encoding=None):
+        """
+        將原始內容與 overlay 中的修改合併寫出。
+        未修改的行直接複製原始位元組；修改行以指定編碼寫出並保留原本的行尾格式。
+        若輸出路徑即為映射中的來源檔，寫出後重新映射新檔案。
+        """
+        encoding = encoding or self.encoding
+        out_dir = os.path.dirname(os.path.abspath(output_path))
+        fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pos = 0
+                for idx in sorted(self._overlay):
+                    start, end = self._offsets[idx], self._offsets[idx + 1]
+                    f.write(self._buf[pos:start])
+                    f.write(_encode_line(self._overlay[idx], self._buf[start:end], encoding))
+                    pos = end
+                f.write(self._buf[pos:len(self._buf)])
+            same_file = os.path.exists(output_path) and os.path.samefile(output_path, self.file_path)
+            if same_file:
+                self.close()
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if same_file:
+            self._overlay = {}
+            self._open()
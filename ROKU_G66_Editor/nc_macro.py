@@ -0,0 +1,636 @@
+"""
+Custom Macro B 直譯器：以宏程式本體 (如 O9131) 計算 G66 / G65 呼叫的實際動作與時間。
+
+宏程式只編譯一次：每個單節轉為指令 tuple (賦值、IF / GOTO、WHILE / DO / END、移動單節)，
+運算式轉為 Python 函式 (compile 後快取)；每次呼叫依引數 (#1~#33) 由指令表執行，
+累計 G0 / G1 的移動距離、G04 暫停與啄鑽次數。相同引數的結果會快取。
+
+支援：#變數 (含 #[運算式] 間接指定、空變數 #0 的 EQ / NE 判斷)、+ - * / MOD AND OR XOR、
+EQ NE GT GE LT LE、SIN COS TAN ATAN SQRT ABS ROUND FIX FUP LN EXP POW、
+IF [...] GOTO n、IF [...] THEN 賦值、GOTO n、WHILE [...] DOm ... ENDm、M99 返回、#3000 警報。
+系統變數：#4001 (G00~G03)、#4003 (G90/G91)、#4109 (F)、#5001~#5003 / #5041~#5043 (目前位置)。
+其他 G 碼與宏呼叫、POPEN / DPRNT 等輸出指令略過。
+"""
+import math
+import re
+
+# 引數指定 I：位址 → 區域變數號 (G / L / N / O / P 不是引數)
+_ARG_SPEC_I = {'A': 1, 'B': 2, 'C': 3, 'D': 7, 'E': 8, 'F': 9, 'H': 11, 'M': 13, 'Q': 17, 'R': 18,
+               'S': 19, 'T': 20, 'U': 21, 'V': 22, 'W': 23, 'X': 24, 'Y': 25, 'Z': 26}
+# 引數指定 II：第 n 組 (0 起算) 的 I / J / K 為 #(4 + 3n) / #(5 + 3n) / #(6 + 3n)，最多 10 組
+_IJK_OFFSET = {'I': 4, 'J': 5, 'K': 6}
+_IJK_SETS = 10
+
+# 比較運算的容許誤差：重複累加 (如每次減去啄鑽量) 的浮點誤差不應多出一次迴圈，
+# 與 CNC 以有限位數保存變數的結果一致
+_CMP_EPS = 1e-9
+# 執行的單節數上限 (避免宏程式無窮迴圈)
+MAX_STEPS = 200000
+# 每個宏程式快取的呼叫結果數
+_RUN_CACHE_SIZE = 4096
+# 快取的編譯結果數 (依宏程式文字與共用變數)
+_COMPILED_CACHE_SIZE = 32
+
+_COMMENT_RE = re.compile(r'\([^)]*\)?|;.*')
+_TOKEN_RE = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|([A-Z]+)|(\S))')
+_COMPARE = {'EQ': '_eq', 'NE': '_ne', 'GT': '_gt', 'GE': '_ge', 'LT': '_lt', 'LE': '_le'}
+_ADD_OPS = {'+': '_add', '-': '_sub', 'OR': '_or', 'XOR': '_xor'}
+_MUL_OPS = {'*': '_mul', '/': '_div', 'AND': '_and', 'MOD': '_mod'}
+_FUNCTIONS = ('SIN', 'COS', 'TAN', 'ASIN', 'ACOS', 'ATAN', 'SQRT', 'SQR', 'ABS', 'ROUND', 'RND',
+              'FIX', 'FUP', 'LN', 'EXP', 'POW', 'BIN', 'BCD')
+_NOP_WORDS = ('POPEN', 'PCLOS', 'DPRNT', 'BPRNT', 'SETVN')
+
+# 指令種類
+_ASSIGN, _IF_GOTO, _IF_ASSIGN, _GOTO, _WHILE, _END, _BLOCK = range(7)
+
+
+class MacroError(Exception):
+    """宏程式語法錯誤、執行警報 (#3000)、無窮迴圈或無法計時的動作。"""
+
+
+# ---- 運算式執行時的輔助函式 (空變數於運算中視為 0) ----
+
+def _n(x):
+    return 0.0 if x is None else x
+
+
+def _add(a, b):
+    return _n(a) + _n(b)
+
+
+def _sub(a, b):
+    return _n(a) - _n(b)
+
+
+def _mul(a, b):
+    return _n(a) * _n(b)
+
+
+def _div(a, b):
+    if not _n(b):
+        raise MacroError("除以 0")
+    return _n(a) / _n(b)
+
+
+def _mod(a, b):
+    if not _n(b):
+        raise MacroError("除以 0")
+    return math.fmod(_n(a), _n(b))
+
+
+def _and(a, b):
+    return float(int(_n(a)) & int(_n(b)))
+
+
+def _or(a, b):
+    return float(int(_n(a)) | int(_n(b)))
+
+
+def _xor(a, b):
+    return float(int(_n(a)) ^ int(_n(b)))
+
+
+def _eq(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= _CMP_EPS
+
+
+def _ne(a, b):
+    return not _eq(a, b)
+
+
+def _gt(a, b):
+    return _n(a) > _n(b) + _CMP_EPS
+
+
+def _ge(a, b):
+    return _n(a) >= _n(b) - _CMP_EPS
+
+
+def _lt(a, b):
+    return _n(a) < _n(b) - _CMP_EPS
+
+
+def _le(a, b):
+    return _n(a) <= _n(b) + _CMP_EPS
+
+
+def _neg(a):
+    return -_n(a)
+
+
+def _round(a):
+    a = _n(a)
+    return float(math.floor(abs(a) + 0.5)) * (1 if a >= 0 else -1)
+
+
+def _fup(a):
+    a = _n(a)
+    return float(math.ceil(abs(a))) * (1 if a >= 0 else -1)
+
+
+def _sqrt(a):
+    if _n(a) < 0:
+        raise MacroError("SQRT 的引數為負值")
+    return math.sqrt(_n(a))
+
+
+def _ln(a):
+    if _n(a) <= 0:
+        raise MacroError("LN 的引數必須大於 0")
+    return math.log(_n(a))
+
+
+def _atan(a, b=None):
+    if b is None:
+        return math.degrees(math.atan(_n(a)))
+    return math.degrees(math.atan2(_n(a), _n(b))) % 360.0
+
+
+_FUNC_IMPL = {
+    'SIN': lambda a: math.sin(math.radians(_n(a))),
+    'COS': lambda a: math.cos(math.radians(_n(a))),
+    'TAN': lambda a: math.tan(math.radians(_n(a))),
+    'ASIN': lambda a: math.degrees(math.asin(_n(a))),
+    'ACOS': lambda a: math.degrees(math.acos(_n(a))),
+    'ATAN': _atan,
+    'SQRT': _sqrt, 'SQR': _sqrt,
+    'ABS': lambda a: abs(_n(a)),
+    'ROUND': _round, 'RND': _round,
+    'FIX': lambda a: float(math.trunc(_n(a))),
+    'FUP': _fup,
+    'LN': _ln,
+    'EXP': lambda a: math.exp(_n(a)),
+    'POW': lambda a, b: math.pow(_n(a), _n(b)),
+    'BIN': _n, 'BCD': _n,
+}
+
+
+def _var_index(x):
+    if x is None:
+        raise MacroError("變數號為空")
+    return int(_round(x))
+
+
+class _Vars(dict):
+    """區域 / 共用變數 (空變數不存在於 dict)；系統變數由 machine 提供。"""
+    __slots__ = ('machine',)
+
+
+def _get(v, n):
+    if n in v:
+        return v[n]
+    if 4000 <= n < 6000:
+        return v.machine.system(n)
+    return None
+
+
+def _set(v, n, value):
+    if n == 3000:
+        raise MacroError(f"#3000 警報 {_n(value):g}")
+    if n <= 0 or 3000 < n < 6000:
+        return  # #0 與系統變數 (含 #3006 停止訊息) 不可寫入
+    if value is None:
+        v.pop(n, None)
+    else:
+        v[n] = float(value)
+
+
+_ENV = {name: obj for name, obj in globals().items() if name.startswith('_') and callable(obj)}
+_ENV.update({'_func_' + name: impl for name, impl in _FUNC_IMPL.items()})
+_ENV['__builtins__'] = {}
+
+
+# ---- 編譯：單節文字 → 指令 tuple ----
+
+def _tokenize(text):
+    tokens = []
+    for num, word, sym in _TOKEN_RE.findall(text):
+        if num:
+            tokens.append(('num', num))
+        elif word:
+            tokens.append(('word', word))
+        elif sym:
+            tokens.append(('sym', sym))
+    return tokens
+
+
+class _Parser:
+    """單一單節的遞迴下降剖析，運算式產生 Python 原始碼字串。"""
+
+    def __init__(self, tokens, line_no):
+        self.tokens = tokens
+        self.i = 0
+        self.line_no = line_no
+
+    def error(self, msg):
+        return MacroError(f"第 {self.line_no + 1} 行: {msg}")
+
+    def peek(self, offset=0):
+        k = self.i + offset
+        return self.tokens[k] if k < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        tok = self.peek()
+        if tok[0] is None or (kind and tok[0] != kind) or (value and tok[1] != value):
+            raise self.error(f"預期 {value or kind}，得到 {tok[1]}")
+        self.i += 1
+        return tok[1]
+
+    def at(self, kind, value=None):
+        tok = self.peek()
+        return tok[0] == kind and (value is None or tok[1] == value)
+
+    def done(self):
+        return self.i >= len(self.tokens)
+
+    def number(self):
+        return float(self.take('num'))
+
+    def compare(self):
+        left = self.additive()
+        if self.at('word') and self.peek()[1] in _COMPARE:
+            op = _COMPARE[self.take('word')]
+            left = f"{op}({left},{self.additive()})"
+        return left
+
+    def additive(self):
+        left = self.term()
+        while True:
+            tok = self.peek()
+            op = _ADD_OPS.get(tok[1]) if tok[0] in ('sym', 'word') else None
+            if op is None:
+                return left
+            self.i += 1
+            left = f"{op}({left},{self.term()})"
+
+    def term(self):
+        left = self.unary()
+        while True:
+            tok = self.peek()
+            op = _MUL_OPS.get(tok[1]) if tok[0] in ('sym', 'word') else None
+            if op is None:
+                return left
+            self.i += 1
+            left = f"{op}({left},{self.unary()})"
+
+    def unary(self):
+        if self.at('sym', '-'):
+            self.i += 1
+            return f"_neg({self.unary()})"
+        if self.at('sym', '+'):
+            self.i += 1
+        return self.primary()
+
+    def bracket(self):
+        self.take('sym', '[')
+        expr = self.compare()
+        self.take('sym', ']')
+        return expr
+
+    def variable(self):
+        """'#' 之後的變數：回傳 (常數變數號或 None, 變數號運算式原始碼)。"""
+        self.take('sym', '#')
+        if self.at('num'):
+            n = int(self.number())
+            return n, str(n)
+        expr = self.bracket()
+        return None, f"_var_index({expr})"
+
+    def primary(self):
+        if self.at('num'):
+            return repr(self.number())
+        if self.at('sym', '#'):
+            n, index = self.variable()
+            if n == 0:
+                return "None"
+            if n is not None and n < 1000:
+                return f"v.get({n})"
+            return f"_get(v,{index})"
+        if self.at('sym', '['):
+            return self.bracket()
+        if self.at('word') and self.peek()[1] in _FUNCTIONS:
+            name = self.take('word')
+            self.take('sym', '[')
+            args = [self.compare()]
+            while self.at('sym', ','):
+                self.i += 1
+                args.append(self.compare())
+            self.take('sym', ']')
+            if name == 'ATAN' and len(args) == 1 and self.at('sym', '/'):
+                self.i += 1  # ATAN[a]/[b]
+                args.append(self.bracket())
+            return f"_func_{name}({','.join(args)})"
+        raise self.error(f"無法解析的運算式 {self.peek()[1]}")
+
+
+def _lambda(src):
+    return eval(compile('lambda v: ' + src, '<macro>', 'eval'), _ENV)
+
+
+def _compile_block(text, line_no):
+    """
+    將一個單節編譯為 (N 號或 None, 指令 tuple 或 None)。指令：
+        (_ASSIGN, 變數號函式, 值函式)     (_IF_GOTO, 條件, N 號函式)
+        (_IF_ASSIGN, 條件, 變數號函式, 值函式)     (_GOTO, N 號函式)
+        (_WHILE, 條件或 None, DO 號)     (_END, DO 號)
+        (_BLOCK, (G 碼函式, ...), ((位址, 值函式), ...), 是否 M99)
+    """
+    text = _COMMENT_RE.sub(' ', text.upper()).strip().lstrip('/')
+    if not text or text.startswith('%'):
+        return None, None
+    p = _Parser(_tokenize(text), line_no)
+    label = None
+    if p.at('word', 'O'):
+        return None, None
+    if p.at('word', 'N') and p.peek(1)[0] == 'num':
+        p.i += 1
+        label = int(p.number())
+
+    def assignment():
+        n, index = p.variable()
+        p.take('sym', '=')
+        return _lambda(index), _lambda(p.compare())
+
+    op = None
+    if p.done():
+        pass
+    elif p.at('word', 'IF'):
+        p.i += 1
+        cond = _lambda(p.bracket())
+        if p.at('word', 'GOTO'):
+            p.i += 1
+            op = (_IF_GOTO, cond, _lambda(p.additive()))
+        else:
+            p.take('word', 'THEN')
+            op = (_IF_ASSIGN, cond) + assignment()
+    elif p.at('word', 'GOTO'):
+        p.i += 1
+        op = (_GOTO, _lambda(p.additive()))
+    elif p.at('word', 'WHILE'):
+        p.i += 1
+        cond = _lambda(p.bracket())
+        p.take('word', 'DO')
+        op = (_WHILE, cond, int(p.number()))
+    elif p.at('word', 'DO'):
+        p.i += 1
+        op = (_WHILE, None, int(p.number()))
+    elif p.at('word', 'END'):
+        p.i += 1
+        op = (_END, int(p.number()))
+    elif p.at('sym', '#'):
+        op = (_ASSIGN,) + assignment()
+    elif p.at('word') and p.peek()[1] in _NOP_WORDS:
+        return label, None
+    else:
+        gcodes, words, ret = [], [], False
+        while not p.done():
+            letter = p.take('word')
+            if len(letter) != 1:
+                raise p.error(f"無法解析的位址 {letter}")
+            value = p.unary()
+            if letter == 'G':
+                gcodes.append(_lambda(value))
+            elif letter == 'M' and value in ('99.0', '30.0', '2.0'):
+                ret = True
+            elif letter in 'FPXYZ':
+                words.append((letter, _lambda(value)))
+        op = (_BLOCK, tuple(gcodes), tuple(words), ret)
+    if op is not None and not p.done():
+        raise p.error(f"多餘的內容 {p.peek()[1]}")
+    return label, op
+
+
+# ---- 執行 ----
+
+class MacroRun:
+    """一次宏呼叫的結果：時間 (分鐘)、G0 / G1 移動距離 (mm)、暫停時間 (分鐘)、啄鑽次數與結束 Z。"""
+    __slots__ = ('time', 'rapid_length', 'feed_length', 'dwell_time', 'pecks', 'final_z')
+
+    def __init__(self, time, rapid_length, feed_length, dwell_time, pecks, final_z):
+        self.time = time
+        self.rapid_length = rapid_length
+        self.feed_length = feed_length
+        self.dwell_time = dwell_time
+        self.pecks = pecks
+        self.final_z = final_z
+
+
+class _Machine:
+    """宏執行中的刀具位置與模態 (XY 以孔位為原點)。"""
+    __slots__ = ('pos', 'incremental', 'motion', 'feed', 'g0_speed',
+                 'rapid', 'cut', 'time', 'dwell', 'pecks', 'cutting_down')
+
+    def __init__(self, g0_speed, init_z, feed):
+        self.pos = [0.0, 0.0, init_z]
+        self.incremental = False
+        self.motion = 0
+        self.feed = feed
+        self.g0_speed = g0_speed
+        self.rapid = self.cut = self.time = self.dwell = 0.0
+        self.pecks = 0
+        self.cutting_down = False
+
+    def system(self, n):
+        if n == 4001:
+            return float(self.motion)
+        if n == 4003:
+            return 91.0 if self.incremental else 90.0
+        if n == 4109:
+            return self.feed
+        if 5001 <= n <= 5003:
+            return self.pos[n - 5001]
+        if 5041 <= n <= 5043:
+            return self.pos[n - 5041]
+        return None
+
+    def block(self, gcodes, words):
+        skip_move = False
+        dwell = False
+        for g in gcodes:
+            if g is None:
+                continue
+            if g in (0.0, 1.0, 2.0, 3.0):
+                self.motion = int(g)
+            elif g == 90.0:
+                self.incremental = False
+            elif g == 91.0:
+                self.incremental = True
+            elif g == 4.0:
+                dwell = True
+            elif g in (10.0, 28.0, 30.0, 52.0, 53.0, 65.0, 66.0, 67.0, 92.0):
+                skip_move = True  # 非一般定位的座標字不列入移動
+        if dwell:
+            sec = words.get('X')
+            if 'P' in words:
+                sec = words['P'] / 1000.0
+            if sec:
+                self.dwell += sec / 60.0
+                self.time += sec / 60.0
+            return
+        if 'F' in words:
+            self.feed = words['F']
+        if skip_move:
+            return
+        target = list(self.pos)
+        moved = False
+        for axis, letter in enumerate('XYZ'):
+            val = words.get(letter)
+            if val is None:
+                continue
+            target[axis] = self.pos[axis] + val if self.incremental else val
+            moved = True
+        if not moved:
+            return
+        if target[2] != target[2]:
+            raise MacroError("Z 位置未知")
+        length = math.dist(self.pos, target)
+        down = target[2] < self.pos[2]
+        if self.motion == 0:
+            self.rapid += length
+            self.time += length / self.g0_speed
+            self.cutting_down = False
+        else:
+            if not self.feed or self.feed <= 0:
+                raise MacroError("進給速度 F 未指定")
+            self.cut += length
+            self.time += length / self.feed
+            if down and not self.cutting_down:
+                self.pecks += 1
+            self.cutting_down = down
+        self.pos = target
+
+
+class MacroProgram:
+    """
+    編譯後的宏程式。lines 為宏程式本體的單節文字 (可含 O 號與 M99)；
+    common 為共用變數初始值 {變數號: 值} (如 #953 下降速度)。
+    """
+
+    def __init__(self, lines, number=None, common=None):
+        self.number = number
+        self.common = {int(k): float(v) for k, v in (common or {}).items() if v is not None}
+        self.ops = []
+        self.labels = {}
+        do_stack = {}
+        for line_no, text in enumerate(lines):
+            label, op = _compile_block(text, line_no)
+            if label is not None:
+                self.labels.setdefault(label, len(self.ops))
+            if op is None:
+                continue
+            if op[0] == _WHILE:
+                do_stack[op[2]] = len(self.ops)
+            elif op[0] == _END:
+                start = do_stack.pop(op[1], None)
+                if start is None:
+                    raise MacroError(f"第 {line_no + 1} 行: END{op[1]} 沒有對應的 DO{op[1]}")
+                w = self.ops[start]
+                self.ops[start] = (_WHILE, w[1], len(self.ops) + 1)  # 條件不成立時跳至 END 之後
+                op = (_END, start)
+            self.ops.append(op)
+        if do_stack:
+            raise MacroError(f"DO{min(do_stack)} 沒有對應的 END")
+        self._cache = {}
+
+    def _jump(self, label):
+        pc = self.labels.get(_var_index(label))
+        if pc is None:
+            raise MacroError(f"GOTO 找不到 N{_n(label):g}")
+        return pc
+
+    def run(self, args, g0_speed, init_z=0.0, feed=None):
+        """
+        以引數 {區域變數號: 值} 執行一次 (刀具在孔位上方 init_z)，回傳 MacroRun。
+        結果依 (引數, g0_speed, init_z, feed) 快取；宏程式錯誤時拋出 MacroError。
+        """
+        key = (tuple(sorted(args.items())), g0_speed, init_z, feed)
+        res = self._cache.get(key)
+        if res is None:
+            res = self._execute(args, g0_speed, init_z, feed)
+            if len(self._cache) >= _RUN_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = res
+        return res
+
+    def _execute(self, args, g0_speed, init_z, feed):
+        m = _Machine(g0_speed, init_z, feed)
+        v = _Vars(self.common)
+        v.machine = m
+        for n, value in args.items():
+            if value is not None:
+                v[n] = float(value)
+        ops = self.ops
+        pc, steps = 0, 0
+        while pc < len(ops):
+            steps += 1
+            if steps > MAX_STEPS:
+                raise MacroError("執行單節數超過上限 (可能為無窮迴圈)")
+            op = ops[pc]
+            kind = op[0]
+            if kind == _BLOCK:
+                m.block([g(v) for g in op[1]], {a: val for a, f in op[2] for val in (f(v),) if val is not None})
+                if op[3]:
+                    break
+            elif kind == _ASSIGN:
+                _set(v, _var_index(op[1](v)), op[2](v))
+            elif kind == _IF_GOTO:
+                if op[1](v):
+                    pc = self._jump(op[2](v))
+                    continue
+            elif kind == _IF_ASSIGN:
+                if op[1](v):
+                    _set(v, _var_index(op[2](v)), op[3](v))
+            elif kind == _GOTO:
+                pc = self._jump(op[1](v))
+                continue
+            elif kind == _WHILE:
+                if op[1] is not None and not op[1](v):
+                    pc = op[2]
+                    continue
+            elif kind == _END:
+                pc = op[1]
+                continue
+            pc += 1
+        return MacroRun(m.time, m.rapid, m.cut, m.dwell, m.pecks, m.pos[2])
+
+
+def macro_arguments(words):
+    """
+    G65 / G66 單節的位址字 [(位址, 值), ...] 轉為區域變數 {變數號: 值}：
+    I / J / K 依引數指定 II 分組 (同一位址再次出現時開始新的一組，與 RokuNCParser 相同)，
+    其餘位址依引數指定 I；G / L / N / O / P 不是引數。
+    """
+    args = {}
+    group, seen = 0, set()
+    for addr, val in words:
+        if addr in _IJK_OFFSET:
+            if addr in seen:
+                group += 1
+                seen = set()
+            seen.add(addr)
+            if group < _IJK_SETS:
+                args[_IJK_OFFSET[addr] + 3 * group] = val
+        elif addr in _ARG_SPEC_I:
+            args[_ARG_SPEC_I[addr]] = val
+    return args
+
+
+_compiled = {}
+
+
+def compile_macro(lines, number=None, common=None):
+    """
+    編譯宏程式 (相同文字與共用變數只編譯一次，呼叫結果的快取也隨之保留)。
+    語法錯誤時拋出 MacroError。
+    """
+    lines = tuple(lines)
+    key = (lines, number, tuple(sorted((int(k), v) for k, v in (common or {}).items())))
+    program = _compiled.get(key)
+    if program is None:
+        program = MacroProgram(lines, number, common)
+        if len(_compiled) >= _COMPILED_CACHE_SIZE:
+            _compiled.clear()
+        _compiled[key] = program
+    return program
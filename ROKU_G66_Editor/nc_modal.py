@@ -0,0 +1,193 @@
+import math
+
+import numpy as np
+
+from nc_lexer import MOTION_IGNORE, MOTION_UNKNOWN, MOTION_SET
+
+# 沒有孔位時回傳的共用空陣列 (唯讀)
+NO_HOLES = np.empty((0, 2))
+NO_HOLES.flags.writeable = False
+# 單節數不超過此值時逐一計算 (NumPy 呼叫的固定開銷大於向量化的效益)
+_SCALAR_ROWS = 16
+
+
+def concat_holes(parts):
+    """合併 MotionState.run 回傳的孔位 (陣列或 (x, y) 列表) 為唯讀 (N, 2) 陣列。"""
+    if not parts:
+        return NO_HOLES
+    if all(type(part) is list for part in parts):
+        rows = [pt for part in parts for pt in part]
+        holes = np.array(rows, dtype=np.float64).reshape(-1, 2)
+    else:
+        holes = np.concatenate([np.array(part, dtype=np.float64).reshape(-1, 2) if type(part) is list else part
+                                for part in parts])
+    holes.flags.writeable = False
+    return holes
+
+
+def _same(a, b):
+    """浮點數比較，兩者皆為 NaN (位置未知) 時視為相同。"""
+    return a == b or (a != a and b != b)
+
+
+def _fill_forward(xy, cur):
+    """G90：未指定的軸沿用前一單節 (第一個單節之前為 cur) 的值。"""
+    n = len(xy)
+    idx = np.where(np.isnan(xy), -1, np.arange(n)[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = xy[idx, np.arange(2)]
+    return np.where(idx >= 0, filled, cur)
+
+
+class MotionState:
+    """
+    XY 平面的模態插補器：追蹤目前位置 (工件座標) 與 G90/G91、G98/G99 模態。
+
+    以 nc_lexer.MotionBlocks 為輸入，一次處理一段模態不變的座標單節：
+    G90 以向前填補 (forward fill) 沿用未指定的軸，G91 以累加 (cumsum) 求絕對位置，
+    循環中的 L/K 重複次數以 np.repeat 展開 (G91 時每次重複再移動一次增量)。
+    位置未知 (程式開頭、G28 之後) 以 NaN 表示並沿用至重新指定絕對座標為止。
+    """
+    __slots__ = ('x', 'y', 'incremental', 'retract')
+
+    def __init__(self):
+        self.x = math.nan
+        self.y = math.nan
+        self.incremental = False  # G91
+        self.retract = 'G98'      # 固定循環的退刀平面：G98 起始點 / G99 R 點
+
+    def snapshot(self):
+        return (self.x, self.y, self.incremental, self.retract)
+
+    def restore(self, snapshot):
+        self.x, self.y, self.incremental, self.retract = snapshot
+
+    def matches(self, snapshot):
+        x, y, incremental, retract = snapshot
+        return (_same(self.x, x) and _same(self.y, y)
+                and self.incremental == incremental and self.retract == retract)
+
+    def run(self, blocks, start, end, drilling=False, repeat=None):
+        """
+        依序處理 blocks[start:end] 的座標單節並更新目前位置。
+        drilling 為 False 時只移動 (不在循環模態中)，回傳 None；
+        為 True 時回傳孔位 ((N, 2) 陣列，或單節數少時為 (x, y) 列表)。repeat 為每個單節的重複次數
+        (G66 模態宏呼叫，由 G66 行的 L 指定)；None 時依各單節的 K (或 L) 決定 (固定循環)。
+        """
+        if end <= start:
+            return [] if drilling else None
+        if end - start <= _SCALAR_ROWS:
+            return self._run_scalar(blocks, start, end, drilling, repeat)
+        special = np.flatnonzero(blocks.flags[start:end])
+        if not len(special):
+            return self._advance(blocks, start, end, drilling, repeat)
+        parts = []
+        pos = start
+        for s in (special + start).tolist():
+            parts.append(self._advance(blocks, pos, s, drilling, repeat))
+            self._apply_special(int(blocks.flags[s]), blocks.xy[s])
+            pos = s + 1
+        parts.append(self._advance(blocks, pos, end, drilling, repeat))
+        return concat_holes(parts) if drilling else None
+
+    def drill_at(self, x, y, repeat):
+        """固定循環指令行本身：移動至 (x, y) (未指定的軸為 NaN) 並鑽 repeat 次。"""
+        holes = []
+        self._step(x, y, repeat, holes)
+        return holes
+
+    def _run_scalar(self, blocks, start, end, drilling, repeat):
+        """單節數少時的逐一計算，結果與向量化計算逐位元相同。"""
+        holes = [] if drilling else None
+        rows = blocks.xy[start:end].tolist()
+        flags = blocks.flags[start:end].tolist()
+        if drilling and repeat is None:
+            reps = zip(blocks.k_words[start:end].tolist(), blocks.l_words[start:end].tolist())
+        else:
+            reps = None
+        for i, (x, y) in enumerate(rows):
+            if reps is not None:
+                k, l = next(reps)
+            if flags[i]:
+                self._apply_special(flags[i], rows[i])
+                continue
+            if not drilling:
+                count = 1
+            elif reps is None:
+                count = repeat
+            else:
+                count = k if k == k else (l if l == l else 1.0)
+                count = max(int(round(count)), 0)
+            self._step(x, y, count, holes)
+        return holes
+
+    def _step(self, x, y, count, holes):
+        """移動至單節位置 count 次 (G91 時每次累加增量)，holes 不為 None 時記錄每次的孔位。"""
+        if count <= 0:
+            return
+        cur_x, cur_y = self.x, self.y
+        for _ in range(count):
+            if self.incremental:
+                cur_x += x if x == x else 0.0
+                cur_y += y if y == y else 0.0
+            else:
+                if x == x: cur_x = x
+                if y == y: cur_y = y
+            if holes is not None:
+                holes.append((cur_x, cur_y))
+        self.x, self.y = cur_x, cur_y
+
+    def _advance(self, blocks, start, end, drilling, repeat):
+        if end <= start:
+            return NO_HOLES if drilling else None
+        reps = None
+        if drilling:
+            if repeat is not None:
+                reps = np.full(end - start, repeat)
+            else:
+                k, l = blocks.k_words[start:end], blocks.l_words[start:end]
+                reps = np.where(np.isnan(k), np.where(np.isnan(l), 1.0, l), k)
+                reps = np.maximum(np.rint(reps), 0).astype(np.intp)
+        return self._move(blocks.xy[start:end], reps, drilling)
+
+    def _move(self, xy, reps, drilling):
+        cur = np.array([self.x, self.y])
+        if drilling:
+            # K0 / L0：只記錄循環資料，不定位也不鑽孔
+            keep = reps > 0
+            if not keep.all():
+                xy, reps = xy[keep], reps[keep]
+            if not len(xy):
+                return NO_HOLES
+            if (reps == 1).all():
+                reps = None
+        if self.incremental:
+            step = np.nan_to_num(xy, nan=0.0)
+            if reps is not None:
+                step = np.repeat(step, reps, axis=0)
+            # 由目前位置依序累加 (與分段處理的結果逐位元相同)
+            pts = np.cumsum(np.vstack((cur, step)), axis=0)[1:]
+        elif drilling:
+            pts = _fill_forward(xy, cur)
+            if reps is not None:
+                pts = np.repeat(pts, reps, axis=0)
+        else:
+            # 只需最後位置：各軸最後一個指定值
+            pts = cur.copy()[None, :]
+            for axis in (0, 1):
+                given = np.flatnonzero(~np.isnan(xy[:, axis]))
+                if len(given):
+                    pts[0, axis] = xy[given[-1], axis]
+        self.x, self.y = float(pts[-1, 0]), float(pts[-1, 1])
+        return pts if drilling else None
+
+    def _apply_special(self, flag, xy):
+        if flag == MOTION_IGNORE:
+            return
+        x, y = float(xy[0]), float(xy[1])
+        if flag == MOTION_UNKNOWN:
+            if x == x: self.x = math.nan
+            if y == y: self.y = math.nan
+        elif flag == MOTION_SET:
+            if x == x: self.x = x
+            if y == y: self.y = y
@@ -0,0 +1,202 @@
+"""
+整份程式的切削參數最佳化 (「全部最佳化」)。
+
+對每個循環執行與主視窗「⚡ 自動參數」相同的計算：calculate_optimized_params_batch 建議 S / F / Z 與
+Q、I/J/K 或 G66 分段，再以諧波對齊微調啄鑽量 (同「🪄 微調 Q/J」)。各循環以 ProcessPoolExecutor
+分送至多個程序，依完成順序逐一回報 (供進度顯示)；結果最後由 apply_results 一次套用至 parser：
+各循環行與 S 指令行各寫入一次，修改範圍只重新解析一次。不載入 PyQt6。
+
+材質、冷卻、刀具材質與倒角幾何等條件為整份程式共用 (主視窗目前的設定)；
+刀具直徑取各循環偵測到的 D 值，主軸轉速沿用各循環目前的 S (為 0 時由引擎建議)。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from analysis_engine import DrillingAnalysisEngine
+from nc_peck import PeckSchedule, MAX_PECKS
+
+# 每個工作單位包含的循環數上限 (批次計算並減少程序間傳遞設定的次數，同時保持進度回報的頻率)
+_CHUNK_CYCLES = 16
+
+
+def build_jobs(parser):
+    """
+    parser.tools_data 各循環的最佳化輸入：
+    {'index', 'cycle_type', 'static', 'dynamic', 'use_ijk_mode', 'tool_dia', 'rpm'}。
+    換刀行附近未標示 D 值時，與主視窗相同改以循環行附近的 D 字查詢。
+    """
+    jobs = []
+    for index, rec in enumerate(parser.tools_data):
+        tool_dia = rec.get('detected_diameter')
+        if not tool_dia:
+            tool_dia = parser.diameter_near(rec['line_index'])
+        jobs.append({
+            'index': index,
+            'cycle_type': rec.get('cycle_type', 'G66'),
+            'static': dict(rec['static_params']),
+            'dynamic': [dict(group) for group in rec['dynamic_params']],
+            'use_ijk_mode': rec.get('use_ijk_mode', False),
+            'tool_dia': tool_dia or 0.0,
+            'rpm': rec.get('rpm', 0) or 0,
+        })
+    return jobs
+
+
+def _refine(depth, peck):
+    """諧波對齊：不增加跳數的最小啄鑽量 (同主視窗的靜默微調)。"""
+    if peck <= 0 or depth <= 0:
+        return peck
+    return DrillingAnalysisEngine._optimize_harmonic_peck(
+        target_depth=depth, current_peck=peck, min_allowable_peck=peck * 0.85)
+
+
+def optimize_cycle(job, settings):
+    """
+    單一循環的最佳化結果 (可序列化，供多程序傳回)：
+    {'index', 'static', 'dynamic', 'use_ijk_mode', 'rpm', 'dri', 'strategy', 'life_index'}；
+    刀具直徑未知時回傳 {'index', 'error'}。
+
+    settings: material_key, tool_mat_key, coolant_mode, material_thickness, exit_chamfer,
+              tip_angle, taylor_n, config (ConfigManager)，與 calculate_optimized_params 的參數同名
+    """
+    return _optimize_chunk([job], settings)[0]
+
+
+def _optimize_chunk(jobs, settings):
+    """
+    一批循環的 optimize_cycle 結果 (依 jobs 順序)：建議值以 calculate_optimized_params_batch
+    一次計算，再逐一展開 G66 分段、諧波對齊與 G83 啄鑽排程。
+    """
+    results = [{'index': job['index'], 'error': "無法取得刀具直徑"} for job in jobs]
+    rows = [i for i, job in enumerate(jobs) if job['tool_dia'] > 0]
+    if not rows:
+        return results
+    # G66 P9131 恆為 IJK 模式；G83 維持目前的 Q / IJK 模式
+    batch = DrillingAnalysisEngine.calculate_optimized_params_batch(
+        tool_dia=[jobs[i]['tool_dia'] for i in rows],
+        target_z=[jobs[i]['static'].get('Z') or 0.0 for i in rows],
+        current_s=[float(jobs[i]['rpm']) for i in rows],
+        prefer_ijk=[jobs[i]['cycle_type'] == 'G66' or bool(jobs[i]['use_ijk_mode']) for i in rows],
+        **settings
+    )
+    for row, i in enumerate(rows):
+        result = {key: values[row].item() for key, values in batch.items()}
+        results[i] = _finish_cycle(jobs[i], result, settings)
+    return results
+
+
+def _finish_cycle(job, result, settings):
+    """以批次建議值 (單列) 產生 optimize_cycle 的結果。"""
+    cycle_type = job['cycle_type']
+    static = dict(job['static'])
+    config = settings.get('config')
+    target_z = static.get('Z') or 0.0
+    static['F'] = result['F']
+    static['Z'] = result['Z']
+    use_ijk = result['use_ijk']
+    r_val = static.get('R') or 0.0
+    depth = abs(static['Z'] - r_val)
+    refine = depth >= 1e-6
+
+    if cycle_type == 'G66':
+        segments = DrillingAnalysisEngine.calc_g66_segments(
+            tool_dia=job['tool_dia'], target_z=target_z, base_feed=result['F'], strategy=result['strategy'],
+            config=config, material_key=settings.get('material_key', 'SUS304'))
+        dynamic = [dict(seg) for seg in segments] or job['dynamic']
+        if refine:
+            prev_z = r_val
+            for seg in dynamic:
+                seg['J'] = _refine(abs(seg['I'] - prev_z), seg['J'])
+                prev_z = seg['I']
+    else:
+        if use_ijk:
+            static['I'], static['J'], static['K'] = result['I'], result['J'], result['K']
+            if refine:
+                static['I'] = _refine(depth, static['I'])
+        else:
+            static['Q'] = _refine(depth, result['Q']) if refine else result['Q']
+        max_pecks = config.get_limit('max_pecks') if config else MAX_PECKS
+        schedule = PeckSchedule.from_params(static, use_ijk, max_pecks)
+        dynamic = [] if schedule.exceeds_limit else schedule.ijk_list()
+
+    return {
+        'index': job['index'],
+        'static': static,
+        'dynamic': dynamic,
+        'use_ijk_mode': use_ijk,
+        'rpm': int(result['S']),
+        'dri': result['dri'],
+        'strategy': result['strategy'],
+        'life_index': result['life_index'],
+    }
+
+
+def iter_optimize_program(jobs, settings, workers=None):
+    """
+    以 ProcessPoolExecutor 最佳化所有循環，依完成順序逐一產出 optimize_cycle 的結果；
+    每個工作單位 (最多 _CHUNK_CYCLES 個循環) 以一次 calculate_optimized_params_batch 計算。
+    提前結束迭代 (如使用者取消) 時，尚未開始的工作會被取消。
+    """
+    if not jobs:
+        return
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for i in range(0, len(jobs), _CHUNK_CYCLES):
+            yield from _optimize_chunk(jobs[i:i + _CHUNK_CYCLES], settings)
+        return
+    size = max(1, min(_CHUNK_CYCLES, -(-len(jobs) // (workers * 4))))
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(chunks)))
+    try:
+        futures = [pool.submit(_optimize_chunk, chunk, settings) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from future.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def apply_results(parser, results):
+    """
+    將最佳化結果依循環順序寫回程式：循環指令行 (update_g66_line) 與主軸轉速 (update_spindle_speed)。
+
+    多個循環共用同一 S 指令行 (換刀後只指定一次轉速) 而建議轉速不同時，該行不修改，
+    列入 rpm_conflicts 由使用者決定。所有改寫完成後，修改的行範圍只重新解析一次。
+    回傳 {'applied': 成功套用的循環數,
+          'rpm_conflicts': [{'line': S 指令行號, 'rpms': {循環索引: 建議 (或目前) 轉速}}, ...]}。
+    """
+    tools_data = parser.tools_data
+    done = sorted((res for res in results if 'error' not in res), key=lambda r: r['index'])
+    wanted = {res['index']: res['rpm'] for res in done if res['rpm'] > 0}
+
+    # 主軸轉速依 S 指令行彙整：共用同一行的循環 (含未最佳化的) 須一致
+    sharing = {}
+    for index, rec in enumerate(tools_data):
+        line = rec.get('rpm_line', -1)
+        if 0 <= line < len(parser.nc_lines):
+            sharing.setdefault(line, []).append(index)
+    rpm_edits, conflicts = [], []
+    for line, indices in sorted(sharing.items()):
+        rpms = {i: wanted.get(i, tools_data[i].get('rpm')) for i in indices}
+        if len(set(rpms.values())) > 1:
+            conflicts.append({'line': line, 'rpms': rpms})
+        else:
+            changed = [i for i in indices if i in wanted and wanted[i] != tools_data[i].get('rpm')]
+            if changed:
+                rpm_edits.append(changed[0])
+
+    applied = 0
+    for res in done:
+        index = res['index']
+        rec = tools_data[index]
+        # G83 依模式重建 Q 或 I/J/K，須在改寫前設定
+        rec['use_ijk_mode'] = res['use_ijk_mode']
+        if not parser.update_g66_line(index, res['static'], res['dynamic'], reparse=False):
+            continue
+        if index in wanted and rec.get('rpm_line', -1) not in sharing:
+            # 無法定位 S 指令行時仍同步至資料結構 (同主視窗)
+            rec['rpm'] = wanted[index]
+        applied += 1
+    for index in rpm_edits:
+        parser.update_spindle_speed(index, wanted[index])
+    parser.reparse_pending()
+    return {'applied': applied, 'rpm_conflicts': conflicts}
@@ -1,6 +1,329 @@
 import re
 import os
-import copy
+import bisect
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from nc_lexer import (tokenize_block, lex_motion_blocks, motion_blocks, lex_words, DWordIndex,
+                      MOTION_IGNORE, MOTION_NORMAL, MOTION_UNKNOWN, MOTION_SET)
+from nc_modal import MotionState, concat_holes
+from nc_route import optimize_order, path_length
+from nc_timing import DEFAULT_G0_SPEED
+from nc_linestore import LineStore, MappedLines, detect_encoding, decode_text
+from nc_record import CycleRecord, FrozenParams, freeze_groups
+from nc_spatial import HoleIndex
+from nc_interval import CycleIntervals
+from nc_peck import PeckSchedule, MAX_PECKS
+
+# 模態取消條件：G80 (固定循環取消)、G67 (模態宏取消)、M06 (換刀)、M30 (程式結束)
+_CYCLE_CANCEL_G = (80.0, 67.0)
+_CYCLE_CANCEL_M = (6.0, 30.0)
+# 插補模式 G0~G3：切換時自動脫離循環模態
+_INTERP_G = (0.0, 1.0, 2.0, 3.0)
+# 影響模態的位址字母 G / M / P / S / T (字元碼查表)
+_MODAL_LETTERS = np.zeros(256, dtype=bool)
+_MODAL_LETTERS[[ord(c) for c in 'GMPST']] = True
+# _lex_cycle_events 的循環類型代碼
+_CYCLE_KINDS = (None, 'G83', 'G66')
+# G83 單節中需要擷取的位址
+_G83_ADDRS = frozenset('RZQFXYIJK')
+# update_g66_line 改寫的循環參數位址 (其餘位址字改變時才需要重新解析)
+_CYCLE_PARAM_ADDRS = {'G83': frozenset('ZRQIJKF'), 'G66': frozenset('RZSTIJKF')}
+# 循環參數寫回的小數位數上限
+_PARAM_DECIMALS = 6
+
+# 超過此大小的檔案預設以串流模式 (mmap) 解析，避免整檔載入為字串列表
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# 解析器版本：解析邏輯或結果格式變更時遞增，使舊的解析快取失效
+PARSER_VERSION = 6
+
+# 平行分區塊解析時每個工作程序至少分到的大小：單程序約 0.5 秒的解析量，
+# 足以抵銷程序池啟動 (Windows spawn 需重新匯入模組) 與結果回傳的成本
+PARALLEL_MIN_CHUNK_BYTES = 8 * 1024 * 1024
+
+# 孔位重排：循環本體中可搬移的座標單節只能含這些位址
+_REORDER_ADDRS = frozenset('XYKL')
+# 循環行的註解 (group 1) 或位址字 (group 2 為位址)，改寫循環參數時逐字替換
+_CYCLE_TOKEN_RE = re.compile(r'(\([^)\n]*\)?|;.*)|([A-Z])[ \t]*[-+]?(?:\d+\.?\d*|\.\d+)')
+# 座標字 (改寫單節時移除後重新補上完整的 X、Y)
+_XY_WORD_RE = re.compile(r'[XY][ \t]*[-+]?(?:\d+\.?\d*|\.\d+)')
+
+# 增量重新解析用的模態狀態檢查點間隔 (行)
+CHECKPOINT_INTERVAL = 256
+# 換刀行前後搜尋 D 值的範圍 (行)
+DIAMETER_WINDOW = 10
+
+
+class _ScanState:
+    """解析過程中的模態狀態，於分區塊掃描 (串流模式) 時跨區塊延續。"""
+    __slots__ = ('current_tool', 'spindle_rpm', 'spindle_line', 'cycle', 'motion', 'hole_parts', 'cycle_repeat')
+
+    def __init__(self):
+        self.current_tool = "Unknown"
+        # State Tracking：模擬 CNC 控制器，逐行追蹤主軸轉速狀態
+        self.spindle_rpm = 0    # 當前主軸轉速值
+        self.spindle_line = -1  # 該轉速 S 指令所在的確切行號
+        # [新增] 循環模態狀態追蹤：目前模態中的循環資料
+        self.cycle = None
+        # XY 位置與 G90/G91、G98/G99 模態
+        self.motion = MotionState()
+        self.hole_parts = []     # 進行中循環已產生的孔位 (陣列或 (x, y) 列表)
+        self.cycle_repeat = None  # G66 每次宏呼叫的重複次數 (L)；固定循環為 None (各單節 K/L)
+
+    def close_holes(self, end_line):
+        """將進行中循環已產生的孔位合併為 cycle.holes (唯讀陣列)，模態暫計至 end_line 行 (不含)。"""
+        parts = self.hole_parts
+        if len(parts) == 1 and type(parts[0]) is not list:
+            holes = parts[0]
+        else:
+            holes = concat_holes(parts)
+            self.hole_parts = [holes]
+        self.cycle.holes = holes
+        self.cycle.hole_count = len(holes)
+        self.cycle.end_line = end_line
+
+    def add_holes(self, holes):
+        if len(holes):
+            self.hole_parts.append(holes)
+            self.cycle.hole_count += len(holes)
+
+
+def _lex_cycle_events(text, base_line):
+    """
+    詞法分析一段以行邊界切齊的程式文字 (base_line 為其首行行號)，不依賴模態狀態。
+    只產出會改變模態的單節事件，座標單節另以 MotionBlocks 陣列保存：
+
+        events: [(行號, 座標單節索引, 檢查點, 循環類型, 取消模態, 距離模式, 退刀模式,
+                  S 值, 刀號, 循環行文字, 循環行 word), ...]
+            座標單節索引為 blocks 中第一個行號 >= 本單節的位置 (其前的座標單節先於本事件套用)；
+            檢查點表示本單節是該 CHECKPOINT_INTERVAL 行區間內的第一個模態單節；
+            循環類型為 'G66' / 'G83' / None；距離模式 G91 為 True、G90 為 False；
+            退刀模式為 'G98' / 'G99'，未指定的欄位為 None。
+        blocks: nc_lexer.MotionBlocks
+
+    模態本身 (刀具、轉速、位置、進行中循環) 由 RokuNCParser._replay_events 依序套用。
+    """
+    letters, values, token_lines = lex_words(text, 'GKLMPSTXY', base_line)
+    blocks = motion_blocks(letters, values, token_lines)
+    # 模態單節：含 G/M/S/T/P 位址字的行，各欄位以向量運算逐行彙整
+    modal = _MODAL_LETTERS[letters]
+    letters, values, token_lines = letters[modal], values[modal], token_lines[modal]
+    if not len(token_lines):
+        return [], blocks
+    rows = token_lines[np.r_[True, token_lines[1:] != token_lines[:-1]]]
+    is_g, is_m = letters == 71, letters == 77
+
+    def first(mask, last=False):
+        return _word_per_line(rows, token_lines[mask], values[mask], last)
+
+    g_vals = np.where(is_g, values, np.nan)
+    is_g66 = ~np.isnan(first(g_vals == 66))
+    is_g83 = ~np.isnan(first(g_vals == 83))
+    is_cancel = ~np.isnan(first(np.isin(g_vals, _CYCLE_CANCEL_G + _INTERP_G)
+                                | (is_m & np.isin(values, _CYCLE_CANCEL_M))))
+    distance = first((g_vals == 90) | (g_vals == 91), last=True)
+    retract = first((g_vals == 98) | (g_vals == 99), last=True)
+    s_words = first(letters == 83)
+    t_words = first(letters == 84)
+    p_words = first(letters == 80)
+
+    # G66 行內的 S 是 Approach Z，T 是孔底暫停，皆非 RPM / 刀號
+    s_words[is_g66] = np.nan
+    t_words[is_g66] = np.nan
+    is_cancel |= ~np.isnan(t_words)  # 換刀結束循環模態
+    kinds = np.where(is_g66 & (p_words == 9131), 2, np.where(is_g83, 1, 0))
+    # 檢查點：每個 CHECKPOINT_INTERVAL 行區間內的第一個模態單節
+    grid = -(-base_line // CHECKPOINT_INTERVAL) * CHECKPOINT_INTERVAL
+    bucket = rows // CHECKPOINT_INTERVAL
+    checkpoints = (rows >= grid) & np.r_[True, bucket[1:] != bucket[:-1]]
+
+    keep = np.flatnonzero(checkpoints | (kinds > 0) | is_cancel | ~np.isnan(s_words) | ~np.isnan(t_words)
+                          | ~np.isnan(distance) | ~np.isnan(retract))
+    rows = rows[keep]
+    m_indices = np.searchsorted(blocks.lines, rows)
+    line_starts = {}
+    if kinds[keep].any():
+        # 循環行需要完整的 word 列表：由換行位置取得行首
+        newlines = np.flatnonzero(np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8) == 10)
+        for idx in rows[kinds[keep] > 0].tolist():
+            rel = idx - base_line
+            line_starts[idx] = int(newlines[rel - 1]) + 1 if rel else 0
+    columns = (rows.tolist(), m_indices.tolist(), checkpoints[keep].tolist(), kinds[keep].tolist(),
+               is_cancel[keep].tolist(), distance[keep].tolist(), retract[keep].tolist(),
+               s_words[keep].tolist(), t_words[keep].tolist())
+    events = []
+    for idx, m_idx, checkpoint, kind, cancel, dist, ret, s_word, t_word in zip(*columns):
+        line = block = None
+        if kind:
+            line_start = line_starts[idx]
+            line_end = text.find('\n', line_start)
+            line_end = len(text) if line_end < 0 else line_end + 1
+            line = text[line_start:line_end]
+            block = tokenize_block(line)
+        events.append((idx, m_idx, checkpoint, _CYCLE_KINDS[kind], cancel,
+                       None if dist != dist else dist == 91,
+                       None if ret != ret else ('G98' if ret == 98 else 'G99'),
+                       None if s_word != s_word else s_word,
+                       None if t_word != t_word else t_word, line, block))
+    return events, blocks
+
+
+def _word_per_line(rows, token_lines, values, last=False):
+    """每個模態單節 (rows 行號) 中第一個 (last 時為最後一個) token 的值，沒有則為 NaN。"""
+    out = np.full(len(rows), np.nan)
+    k = np.searchsorted(rows, token_lines)
+    if last:
+        out[k] = values  # 重複的索引以最後一次指定為準
+    else:
+        out[k[::-1]] = values[::-1]
+    return out
+
+
+def _lex_chunk_bytes(raw, base_line, encoding):
+    """平行解析的工作程序：解碼一個位元組區塊，回傳 (events, 座標單節, D 字索引)。"""
+    text = decode_text(raw, encoding)
+    d_index = DWordIndex()
+    d_index.index_text(text, base_line)
+    events, blocks = _lex_cycle_events(text, base_line)
+    return events, blocks, d_index
+
+
+def _split_line_ranges(data, n_chunks):
+    """將位元組內容依行邊界切成約 n_chunks 個區段，回傳 [(起點, 終點, 首行行號), ...]。"""
+    size = len(data)
+    step = max(1, -(-size // max(1, n_chunks)))
+    ranges = []
+    start = 0
+    base_line = 0
+    while start < size:
+        end = data.find(b'\n', min(start + step, size) - 1)
+        end = size if end < 0 else end + 1
+        ranges.append((start, end, base_line))
+        base_line += data.count(b'\n', start, end)
+        start = end
+    return ranges
+
+
+def auto_parse_workers(file_size, cpu_count=None):
+    """
+    parse_file 預設的平行解析程序數：每個程序至少分到 PARALLEL_MIN_CHUNK_BYTES，
+    且不超過 CPU 核心數；單核心或檔案不足兩個區塊時為 1 (不建立程序池)。
+    """
+    if cpu_count is None:
+        cpu_count = os.cpu_count() or 1
+    workers = min(cpu_count, file_size // PARALLEL_MIN_CHUNK_BYTES)
+    return workers if workers > 1 else 1
+
+
+def _format_coord(val):
+    """座標值格式化為可還原原值的最短小數 (整數保留小數點，如 10.)。"""
+    return np.format_float_positional(val, trim='.')
+
+
+def _format_param(val):
+    """循環參數格式化：最多 _PARAM_DECIMALS 位小數、不含尾端零 (如 Z-4.07、R1)，不使用指數表示。"""
+    return np.format_float_positional(round(val, _PARAM_DECIMALS) + 0.0, trim="-")
+
+
+def _cycle_line_signature(line, cycle_type):
+    """
+    循環行中循環參數以外的位址字 (G/M 碼、X/Y、L、D 等)，與 G83 的 K0 (僅宣告參數不鑽孔)。
+    改寫前後相同時，模態、孔位與 D 字索引都不受影響。
+    """
+    words = tokenize_block(line)
+    params = _CYCLE_PARAM_ADDRS.get(cycle_type, _CYCLE_PARAM_ADDRS['G66'])
+    signature = sorted((addr, val) for addr, val in words if addr not in params)
+    if cycle_type == 'G83':
+        signature.append(('K', next((val for addr, val in words if addr == 'K'), None) == 0))
+    return signature
+
+
+def _rewrite_cycle_words(line, words, groups=None):
+    """
+    就地改寫循環指令行的參數位址字，其餘位址字 (G98/G99、L、M、X/Y 等) 與註解保持原位。
+
+    words: {位址: 新的位址字文字}；替換該位址第一個出現的位址字，"" 為移除，None 為不修改。
+           原本沒有的位址字放在第一個被移除的位址字處 (如 Q 模式改為 I/J/K 模式)，
+           否則接在最後一個參數位址字之後；G66 時放在 I/J/K 組之前。
+    groups: G66 的 I/J/K 位址字文字列表：取代原有的所有 I/J/K，置於第一個 I/J/K 的位置。
+    """
+    text = line.rstrip('\r\n')
+    pending = {addr: val for addr, val in words.items() if val is not None}
+    tokens = []
+    group_at = removed_at = last_param = last_word = None  # tokens 中的位置
+    pos = 0
+    for m in _CYCLE_TOKEN_RE.finditer(text):
+        tokens.append(text[pos:m.start()].strip())
+        pos = m.end()
+        addr = m.group(2)
+        if addr is None:
+            tokens.append(m.group())  # 註解
+        elif groups is not None and addr in 'IJK':
+            if group_at is None:
+                group_at = len(tokens)
+                tokens.append("")
+        elif addr in pending:
+            val = pending.pop(addr)
+            if not val and removed_at is None:
+                removed_at = len(tokens)
+            tokens.append(val)
+            last_param = last_word = len(tokens)
+        else:
+            tokens.append(m.group())
+            last_word = len(tokens)
+    tokens.append(text[pos:].strip())
+
+    added = [val for val in pending.values() if val]
+    slot = removed_at
+    if groups is not None:
+        added += groups
+        slot = group_at
+    if slot is not None:
+        tokens[slot] = " ".join(added)
+    elif added:
+        at = next((i for i in (last_param, last_word) if i is not None), len(tokens))
+        tokens.insert(at, " ".join(added))
+    return " ".join(tok for tok in tokens if tok) + "\n"
+
+
+def _explicit_xy(line, x, y):
+    """
+    孔位重排後，單節的 X、Y 不能再沿用前一單節：缺少任一軸時改寫為完整的 X、Y，
+    保留其餘位址字 (K/L) 與註解；兩軸皆已指定時原樣回傳。
+    """
+    cut = min([i for i in (line.find('('), line.find(';')) if i >= 0], default=len(line.rstrip('\r\n')))
+    code, rest = line[:cut], line[cut:]
+    addrs = {m.group()[0] for m in _XY_WORD_RE.finditer(code)}
+    if addrs == {'X', 'Y'}:
+        return line
+    others = _XY_WORD_RE.sub('', code).split()
+    words = [f"X{_format_coord(x)}", f"Y{_format_coord(y)}"] + others
+    rest = rest.rstrip('\r\n')
+    return " ".join(words) + (" " + rest if rest else "") + "\n"
+
+
+class _Checkpoint:
+    """
+    某行開始處的模態狀態快照，供增量重新解析從中途恢復掃描。
+    holes 為當時仍在模態中的循環已累計的孔數 (無進行中循環時為 None)。
+    """
+    __slots__ = ('line', 'tool', 'spindle_rpm', 'spindle_line', 'diameters', 'n_records', 'holes',
+                 'motion', 'cycle_repeat')
+
+    def __init__(self, line, state, diameters, n_records):
+        self.line = line
+        self.tool = state.current_tool
+        self.spindle_rpm = state.spindle_rpm
+        self.spindle_line = state.spindle_line
+        self.diameters = diameters
+        self.n_records = n_records
+        self.holes = state.cycle.hole_count if state.cycle is not None else None
+        self.motion = state.motion.snapshot()
+        self.cycle_repeat = state.cycle_repeat
+
 
 class RokuNCParser:
     """
@@ -8,130 +331,424 @@ class RokuNCParser:
     - G66 P9131 cycles (custom ROKU format)
     - G83 standard peck drilling cycles
     """
-    def __init__(self):
-        self.nc_lines = []
+    def __init__(self, cache=None):
+        self.cache = cache  # ParseCache (可選)：內容未變更的檔案直接載入解析結果
+        self.nc_lines = LineStore()
         self.tools_data = []
         self.tool_diameters = {}
+        self.d_index = DWordIndex()  # D 字位置索引，供刀具直徑查詢
+        self._checkpoints = []       # 模態狀態檢查點 (依行號排序)
+        self._checkpoint_lines = []
         self.file_encoding = 'utf-8'  # 記錄讀取時使用的編碼
+        self._revision = 0           # 解析結果每次變更時遞增 (孔位索引等衍生資料的快取鍵)
+        self._hole_index = None
+        self._intervals = None
+        self.max_pecks = MAX_PECKS  # G83 每跳明細的展開上限 (設定檔 limits.max_pecks)
+        self._pending_reparse = None  # update_g66_line(reparse=False) 累積待重新解析的行範圍
 
-    def parse_file(self, file_path):
+    def parse_file(self, file_path, streaming=None, workers=None, chunk_bytes=None):
         """
         讀取檔案並解析 G66 和 G83 循環指令。
         保留完整檔案內容於 self.nc_lines 以供修改。
+
+        streaming: True 時改用 iter_parse 串流模式 (mmap，只保留行 offset)；
+                   None 時依檔案大小自動判斷 (>= STREAMING_THRESHOLD_BYTES)。
+        workers: 平行解析的程序數，1 為單程序；None 時依 CPU 核心數與檔案大小自動決定
+                 (見 auto_parse_workers)。結果與單程序解析完全相同。
+        chunk_bytes: 平行解析時每個區塊的大小 (預設依 workers 平均分割)。
         """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
 
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                self.nc_lines = f.readlines()
-            self.file_encoding = 'utf-8'
-        except UnicodeDecodeError:
-            with open(file_path, 'r', encoding='cp950', errors='ignore') as f:
-                self.nc_lines = f.readlines()
-            self.file_encoding = 'cp950'
+        file_size = os.path.getsize(file_path)
+        if streaming is None:
+            streaming = file_size >= STREAMING_THRESHOLD_BYTES
+        if workers is None:
+            workers = auto_parse_workers(file_size)
+        if streaming:
+            for _ in self.iter_parse(file_path):
+                pass
+            return self.tools_data
+
+        # 以位元組讀入一次，程式內容保存在 LineStore (單一緩衝區 + offset 索引)
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        return self.parse_bytes(data, workers, chunk_bytes)
+
+    def parse_bytes(self, data, workers=1, chunk_bytes=None):
+        """
+        解析記憶體中的程式內容 (檔案的原始位元組)，如程式重新排列後整份重新解析。
+        workers、chunk_bytes 與 parse_file 相同。
+        """
+        cache_key = None
+        if self.cache is not None:
+            # 展開上限影響 G83 的 dynamic_params，一併納入快取鍵
+            cache_version = f"{PARSER_VERSION}.{self.max_pecks}"
+            cache_key = self.cache.key(data, cache_version)
+            entry = self.cache.get(cache_key, cache_version)
+            if entry is not None:
+                self._load_cache_entry(data, entry)
+                return self.tools_data
+
+        # 由檔案開頭判斷主要編碼後只解碼一次；混合編碼的行逐行改用其他編碼，不略過字元
+        self.file_encoding = detect_encoding(data)
+        if workers > 1:
+            self._parse_parallel(data, workers, chunk_bytes)
+        else:
+            text = decode_text(data, self.file_encoding)
+            self._set_lines(LineStore(data, self.file_encoding))
+            state = self._begin_scan()
+            self.d_index.index_text(text)
+            for _ in self._scan_text(text, 0, state):
+                pass
+        if cache_key is not None:
+            self.cache.put(cache_key, cache_version, self._cache_entry())
+        return self.tools_data
+
+    def _parse_parallel(self, data, workers, chunk_bytes=None):
+        """
+        平行分區塊解析：依行邊界將內容切成位元組區段，由 ProcessPoolExecutor 各自解碼並做
+        詞法分析 (模態事件、區段孔數、D 字索引)，再由本程序依序套用事件，銜接各區塊間的
+        刀具、轉速與循環模態狀態。
+        """
+        n_chunks = -(-len(data) // chunk_bytes) if chunk_bytes else workers
+        ranges = _split_line_ranges(data, n_chunks)
+        chunks = [data[start:end] for start, end, _ in ranges]
+        bases = [base_line for _, _, base_line in ranges]
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_lex_chunk_bytes, chunks, bases, repeat(self.file_encoding))
+            # 工作程序分析時，本程序同時建立行 offset 索引
+            self._set_lines(LineStore(data, self.file_encoding))
+            results = list(results)
+
+        state = self._begin_scan()
+        for _, _, d_part in results:
+            self.d_index.extend(d_part)
+        ends = bases[1:] + [len(self.nc_lines)]
+        for (events, blocks, _), end_line in zip(results, ends):
+            for _ in self._replay_events(events, blocks, state, end_line):
+                pass
+
+    def _cache_entry(self):
+        """打包目前的解析結果供 ParseCache 儲存。"""
+        return {
+            'encoding': self.nc_lines.encoding,
+            'offsets': self.nc_lines.offsets,
+            'tools_data': self.tools_data,
+            'tool_diameters': self.tool_diameters,
+            'd_index': self.d_index,
+            'checkpoints': self._checkpoints,
+        }
+
+    def _load_cache_entry(self, data, entry):
+        """由快取項目還原解析結果 (檔案內容 data 與快取鍵一致)。"""
+        self._set_lines(LineStore(data, entry['encoding'], offsets=entry['offsets']))
+        self.file_encoding = entry['encoding']
+        self.tools_data = entry['tools_data']
+        self.tool_diameters = entry['tool_diameters']
+        self.d_index = entry['d_index']
+        self._checkpoints = entry['checkpoints']
+        self._checkpoint_lines = [cp.line for cp in self._checkpoints]
+        self._revision += 1
 
+    def iter_parse(self, file_path, chunk_bytes=4 << 20):
+        """
+        串流解析模式：以 mmap 映射檔案，逐區塊解碼並掃描。
+        每當一個循環的模態結束 (孔數確定) 即產出該循環資料。
+
+        self.nc_lines 改為 MappedLines，只保留每行的 byte offset，
+        generate_html / update_g66_line 需要的行會在存取時才從檔案讀出。
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        lines = MappedLines(file_path)
+        self._set_lines(lines)
+        self.file_encoding = lines.encoding
+        state = self._begin_scan()
+        for base_line, text in lines.iter_text_chunks(chunk_bytes):
+            self.d_index.index_text(text, base_line)
+            yield from self._scan_text(text, base_line, state)
+        if state.cycle is not None:
+            yield state.cycle
+
+    def _set_lines(self, lines):
+        """以新的程式內容取代 self.nc_lines，並關閉先前串流模式的檔案映射。"""
+        self.close()
+        self.nc_lines = lines
+
+    def close(self):
+        """
+        關閉串流模式 (MappedLines) 映射的檔案；LineStore 不持有檔案，不需關閉。
+        重新解析其他檔案時會自動關閉前一個映射，也可以 with 陳述式使用解析器。
+        """
+        if isinstance(self.nc_lines, MappedLines):
+            self.nc_lines.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _begin_scan(self):
+        """重設解析結果，建立初始模態狀態並記錄第 0 行的檢查點。"""
         self.tools_data = []
         self.tool_diameters = {}
-        current_tool = "Unknown"
-        
-        # State Tracking：模擬 CNC 控制器，逐行追蹤主軸轉速狀態
-        current_spindle_rpm = 0   # 當前主軸轉速值
-        current_spindle_line = -1  # 該轉速 S 指令所在的確切行號
-        
-        # [新增] 循環模態狀態追蹤：計算孔數
-        in_cycle_mode = False
-        current_cycle_data = None
-
-        for idx, line in enumerate(self.nc_lines):
-            # 追蹤主軸轉速狀態（注意：G66 行內的 S 是 Approach Z，不是 RPM）
-            if 'G66' not in line:
-                s_state_match = re.search(r'S(\d+)', line)
-                if s_state_match:
-                    current_spindle_rpm = int(s_state_match.group(1))
-                    current_spindle_line = idx
-            
+        self.d_index = DWordIndex()
+        self._checkpoints = []
+        self._checkpoint_lines = []
+        self._revision += 1
+        state = _ScanState()
+        self._add_checkpoint(state, 0)
+        return state
+
+    def _add_checkpoint(self, state, line):
+        self._checkpoints.append(_Checkpoint(line, state, dict(self.tool_diameters), len(self.tools_data)))
+        self._checkpoint_lines.append(line)
+
+    def _scan_text(self, text, base_line, state):
+        """
+        掃描一段以行邊界切齊的程式文字 (base_line 為其首行行號)，更新模態狀態並建立循環資料。
+        state 跨區塊延續，區塊結尾仍處於循環模態時，孔數先累計至區塊結尾。
+        每個在本區塊內結束模態的循環會被產出 (yield)。
+        """
+        # 單次詞法分析：整段文字只掃描一次，僅對模態事件套用狀態
+        events, blocks = _lex_cycle_events(text, base_line)
+        end_line = base_line + text.count('\n') + (1 if text and not text.endswith('\n') else 0)
+        return self._replay_events(events, blocks, state, end_line)
+
+    def _replay_events(self, events, blocks, state, end_line):
+        """
+        依序套用 _lex_cycle_events 產出的事件與座標單節：建立循環資料、以模態插補器計算
+        各循環的絕對孔位 (cycle.holes)，並產出結束模態的循環。end_line 為這段文字的結尾行號 (不含)。
+        """
+        motion = state.motion
+        m_prev = 0
+        for idx, m_idx, checkpoint, kind, is_cancel, distance, retract, s_word, t_word, line, block in events:
+            # 上一事件至本單節之間的座標單節：循環模態中為孔位，否則只更新位置。
+            # 模態外的位置只在檢查點、G90/G91 切換與循環指令行用到，其餘事件 (G0/G1 等) 延後一併計算
+            if m_idx > m_prev and (state.cycle is not None or checkpoint or kind or distance is not None):
+                if state.cycle is not None:
+                    state.add_holes(motion.run(blocks, m_prev, m_idx, True, state.cycle_repeat))
+                else:
+                    motion.run(blocks, m_prev, m_idx)
+                m_prev = m_idx
+            if checkpoint and idx > self._checkpoint_lines[-1]:
+                # 模態檢查點：進行中循環的孔位已累計至本行為止
+                self._add_checkpoint(state, idx)
+
+            if distance is not None:
+                motion.incremental = distance
+            if retract is not None:
+                motion.retract = retract
+
+            # 追蹤主軸轉速狀態 (State Tracking)
+            if s_word is not None:
+                state.spindle_rpm = int(s_word)
+                state.spindle_line = idx
+
             # 偵測刀具換刀
-            t_match = re.search(r'T(\d+)', line)
-            if t_match:
-                found_id = t_match.group(1)
+            if t_word is not None:
+                found_id = str(int(t_word))
                 dia = self._scan_for_diameter(idx, found_id)
                 if dia is not None:
                     self.tool_diameters[found_id] = dia
-                current_tool = found_id
-
-            # [新增] 取消模態判斷
-            if in_cycle_mode:
-                if re.search(r'(G80|G67|M06|M30)', line) or re.search(r'T\d+', line):
-                    in_cycle_mode = False
-                    current_cycle_data = None
-                elif re.search(r'G0?[0123]\b', line):
-                    # 若因為更換插補模式 (如 G1) 導致自動脫離循環
-                    in_cycle_mode = False
-                    current_cycle_data = None
+                state.current_tool = found_id
+
+            # [新增] 取消模態判斷 (G80/G67/M06/M30、換刀，或改變插補模式 G0~G3 自動脫離循環)
+            # 新的循環指令同樣結束前一個循環的孔位累計
+            if state.cycle is not None and (is_cancel or kind):
+                state.close_holes(idx)
+                yield state.cycle
+                state.cycle = None
 
             # 偵測 G66 P9131 或 G83 循環指令
-            is_cycle_line = False
-            if 'G66' in line and 'P9131' in line:
-                self._parse_g66_line(idx, line, current_tool, current_spindle_rpm, current_spindle_line)
-                is_cycle_line = True
-            elif 'G83' in line:
-                self._parse_fixed_cycle_line(idx, line, current_tool, current_spindle_rpm, current_spindle_line)
-                is_cycle_line = True
-                
-            # [新增] 孔數累加邏輯
-            if is_cycle_line:
-                in_cycle_mode = True
-                current_cycle_data = self.tools_data[-1]
-                # 指令行本身即代表進行一次鑽孔動作 (除非帶有 K0 或 L0 僅做參數宣告)
-                if re.search(r'\b[KL]0\.?\b', line):
-                    current_cycle_data['hole_count'] = 0
+            if kind:
+                if kind == 'G66':
+                    self._parse_g66_line(idx, line, block, state.current_tool, state.spindle_rpm, state.spindle_line)
                 else:
-                    current_cycle_data['hole_count'] = 1
-            elif in_cycle_mode and current_cycle_data:
-                # 若處於循環模態且非宣告行，尋找座標並累加 (排除註解行)
-                if not line.strip().startswith('(') and re.search(r'[XY]\s*[-+]?(?:\d*\.\d+|\d+)', line):
-                    current_cycle_data['hole_count'] += 1
+                    self._parse_fixed_cycle_line(idx, line, block, state.current_tool, state.spindle_rpm, state.spindle_line)
+                state.cycle = self.tools_data[-1]
+                state.cycle.retract_mode = motion.retract
+                state.cycle.hole_count = 0
+                state.hole_parts = []
+                # 循環行本身的 X/Y 已由 word 處理，不再視為循環本體的座標單節
+                if m_prev < len(blocks) and blocks.lines[m_prev] == idx:
+                    m_prev += 1
+                self._start_cycle_holes(kind, block, state)
 
-        return self.tools_data
+        # 區塊結束時仍在循環模態中：孔位先累計至區塊結尾，下一區塊由開頭繼續
+        if state.cycle is not None:
+            state.add_holes(motion.run(blocks, m_prev, len(blocks), True, state.cycle_repeat))
+            state.close_holes(end_line)
+        else:
+            motion.run(blocks, m_prev, len(blocks))
+
+    def _start_cycle_holes(self, kind, block, state):
+        """
+        循環指令行的孔位與重複次數：
+        G66 為模態宏呼叫，指令行本身不鑽孔，之後每個座標單節呼叫 L 次 (預設 1)；
+        G83 指令行定位至其 X/Y (未指定則為目前位置) 鑽孔，K0 或 L0 僅宣告參數不鑽孔，
+        L 為重複次數；循環本體各單節的重複次數由該單節的 K (或 L) 決定。
+        """
+        if kind == 'G66':
+            repeat = next((val for addr, val in block if addr == 'L'), 1)
+            state.cycle_repeat = max(int(round(repeat)), 0)
+            return
+        state.cycle_repeat = None
+        words = {}
+        for addr, val in block:
+            if addr in 'XYKL' and addr not in words:
+                words[addr] = val
+        if words.get('K') == 0 or words.get('L') == 0:
+            return
+        repeat = max(int(round(words.get('L', 1))), 0)
+        state.add_holes(state.motion.drill_at(words.get('X', np.nan), words.get('Y', np.nan), repeat))
+
+    def reparse_lines(self, start, end=None):
+        """
+        增量重新解析：第 [start, end) 行修改後 (行數不變)，從最近的模態檢查點重新掃描，
+        直到模態狀態與原本的檢查點一致 (收斂) 為止，並就地更新 tools_data 中受影響的循環
+        (hole_count、rpm / rpm_line、刀具直徑與循環參數)。
+        回傳是否有重新解析 (尚未解析過檔案時回傳 False)。
+        """
+        if not self._checkpoints:
+            return False
+        if end is None:
+            end = start + 1
+        if self._pending_reparse is not None:
+            self.reparse_pending()
+        self._revision += 1
+        n = len(self.nc_lines)
+        self.d_index.reindex_lines(start, end, self.nc_lines.text_range(start, end))
+
+        # 換刀行以 +/- DIAMETER_WINDOW 行查詢 D 值，重新掃描需涵蓋 D 字變動的影響範圍
+        dirty_start = max(0, start - DIAMETER_WINDOW)
+        dirty_end = min(n, end + DIAMETER_WINDOW)
+        cps, cp_lines = self._checkpoints, self._checkpoint_lines
+        k = bisect.bisect_right(cp_lines, dirty_start) - 1
+        cp = cps[k]
+
+        old_data = self.tools_data
+        old_diameters = self.tool_diameters
+        first = cp.n_records - (1 if cp.holes is not None else 0)
+        self.tools_data = old_data[:first]
+        self.tool_diameters = dict(cp.diameters)
+        # 起始檢查點之前的狀態不受修改影響，保留至該檢查點為止
+        self._checkpoints, self._checkpoint_lines = cps[:k + 1], cp_lines[:k + 1]
+        state = _ScanState()
+        state.current_tool = cp.tool
+        state.spindle_rpm = cp.spindle_rpm
+        state.spindle_line = cp.spindle_line
+        state.motion.restore(cp.motion)
+        state.cycle_repeat = cp.cycle_repeat
+        if cp.holes is not None:
+            state.cycle = old_data[first].copy()
+            state.cycle.hole_count = cp.holes
+            state.hole_parts = [old_data[first].holes[:cp.holes]]
+            self.tools_data.append(state.cycle)
+
+        # 逐段掃描至下一個原檢查點，於修改範圍之後比對狀態是否收斂
+        j = k + 1
+        seg_start = cp.line
+        converged = None
+        while True:
+            while j < len(cps) and cp_lines[j] < dirty_end:
+                j += 1
+            seg_end = cp_lines[j] if j < len(cps) else n
+            for _ in self._scan_text(self.nc_lines.text_range(seg_start, seg_end), seg_start, state):
+                pass
+            if j >= len(cps):
+                break
+            if self._state_matches(state, cps[j], old_data):
+                converged = cps[j]
+                break
+            seg_start = seg_end
+            j += 1
+
+        new_data = self.tools_data
+        if converged is not None:
+            old_end = converged.n_records
+            if state.cycle is not None:
+                # 收斂點之後的孔位與原結果相同，接上原循環其後的孔位
+                state.add_holes(old_data[old_end - 1].holes[converged.holes:])
+                state.close_holes(old_data[old_end - 1].end_line)
+            shift = len(new_data) - old_end
+            if shift:
+                for later in cps[j:]:
+                    later.n_records += shift
+            self._checkpoints += cps[j:]
+            self._checkpoint_lines += cp_lines[j:]
+            self.tool_diameters = old_diameters
+        else:
+            old_end = len(old_data)
+
+        # 就地更新：同一循環行的紀錄沿用原 dict (保留 initial_* 比對基準與 UI 附加欄位)
+        old_by_line = {rec.line_index: rec for rec in old_data[first:old_end]}
+        merged = []
+        for rec in new_data[first:]:
+            old = old_by_line.get(rec.line_index)
+            if old is not None and old.cycle_type == rec.cycle_type:
+                rec.keep_initial_from(old)
+                if old.original_line == rec.original_line:
+                    # 循環行未變 (或由 update_g66_line 寫回)：保留記憶體中未經格式化的參數
+                    rec.keep_params_from(old)
+                old.update(rec)
+                rec = old
+            merged.append(rec)
+        old_data[first:old_end] = merged
+        self.tools_data = old_data
+        return True
+
+    def _state_matches(self, state, cp, old_data):
+        """重新掃描後的模態狀態是否與原檢查點相同 (含進行中循環與已累計孔數)。"""
+        if (state.current_tool != cp.tool or state.spindle_rpm != cp.spindle_rpm
+                or state.spindle_line != cp.spindle_line or self.tool_diameters != cp.diameters
+                or not state.motion.matches(cp.motion) or state.cycle_repeat != cp.cycle_repeat):
+            return False
+        if state.cycle is None or cp.holes is None:
+            return state.cycle is None and cp.holes is None
+        return (state.cycle.line_index == old_data[cp.n_records - 1].line_index
+                and state.cycle.hole_count == cp.holes)
 
     def _scan_for_diameter(self, current_line_idx, tool_id):
         """
-        在刀具行 +/- 10 行範圍內搜尋 D 值。
+        在刀具行 +/- 10 行範圍內搜尋 D 值 (由 D 字索引查詢)。
         """
-        start = max(0, current_line_idx - 10)
-        end = min(len(self.nc_lines), current_line_idx + 11)
-        
-        for i in range(start, end):
-            line = self.nc_lines[i]
-            d_matches = re.findall(r'D\s*(\d*\.?\d+)', line)
-            for d_val in d_matches:
-                try:
-                    val = float(d_val)
-                    if val > 0: return val
-                except:
-                    continue
+        return self.diameter_near(current_line_idx)
+
+    def diameter_near(self, line_idx, window=DIAMETER_WINDOW):
+        """
+        回傳第 line_idx 行 +/- window 行範圍內第一個大於 0 的 D 值，無則回傳 None。
+        使用解析時建立的 D 字索引；串流模式下視窗超出已索引區塊的行才直接讀取。
+        """
+        start = max(0, line_idx - window)
+        end = min(len(self.nc_lines), line_idx + window + 1)
+        indexed_end = min(end, self.d_index.end_line)
+        dia = self.d_index.first_in_range(start, indexed_end)
+        if dia is not None:
+            return dia
+        for i in range(max(start, indexed_end), end):
+            for d_val in re.findall(r'D\s*(\d*\.?\d+)', self.nc_lines[i]):
+                val = float(d_val)
+                if val > 0: return val
         return None
 
-    def _parse_g66_line(self, line_index, line, tool_id, spindle_rpm=0, spindle_line=-1):
+    def _parse_g66_line(self, line_index, line, words, tool_id, spindle_rpm=0, spindle_line=-1):
         """
         解析 G66 P9131 循環指令。
+        words: tokenize_block 切分好的 (位址, 數值) 列表
         spindle_rpm: 由 parse_file State Tracking 傳入的當前主軸轉速
         spindle_line: 該 S 指令所在的確切行號
         """
-        matches = re.findall(r'([RZSIJKT])\s*([-+]?(?:\d*\.\d+|\d+))', line)
-
         static_params = {'R': None, 'Z': None, 'S': None, 'T': None, 'F': None, 'Q': None}
         dynamic_params = []
         
         temp_ijk = {}
         
-        for key, val_str in matches:
-            key = key.strip()
-            if not key or not val_str: continue
-            
-            val = float(val_str)
-            
+        for key, val in words:
             if key in ['R', 'Z', 'S', 'T']:
                 static_params[key] = val
             elif key in ['I', 'J', 'K']:
@@ -149,35 +766,33 @@ class RokuNCParser:
         
         detected_dia = self.tool_diameters.get(tool_id, None)
 
-        data = {
-            'tool_id': tool_id,
-            'line_index': line_index,
-            'original_line': line.strip(),
-            'cycle_type': 'G66',
-            'static_params': static_params,
-            'dynamic_params': dynamic_params,
-            'initial_static': copy.deepcopy(static_params),
-            'initial_dynamic': copy.deepcopy(dynamic_params),
-            'detected_diameter': detected_dia,
-            'rpm': spindle_rpm,      # State Tracking 傳入的主軸轉速
-            'initial_rpm': spindle_rpm, # 儲存初始轉速供比對
-            'rpm_line': spindle_line  # S 指令的確切行號，供回寫使用
-        }
-        self.tools_data.append(data)
+        # 初始參數為不可變快照 (共用，不 deepcopy)；可修改的參數在第一次存取時才複製
+        record = CycleRecord(
+            tool_id=tool_id,
+            line_index=line_index,
+            original_line=line.strip(),
+            cycle_type='G66',
+            initial_static=FrozenParams(static_params),
+            initial_dynamic=freeze_groups(dynamic_params),
+            detected_diameter=detected_dia,
+            rpm=spindle_rpm,          # State Tracking 傳入的主軸轉速
+            initial_rpm=spindle_rpm,  # 儲存初始轉速供比對
+            rpm_line=spindle_line     # S 指令的確切行號，供回寫使用
+        )
+        self.tools_data.append(record)
 
-    def _parse_fixed_cycle_line(self, line_index, line, tool_id, spindle_rpm=0, spindle_line=-1, cycle_type='G83'):
+    def _parse_fixed_cycle_line(self, line_index, line, words, tool_id, spindle_rpm=0, spindle_line=-1, cycle_type='G83'):
         """
         解析 G83 固定循環 (支援 Q 模式 與 I/J/K 模式)。
+        words: tokenize_block 切分好的 (位址, 數值) 列表
         spindle_rpm: 由 parse_file State Tracking 傳入的當前主軸轉速
         spindle_line: 該 S 指令所在的確切行號
         """
-        matches = re.findall(r'([RZQFXYIJK])\s*([-+]?(?:\d*\.\d+|\d+))', line)
-        
         static_params = {'R': None, 'Z': None, 'Q': None, 'F': None, 'P': None, 'I': None, 'J': None, 'K': None}
         
-        for key, val_str in matches:
-            val = float(val_str)
-            static_params[key] = val
+        for key, val in words:
+            if key in _G83_ADDRS:
+                static_params[key] = val
             
         detected_dia = self.tool_diameters.get(tool_id, 0.0)
         
@@ -226,24 +841,22 @@ class RokuNCParser:
 
         dynamic_params = self._g83_to_ijk(static_params, cycle_type, use_ijk_mode)
         
-        data = {
-            'tool_id': tool_id,
-            'line_index': line_index,
-            'original_line': line.strip(),
-            'cycle_type': 'G83',
-            'use_ijk_mode': use_ijk_mode,
-            'initial_use_ijk_mode': use_ijk_mode,
-            'static_params': static_params,
-            'dynamic_params': dynamic_params,
-            'initial_static': copy.deepcopy(static_params),
-            'initial_dynamic': copy.deepcopy(dynamic_params),
-            'detected_diameter': detected_dia,
-            'rpm': spindle_rpm,      # State Tracking 傳入的主軸轉速
-            'initial_rpm': spindle_rpm, # 儲存初始轉速供比對
-            'rpm_line': spindle_line, # S 指令的確切行號，供回寫使用
-            'original_xy': {'X': static_params.get('X'), 'Y': static_params.get('Y')}
-        }
-        self.tools_data.append(data)
+        record = CycleRecord(
+            tool_id=tool_id,
+            line_index=line_index,
+            original_line=line.strip(),
+            cycle_type='G83',
+            use_ijk_mode=use_ijk_mode,
+            initial_use_ijk_mode=use_ijk_mode,
+            initial_static=FrozenParams(static_params),
+            initial_dynamic=freeze_groups(dynamic_params),
+            detected_diameter=detected_dia,
+            rpm=spindle_rpm,          # State Tracking 傳入的主軸轉速
+            initial_rpm=spindle_rpm,  # 儲存初始轉速供比對
+            rpm_line=spindle_line,    # S 指令的確切行號，供回寫使用
+            original_xy={'X': static_params.get('X'), 'Y': static_params.get('Y')}
+        )
+        self.tools_data.append(record)
 
     def _g83_to_ijk(self, params, cycle_type='G83', use_ijk_mode=False):
         """
@@ -256,61 +869,18 @@ class RokuNCParser:
         - I: Initial Peck
         - J: Reduction Amount
         - K: Minimum Peck
+
+        跳數由 PeckSchedule 解析計算；超過 self.max_pecks 時不展開 (回傳空列表)，
+        時間與跳數改由 peck_schedule 取得。
         """
-        r_point = params.get('R', 0)
-        z_bottom = params.get('Z', 0)
-        
-        ijk_list = []
-        current_z = r_point
-        drilling_down = z_bottom < r_point
-        
-        # Mode Selection
-        if use_ijk_mode:
-            current_peck = abs(params.get('I', 0)) # Initial Peck
-            peck_reduction = abs(params.get('J', 0))
-            min_peck = abs(params.get('K', 0))
-            if current_peck <= 1e-6: return [] # Avoid infinite loop
-        else:
-            current_peck = abs(params.get('Q', 0))
-            if current_peck <= 1e-6: return []
-            
-        while True:
-            # Calculate next Z
-            if drilling_down:
-                next_z = max(current_z - current_peck, z_bottom)
-                depth_increment = current_z - next_z
-            else:
-                next_z = min(current_z + current_peck, z_bottom)
-                depth_increment = next_z - current_z
-            
-            if depth_increment < 1e-6:
-                break
-            
-            # I parameter for visualization (Step Depth)
-            i_vis = -depth_increment if drilling_down else depth_increment
-            
-            # J parameter for visualization (Retract to R for G83)
-            j_vis = r_point - next_z 
-            
-            ijk_list.append({
-                'I': i_vis,
-                'J': j_vis,
-                'K': 0.0
-            })
-            
-            current_z = next_z
-            
-            # Check finish
-            if drilling_down and current_z <= z_bottom: break
-            if not drilling_down and current_z >= z_bottom: break
-            
-            # Update Peck for next pass (Variable Mode only)
-            if use_ijk_mode:
-                current_peck -= peck_reduction
-                if current_peck < min_peck:
-                    current_peck = min_peck
-        
-        return ijk_list
+        schedule = self.peck_schedule(params, use_ijk_mode)
+        if schedule.exceeds_limit:
+            return []
+        return schedule.ijk_list()
+
+    def peck_schedule(self, params, use_ijk_mode=False):
+        """G83 位址值的啄鑽排程 (展開上限為 self.max_pecks)。"""
+        return PeckSchedule.from_params(params, use_ijk_mode, self.max_pecks)
 
     def _is_zero_set(self, ijk):
         """檢查 I, J, K 是否全為零。"""
@@ -324,10 +894,16 @@ class RokuNCParser:
             if k not in ijk_dict:
                 ijk_dict[k] = 0.0
 
-    def update_g66_line(self, data_index, new_static, new_dynamic_list):
+    def update_g66_line(self, data_index, new_static, new_dynamic_list, reparse=True):
         """
         更新指定刀具的循環指令。
-        根據原始類型（G83 或 G66）重建對應格式。
+        依原始類型（G83 或 G66）改寫對應的參數。
+
+        只改寫循環參數的位址字，其餘位址字 (G98/G99、L、M、X/Y 等) 與註解保持原位，
+        因此模態與孔位不變，不需重新解析；紀錄就地更新，static_params / dynamic_params
+        保留傳入的數值 (不以寫回的文字取代)。G83 由 Q 模式改為 I/J/K 模式而取代 K0 等
+        改變了孔數的改寫仍會重新解析該行；reparse 為 False 時改為累積至 reparse_pending
+        (批次改寫多行後一次重新解析)。
         """
         if data_index < 0 or data_index >= len(self.tools_data):
             return False
@@ -336,60 +912,37 @@ class RokuNCParser:
         line_idx = tool_data['line_index']
         cycle_type = tool_data.get('cycle_type', 'G66')
         
-        # [M3 修復] 使用 :g 格式化浮點數，避免超長精度（如 Z-4.069999999999999）
-        def fmt(val):
-            """格式化數值：移除尾端零與不必要的小數點"""
-            return f"{val:g}"
-        
+        # [M3 修復] 限制小數位數，避免超長精度（如 Z-4.069999999999999）
+        def word(addr, val):
+            return None if val is None else f"{addr}{_format_param(val)}"
+
+        old_line = self.nc_lines[line_idx]
         if cycle_type == 'G83':
-            # Reconstruct G83
-            parts = ["G83"]
-            
-            original_xy = tool_data.get('original_xy', {})
-            if original_xy.get('X') is not None: parts.append(f"X{fmt(original_xy['X'])}")
-            if original_xy.get('Y') is not None: parts.append(f"Y{fmt(original_xy['Y'])}")
-            
-            if new_static.get('Z') is not None: parts.append(f"Z{fmt(new_static['Z'])}")
-            if new_static.get('R') is not None: parts.append(f"R{fmt(new_static['R'])}")
-            
-            use_ijk = tool_data.get('use_ijk_mode', False)
-            if use_ijk:
-                if new_static.get('I') is not None: parts.append(f"I{fmt(new_static['I'])}")
-                if new_static.get('J') is not None: parts.append(f"J{fmt(new_static['J'])}")
-                if new_static.get('K') is not None: parts.append(f"K{fmt(new_static['K'])}")
+            words = {addr: word(addr, new_static.get(addr)) for addr in 'ZR'}
+            if tool_data.get('use_ijk_mode', False):
+                words.update((addr, word(addr, new_static.get(addr))) for addr in 'IJK')
+                words['Q'] = ""
             else:
-                if new_static.get('Q') is not None: parts.append(f"Q{fmt(new_static['Q'])}")
-                
-            if new_static.get('F') is not None: parts.append(f"F{fmt(new_static['F'])}")
-        
+                words.update(Q=word('Q', new_static.get('Q')), I="", J="")
+                # Q 模式的 K0 表示僅宣告參數不鑽孔，保留；其餘 K 為 I/J/K 模式的最小啄鑽量
+                if next((val for addr, val in tokenize_block(old_line) if addr == 'K'), 0) != 0:
+                    words['K'] = ""
+            words['F'] = word('F', new_static.get('F'))
+            groups = None
         else:
-            # 重建 G66 P9131 格式
-            parts = ["G66 P9131"]
-            
-            # R、Z 必須參數
-            if new_static.get('R') is not None: 
-                parts.append(f"R{fmt(new_static['R'])}")
-            if new_static.get('Z') is not None: 
-                parts.append(f"Z{fmt(new_static['Z'])}")
-            
+            words = {addr: word(addr, new_static.get(addr)) for addr in 'RZ'}
             # S、T 可選參數（省略 0 值）
-            if new_static.get('S') is not None and abs(new_static['S']) > 1e-6:
-                parts.append(f"S{fmt(new_static['S'])}")
-            if new_static.get('T') is not None and abs(new_static['T']) > 1e-6:
-                parts.append(f"T{fmt(new_static['T'])}")
-            
-            # 添加動態參數（省略 0 值）
+            for addr in 'ST':
+                val = new_static.get(addr)
+                if val is not None:
+                    words[addr] = word(addr, val) if abs(val) > 1e-6 else ""
+            # 動態參數（省略全為 0 的組）
+            groups = []
             for group in new_dynamic_list:
-                i_val = group.get('I', 0.0)
-                j_val = group.get('J', 0.0)
-                k_val = group.get('K', 0.0)
-                # 只添加非 0 值
-                if abs(i_val) > 1e-6 or abs(j_val) > 1e-6 or abs(k_val) > 1e-6:
-                    parts.append(f"I{fmt(i_val)}")
-                    parts.append(f"J{fmt(j_val)}")
-                    parts.append(f"K{fmt(k_val)}")
-        
-        new_line = " ".join(parts) + "\n"
+                ijk = [group.get(addr, 0.0) for addr in 'IJK']
+                if any(abs(val) > 1e-6 for val in ijk):
+                    groups.extend(word(addr, val) for addr, val in zip('IJK', ijk))
+        new_line = _rewrite_cycle_words(old_line, words, groups)
         
         # 更新記憶體
         self.nc_lines[line_idx] = new_line
@@ -398,13 +951,31 @@ class RokuNCParser:
         tool_data['static_params'] = new_static
         tool_data['dynamic_params'] = new_dynamic_list
         tool_data['original_line'] = new_line.strip()
-        
+
+        # 其他位址字被改寫時，重新推導受影響的模態狀態 (孔數、後續循環等)
+        if _cycle_line_signature(old_line, cycle_type) != _cycle_line_signature(new_line, cycle_type):
+            if reparse:
+                self.reparse_lines(line_idx)
+            else:
+                self._defer_reparse(line_idx, line_idx + 1)
         return True
 
+    def _defer_reparse(self, start, end):
+        pending = self._pending_reparse
+        self._pending_reparse = (start, end) if pending is None else (min(pending[0], start), max(pending[1], end))
+
+    def reparse_pending(self):
+        """重新解析 update_g66_line(reparse=False) 累積的行範圍 (一次)；回傳是否有重新解析。"""
+        pending, self._pending_reparse = self._pending_reparse, None
+        if pending is None:
+            return False
+        return self.reparse_lines(*pending)
+
     def generate_html(self, data_index, context_lines=10):
         """
         Generates HTML string with changed values highlighted in red.
         Includes context_lines above and below the active line.
+        Context lines link to 'line:<line index>' so the preview can select the cycle owning a clicked line.
         """
         if data_index < 0 or data_index >= len(self.tools_data):
             return "<i>No tool selected</i>"
@@ -431,7 +1002,7 @@ class RokuNCParser:
             line_str = self.nc_lines[i].strip()
             line_str = line_str.replace("<", "&lt;").replace(">", "&gt;")
             line_str = highlight_line(i, line_str)
-            context_above.append(f"<span style='color:gray;'>{line_str}</span>")
+            context_above.append(f"<a href='line:{i}' style='color:gray; text-decoration:none;'>{line_str}</a>")
             
         # --- Active Line Construction (Highlighed) ---
         current_static = tool_data['static_params']
@@ -516,7 +1087,7 @@ class RokuNCParser:
             line_str = self.nc_lines[i].strip()
             line_str = line_str.replace("<", "&lt;").replace(">", "&gt;")
             line_str = highlight_line(i, line_str)
-            context_below.append(f"<span style='color:gray;'>{line_str}</span>")
+            context_below.append(f"<a href='line:{i}' style='color:gray; text-decoration:none;'>{line_str}</a>")
 
         full_html = "<br>".join(context_above + [active_line_html] + context_below)
         return full_html
@@ -549,12 +1120,196 @@ class RokuNCParser:
         new_line = re.sub(r'S\d+', f'S{int(new_rpm)}', old_line, count=1)
         self.nc_lines[rpm_line] = new_line
         
-        # 同步內部狀態
-        tool_data['rpm'] = int(new_rpm)
-        
+        # 同步內部狀態：S 行只改變轉速，同一 S 指令下的其他循環與模態檢查點就地更新，不需重新解析
+        new_rpm = int(new_rpm)
+        tool_data['rpm'] = new_rpm
+        for rec in self.tools_data:
+            if rec.get('rpm_line') == rpm_line:
+                rec['rpm'] = new_rpm
+        for cp in self._checkpoints:
+            if cp.spindle_line == rpm_line:
+                cp.spindle_rpm = new_rpm
+        return True
+
+    def reorder_cycle_holes(self, data_index, g0_speed=DEFAULT_G0_SPEED):
+        """
+        最佳化指定循環 (G83 / G66 模態) 內的孔位加工順序 (nc_route)，改寫循環本體的座標單節。
+
+        循環指令行不變 (G83 行本身的孔位仍為第一孔；G66 則保留本體第一孔為起點)；
+        循環結束後的下一個座標單節依賴結束位置時 (增量座標、只指定單軸)，最後一孔也固定不動。
+        只有 G90 絕對座標、本體單節只含 X/Y/K/L (與註解) 的循環可以重排。
+
+        回傳 {'holes', 'before_length', 'after_length', 'saved_time'} (路徑長度 mm，
+        saved_time 為節省的 G0 定位時間，分鐘)；無法安全重排時回傳 None。
+        """
+        if data_index < 0 or data_index >= len(self.tools_data):
+            return None
+        rec = self.tools_data[data_index]
+        start, end = rec['line_index'], rec.get('end_line')
+        if end is None or self.incremental_at(start):
+            return None
+        mapped = self.cycle_hole_rows(data_index)
+        if mapped is None:
+            return None
+        slots, reps, n_line_holes = mapped
+        for idx in range(start + 1, end):
+            text = self.nc_lines[idx]
+            words = tokenize_block(text)
+            if not words:
+                continue  # 空行 / 註解行留在原位；K0 / L0 單節不定位也不鑽孔，同樣留在原位
+            if (text.lstrip().startswith('/') or not {a for a, _ in words} <= _REORDER_ADDRS
+                    or not {'X', 'Y'} & {a for a, _ in words}):
+                return None
+        texts = [self.nc_lines[idx] for idx in slots]
+
+        holes = rec['holes']
+        body = holes[n_line_holes:]
+        if len(slots) < 2:
+            return None
+        points = body[np.cumsum(reps) - reps]
+        if np.isnan(points).any():
+            return None
+        origin = holes[n_line_holes - 1] if n_line_holes else None
+
+        order = optimize_order(points, origin, fixed_end=not self._position_free_after(end))
+        before = path_length(points, None, origin)
+        after = path_length(points, order, origin)
+        report = {'holes': int(len(body)), 'before_length': before, 'after_length': after,
+                  'saved_time': (before - after) / g0_speed}
+        if (order == np.arange(len(order))).all():
+            report.update(after_length=before, saved_time=0.0)
+            return report
+
+        for idx, k in zip(slots, order.tolist()):
+            x, y = points[k]
+            new_line = _explicit_xy(texts[k], float(x), float(y))
+            if new_line != self.nc_lines[idx]:
+                self.nc_lines[idx] = new_line
+        self.reparse_lines(start + 1, end)
+        return report
+
+    def hole_index(self):
+        """所有循環孔位的空間索引 (nc_spatial.HoleIndex)；解析結果變更後第一次呼叫時重新建立。"""
+        if self._hole_index is None or self._hole_index[0] != self._revision:
+            self._hole_index = (self._revision, HoleIndex(self.tools_data))
+        return self._hole_index[1]
+
+    def cycle_intervals(self):
+        """各循環模態區間的索引 (nc_interval.CycleIntervals)；解析結果變更後第一次呼叫時重新建立。"""
+        if self._intervals is None or self._intervals[0] != self._revision:
+            self._intervals = (self._revision, CycleIntervals(self.tools_data))
+        return self._intervals[1]
+
+    def cycle_at(self, line_idx):
+        """第 line_idx 行所屬循環在 tools_data 中的索引 (不在循環模態中時為 None)。"""
+        return self.cycle_intervals().cycle_at(line_idx)
+
+    def cycles_in(self, start, end):
+        """與第 [start, end) 行重疊的循環索引 (range)，供修改某段程式後找出受影響的循環。"""
+        return self.cycle_intervals().cycles_in(start, end)
+
+    def modal_at(self, line_idx):
+        """
+        第 line_idx 行 (含該行) 生效的模態狀態，由最近的檢查點往後只詞法分析至該行：
+            {'cycle': 所屬循環索引或 None, 'tool_id', 'rpm', 'rpm_line', 'incremental', 'retract'}
+        """
+        if not self._checkpoints:
+            return None
+        k = bisect.bisect_right(self._checkpoint_lines, line_idx) - 1
+        cp = self._checkpoints[max(k, 0)]
+        _, _, incremental, retract = cp.motion
+        state = {'cycle': self.cycle_at(line_idx), 'tool_id': cp.tool, 'rpm': cp.spindle_rpm,
+                 'rpm_line': cp.spindle_line, 'incremental': incremental, 'retract': retract}
+        events, _ = _lex_cycle_events(self.nc_lines.text_range(cp.line, line_idx + 1), cp.line)
+        for idx, _, _, _, _, distance, retract, s_word, t_word, _, _ in events:
+            if distance is not None:
+                state['incremental'] = distance
+            if retract is not None:
+                state['retract'] = retract
+            if s_word is not None:
+                state['rpm'], state['rpm_line'] = int(s_word), idx
+            if t_word is not None:
+                state['tool_id'] = str(int(t_word))
+        return state
+
+    def cycle_hole_rows(self, data_index):
+        """
+        循環本體中產生孔位的座標單節：回傳 (行號列表, 各單節孔數陣列, 循環指令行本身的孔數)，
+        依序對應 tools_data[data_index].holes。本體含回參考點 / 座標系設定，或孔數與 holes
+        不一致時回傳 None。
+        """
+        rec = self.tools_data[data_index]
+        start, end = rec['line_index'], rec.get('end_line')
+        if end is None:
+            return None
+        # 循環指令行本身的孔數與 G66 每個單節的呼叫次數
+        line_words = dict(reversed(tokenize_block(rec['original_line'])))
+        if rec['cycle_type'] == 'G66':
+            n_line_holes = 0
+            repeat = max(int(round(line_words.get('L', 1))), 0)
+        else:
+            drills = line_words.get('K') != 0 and line_words.get('L') != 0
+            n_line_holes = max(int(round(line_words.get('L', 1))), 0) if drills else 0
+            repeat = None
+
+        blocks = lex_motion_blocks(self.nc_lines.text_range(start + 1, end), start + 1)
+        if np.isin(blocks.flags, (MOTION_UNKNOWN, MOTION_SET)).any():
+            return None
+        if repeat is not None:
+            counts = np.full(len(blocks), repeat, dtype=np.intp)
+        else:
+            counts = np.where(np.isnan(blocks.k_words), blocks.l_words, blocks.k_words)
+            counts = np.maximum(np.round(np.nan_to_num(counts, nan=1.0)), 0).astype(np.intp)
+        keep = (blocks.flags == MOTION_NORMAL) & (counts > 0)
+        reps = counts[keep]
+        if reps.sum() != len(rec['holes']) - n_line_holes:
+            return None
+        return blocks.lines[keep].tolist(), reps, n_line_holes
+
+    def incremental_at(self, line_idx):
+        """第 line_idx 行 (含該行) 生效的距離模式是否為 G91 增量 (由最近的檢查點往後查)。"""
+        k = bisect.bisect_right(self._checkpoint_lines, line_idx) - 1
+        cp = self._checkpoints[k]
+        _, values, _ = lex_words(self.nc_lines.text_range(cp.line, line_idx + 1), 'G', cp.line)
+        modes = values[(values == 90) | (values == 91)]
+        return bool(modes[-1] == 91) if len(modes) else cp.motion[2]
+
+    def _position_free_after(self, line_idx, window=1024):
+        """
+        第 line_idx 行起的下一個座標單節是否與之前的位置無關：G90 且同時指定 X、Y 的
+        直線定位，或同時指定 X、Y 的回參考點 / 座標系設定；之後沒有座標單節時亦為 True。
+        """
+        n = len(self.nc_lines)
+        incremental = False
+        pos = line_idx
+        while pos < n:
+            stop = min(n, pos + window)
+            text = self.nc_lines.text_range(pos, stop)
+            blocks = lex_motion_blocks(text, pos)
+            _, g_vals, g_lines = lex_words(text, 'G', pos)
+            for r in np.flatnonzero(blocks.flags != MOTION_IGNORE).tolist():
+                line = blocks.lines[r]
+                before = g_vals[g_lines <= line]
+                modes = before[(before == 90) | (before == 91)]
+                if len(modes):
+                    incremental = modes[-1] == 91
+                both = not np.isnan(blocks.xy[r]).any()
+                if blocks.flags[r] != MOTION_NORMAL:
+                    return both
+                here = g_vals[g_lines == line]
+                arc = ((here == 2) | (here == 3)).any()
+                return both and not incremental and not arc
+            modes = g_vals[(g_vals == 90) | (g_vals == 91)]
+            if len(modes):
+                incremental = modes[-1] == 91
+            pos = stop
         return True
 
     def save_file(self, output_path):
         """將修改後的內容寫入檔案，使用與讀取時相同的編碼。"""
+        if isinstance(self.nc_lines, (LineStore, MappedLines)):
+            # LineStore 整個緩衝區一次寫出；串流模式則直接複製未修改行的原始位元組
+            self.nc_lines.save(output_path, self.file_encoding)
+            return
         with open(output_path, 'w', encoding=self.file_encoding) as f:
             f.writelines(self.nc_lines)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+G83 啄鑽排程 (Q 固定 / I/J/K 遞減) 的解析計算。
+
+第 p 跳的啄鑽量為 I (p = 0)、max(I - p·J, K) (p >= 1)；Q 模式為固定 Q。
+遞減段的累計深度為等差級數和，K 段為線性，因此跳數與各跳位置皆可直接計算，
+不需逐跳迴圈：極小的 Q / K 或使 J 遞減至 0 的參數也能立即得到跳數。
+每跳的明細 (表格、圖形用) 只在需要時才以 NumPy 陣列產生，跳數超過上限時拒絕展開；
+時間計算改用連續段 runs()，其長度只與遞減段跳數有關，固定 Q / K 段不論多少跳都只是一段。
+
+判定與原本逐跳迴圈相同：剩餘深度或啄鑽量小於 1e-6 時停止，最後一跳止於孔底。
+"""
+import math
+
+import numpy as np
+
+# 每跳明細的展開上限預設值 (跳數，設定檔 limits.max_pecks)：超過時 increments / ijk_list 等引發 PeckLimitError
+MAX_PECKS = 10000
+# 小於此值的啄鑽量 / 剩餘深度視為 0
+_EPS = 1e-6
+
+
+class PeckLimitError(ValueError):
+    """跳數超過展開上限。"""
+
+
+class PeckSchedule:
+    """
+    單孔 G83 啄鑽排程。
+
+        r_point, z_bottom: R 點與孔底 Z
+        first:     第一跳啄鑽量 (I 或 Q)
+        reduction: 每跳遞減量 (J，Q 模式為 0)
+        minimum:   最小啄鑽量 (K，Q 模式為 Q)
+        max_pecks: 每跳明細的展開上限 (None 為不限制)
+        count:     總跳數 (解析計算，不受上限影響)
+    """
+    __slots__ = ('r_point', 'z_bottom', 'first', 'reduction', 'minimum', 'max_pecks',
+                 'direction', 'depth', 'tail', 'n_decrease', 'count')
+
+    def __init__(self, r_point, z_bottom, first, reduction=0.0, minimum=None, max_pecks=MAX_PECKS):
+        self.r_point = r_point
+        self.z_bottom = z_bottom
+        self.first = abs(first)
+        self.reduction = abs(reduction)
+        self.minimum = self.first if minimum is None else abs(minimum)
+        self.max_pecks = max_pecks
+        self.direction = -1.0 if z_bottom < r_point else 1.0
+        self.depth = abs(z_bottom - r_point)
+        # 遞減段 [0, n_decrease) 的啄鑽量為 first - p·reduction，之後固定為 tail
+        if self.reduction > 0:
+            self.tail = self.minimum
+            self.n_decrease = max(1, math.ceil((self.first - self.minimum) / self.reduction))
+        else:
+            self.tail = max(self.first, self.minimum)
+            self.n_decrease = 1
+        self.count = self._count()
+
+    @classmethod
+    def from_params(cls, params, use_ijk_mode=False, max_pecks=MAX_PECKS):
+        """由 G83 位址值 {'R', 'Z', 'Q', 'I', 'J', 'K'} 建立排程。"""
+        r_point = params.get('R', 0)
+        z_bottom = params.get('Z', 0)
+        if use_ijk_mode:
+            return cls(r_point, z_bottom, params.get('I', 0), params.get('J', 0), params.get('K', 0), max_pecks)
+        return cls(r_point, z_bottom, params.get('Q', 0), max_pecks=max_pecks)
+
+    def cumulative(self, k):
+        """前 k 跳的累計啄鑽量 (未截斷至孔底)；k 可為 NumPy 陣列。"""
+        m = self.n_decrease
+        head = np.minimum(k, m)
+        return head * self.first - self.reduction * head * (head - 1) / 2.0 + np.maximum(k - m, 0) * self.tail
+
+    def _count(self):
+        if self.first < _EPS or self.depth < _EPS:
+            return 0
+        m = self.n_decrease
+        # 啄鑽量降至 1e-6 以下的第一跳 (之後的迴圈即停止)
+        stop = math.inf
+        if self.reduction > 0 and self.first - (m - 1) * self.reduction < _EPS:
+            stop = math.floor((self.first - _EPS) / self.reduction) + 1
+        elif self.tail < _EPS:
+            stop = m
+        # 第 k 跳在剩餘深度 depth - C(k) >= 1e-6 時執行：找第一個 C(k) > target 的 k
+        target = self.depth - _EPS
+        c_m = float(self.cumulative(m))
+        if c_m > target:
+            b = self.first + self.reduction / 2.0
+            if self.reduction > 0:
+                k = int((b - math.sqrt(max(b * b - 2.0 * self.reduction * target, 0.0))) / self.reduction) + 1
+            else:
+                k = int(target / self.first) + 1
+            k = min(max(k, 1), m)
+        else:
+            k = m + int((target - c_m) / self.tail) + 1 if self.tail >= _EPS else math.inf
+        if k != math.inf:
+            # 浮點誤差修正
+            while k > 1 and self.cumulative(k - 1) > target:
+                k -= 1
+            while self.cumulative(k) <= target:
+                k += 1
+        return int(min(k, stop))
+
+    def check_limit(self):
+        """跳數超過展開上限時引發 PeckLimitError。"""
+        if self.max_pecks is not None and self.count > self.max_pecks:
+            raise PeckLimitError(f"啄鑽跳數 {self.count} 超過上限 {self.max_pecks}")
+
+    @property
+    def exceeds_limit(self):
+        return self.max_pecks is not None and self.count > self.max_pecks
+
+    def depths(self):
+        """各跳結束時距 R 點的深度 (NumPy 陣列，最後一跳截斷至孔底)。"""
+        self.check_limit()
+        return np.minimum(self.cumulative(np.arange(1, self.count + 1, dtype=np.float64)), self.depth)
+
+    def increments(self):
+        """各跳的實際下鑽量 (NumPy 陣列，正值)。"""
+        return np.diff(self.depths(), prepend=0.0)
+
+    def z_positions(self):
+        """各跳結束時的 Z 座標 (NumPy 陣列)。"""
+        return self.r_point + self.direction * self.depths()
+
+    def runs(self):
+        """
+        [(增量, 次數), ...]：連續相同增量合併為一段 (含方向)，
+        可直接傳入 DrillingAnalysisEngine.calc_peck_runs_time。
+        跳數超過展開上限時仍可使用；只有遞減段本身超過上限時才引發 PeckLimitError。
+        """
+        n = self.count
+        m = min(self.n_decrease, n)
+        if self.max_pecks is not None and m > self.max_pecks:
+            raise PeckLimitError(f"啄鑽遞減段 {m} 跳超過上限 {self.max_pecks}")
+        if n == 0:
+            return []
+        head = self.first - self.reduction * np.arange(m)
+        result = [(self.direction * float(p), 1) for p in head]
+        if n > m:
+            result.append((self.direction * self.tail, n - m))
+        # 最後一跳止於孔底
+        last = self.depth - float(self.cumulative(n - 1))
+        if last < abs(result[-1][0]) - 1e-12:
+            inc, cnt = result.pop()
+            if cnt > 1:
+                result.append((inc, cnt - 1))
+            result.append((self.direction * last, 1))
+        return result
+
+    def ijk_list(self):
+        """視覺化用的每跳明細 [{'I': 單次增量, 'J': 相對 R 的深度, 'K': 0.0}, ...] (同 _g83_to_ijk)。"""
+        depths = self.depths()
+        incs = np.diff(depths, prepend=0.0) * self.direction
+        rel = -self.direction * depths
+        return [{'I': i, 'J': j, 'K': 0.0} for i, j in zip(incs.tolist(), rel.tolist())]
@@ -0,0 +1,207 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class FrozenParams(Mapping):
+    """
+    不可變的參數字典 (initial_static / initial_dynamic 各組使用)。
+    建立時直接接管傳入的 dict，不複製；唯讀，因此可在多處安全共用而不需 deepcopy。
+    """
+    __slots__ = ('_d',)
+
+    def __init__(self, params=()):
+        self._d = params if type(params) is dict else dict(params)
+
+    def __getitem__(self, key):
+        return self._d[key]
+
+    def __iter__(self):
+        return iter(self._d)
+
+    def __len__(self):
+        return len(self._d)
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def get(self, key, default=None):
+        return self._d.get(key, default)
+
+    def __repr__(self):
+        return f"FrozenParams({self._d!r})"
+
+    def __reduce__(self):
+        return (FrozenParams, (self._d,))
+
+
+def freeze_groups(groups):
+    """將動態參數組列表轉為不可變快照 (tuple of FrozenParams)。"""
+    return tuple(g if type(g) is FrozenParams else FrozenParams(g) for g in groups)
+
+
+class CycleRecord:
+    """
+    單一循環 (G66 P9131 / G83) 的解析紀錄，即 tools_data 的元素。
+
+    固定欄位以 __slots__ 儲存，並提供與 dict 相容的介面 (record['key']、get、in、
+    keys / items、update、copy)，UI 照舊以 key 存取；未設定的欄位視同不存在的 key。
+    UI 另外附加的欄位 (如 current_life_index) 存於 extra dict。
+
+    holes 為 (N, 2) float64 唯讀陣列 (各孔的絕對 XY 位置，位置未知的軸為 NaN)，
+    retract_mode 為循環開始時的退刀模式 ('G98' / 'G99')，end_line 為結束循環模態的單節行號
+    (不含該行；模態持續至程式結尾時為總行數)，循環本體即第 line_index + 1 至 end_line - 1 行。
+
+    initial_static / initial_dynamic 是不可變快照；static_params / dynamic_params
+    在第一次存取時才由快照複製出可修改的 dict / list，未編輯的循環不需額外配置。
+    """
+    FIELDS = ('tool_id', 'line_index', 'original_line', 'cycle_type',
+              'use_ijk_mode', 'initial_use_ijk_mode',
+              'static_params', 'dynamic_params', 'initial_static', 'initial_dynamic',
+              'detected_diameter', 'rpm', 'initial_rpm', 'rpm_line', 'original_xy', 'hole_count',
+              'holes', 'retract_mode', 'end_line')
+    __slots__ = ('tool_id', 'line_index', 'original_line', 'cycle_type',
+                 'use_ijk_mode', 'initial_use_ijk_mode', '_static', '_dynamic',
+                 'initial_static', 'initial_dynamic', 'detected_diameter',
+                 'rpm', 'initial_rpm', 'rpm_line', 'original_xy', 'hole_count',
+                 'holes', 'retract_mode', 'end_line', '_extra')
+    _FIELD_SET = frozenset(FIELDS)
+    # 延遲複製的欄位：(已複製的 slot, 來源快照)
+    _LAZY = {'static_params': ('_static', 'initial_static'), 'dynamic_params': ('_dynamic', 'initial_dynamic')}
+
+    def __init__(self, **fields):
+        self._static = self._dynamic = None
+        self._extra = None
+        for key, val in fields.items():
+            self[key] = val
+
+    # --- 可修改參數：由不可變快照延遲複製 ---
+    @property
+    def static_params(self):
+        if self._static is None:
+            self._static = dict(self.initial_static)
+        return self._static
+
+    @static_params.setter
+    def static_params(self, value):
+        self._static = value
+
+    @property
+    def dynamic_params(self):
+        if self._dynamic is None:
+            self._dynamic = [dict(g) for g in self.initial_dynamic]
+        return self._dynamic
+
+    @dynamic_params.setter
+    def dynamic_params(self, value):
+        self._dynamic = value
+
+    def current_params(self):
+        """目前的 (static, dynamic) 參數供唯讀計算使用：未編輯過的循環直接回傳快照，不複製。"""
+        static = self._static if self._static is not None else self.initial_static
+        dynamic = self._dynamic if self._dynamic is not None else self.initial_dynamic
+        return static, dynamic
+
+    def keep_initial_from(self, other):
+        """沿用另一筆紀錄的 initial_* 快照 (增量重新解析時保留載入時的比對基準)。"""
+        static, dynamic = self.static_params, self.dynamic_params
+        for key in ('initial_static', 'initial_dynamic', 'initial_rpm', 'initial_use_ijk_mode'):
+            if key in other:
+                self[key] = other[key]
+        self._static, self._dynamic = static, dynamic
+
+    def keep_params_from(self, other):
+        """沿用另一筆紀錄已編輯的參數 (循環行文字相同時，保留寫回前未經格式化的數值)。"""
+        if other._static is not None:
+            self._static = other._static
+        if other._dynamic is not None:
+            self._dynamic = other._dynamic
+
+    # --- dict 相容介面 ---
+    def __getitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        if key in self._FIELD_SET:
+            lazy = self._LAZY.get(key)
+            if lazy is not None:
+                return getattr(self, lazy[0]) is not None or hasattr(self, lazy[1])
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [k for k in self.FIELDS if k in self]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def update(self, other=(), **kwargs):
+        pairs = other.items() if hasattr(other, 'items') else other
+        for key, val in pairs:
+            self[key] = val
+        for key, val in kwargs.items():
+            self[key] = val
+
+    def copy(self):
+        """淺層複製 (快照共用；已複製出的可修改參數各自再複製一層)。"""
+        rec = CycleRecord()
+        for key in self.keys():
+            val = self[key]
+            if key == 'static_params':
+                val = dict(val)
+            elif key == 'dynamic_params':
+                val = [dict(g) for g in val]
+            rec[key] = val
+        return rec
+
+    def __eq__(self, other):
+        if not isinstance(other, (CycleRecord, dict)):
+            return NotImplemented
+        mine, theirs = dict(self.items()), dict(other.items())
+        if mine.keys() != theirs.keys():
+            return False
+        for key, val in mine.items():
+            if isinstance(val, np.ndarray):
+                if not np.array_equal(val, theirs[key], equal_nan=True):
+                    return False
+            elif val != theirs[key]:
+                return False
+        return True
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"CycleRecord({dict(self.items())!r})"
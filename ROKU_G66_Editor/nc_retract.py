@@ -0,0 +1,318 @@
+"""
+退刀高度最佳化：依素材上面 (由程式原點偏移 origin_z_shift 推得) 與 XY 夾具 / 障礙物範圍，
+為單一循環選擇最低的安全 R 點 (G66 另含 S 接近點)，以及 G83 各孔的 G98 / G99 退刀。
+
+行程模型 (與 P9131 說明書 MM0140C 相同)：
+- G83：每次啄鑽後快速退回 R，再快速下降至上次深度 + 間隙；第一刀由 R 進給。
+  孔與孔之間 G99 在 R 高度移動，G98 則先退回循環開始前的初始高度。
+- G66 P9131：由 R 下降至 S 後進給，每次啄鑽退回 R，孔與孔之間在 R 高度移動 (沒有 G98 可選)。
+
+障礙物為 [xmin, ymin, xmax, ymax, 頂面 Z] 矩形 (程式座標)，XY 外擴 obstacle_margin
+(刀具半徑與安全距離)；經過障礙物的移動高度至少為頂面 + obstacle_clearance。
+"""
+import re
+
+import numpy as np
+
+from analysis_engine import DrillingAnalysisEngine
+from nc_lexer import lex_words
+from nc_peck import PeckLimitError
+from nc_timing import DEFAULT_G0_SPEED
+
+# 預設安全距離 (mm)：R 點、S 接近點高於素材上面的距離，障礙物頂面與 XY 外擴量
+DEFAULT_R_CLEARANCE = 0.3
+DEFAULT_S_CLEARANCE = 0.1
+DEFAULT_OBSTACLE_CLEARANCE = 1.0
+DEFAULT_OBSTACLE_MARGIN = 1.0
+# 啄鑽間隙 d (與 DrillingAnalysisEngine 相同)
+_PECK_CLEARANCE = 0.1
+# 向前搜尋循環開始前 Z 高度的行數
+_INITIAL_Z_WINDOW = 400
+# 這些 G 碼單節的 Z 不是一般定位 (回參考點、機械座標、座標設定、暫停、宏引數、固定循環)
+_NON_POSITION_G = frozenset((4.0, 10.0, 28.0, 30.0, 52.0, 53.0, 65.0, 66.0, 92.0)
+                            + tuple(float(g) for g in range(73, 90)))
+_RETRACT_WORD_RE = re.compile(r'G[ \t]*9[89](?![\d.])')
+
+
+def stock_top_z(origin_z_shift):
+    """素材上面在程式座標中的 Z (視覺化以素材上面為 0，程式原點位於 origin_z_shift)。"""
+    return -origin_z_shift
+
+
+def _crossing_height(p0, p1, boxes):
+    """各線段 p0[i] → p1[i] 經過的障礙物最高頂面 Z (沒有經過則為 -inf)；p0 == p1 時為點是否在範圍內。"""
+    out = np.full(len(p0), -np.inf)
+    if not len(boxes) or not len(p0):
+        return out
+    lo, hi = boxes[None, :, 0:2], boxes[None, :, 2:4]
+    a = p0[:, None, :]
+    d = (p1 - p0)[:, None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1, t2 = (lo - a) / d, (hi - a) / d
+    parallel = d == 0
+    inside = (a >= lo) & (a <= hi)
+    t_near = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2)).max(axis=2)
+    t_far = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2)).min(axis=2)
+    hit = (t_near <= t_far) & (t_far >= 0) & (t_near <= 1)
+    return np.where(hit, boxes[None, :, 4], -np.inf).max(axis=1)
+
+
+def _g83_strokes(runs, feedrate, r_point, g0_speed):
+    """
+    G83 單孔的 (快速移動距離, 時間)，啄鑽為 PeckSchedule.runs() 的連續段；
+    與 DrillingAnalysisEngine.calc_peck_runs_time 相同 (跳數超過展開上限時亦可計算)。
+    """
+    rapid, _ = DrillingAnalysisEngine.calc_peck_runs_distance(runs, r_point, _PECK_CLEARANCE)
+    return rapid, DrillingAnalysisEngine.calc_peck_runs_time(runs, feedrate, r_point, g0_speed, _PECK_CLEARANCE)
+
+
+def _g66_strokes(segments, r_point, s_point, g0_speed):
+    """G66 P9131 單孔的 (快速移動距離, 時間)：R → S 下降後進給，各次啄鑽退回 R 再降至上次深度 + 間隙。"""
+    rapid = abs(r_point - s_point)
+    feed_time = 0.0
+    current = s_point
+    first = True
+    for seg in segments:
+        seg_z, seg_q, seg_f = seg['I'], abs(seg['J']), seg['K']
+        if seg_q < 1e-6 or seg_f < 1e-6:
+            continue
+        while current > seg_z + 1e-9:
+            peck_end = max(current - seg_q, seg_z)
+            start = current if first else current + _PECK_CLEARANCE
+            if not first:
+                rapid += abs(r_point - start)
+            feed_time += (start - peck_end) / seg_f
+            rapid += abs(r_point - peck_end)
+            current = peck_end
+            first = False
+    return rapid, rapid / g0_speed + feed_time
+
+
+def initial_z(parser, line_idx):
+    """
+    循環開始前的刀具 Z 高度 (G98 退回的初始點)：往前搜尋最近一個 G90 絕對座標的一般 Z 定位，
+    找不到或為增量座標時回傳 None。
+    """
+    base = max(0, line_idx - _INITIAL_Z_WINDOW)
+    letters, values, token_lines = lex_words(parser.nc_lines.text_range(base, line_idx), 'GZ', base)
+    g_lines = token_lines[letters == ord('G')]
+    g_vals = values[letters == ord('G')]
+    z_mask = letters == ord('Z')
+    for line, z in zip(token_lines[z_mask][::-1].tolist(), values[z_mask][::-1].tolist()):
+        if set(g_vals[g_lines == line].tolist()) & _NON_POSITION_G:
+            continue
+        return None if parser.incremental_at(line) else z
+    return None
+
+
+def _row_modes(parser, rec, rows):
+    """
+    各孔位單節 (含循環行) 原本的退刀模式；本體中不產生孔位的單節也有 G98 / G99 時回傳 None
+    (改寫後無法保持原本的模態變化)。回傳 (各單節模式列表, 循環結束時的模式)。
+    """
+    start, end = rec['line_index'], rec['end_line']
+    letters, values, token_lines = lex_words(parser.nc_lines.text_range(start + 1, end), 'G', start + 1)
+    mask = (values == 98) | (values == 99)
+    changes = dict(zip(token_lines[mask].tolist(), values[mask].tolist()))
+    if set(changes) - set(rows):
+        return None
+    mode = rec.get('retract_mode') or 'G98'
+    modes = []
+    for line in rows:
+        if line in changes:
+            mode = 'G98' if changes[line] == 98 else 'G99'
+        modes.append(mode)
+    return modes, mode
+
+
+def _split_code(line):
+    """單節拆為 (程式碼部分, 註解部分)，皆不含行尾。"""
+    line = line.rstrip('\r\n')
+    cut = min([i for i in (line.find('('), line.find(';')) if i >= 0], default=len(line))
+    return line[:cut], line[cut:]
+
+
+def _join(words, comment):
+    return " ".join(words + ([comment.strip()] if comment.strip() else [])) + "\n"
+
+
+def _set_retract_word(line, code=None):
+    """移除單節中的 G98 / G99 (註解除外)，code 不為 None 時於行首加上；沒有變更時原樣回傳。"""
+    body, comment = _split_code(line)
+    if code is None and not _RETRACT_WORD_RE.search(body):
+        return line
+    return _join(([code] if code else []) + _RETRACT_WORD_RE.sub('', body).split(), comment)
+
+
+def _set_word(line, letter, value):
+    """將單節中第一個 letter 位址字的值改為 value (沒有時加在行尾)，保留其餘位址字與註解。"""
+    body, comment = _split_code(line)
+    text = f"{letter}{round(value, 4):g}"
+    pattern = re.compile(letter + r'[ \t]*[-+]?(?:\d+\.?\d*|\.\d+)')
+    if pattern.search(body):
+        body = pattern.sub(lambda m: text, body, count=1)
+    else:
+        body = body + " " + text
+    return _join(body.split(), comment)
+
+
+def plan_retract(parser, data_index, stock_top, obstacles=(), init_z=None,
+                 r_clearance=DEFAULT_R_CLEARANCE, s_clearance=DEFAULT_S_CLEARANCE,
+                 obstacle_clearance=DEFAULT_OBSTACLE_CLEARANCE, obstacle_margin=DEFAULT_OBSTACLE_MARGIN,
+                 g0_speed=DEFAULT_G0_SPEED):
+    """
+    計算 tools_data[data_index] 的最佳退刀高度 (不修改程式)。
+
+    stock_top: 素材上面 Z (程式座標，見 stock_top_z)；init_z: 循環開始前的 Z (None 時往前搜尋)。
+    回傳 {'cycle_type', 'holes', 'R': (原, 新), 'S': (原, 新) (G83 為 None), 'initial_z',
+          'modes': 各孔位單節的 'G98' / 'G99', 'g98_rows', 'saved_distance' (mm), 'saved_time' (分鐘)}；
+    增量座標、孔位未知或孔深不足以容納安全高度時回傳 None。
+    """
+    rec = parser.tools_data[data_index]
+    if rec.get('end_line') is None or parser.incremental_at(rec['line_index']):
+        return None
+    mapped = parser.cycle_hole_rows(data_index)
+    holes = rec['holes']
+    if mapped is None or not len(holes) or np.isnan(holes).any():
+        return None
+    body_rows, body_reps, n_line_holes = mapped
+    rows = ([rec['line_index']] if n_line_holes else []) + body_rows
+    reps = np.r_[[n_line_holes] if n_line_holes else [], body_reps].astype(np.intp)
+
+    boxes = np.asarray(obstacles, dtype=np.float64).reshape(-1, 5)
+    boxes = boxes + np.array([-obstacle_margin, -obstacle_margin, obstacle_margin, obstacle_margin, 0.0])
+    point_need = _crossing_height(holes, holes, boxes).max() + obstacle_clearance
+    travel_need = _crossing_height(holes[:-1], holes[1:], boxes) + obstacle_clearance
+    # 每個單節的最後一孔之後的移動 (同一單節內 K 重複的孔之間亦須安全)
+    ends = np.cumsum(reps) - 1
+    hole_need = np.r_[travel_need, -np.inf]
+    row_need = np.maximum.reduceat(hole_need, ends - reps + 1) if len(reps) else hole_need[:0]
+
+    static, dynamic = rec.current_params()
+    old_r = static.get('R')
+    z_bottom = static.get('Z')
+    if old_r is None or z_bottom is None:
+        return None
+    floor = max(stock_top + r_clearance, point_need)
+
+    if rec['cycle_type'] == 'G66':
+        old_s = static.get('S') or old_r
+        new_s = stock_top + s_clearance
+        new_r = max(floor, new_s, row_need.max(initial=-np.inf))
+        if not dynamic or dynamic[0]['I'] >= new_s or z_bottom >= new_s:
+            return None
+        old_rapid, old_time = _g66_strokes(dynamic, old_r, old_s, g0_speed)
+        new_rapid, new_time = _g66_strokes(dynamic, new_r, new_s, g0_speed)
+        n = len(holes)
+        return {'cycle_type': 'G66', 'holes': int(n), 'R': (old_r, new_r), 'S': (old_s, new_s),
+                'initial_z': None, 'modes': None, 'g98_rows': 0,
+                'saved_distance': (old_rapid - new_rapid) * n, 'saved_time': (old_time - new_time) * n}
+
+    if z_bottom >= floor:
+        return None
+    modal = _row_modes(parser, rec, rows)
+    if modal is None:
+        return None
+    old_modes, _ = modal
+    z0 = init_z if init_z is not None else initial_z(parser, rec['line_index'])
+    feed = static.get('F') or 0.0
+    use_ijk = rec.get('use_ijk_mode', False)
+
+    def hole_cost(r):
+        runs = parser.peck_schedule(dict(static, R=r), use_ijk).runs()
+        return _g83_strokes(runs, feed, r, g0_speed)
+
+    def travel_cost(r, modes):
+        # G98 單節的每孔多出 退回初始點 + 下降回 R；初始點未知時兩者相同不列入比較
+        if z0 is None:
+            return 0.0
+        g98 = sum(int(k) for k, mode in zip(reps, modes) if mode == 'G98')
+        return g98 * 2 * max(z0 - r, 0.0)
+
+    def modes_for(r):
+        modes = []
+        for need, old in zip(row_need.tolist(), old_modes):
+            if need <= r:
+                modes.append('G99' if z0 is not None else old)
+            elif z0 is None:
+                if old != 'G98':
+                    return None
+                modes.append(old)  # 初始點未知：保留原本的 G98 (由操作者確認過的高度)
+            elif z0 >= need:
+                modes.append('G98')
+            else:
+                return None
+        return modes
+
+    n = int(reps.sum())
+    candidates = sorted({floor} | {v for v in row_need.tolist() if v > floor})
+    try:
+        costs = {r: hole_cost(r) for r in candidates + [old_r]}
+    except PeckLimitError:
+        return None  # 啄鑽遞減段超過展開上限
+    best = None
+    for r in candidates:
+        modes = modes_for(r)
+        if modes is None:
+            continue
+        rapid, time = costs[r]
+        dist = rapid * n + travel_cost(r, modes)
+        total = time * n + travel_cost(r, modes) / g0_speed
+        if best is None or total < best[0] - 1e-12:
+            best = (total, dist, r, modes)
+    if best is None:
+        return None
+    old_rapid, old_time = costs[old_r]
+    old_dist = old_rapid * n + travel_cost(old_r, old_modes)
+    old_total = old_time * n + travel_cost(old_r, old_modes) / g0_speed
+    total, dist, new_r, modes = best
+    return {'cycle_type': 'G83', 'holes': n, 'R': (old_r, new_r), 'S': None, 'initial_z': z0,
+            'modes': modes, 'g98_rows': modes.count('G98'),
+            'saved_distance': old_dist - dist, 'saved_time': old_total - total}
+
+
+def apply_retract(parser, data_index, plan):
+    """
+    將 plan_retract 的結果寫回程式：循環指令行只改寫 R (G66 另含 S)，其餘位址字保留；
+    G83 各孔位單節依計畫指定 G98 / G99，循環結束後恢復原本的退刀模態。
+    """
+    rec = parser.tools_data[data_index]
+    static, dynamic = rec.current_params()
+    start, end = rec['line_index'], rec['end_line']
+    new_static = dict(static, R=round(plan['R'][1], 4))
+    line = _set_word(parser.nc_lines[start], 'R', new_static['R'])
+    last = start + 1
+    if plan['cycle_type'] == 'G66':
+        new_static['S'] = round(plan['S'][1], 4)
+        line = _set_word(line, 'S', new_static['S'])
+        new_dynamic = [dict(g) for g in dynamic]
+    else:
+        body_rows, _, n_line_holes = parser.cycle_hole_rows(data_index)
+        rows = ([start] if n_line_holes else []) + body_rows
+        _, old_final = _row_modes(parser, rec, rows)
+        # 循環行明確指定其退刀模式，本體只在模式改變的單節指定
+        mode = plan['modes'][0] if n_line_holes else (rec.get('retract_mode') or 'G98')
+        line = _set_retract_word(line, mode)
+        for row, want in zip(body_rows, plan['modes'][1:] if n_line_holes else plan['modes']):
+            parser.nc_lines[row] = _set_retract_word(parser.nc_lines[row], want if want != mode else None)
+            mode = want
+        if mode != old_final and end < len(parser.nc_lines):
+            parser.nc_lines[end] = _set_retract_word(parser.nc_lines[end], old_final)
+            last = end + 1
+        else:
+            last = end
+        new_dynamic = parser._g83_to_ijk(new_static, 'G83', rec.get('use_ijk_mode', False))
+    parser.nc_lines[start] = line
+    rec['static_params'] = new_static
+    rec['dynamic_params'] = new_dynamic
+    rec['original_line'] = line.strip()
+    parser.reparse_lines(start, last)
+    return True
+
+
+def optimize_retract(parser, data_index, stock_top, obstacles=(), **options):
+    """plan_retract 後直接套用；回傳計畫 (無法最佳化或沒有節省時不修改程式，回傳 None / 計畫)。"""
+    plan = plan_retract(parser, data_index, stock_top, obstacles, **options)
+    if plan is not None and plan['saved_time'] > 1e-12:
+        apply_retract(parser, data_index, plan)
+    return plan
@@ -0,0 +1,281 @@
+"""
+孔位加工順序最佳化 (起點固定的開放路徑 TSP)。
+
+以最近鄰居法 (nearest neighbour) 建立初始路徑，再以 2-opt (反轉區段) 與 Or-opt
+(搬移 1~3 個連續孔位，可反向插入) 反覆改善，直到沒有可縮短路徑的移動為止。
+候選移動只考慮每個孔位的 _NEIGHBOURS 個最近鄰 (新的邊必連到近鄰)，每一回合以 NumPy
+一次計算所有候選移動的長度差，再依改善量由大到小逐一重新驗證後套用；
+只重新評估上一回合移動過的邊所連接的孔位 (don't-look bits)。
+距離為 XY 平面的直線距離 (與 nc_timing 的 G0 定位相同)。
+"""
+import math
+
+import numpy as np
+
+# 改善量小於此值 (mm) 視為沒有改善，避免浮點誤差造成無限循環
+_EPS = 1e-7
+# 每個孔位的候選近鄰數
+_NEIGHBOURS = 10
+# 計算近鄰時每次處理的列數 (限制距離矩陣的記憶體用量)
+_KNN_CHUNK = 512
+# 2-opt / Or-opt 交替改善的最大回合數
+_MAX_ROUNDS = 100
+_OR_OPT_SEGMENTS = (1, 2, 3)
+
+
+def path_length(points, order=None, start=None):
+    """依 order (預設為原順序) 經過各點的路徑長度；start 為起點 (None 時由第一點開始)。"""
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if order is not None:
+        pts = pts[np.asarray(order)]
+    if start is not None:
+        pts = np.vstack((np.asarray(start, dtype=np.float64).reshape(1, 2), pts))
+    if len(pts) < 2:
+        return 0.0
+    return float(np.hypot(*np.diff(pts, axis=0).T).sum())
+
+
+def _dist(a, b):
+    dx, dy = a[..., 0] - b[..., 0], a[..., 1] - b[..., 1]
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def _neighbours(xy, k):
+    """每個點的 k 個最近鄰 (不含自己)，依距離排序。"""
+    n = len(xy)
+    k = min(k, n - 1)
+    out = np.empty((n, k), dtype=np.intp)
+    for lo in range(0, n, _KNN_CHUNK):
+        hi = min(n, lo + _KNN_CHUNK)
+        d = _dist(xy[lo:hi, None, :], xy[None, :, :])
+        d[np.arange(hi - lo), np.arange(lo, hi)] = np.inf
+        part = np.argpartition(d, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(d, part, axis=1), axis=1)
+        out[lo:hi] = np.take_along_axis(part, order, axis=1)
+    return out
+
+
+def _nearest_neighbour(xy, nbrs, last):
+    """由第 0 點出發，每次前往最近的未造訪點 (先查近鄰表)；last 不為 None 時固定為終點。"""
+    n = len(xy)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    if last is not None:
+        visited[last] = True
+    nbr_list = nbrs.tolist()
+    route = [0]
+    cur = 0
+    for _ in range(n - 1 - (last is not None)):
+        nxt = next((c for c in nbr_list[cur] if not visited[c]), None)
+        if nxt is None:
+            d = _dist(xy, xy[cur])
+            d[visited] = np.inf
+            nxt = int(np.argmin(d))
+        visited[nxt] = True
+        route.append(nxt)
+        cur = nxt
+    if last is not None:
+        route.append(last)
+    return np.array(route, dtype=np.intp)
+
+
+class _Tour:
+    """路徑 (route[0] 固定；fixed_end 時 route[-1] 亦固定) 與各點所在位置。"""
+
+    def __init__(self, xy, route, fixed_end):
+        self.xy = xy
+        self.pts = xy.tolist()
+        self.route = route
+        self.pos = np.empty(len(route), dtype=np.intp)
+        self.pos[route] = np.arange(len(route))
+        self.fixed_end = fixed_end
+        self.dirty = np.ones(len(route), dtype=bool)  # 需要重新評估的孔位
+
+    def touch(self, *positions):
+        m = len(self.route)
+        for i in positions:
+            if 0 <= i < m:
+                self.dirty[self.route[i]] = True
+
+    def d(self, a, b):
+        pa, pb = self.pts[a], self.pts[b]
+        return math.hypot(pa[0] - pb[0], pa[1] - pb[1])
+
+    def reverse(self, x, y):
+        """反轉 route[x+1 .. y]。"""
+        seg = self.route[x + 1:y + 1][::-1].copy()
+        self.route[x + 1:y + 1] = seg
+        self.pos[seg] = np.arange(x + 1, y + 1)
+        self.touch(x, x + 1, y, y + 1)
+
+    def two_opt_delta(self, x, y):
+        """以 (route[x], route[y])、(route[x+1], route[y+1]) 取代原本兩條邊的長度差 (x < y)。"""
+        r, m = self.route, len(self.route)
+        if x < 0 or x + 1 >= y or y >= m or (self.fixed_end and y >= m - 1):
+            return 0.0
+        delta = self.d(r[x], r[y]) - self.d(r[x], r[x + 1])
+        if y + 1 < m:
+            delta += self.d(r[x + 1], r[y + 1]) - self.d(r[y], r[y + 1])
+        return delta
+
+    def move(self, i, seg, e, rev):
+        """將 route[i:i+seg] (rev 時反向) 移到邊 (route[e], route[e+1]) 之間 (e 為移除前的位置)。"""
+        r = self.route
+        self.touch(i - 1, i, i + seg - 1, i + seg, e, e + 1)
+        moved = r[i:i + seg][::-1] if rev else r[i:i + seg]
+        rest = np.r_[r[:i], r[i + seg:]]
+        at = e + 1 if e < i else e + 1 - seg
+        r[:] = np.r_[rest[:at], moved, rest[at:]]
+        lo = min(i, at)
+        hi = max(i + seg, at + seg)
+        self.pos[r[lo:hi]] = np.arange(lo, hi)
+
+    def or_opt_delta(self, i, seg, e):
+        """搬移 route[i:i+seg] 至邊 e 的長度差與是否反向；不合法的移動回傳 (0, False)。"""
+        r, m = self.route, len(self.route)
+        last_i = m - seg - (1 if self.fixed_end else 0)
+        if i < 1 or i > last_i or (i - 1 <= e <= i + seg - 1) or e < 0 or e > m - 1:
+            return 0.0, False
+        if e == m - 1 and (self.fixed_end or i + seg >= m):
+            return 0.0, False
+        first, last, prev = r[i], r[i + seg - 1], r[i - 1]
+        if i + seg < m:
+            nxt = r[i + seg]
+            gain = self.d(prev, first) + self.d(last, nxt) - self.d(prev, nxt)
+        else:
+            gain = self.d(prev, first)
+        u = r[e]
+        if e + 1 < m:
+            v = r[e + 1]
+            base = self.d(u, v)
+            fwd = self.d(u, first) + self.d(last, v) - base
+            rev = self.d(u, last) + self.d(first, v) - base
+        else:
+            fwd, rev = self.d(u, first), self.d(u, last)
+        if rev < fwd:
+            return rev - gain, True
+        return fwd - gain, False
+
+
+def _two_opt_round(tour, nbrs, active):
+    """active 孔位的所有近鄰候選 2-opt 移動一次計算，依改善量排序後逐一驗證套用。"""
+    route, pos, xy = tour.route, tour.pos, tour.xy
+    m = len(route)
+    P = np.vstack((xy[route], [[np.nan, np.nan]]))  # 尾端哨兵：開放終點沒有後續邊
+    nodes = np.flatnonzero(active)
+    q = pos[nbrs[nodes]]
+    p = np.broadcast_to(pos[nodes][:, None], q.shape)
+    lo, hi = np.minimum(p, q), np.maximum(p, q)
+    cands = []
+    for shift in (0, 1):  # (x, y) 為兩點後方的邊或前方的邊
+        x, y = (lo - shift).ravel(), (hi - shift).ravel()
+        ok = (x >= 0) & (x + 1 < y) & (y < (m - 1 if tour.fixed_end else m))
+        x, y = x[ok], y[ok]
+        delta = _dist(P[x], P[y]) - _dist(P[x], P[x + 1])
+        tail = y + 1 < m
+        delta += np.where(tail, _dist(P[x + 1], P[np.minimum(y + 1, m)]) - _dist(P[y], P[np.minimum(y + 1, m)]), 0.0)
+        good = delta < -_EPS
+        cands.append((delta[good], route[x[good]], route[y[good]]))
+    delta = np.concatenate([c[0] for c in cands])
+    if not len(delta):
+        return False
+    a_nodes = np.concatenate([c[1] for c in cands])
+    b_nodes = np.concatenate([c[2] for c in cands])
+    improved = False
+    for k in np.argsort(delta, kind='stable').tolist():
+        # 以節點重新定位 (先前的移動可能已改變位置)
+        x, y = int(pos[a_nodes[k]]), int(pos[b_nodes[k]])
+        if x > y:
+            continue
+        if tour.two_opt_delta(x, y) < -_EPS:
+            tour.reverse(x, y)
+            improved = True
+    return improved
+
+
+def _or_opt_round(tour, nbrs, seg, active):
+    """長度 seg 的區段 (首或尾為 active 孔位) 搬移至其首尾點近鄰旁的邊，一次計算後逐一驗證套用。"""
+    route, pos, xy = tour.route, tour.pos, tour.xy
+    m = len(route)
+    last_i = m - seg - (1 if tour.fixed_end else 0)
+    if last_i < 1:
+        return False
+    i = np.arange(1, last_i + 1)
+    i = i[active[route[i]] | active[route[i + seg - 1]]]
+    if not len(i):
+        return False
+    P = np.vstack((xy[route], [[np.nan, np.nan]]))
+    first, last, prev = P[i], P[i + seg - 1], P[i - 1]
+    nxt = P[np.minimum(i + seg, m)]
+    has_next = i + seg < m
+    gain = _dist(prev, first) + np.where(has_next, _dist(last, nxt) - _dist(prev, nxt), 0.0)
+
+    # 候選邊：區段首尾點近鄰的前後邊
+    near = np.concatenate((pos[nbrs[route[i]]], pos[nbrs[route[i + seg - 1]]]), axis=1)
+    e = np.concatenate((near, near - 1), axis=1)
+    ii = np.broadcast_to(i[:, None], e.shape)
+    ok = (e >= 0) & ((e < ii - 1) | (e > ii + seg - 1))
+    ok &= (e < m - 1) | ((e == m - 1) & (ii + seg < m) & (not tour.fixed_end))
+    u, v = P[np.minimum(np.maximum(e, 0), m)], P[np.minimum(e + 1, m)]
+    f, l = first[:, None, :], last[:, None, :]
+    has_v = e + 1 < m
+    base = np.where(has_v, _dist(u, v), 0.0)
+    fwd = _dist(u, f) + np.where(has_v, _dist(l, v), 0.0) - base
+    rev = _dist(u, l) + np.where(has_v, _dist(f, v), 0.0) - base
+    delta = np.minimum(fwd, rev) - gain[:, None]
+    good = ok & (delta < -_EPS)
+    if not good.any():
+        return False
+    rows, cols = np.nonzero(good)
+    order = np.argsort(delta[rows, cols], kind='stable')
+    seg_nodes = route[i[rows[order]]]
+    edge_nodes = route[e[rows[order], cols[order]]]
+    improved = False
+    for s_node, e_node in zip(seg_nodes.tolist(), edge_nodes.tolist()):
+        si, ei = int(pos[s_node]), int(pos[e_node])
+        d, rev_flag = tour.or_opt_delta(si, seg, ei)
+        if d < -_EPS:
+            tour.move(si, seg, ei, rev_flag)
+            improved = True
+    return improved
+
+
+def optimize_order(points, start=None, fixed_end=False):
+    """
+    最佳化經過 points ((N, 2)) 的順序，回傳索引排列 (np.intp 陣列)。
+
+    start: 起點座標 (如循環開始前的刀具位置)；None 時 points[0] 固定為第一點。
+    fixed_end: True 時 points[-1] 固定為最後一點 (循環結束後的位置會影響後續單節時)。
+    結果不比原順序短時回傳原順序。
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(pts)
+    original = np.arange(n, dtype=np.intp)
+    if n < (2 if start is not None else 3):
+        return original
+    if start is not None:
+        xy = np.vstack((np.asarray(start, dtype=np.float64).reshape(1, 2), pts))
+        offset = 1
+    else:
+        xy = pts
+        offset = 0
+    nbrs = _neighbours(xy, _NEIGHBOURS)
+    last = len(xy) - 1 if fixed_end else None
+    tour = _Tour(xy, _nearest_neighbour(xy, nbrs, last), fixed_end)
+    verified = False
+    for _ in range(_MAX_ROUNDS):
+        if not tour.dirty.any():
+            if verified:
+                break
+            # 局部收斂後再完整檢查一次全部孔位，仍有改善時繼續
+            tour.dirty[:] = True
+        verified = tour.dirty.all()
+        active = tour.dirty
+        tour.dirty = np.zeros_like(active)
+        _two_opt_round(tour, nbrs, active)
+        for seg in _OR_OPT_SEGMENTS:
+            _or_opt_round(tour, nbrs, seg, active | tour.dirty)
+    order = tour.route[offset:] - offset
+    if path_length(pts, order, start) >= path_length(pts, original, start) - _EPS:
+        return original
+    return order
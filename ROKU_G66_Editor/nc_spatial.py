@@ -0,0 +1,247 @@
+"""
+整份程式孔位的空間索引 (均勻網格)。
+
+所有循環的孔位 (CycleRecord.holes) 依所在網格的 cell 鍵排序成一個陣列，
+查詢某個 cell 內的孔位以二分搜尋 (np.searchsorted) 取得連續區段，單次查詢為 O(log n)。
+提供：同刀號重複加工的孔位、不同刀號在同一 XY 的加工鏈 (中心鑽 → 鑽頭 → 倒角)、
+最近鄰與半徑查詢。
+"""
+import math
+
+import numpy as np
+
+# 預設的同位置容許誤差 (mm)
+DEFAULT_TOLERANCE = 1e-3
+# 每個 cell 平均的孔數 (決定網格大小)
+_POINTS_PER_CELL = 2.0
+# cell 鍵中 y 佔用的位元數 (cell 座標加上 2^30 的偏移後為非負整數)
+_KEY_BITS = 31
+# 配對查詢的最小 cell 大小 (mm)，避免 cell 座標超出鍵的範圍
+_MIN_TOLERANCE = 1e-6
+
+
+def _cell_keys(cells):
+    """(N, 2) 的整數 cell 座標合併為單一 int64 鍵 (依 x 再依 y 排序)。"""
+    return (cells[:, 0] << _KEY_BITS) + cells[:, 1]
+
+
+class _Grid:
+    """cell 大小為 size 的均勻網格；order 為依 cell 鍵排序後的孔位索引。"""
+
+    def __init__(self, xy, size):
+        self.size = float(size)
+        self.origin = xy.min(axis=0) if len(xy) else np.zeros(2)
+        self.cells = self.cell_of(xy)
+        self.cell_min = self.cells.min(axis=0) if len(xy) else np.zeros(2, dtype=np.int64)
+        self.cell_max = self.cells.max(axis=0) if len(xy) else np.zeros(2, dtype=np.int64)
+        keys = _cell_keys(self.cells)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def cell_of(self, xy):
+        return np.floor((np.asarray(xy, dtype=np.float64) - self.origin) / self.size).astype(np.int64) + (1 << (_KEY_BITS - 1))
+
+    def ranges(self, cells):
+        """各 cell 在排序後陣列中的 [lo, hi) 區段。"""
+        keys = _cell_keys(np.asarray(cells, dtype=np.int64).reshape(-1, 2))
+        return np.searchsorted(self.keys, keys, 'left'), np.searchsorted(self.keys, keys, 'right')
+
+
+class HoleIndex:
+    """
+    已解析程式 (RokuNCParser) 所有孔位的空間索引。
+
+        xy:     (N, 2) 孔位座標
+        cycle:  各孔所屬循環在 tools_data 中的索引
+        hole:   各孔在該循環 holes 中的索引
+        tool_code: 各孔的刀號在 tool_names 中的索引
+    """
+
+    def __init__(self, tools_data):
+        self.records = list(tools_data)
+        parts, cycles, holes = [], [], []
+        for i, rec in enumerate(self.records):
+            pts = rec.holes if 'holes' in rec else None
+            if pts is None or not len(pts):
+                continue
+            pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+            parts.append(pts)
+            cycles.append(np.full(len(pts), i, dtype=np.intp))
+            holes.append(np.arange(len(pts), dtype=np.intp))
+        self.xy = np.concatenate(parts) if parts else np.empty((0, 2))
+        self.cycle = np.concatenate(cycles) if cycles else np.empty(0, dtype=np.intp)
+        self.hole = np.concatenate(holes) if holes else np.empty(0, dtype=np.intp)
+        # 座標未知 (NaN) 的孔位不列入索引
+        valid = np.isfinite(self.xy).all(axis=1)
+        self.xy, self.cycle, self.hole = self.xy[valid], self.cycle[valid], self.hole[valid]
+        tool_names = [rec.tool_id for rec in self.records]
+        self.tool_names = list(dict.fromkeys(tool_names))  # 依第一次出現的順序
+        codes = {name: k for k, name in enumerate(self.tool_names)}
+        self.tool_code = np.array([codes[name] for name in tool_names], dtype=np.intp)[self.cycle] \
+            if len(self.cycle) else np.empty(0, dtype=np.intp)
+        self._grid = _Grid(self.xy, self._cell_size())
+
+    def __len__(self):
+        return len(self.xy)
+
+    def _cell_size(self):
+        n = len(self.xy)
+        if n < 2:
+            return 1.0
+        span = self.xy.max(axis=0) - self.xy.min(axis=0)
+        # 孔位排成一直線時面積趨近 0，改以最長邊平均分配
+        size = max(math.sqrt(span[0] * span[1] * _POINTS_PER_CELL / n), float(span.max()) * _POINTS_PER_CELL / n)
+        return max(size, _MIN_TOLERANCE)
+
+    def location(self, i):
+        """第 i 個孔的 (循環索引, 循環內孔號)。"""
+        return int(self.cycle[i]), int(self.hole[i])
+
+    # ---- 點查詢 ----
+
+    def within(self, x, y, radius):
+        """與 (x, y) 距離不超過 radius 的孔位索引 (依距離排序)。"""
+        grid = self._grid
+        c0 = grid.cell_of(np.array([[x - radius, y - radius]]))[0]
+        c1 = grid.cell_of(np.array([[x + radius, y + radius]]))[0]
+        found = []
+        for cx in range(int(c0[0]), int(c1[0]) + 1):
+            # 同一個 x 的連續 cell 在排序後的鍵中相鄰，一次取得整列
+            lo = np.searchsorted(grid.keys, (cx << _KEY_BITS) + int(c0[1]), 'left')
+            hi = np.searchsorted(grid.keys, (cx << _KEY_BITS) + int(c1[1]), 'right')
+            if hi > lo:
+                found.append(grid.order[lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        idx = np.concatenate(found)
+        d = np.hypot(self.xy[idx, 0] - x, self.xy[idx, 1] - y)
+        keep = d <= radius
+        return idx[keep][np.argsort(d[keep], kind='stable')]
+
+    def nearest(self, x, y, k=1, exclude=()):
+        """
+        (x, y) 最近的 k 個孔位，回傳 (索引陣列, 距離陣列)，依距離排序。
+        由所在 cell 向外逐圈搜尋，直到第 k 近的距離小於尚未搜尋的範圍；exclude 為要略過的孔位索引。
+        """
+        n = len(self.xy)
+        exclude = set(int(i) for i in np.atleast_1d(exclude).tolist())
+        k = min(k, n - len(exclude))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        grid = self._grid
+        center = grid.cell_of(np.array([[x, y]]))[0]
+        max_ring = int(max(np.abs(center - grid.cell_min).max(), np.abs(center - grid.cell_max).max()))
+        cand = []
+        ring = 0
+        while True:
+            if ring == 0:
+                cells = [center]
+            else:
+                rng = np.arange(-ring, ring + 1)
+                side = np.full(len(rng), ring)
+                cells = np.concatenate([
+                    np.column_stack((center[0] - side, center[1] + rng)),
+                    np.column_stack((center[0] + side, center[1] + rng)),
+                    np.column_stack((center[0] + rng[1:-1], center[1] - side[1:-1])),
+                    np.column_stack((center[0] + rng[1:-1], center[1] + side[1:-1])),
+                ])
+            lo, hi = grid.ranges(cells)
+            for a, b in zip(lo.tolist(), hi.tolist()):
+                cand.extend(grid.order[a:b].tolist())
+            pts = [i for i in cand if i not in exclude]
+            # 已搜尋範圍 (ring 圈) 之外的孔位距離至少為 ring * size
+            if len(pts) >= k or ring >= max_ring:
+                idx = np.array(pts, dtype=np.intp)
+                d = np.hypot(self.xy[idx, 0] - x, self.xy[idx, 1] - y)
+                order = np.argsort(d, kind='stable')[:k]
+                if ring >= max_ring or d[order[-1]] <= ring * grid.size:
+                    return idx[order], d[order]
+            ring += 1
+
+    # ---- 整體查詢 ----
+
+    def close_pairs(self, tolerance=DEFAULT_TOLERANCE):
+        """距離不超過 tolerance 的所有孔位配對 (i < j)，回傳 (N, 2) 索引陣列。"""
+        n = len(self.xy)
+        if n < 2:
+            return np.empty((0, 2), dtype=np.intp)
+        grid = _Grid(self.xy, max(tolerance, _MIN_TOLERANCE))
+        cells = grid.cells[grid.order]
+        pairs = []
+        # 每個 cell 只與自己及「右、右上、上、右下」相鄰的 cell 比對，每對只比一次
+        for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+            lo, hi = grid.ranges(cells + (dx, dy))
+            if dx == 0 and dy == 0:
+                lo = np.arange(1, n + 1)  # 同一 cell 內只取排序後位置較大的
+            count = np.maximum(hi - lo, 0)
+            if not count.any():
+                continue
+            a = np.repeat(np.arange(n), count)
+            offsets = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+            b = lo[a] + offsets
+            pairs.append(np.column_stack((grid.order[a], grid.order[b])))
+        if not pairs:
+            return np.empty((0, 2), dtype=np.intp)
+        pairs = np.concatenate(pairs)
+        d = np.hypot(*(self.xy[pairs[:, 0]] - self.xy[pairs[:, 1]]).T)
+        pairs = np.sort(pairs[d <= tolerance], axis=1)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+    def _groups(self, pairs):
+        """配對的連通分量 (union-find)，回傳孔位索引列表的列表 (各組依孔位順序排列)。"""
+        parent = {}
+
+        def find(i):
+            root = i
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while parent.get(i, i) != root:
+                parent[i], i = root, parent[i]
+            return root
+
+        for a, b in pairs.tolist():
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+        groups = {}
+        for i in sorted(set(pairs.ravel().tolist())):
+            groups.setdefault(find(i), []).append(i)
+        return list(groups.values())
+
+    def duplicates(self, tolerance=DEFAULT_TOLERANCE):
+        """
+        同一刀號重複加工的孔位。回傳
+        [{'tool_id', 'xy': (x, y), 'holes': [(循環索引, 孔號), ...]}, ...] (依第一次加工順序)。
+        """
+        pairs = self.close_pairs(tolerance)
+        pairs = pairs[self.tool_code[pairs[:, 0]] == self.tool_code[pairs[:, 1]]]
+        out = []
+        for group in self._groups(pairs):
+            out.append({'tool_id': self.tool_names[self.tool_code[group[0]]],
+                        'xy': tuple(self.xy[group[0]].tolist()),
+                        'holes': [self.location(i) for i in group]})
+        return out
+
+    def tool_chains(self, tolerance=DEFAULT_TOLERANCE):
+        """
+        不同刀號在同一 XY 加工的孔位 (如中心鑽 → 鑽頭 → 倒角)。回傳
+        [{'xy': (x, y), 'tools': [依加工順序的刀號], 'holes': [(循環索引, 孔號), ...]}, ...]。
+        """
+        pairs = self.close_pairs(tolerance)
+        out = []
+        for group in self._groups(pairs):
+            codes = self.tool_code[group]
+            if len(set(codes.tolist())) < 2:
+                continue
+            out.append({'xy': tuple(self.xy[group[0]].tolist()),
+                        'tools': [self.tool_names[c] for c in codes.tolist()],
+                        'holes': [self.location(i) for i in group]})
+        return out
+
+    def chain_summary(self, tolerance=DEFAULT_TOLERANCE):
+        """tool_chains 依刀號順序統計：{('5', '1'): 孔數, ...}。"""
+        summary = {}
+        for chain in self.tool_chains(tolerance):
+            key = tuple(chain['tools'])
+            summary[key] = summary.get(key, 0) + 1
+        return summary
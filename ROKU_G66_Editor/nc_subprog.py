@@ -0,0 +1,283 @@
+"""
+子程式呼叫 (M98 / M99、G65) 的展開：孔數與加工時間乘上呼叫次數，不展開程式文字。
+
+檔案依 O 號分成多個程式 (第一個程式為主程式)；M98 P__ L__ (或 P 超過四位數時前面為重複次數)
+與 G65 P__ L__ 呼叫同一檔案或子程式資料夾 (檔名為 O1234 / 1234，副檔名不限) 內的程式。
+每個程式只解析並以 nc_timing 計算一次「單獨執行一次」的時間與孔數，依呼叫圖由下而上
+乘以呼叫次數累加 (每個程式與呼叫各處理一次，巢狀深度不影響計算量)。
+
+子程式內第一個 T 字之前的時間與孔數歸於呼叫端當時的刀號。鑽孔巨集 (G66 / G65 P9131)
+由循環模型計時，不展開：找得到 O9131 本體時以 nc_macro 直譯計時，否則使用近似模型。
+遞迴呼叫與找不到的程式不計入，另外回報。
+"""
+import os
+import re
+
+import numpy as np
+
+from nc_lexer import lex_words, words_per_line
+from nc_macro import compile_macro, MacroError
+from nc_parser import RokuNCParser
+from nc_timing import (estimate_range_time, summarize_tools, CALLER_TOOL,
+                       DEFAULT_G0_SPEED, DEFAULT_TOOL_CHANGE_SEC)
+
+# 由循環模型計時的鑽孔巨集，呼叫時不展開
+_CYCLE_MACROS = frozenset((9131,))
+# 子程式資料夾內的檔名：O1234、O1234.nc、1234.tap 等 (不分大小寫)
+_LIBRARY_NAME_RE = re.compile(r'^O?(\d+)(?:\.[^.]*)?$', re.I)
+_WINDOW_LINES = 1 << 16
+_SUM_KEYS = ('rapid_time', 'feed_time', 'cycle_time', 'dwell_time', 'tool_change_time', 'tool_changes', 'holes')
+
+
+def _call_target(code, p, l):
+    """呼叫單節的 (程式號, 次數)：M98 省略 L 且 P 超過四位數時，前面的位數為重複次數。"""
+    if l == l:
+        return int(p), int(l)
+    if code == 'M98' and p > 9999:
+        return int(p) % 10000, int(p) // 10000
+    return int(p), 1
+
+
+class _Program:
+    """
+    檔案中一個程式 (O 號) 的行範圍、範圍內的循環紀錄 (records)
+    與其中的呼叫 [(行號, 程式號, 次數, 呼叫時的刀號), ...]。
+    """
+    __slots__ = ('number', 'parser', 'start', 'end', 'records', 'calls')
+
+    def __init__(self, number, parser, start, end, records):
+        self.number = number
+        self.parser = parser
+        self.start = start
+        self.end = end
+        self.records = records
+        self.calls = []
+
+
+def split_programs(parser, default_number=None):
+    """
+    依 O 號將已解析的檔案分成多個 _Program (依行號排序)。
+    第一個 O 號之前的行併入第一個程式；沒有 O 號時整個檔案為 default_number 一個程式。
+    """
+    lines = parser.nc_lines
+    n = len(lines)
+    headers, calls, tools = [], [], []
+    for lo in range(0, n, _WINDOW_LINES):
+        hi = min(n, lo + _WINDOW_LINES)
+        letters, values, token_lines = lex_words(lines.text_range(lo, hi), 'GLMOPT', lo)
+        if not len(token_lines):
+            continue
+        rows = np.unique(token_lines)
+        word = {a: words_per_line(letters, values, token_lines, a, rows) for a in 'LOPT'}
+        g_lines = token_lines[letters == 71]
+        g_vals = values[letters == 71]
+        m_lines = token_lines[(letters == 77) & (values == 98.0)]
+        g65 = np.isin(rows, g_lines[g_vals == 65.0])
+        m98 = np.isin(rows, m_lines)
+        # G65 / G66 單節的 T 是宏引數，不是刀號 (與 RokuNCParser 相同)
+        macro = g65 | np.isin(rows, g_lines[g_vals == 66.0])
+        # 程式號必須是單節的第一個字 (宏程式的 DO1 / GOTO 90 不是 O 號)
+        has_o = ~np.isnan(word['O'])
+        headers.extend((row, number) for row, number in
+                       zip(rows[has_o].tolist(), word['O'][has_o].astype(np.int64).tolist())
+                       if lines[row].lstrip().upper().startswith('O'))
+        is_call = (g65 | m98) & ~np.isnan(word['P'])
+        for row, p, l, is_m98 in zip(rows[is_call].tolist(), word['P'][is_call].tolist(),
+                                     word['L'][is_call].tolist(), m98[is_call].tolist()):
+            calls.append((row,) + _call_target('M98' if is_m98 else 'G65', p, l))
+        has_t = ~np.isnan(word['T']) & ~macro
+        tools.extend(zip(rows[has_t].tolist(), word['T'][has_t].astype(np.int64).tolist()))
+
+    if not headers or headers[0][0] != 0:
+        first = headers[0][1] if headers else default_number
+        headers.insert(0, (0, first))
+        if len(headers) > 1 and headers[1][1] == first:
+            del headers[1]
+    programs = []
+    rec_lines = np.array([rec.line_index for rec in parser.tools_data], dtype=np.int64)
+    bounds = np.searchsorted(rec_lines, [line for line, _ in headers] + [n]).tolist()
+    for i, (line, number) in enumerate(headers):
+        end = headers[i + 1][0] if i + 1 < len(headers) else n
+        programs.append(_Program(number, parser, line, end, parser.tools_data[bounds[i]:bounds[i + 1]]))
+
+    starts = [prog.start for prog in programs]
+    tool_lines = np.array([t[0] for t in tools], dtype=np.int64)
+    for row, target, count in calls:
+        prog = programs[int(np.searchsorted(starts, row, 'right')) - 1]
+        k = int(np.searchsorted(tool_lines, row, 'right')) - 1
+        tool_id = str(tools[k][1]) if k >= 0 and tool_lines[k] >= prog.start else CALLER_TOOL
+        prog.calls.append((row, target, count, tool_id))
+    return programs
+
+
+class _Library:
+    """依程式號尋找子程式：先找主檔案，再找子程式資料夾 (每個檔案只解析一次)。"""
+
+    def __init__(self, programs, library_dir=None, cache=None):
+        self.programs = {}
+        self.library_dir = library_dir
+        self.cache = cache
+        self.parsers = []
+        self._files = None
+        for prog in programs:
+            self.programs.setdefault(prog.number, prog)
+
+    def _library_files(self):
+        if self._files is None:
+            self._files = {}
+            if self.library_dir and os.path.isdir(self.library_dir):
+                for name in sorted(os.listdir(self.library_dir)):
+                    m = _LIBRARY_NAME_RE.match(name)
+                    path = os.path.join(self.library_dir, name)
+                    if m and os.path.isfile(path):
+                        self._files.setdefault(int(m.group(1)), path)
+        return self._files
+
+    def find(self, number):
+        prog = self.programs.get(number)
+        if prog is None:
+            path = self._library_files().pop(number, None)
+            if path is None:
+                return None
+            parser = RokuNCParser(cache=self.cache)
+            parser.parse_file(path, workers=1)
+            self.parsers.append(parser)
+            for sub in split_programs(parser, number):
+                self.programs.setdefault(sub.number, sub)
+            prog = self.programs.get(number)
+        return prog
+
+    def close(self):
+        for parser in self.parsers:
+            parser.close()
+
+
+def _add_tools(acc, tools, factor, caller_tool):
+    """acc += tools × factor；CALLER_TOOL 的部分歸於 caller_tool。"""
+    for tool_id, entry in tools.items():
+        key = caller_tool if tool_id == CALLER_TOOL else tool_id
+        dst = acc.get(key)
+        if dst is None:
+            dst = acc[key] = dict.fromkeys(_SUM_KEYS, 0)
+        for k in _SUM_KEYS:
+            dst[k] += entry[k] * factor
+
+
+def _load_macros(library, variables):
+    """鑽孔巨集本體 (同一檔案或子程式資料夾)，回傳 ({程式號: MacroProgram}, 無法編譯的程式號)。"""
+    macros, errors = {}, []
+    for number in sorted(_CYCLE_MACROS):
+        prog = library.find(number)
+        if prog is None:
+            continue
+        lines = [prog.parser.nc_lines[i] for i in range(prog.start, prog.end)]
+        try:
+            macros[number] = compile_macro(lines, number, variables)
+        except MacroError:
+            errors.append(number)
+    return macros, errors
+
+
+def expand_program_time(parser, library_dir=None, g0_speed=DEFAULT_G0_SPEED,
+                        tool_change_sec=DEFAULT_TOOL_CHANGE_SEC, cache=None, macro_variables=None):
+    """
+    展開子程式呼叫後的整份程式加工時間與孔數 (分鐘)。
+
+    回傳 estimate_program_time 的所有欄位 (乘上呼叫次數後)，另外加上：
+        'programs':   {程式號: 執行次數} (主程式為 1)
+        'calls':      展開後的子程式呼叫總次數
+        'unresolved': 找不到的程式號 (排序)
+        'recursive':  形成遞迴而略過的程式號 (排序)
+        'macros':     以宏程式本體計時的鑽孔巨集號；'macro_errors': 無法編譯的鑽孔巨集號
+    檔案只有一個程式且沒有子程式呼叫時與 estimate_program_time 相同。
+    cache 為 ParseCache (可選)，用於解析子程式資料夾中的檔案；
+    macro_variables 為宏程式的共用變數 {變數號: 值} (如 #953)。
+    """
+    if g0_speed <= 0:
+        raise ValueError("g0_speed must be positive")
+    programs = split_programs(parser)
+    library = _Library(programs, library_dir, cache)
+    try:
+        called = {target for prog in programs for _, target, _, _ in prog.calls}
+        # 主流程：第一個程式與檔案中未被呼叫的程式 (依序執行一次，與未展開時相同)
+        roots = [prog for i, prog in enumerate(programs)
+                 if i == 0 or (prog.number not in called and prog.number not in _CYCLE_MACROS)]
+        macros, macro_errors = _load_macros(library, macro_variables)
+
+        own = {}        # id(_Program) -> (單獨執行一次的 {刀號: 累計}, unknown_moves)
+        order = []      # 後序 (被呼叫的程式在前)
+        edges = {}      # id(_Program) -> [(子程式, 次數, 呼叫時的刀號), ...]
+        unresolved, recursive = set(), set()
+        state = {}      # id -> 1 走訪中 / 2 完成
+        for root in roots:
+            stack = [(root, iter(root.calls))]
+            state[id(root)] = 1
+            edges[id(root)] = []
+            while stack:
+                prog, it = stack[-1]
+                for _, target, count, tool_id in it:
+                    if target in _CYCLE_MACROS or count <= 0:
+                        continue
+                    sub = library.find(target)
+                    if sub is None:
+                        unresolved.add(target)
+                        continue
+                    mark = state.get(id(sub))
+                    if mark == 1:
+                        recursive.add(target)
+                        continue
+                    edges[id(prog)].append((sub, count, tool_id))
+                    if mark is None:
+                        state[id(sub)] = 1
+                        edges[id(sub)] = []
+                        stack.append((sub, iter(sub.calls)))
+                        break
+                else:
+                    stack.pop()
+                    state[id(prog)] = 2
+                    order.append(prog)
+
+        for prog in order:
+            # 主程式開頭的刀號依 parser 的判斷 (與 estimate_program_time 相同)
+            own[id(prog)] = estimate_range_time(prog.parser, prog.start, prog.end, g0_speed, tool_change_sec,
+                                                caller_tool=prog is not roots[0], tools_data=prog.records,
+                                                macros=macros)
+
+        # 由下而上：每個程式含其子程式的總計 (CALLER_TOOL 保留至上層決定)
+        total = {}
+        for prog in order:
+            tools, unknown = own[id(prog)]
+            acc = {}
+            _add_tools(acc, tools, 1, CALLER_TOOL)
+            calls = 0
+            for sub, count, tool_id in edges[id(prog)]:
+                sub_tools, sub_unknown, sub_calls = total[id(sub)]
+                _add_tools(acc, sub_tools, count, tool_id)
+                unknown += sub_unknown * count
+                calls += (sub_calls + 1) * count
+            total[id(prog)] = (acc, unknown, calls)
+
+        # 由上而下：各程式的執行次數
+        executions = {id(root): 1 for root in roots}
+        for prog in reversed(order):
+            for sub, count, _ in edges[id(prog)]:
+                executions[id(sub)] = executions.get(id(sub), 0) + executions.get(id(prog), 0) * count
+
+        result_tools, unknown_moves, n_calls = {}, 0, 0
+        for root in roots:
+            tools, unknown, calls = total[id(root)]
+            _add_tools(result_tools, tools, 1, "Unknown")
+            unknown_moves += unknown
+            n_calls += calls
+        result = summarize_tools(result_tools, unknown_moves)
+        result['programs'] = {}
+        for prog in order:
+            result['programs'][prog.number] = result['programs'].get(prog.number, 0) + executions.get(id(prog), 0)
+        result['calls'] = n_calls
+        result['unresolved'] = sorted(unresolved)
+        result['recursive'] = sorted(recursive)
+        result['macros'] = sorted(macros)
+        result['macro_errors'] = macro_errors
+        return result
+    finally:
+        library.close()
@@ -0,0 +1,440 @@
+"""
+整份程式的加工時間預估 (報價、排程用)。
+
+以 nc_lexer.lex_words 向量化切分所有單節的位址字，再以 NumPy 一次計算整段程式：
+各軸絕對位置 (G90/G91、G28 之後位置未知、G92 設定)、G0 快速位移與 G1/G2/G3 進給的
+移動長度 (圓弧依 I/J/K 或 R 計算，含螺旋插補的第三軸)，除以速度得到時間；
+G04 暫停與 M06 換刀另外累計。鑽孔循環 (parser.tools_data) 的單孔時間由
+DrillingAnalysisEngine 計算後乘以孔數，孔與孔之間以 G0 沿 cycle.holes 路徑定位；
+有提供宏程式本體 (macros) 時，G66 的單孔時間改由 nc_macro 直譯宏程式計算。
+
+時間單位皆為分鐘。G95 每轉進給、加減速與未解析的固定循環 (G81 等) 不列入計算。
+"""
+import math
+
+import numpy as np
+
+from analysis_engine import DrillingAnalysisEngine
+from nc_lexer import lex_words, words_per_line, tokenize_block
+from nc_macro import macro_arguments, MacroError
+from nc_modal import NO_HOLES
+from nc_peck import PeckSchedule, PeckLimitError
+
+# 與主視窗「機台快速位移速度」的預設值相同 (mm/min)
+DEFAULT_G0_SPEED = 5000.0
+# 每次 M06 換刀的時間 (秒)
+DEFAULT_TOOL_CHANGE_SEC = 6.0
+
+# 每次處理的行數 (限制暫存陣列的記憶體用量)，視窗之間延續模態狀態
+_WINDOW_LINES = 1 << 16
+_LETTERS = 'FGIJKMPRTXYZ'
+
+# G17 / G18 / G19：圓弧平面的 (第一軸, 第二軸, 垂直軸) 與圓心偏移位址
+_PLANE_AXES = {17: (0, 1, 2), 18: (2, 0, 1), 19: (1, 2, 0)}
+_PLANE_OFFSETS = {17: ('I', 'J'), 18: ('K', 'I'), 19: ('J', 'K')}
+
+_TIME_KEYS = ('rapid_time', 'feed_time', 'cycle_time', 'dwell_time', 'tool_change_time')
+
+# 子程式內第一個 T 字之前的時間歸屬：執行時為呼叫端當時的刀號
+CALLER_TOOL = "<caller>"
+_CALLER_CODE = -2.0
+
+
+class _MachineState:
+    """視窗之間延續的模態狀態。"""
+    __slots__ = ('pos', 'incremental', 'motion', 'plane', 'feed', 'tool')
+
+    def __init__(self):
+        self.pos = np.full(3, np.nan)  # XYZ 工件座標，程式開頭未知
+        self.incremental = False
+        self.motion = 0     # G0~G3
+        self.plane = 17
+        self.feed = np.nan
+        self.tool = -1.0    # 刀號 (-1 為 Unknown，與 parser 相同)
+
+
+def _fill_forward(values, start):
+    """NaN 沿用前一個有值的元素 (第一個有值元素之前為 start)。"""
+    idx = np.where(np.isnan(values), -1, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], start)
+
+
+def _resolve_axis(vals, given, incremental, absolute, start):
+    """
+    單軸各單節結束時的位置：absolute 的單節 (G90、G92、G28) 直接指定 vals，
+    其餘指定的單節在 G91 下累加；未指定的單節沿用前一位置。
+    """
+    steps = np.where(given & ~absolute, vals, 0.0)
+    csum = np.cumsum(steps)
+    last = np.where(absolute, np.arange(len(vals)), -1)
+    np.maximum.accumulate(last, out=last)
+    k = np.maximum(last, 0)
+    base = np.where(last >= 0, vals[k] - csum[k], start)
+    return base + csum
+
+
+def _arc_lengths(delta, mode, offsets, radius):
+    """
+    平面上的圓弧長度 (含垂直軸的螺旋長度)。delta 為 (N, 3) 位移 (第一軸, 第二軸, 垂直軸)，
+    offsets 為起點至圓心的偏移 (I/J 格式，未指定為 NaN)，radius 為 R 格式 (負值為大於 180 度)。
+    起點與終點相同且以 I/J 指定時為整圓。
+    """
+    du, dv, dw = delta[:, 0], delta[:, 1], delta[:, 2]
+    ci, cj = np.nan_to_num(offsets[:, 0]), np.nan_to_num(offsets[:, 1])
+    use_r = np.isnan(offsets).all(axis=1) & ~np.isnan(radius)
+    chord = np.hypot(du, dv)
+
+    r_ij = np.hypot(ci, cj)
+    a0 = np.arctan2(-cj, -ci)
+    a1 = np.arctan2(dv - cj, du - ci)
+    sweep = np.where(mode == 3, a1 - a0, a0 - a1) % (2 * math.pi)
+    sweep = np.where(chord < 1e-9, 2 * math.pi, sweep)
+
+    r_abs = np.abs(radius)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        half = np.arcsin(np.minimum(chord / (2 * r_abs), 1.0))
+    sweep_r = np.where(radius < 0, 2 * math.pi - 2 * half, 2 * half)
+
+    planar = np.where(use_r, r_abs * sweep_r, r_ij * sweep)
+    return np.hypot(planar, dw)
+
+
+def _cycle_hole_time(record, feed, g0_speed, macro=None, init_z=math.nan):
+    """
+    單孔的鑽孔循環時間 (分鐘)，參數不足時回傳 None。
+    macro 為 (MacroProgram, G66 單節的位址字)：以宏程式本體計算，刀具由 init_z (未知時為 R 點) 開始；
+    宏程式無法執行時改用 calc_g66_drilling_time 的近似模型。
+    """
+    static, dynamic = record.current_params()
+    r_point = static.get('R')
+    if r_point is None:
+        return None
+    if record.cycle_type == 'G66':
+        if macro is not None:
+            program, words = macro
+            try:
+                run = program.run(macro_arguments(words), g0_speed,
+                                  init_z if init_z == init_z else r_point, feed if feed == feed else None)
+                return run.time
+            except MacroError:
+                pass
+        t = DrillingAnalysisEngine.calc_g66_drilling_time(dynamic, r_point, g0_speed)
+    else:
+        f = static.get('F') or feed
+        if not f or f != f:
+            return None
+        if dynamic:
+            t = DrillingAnalysisEngine.calc_drilling_time(dynamic, f, r_point, g0_speed, record.use_ijk_mode)
+        else:
+            # 跳數超過展開上限時 dynamic_params 為空：改以啄鑽排程的連續段計算
+            try:
+                runs = PeckSchedule.from_params(static, record.use_ijk_mode).runs()
+            except PeckLimitError:
+                return None
+            t = DrillingAnalysisEngine.calc_peck_runs_time(runs, f, r_point, g0_speed)
+    return t if math.isfinite(t) else None
+
+
+class _Totals:
+    """依刀號累計的時間與次數。"""
+
+    def __init__(self):
+        self.tools = {}
+        self.unknown_moves = 0
+
+    def tool(self, tool_id):
+        entry = self.tools.get(tool_id)
+        if entry is None:
+            entry = dict.fromkeys(_TIME_KEYS, 0.0)
+            entry['tool_changes'] = 0
+            entry['holes'] = 0
+            self.tools[tool_id] = entry
+        return entry
+
+
+def _tool_name(code):
+    if code == _CALLER_CODE:
+        return CALLER_TOOL
+    return "Unknown" if code < 0 else str(int(code))
+
+
+class MoveWindow:
+    """
+    一個視窗內各單節 (rows，依行號排序) 的移動：
+        start_pos / pos: 單節開始前 (視窗第一個單節) 與各單節結束時的 XYZ 位置 (未知為 NaN)
+        length: 移動長度 (圓弧為弧長)；motion: G0~G3 模態；feed: F 模態；tool: 刀號 (-1 為 Unknown)
+        rapid / cutting / unknown: 可計時的 G0 快速位移 / 進給移動 / 位置或進給未知的移動
+        word: {位址: 各單節第一個該位址字的值 (NaN 為未指定)}；g_motion: 單節明確指定的 G0~G3
+    """
+    __slots__ = ('rows', 'word', 'start_pos', 'pos', 'length', 'motion', 'g_motion', 'plane', 'feed', 'tool',
+                 'rapid', 'cutting', 'unknown', 'dwell', 'm06')
+
+
+def _resolve_window(letters, values, token_lines, records, st):
+    """解析一個視窗內所有單節的位置與移動 (MoveWindow)，st 延續至下一個視窗；沒有單節時回傳 None。"""
+    rows = token_lines[np.r_[True, token_lines[1:] != token_lines[:-1]]] if len(token_lines) else token_lines
+    n = len(rows)
+    if not n:
+        return None
+    word = {a: words_per_line(letters, values, token_lines, a, rows) for a in 'FIJKPRTXYZ'}
+
+    # G 碼：同一單節可有多個，依群組各取最後一個
+    is_g = letters == 71
+    g_vals = values[is_g]
+    g_rows = np.searchsorted(rows, token_lines[is_g])
+
+    def g_last(codes):
+        out = np.full(n, np.nan)
+        mask = np.isin(g_vals, codes)
+        out[g_rows[mask]] = g_vals[mask]
+        return out
+
+    def g_any(codes):
+        out = np.zeros(n, dtype=bool)
+        out[g_rows[np.isin(g_vals, codes)]] = True
+        return out
+
+    ref = g_any((28.0, 30.0, 53.0))
+    set_pos = g_any((92.0,))
+    ignore = g_any((4.0, 10.0, 52.0, 65.0))
+    dwell = g_any((4.0,))
+    is_m = letters == 77
+    m06 = np.zeros(n, dtype=bool)
+    m06[np.searchsorted(rows, token_lines[is_m][values[is_m] == 6.0])] = True
+
+    # 循環模態中的單節：本體的 X/Y 只是孔位 (定位時間由孔位路徑計算)，G66 行的位址字皆為宏引數
+    in_cycle = np.zeros(n, dtype=bool)
+    macro_line = np.zeros(n, dtype=bool)
+    if len(records.lines):
+        k = np.searchsorted(records.lines, rows, 'right') - 1
+        kk = np.maximum(k, 0)
+        in_cycle = (k >= 0) & (rows < records.ends[kk])
+        macro_line = in_cycle & (rows == records.lines[kk]) & records.is_g66[kk]
+
+    incremental = _fill_forward(g_last((90.0, 91.0)), 91.0 if st.incremental else 90.0) == 91.0
+    g_motion = g_last((0.0, 1.0, 2.0, 3.0))
+    motion = _fill_forward(g_motion, st.motion)
+    plane = _fill_forward(g_last((17.0, 18.0, 19.0)), st.plane)
+    feed = _fill_forward(np.where(macro_line, np.nan, word['F']), st.feed)
+    tool = _fill_forward(np.where(macro_line, np.nan, word['T']), st.tool)
+
+    pos = np.empty((n, 3))
+    delta = np.empty((n, 3))
+    for axis, a in enumerate('XYZ'):
+        vals = word[a]
+        given = ~np.isnan(vals) & ~ignore & ~macro_line
+        if a == 'Z':
+            given &= ~in_cycle
+        absolute = given & (ref | set_pos | ~incremental)
+        pos[:, axis] = _resolve_axis(np.where(ref, np.nan, vals), given, incremental, absolute, st.pos[axis])
+        prev = np.r_[st.pos[axis], pos[:-1, axis]]
+        step = given & ~absolute
+        delta[:, axis] = np.where(step, vals, np.where(given, pos[:, axis] - prev, 0.0))
+
+    moves = ~in_cycle & ~ignore & ~set_pos
+    arc = moves & ((motion == 2) | (motion == 3))
+    length = np.sqrt((delta ** 2).sum(axis=1))
+    if arc.any():
+        idx = np.flatnonzero(arc)
+        for p, axes in _PLANE_AXES.items():
+            sel = idx[plane[idx] == p]
+            if not len(sel):
+                continue
+            oi, oj = _PLANE_OFFSETS[p]
+            offsets = np.column_stack((word[oi][sel], word[oj][sel]))
+            length[sel] = _arc_lengths(delta[sel][:, axes], motion[sel], offsets, word['R'][sel])
+    moving = moves & (length != 0)
+    unknown = moving & (np.isnan(length) | ref)
+    rapid = moving & ~unknown & (motion == 0)
+    cutting = moving & ~unknown & (motion != 0)
+    bad_feed = cutting & ~(feed > 0)
+    cutting &= ~bad_feed
+
+    win = MoveWindow()
+    win.rows, win.word, win.start_pos, win.pos, win.length = rows, word, st.pos.copy(), pos, length
+    win.motion, win.g_motion, win.plane, win.feed, win.tool = motion, g_motion, plane, feed, tool
+    win.rapid, win.cutting, win.unknown = rapid, cutting, unknown | bad_feed
+    win.dwell, win.m06 = dwell, m06
+    st.pos = pos[-1].copy()
+    st.incremental = bool(incremental[-1])
+    st.motion = float(motion[-1])
+    st.plane = float(plane[-1])
+    st.feed = float(feed[-1])
+    st.tool = float(tool[-1])
+    return win
+
+
+def _time_window(letters, values, token_lines, records, st, totals, g0_speed, tool_change_min):
+    """計算一個視窗內所有單節的時間並累計至 totals，st 延續至下一個視窗。"""
+    win = _resolve_window(letters, values, token_lines, records, st)
+    if win is None:
+        return
+    rows, word, pos, length, feed, tool = win.rows, win.word, win.pos, win.length, win.feed, win.tool
+    rapid, cutting, dwell, m06 = win.rapid, win.cutting, win.dwell, win.m06
+    totals.unknown_moves += int(win.unknown.sum())
+
+    rapid_time = np.where(rapid, length, 0.0) / g0_speed
+    feed_time = np.where(cutting, length / np.where(cutting, feed, 1.0), 0.0)
+    # G04：P 為毫秒、X 為秒
+    dwell_sec = np.where(~np.isnan(word['P']), word['P'] / 1000.0, word['X'])
+    dwell_time = np.where(dwell, np.nan_to_num(dwell_sec), 0.0) / 60.0
+
+    codes, inverse = np.unique(tool, return_inverse=True)
+    per_tool = {
+        'rapid_time': np.bincount(inverse, rapid_time, len(codes)),
+        'feed_time': np.bincount(inverse, feed_time, len(codes)),
+        'dwell_time': np.bincount(inverse, dwell_time, len(codes)),
+        'tool_changes': np.bincount(inverse, m06, len(codes)),
+    }
+    for i, code in enumerate(codes.tolist()):
+        entry = totals.tool(_tool_name(code))
+        for key in ('rapid_time', 'feed_time', 'dwell_time'):
+            entry[key] += float(per_tool[key][i])
+        changes = int(per_tool['tool_changes'][i])
+        entry['tool_changes'] += changes
+        entry['tool_change_time'] += changes * tool_change_min
+
+    # 鑽孔循環：單孔時間 × 孔數，加上由循環前位置依序經過各孔的 G0 定位 (各循環一起計算)
+    lo, hi = np.searchsorted(records.lines, [rows[0], rows[-1] + 1])
+    if hi > lo:
+        items = records.items[lo:hi]
+        rec_rows = np.searchsorted(rows, records.lines[lo:hi])
+        start_xy = np.where((rec_rows > 0)[:, None], pos[np.maximum(rec_rows - 1, 0), :2], win.start_pos[:2])
+        paths = []
+        for i, rec in enumerate(items):
+            paths.append(start_xy[i:i + 1])
+            paths.append(rec.holes if 'holes' in rec else NO_HOLES)
+        sizes = np.array([len(part) for part in paths[1::2]]) + 1
+        owner = np.repeat(np.arange(len(items)), sizes)
+        path = np.concatenate(paths)
+        step = np.hypot(*np.diff(path, axis=0).T)
+        same = owner[1:] == owner[:-1]
+        travel = np.bincount(owner[1:][same], np.nan_to_num(step[same]), len(items)) / g0_speed
+        for i, rec in enumerate(items):
+            # 子程式內尚未換刀的循環屬於呼叫端的刀號 (parser 的 tool_id 為文字上前一個 T 字)
+            caller = tool[rec_rows[i]] == _CALLER_CODE
+            entry = totals.tool(CALLER_TOOL if caller else rec.tool_id)
+            entry['holes'] += rec.get('hole_count', 0)
+            n_holes = int(sizes[i]) - 1
+            if not n_holes:
+                continue
+            entry['rapid_time'] += float(travel[i])
+            z0 = pos[rec_rows[i] - 1, 2] if rec_rows[i] > 0 else win.start_pos[2]
+            t_hole = _cycle_hole_time(rec, float(feed[rec_rows[i]]), g0_speed, records.macro_for(rec), float(z0))
+            if t_hole is None:
+                totals.unknown_moves += 1
+            else:
+                entry['cycle_time'] += t_hole * n_holes
+
+
+class _Records:
+    """依行號排序的循環紀錄與其模態範圍 (向量化查詢用)。"""
+
+    def __init__(self, tools_data, n_lines, nc_lines=None, macros=None):
+        self.items = list(tools_data)
+        self.nc_lines = nc_lines
+        self.macros = macros or {}
+        self.lines = np.array([rec.line_index for rec in self.items], dtype=np.int64)
+        self.ends = np.array([min(rec.get('end_line', n_lines), n_lines) for rec in self.items], dtype=np.int64)
+        self.is_g66 = np.array([rec.cycle_type == 'G66' for rec in self.items], dtype=bool)
+
+    def macro_for(self, rec):
+        """G66 循環呼叫的宏程式本體與該單節的位址字 (沒有提供宏程式時為 None)。"""
+        if not self.macros or rec.cycle_type != 'G66':
+            return None
+        words = tokenize_block(self.nc_lines[rec.line_index])
+        number = next((val for addr, val in words if addr == 'P'), None)
+        program = self.macros.get(int(number)) if number is not None else None
+        return (program, words) if program is not None else None
+
+
+def _estimate_range(parser, start, end, g0_speed, tool_change_min, caller_tool=False, tools_data=None,
+                    macros=None):
+    """
+    累計第 [start, end) 行的時間至新的 _Totals。caller_tool 為 True 時 (子程式)，
+    範圍內第一個 T 字之前的移動與循環歸於 CALLER_TOOL (由呼叫端的刀號取代)。
+    tools_data 為已依範圍篩選的循環紀錄 (None 時由 parser.tools_data 篩選)。
+    macros 為 {宏程式號: nc_macro.MacroProgram}。
+    """
+    lines = parser.nc_lines
+    if tools_data is None:
+        tools_data = [rec for rec in parser.tools_data if start <= rec.line_index < end]
+    records = _Records(tools_data, end, lines, macros)
+    st = _MachineState()
+    if caller_tool:
+        st.tool = _CALLER_CODE
+    totals = _Totals()
+    for lo in range(start, end, _WINDOW_LINES):
+        hi = min(end, lo + _WINDOW_LINES)
+        letters, values, token_lines = lex_words(lines.text_range(lo, hi), _LETTERS, lo)
+        _time_window(letters, values, token_lines, records, st, totals, g0_speed, tool_change_min)
+    return totals
+
+
+def iter_move_windows(parser, start=0, end=None, tools_data=None):
+    """
+    依序產出第 [start, end) 行各視窗的 MoveWindow (與時間預估相同的位置與模態計算)。
+    鑽孔循環模態中的單節不是移動 (rapid / cutting 皆為 False)。
+    """
+    lines = parser.nc_lines
+    end = len(lines) if end is None else end
+    if tools_data is None:
+        tools_data = [rec for rec in parser.tools_data if start <= rec.line_index < end]
+    records = _Records(tools_data, end, lines)
+    st = _MachineState()
+    for lo in range(start, end, _WINDOW_LINES):
+        hi = min(end, lo + _WINDOW_LINES)
+        win = _resolve_window(*lex_words(lines.text_range(lo, hi), _LETTERS, lo), records, st)
+        if win is not None:
+            yield win
+
+
+def summarize_tools(tools_totals, unknown_moves):
+    """依刀號的累計 (dict) 整理為 estimate_program_time 的回傳格式。"""
+    result = dict.fromkeys(_TIME_KEYS, 0.0)
+    result.update(tool_changes=0, holes=0, unknown_moves=unknown_moves)
+    tools = {}
+    for tool_id, entry in tools_totals.items():
+        entry['total_time'] = sum(entry[key] for key in _TIME_KEYS)
+        if not entry['total_time'] and not entry['holes']:
+            continue
+        tools[tool_id] = entry
+        for key in _TIME_KEYS + ('tool_changes', 'holes'):
+            result[key] += entry[key]
+    result['total_time'] = sum(result[key] for key in _TIME_KEYS)
+    result['tools'] = tools
+    return result
+
+
+def estimate_program_time(parser, g0_speed=DEFAULT_G0_SPEED, tool_change_sec=DEFAULT_TOOL_CHANGE_SEC, macros=None):
+    """
+    預估已解析程式 (RokuNCParser) 的總加工時間 (分鐘)。
+
+    回傳：
+        {'total_time', 'rapid_time', 'feed_time', 'cycle_time', 'dwell_time', 'tool_change_time',
+         'tool_changes', 'holes', 'unknown_moves',
+         'tools': {刀號: {同上各時間欄位, 'total_time', 'tool_changes', 'holes'}, ...}}
+    rapid_time 含循環孔間定位；unknown_moves 為位置或進給未知而無法計時的移動 (如 G28 之後
+    的第一個絕對定位)，不計入總時間。子程式呼叫 (M98 / G65) 的展開見 nc_subprog。
+    macros 為 {宏程式號: nc_macro.MacroProgram}，提供時 G66 以宏程式本體計時。
+    """
+    if g0_speed <= 0:
+        raise ValueError("g0_speed must be positive")
+    totals = _estimate_range(parser, 0, len(parser.nc_lines), g0_speed, tool_change_sec / 60.0,
+                             tools_data=parser.tools_data, macros=macros)
+    return summarize_tools(totals.tools, totals.unknown_moves)
+
+
+def estimate_range_time(parser, start, end, g0_speed=DEFAULT_G0_SPEED, tool_change_sec=DEFAULT_TOOL_CHANGE_SEC,
+                        caller_tool=True, tools_data=None, macros=None):
+    """
+    第 [start, end) 行 (如一個子程式) 單獨執行一次的時間，依刀號回傳
+    ({刀號: {各時間欄位, 'tool_changes', 'holes'}}, unknown_moves)。
+    範圍開頭的位置未知；caller_tool 時第一個 T 字之前的時間與孔數記在 CALLER_TOOL 之下。
+    tools_data 可傳入範圍內的循環紀錄，省去逐一篩選 parser.tools_data；macros 同 estimate_program_time。
+    """
+    if g0_speed <= 0:
+        raise ValueError("g0_speed must be positive")
+    totals = _estimate_range(parser, start, end, g0_speed, tool_change_sec / 60.0, caller_tool, tools_data, macros)
+    return totals.tools, totals.unknown_moves
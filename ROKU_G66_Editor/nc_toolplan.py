@@ -0,0 +1,364 @@
+"""
+整份程式的換刀合併規劃：同一刀號在程式中被多次呼叫 (T1 … T5 … T1) 時，將後面的工序
+搬到同刀號的前一工序之後並刪除其換刀指令，每把刀只裝一次。
+
+工序 (Operation) 由 M06 換刀單節 (T 字與 M06 同行，或 T 字的下一個模態單節為 M06；
+含其正上方的註解標頭) 開始，至下一個工序或程式結束 (M30 / M02) 為止；M06 之外的 T 字
+(預選刀) 屬於所在工序，重排後改寫為新順序中下一把要換的刀。
+
+依原順序逐一處理工序，只會把工序往前搬，合法條件：
+- 跳過的工序都不需先於本工序 (使用者宣告的刀號先後關係，如中心鑽先於鑽頭，取遞移閉包)；
+- 前一工序結束時沒有仍在模態中的循環 (原本由被刪除的換刀單節取消)；
+- 前後銜接改變的工序，第一個座標單節與之前的位置無關 (G90 且同時指定 X、Y 的直線定位，
+  或 G28 / G92 等同時指定 X、Y)，且沿用的距離模式 (G90/G91) 與主軸轉速 (S) 在新位置
+  與原位置相同，或由工序自行指定。
+工件座標系 (G54~G59)、刀長補正等其他模態假設各工序自行指定。
+"""
+import bisect
+import re
+
+import numpy as np
+
+from nc_lexer import iter_modal_blocks, lex_motion_blocks, MOTION_IGNORE, MOTION_NORMAL
+from nc_timing import DEFAULT_TOOL_CHANGE_SEC
+
+# 換刀單節改寫：刪除 T 字與 M06 (只處理註解之外的部分)
+_T_WORD_RE = re.compile(r'T[ \t]*(\d+)\.?')
+_M06_RE = re.compile(r'M[ \t]*0*6(?![\d.])')
+# T 字出現在這些 G 碼單節時不是刀號 (G66 孔底暫停、G65 宏引數)，與 RokuNCParser 相同
+_MACRO_G = (65.0, 66.0)
+_SPINDLE_START_M = (3.0, 4.0)
+_CUTTING_G = frozenset((1.0, 2.0, 3.0, 66.0) + tuple(float(g) for g in range(73, 90)))
+_PROGRAM_END_M = (2.0, 30.0)
+
+
+class Operation:
+    """
+    一個工序：第 start 至 end - 1 行，換刀單節為 change_line (M06 在 m06_line)。
+    entry / exit 為工序開始前與結束時的 (G91 增量模式, 主軸轉速)；
+    sets_distance / sets_spindle 表示工序在使用之前自行指定了距離模式 / 轉速。
+    """
+    __slots__ = ('tool_id', 'start', 'end', 'change_line', 'm06_line', 'prestage_lines',
+                 'free_start', 'sets_distance', 'sets_spindle', 'entry', 'exit', 'open_at_end')
+
+    def __init__(self, tool_id, start, change_line, m06_line):
+        self.tool_id = tool_id
+        self.start = start
+        self.end = None
+        self.change_line = change_line
+        self.m06_line = m06_line
+        self.prestage_lines = []
+        self.free_start = True
+        self.sets_distance = self.sets_spindle = False
+        self.entry = self.exit = (False, 0)
+        self.open_at_end = False
+
+    def accepts(self, pred):
+        """接在 pred 之後是否與原位置的模態相同 (未自行指定的距離模式與轉速沿用 pred 的結束狀態)。"""
+        return ((self.sets_distance or pred.exit[0] == self.entry[0])
+                and (self.sets_spindle or pred.exit[1] == self.entry[1]))
+
+
+def _tool_key(tool):
+    """刀號統一為 RokuNCParser 的格式 ('T05' / 5 / '5.' → '5')。"""
+    text = str(tool).strip().upper().lstrip('T')
+    return str(int(float(text)))
+
+
+def precedence_closure(pairs):
+    """使用者宣告的 (先, 後) 刀號關係取遞移閉包。"""
+    after = {}
+    for first, second in pairs:
+        after.setdefault(_tool_key(first), set()).add(_tool_key(second))
+    closure = set()
+    for first in after:
+        stack = list(after[first])
+        seen = set()
+        while stack:
+            tool = stack.pop()
+            if tool in seen:
+                continue
+            seen.add(tool)
+            closure.add((first, tool))
+            stack.extend(after.get(tool, ()))
+    return closure
+
+
+def _mode_at(lines, values, line, default):
+    """事件列表 (依行號排序) 中行號 < line 的最後一個值。"""
+    k = bisect.bisect_left(lines, line)
+    return values[k - 1] if k else default
+
+
+class _ProgramScan:
+    """切分工序所需的模態事件 (全程式單次掃描)。"""
+
+    def __init__(self, text, base_line=0):
+        self.tool_changes = []   # (行號, 刀號, M06 行號或 None)
+        self.t_lines = []        # 所有 T 字單節 (行號, 刀號字串)
+        self.end_lines = []      # M30 / M02
+        self.dist_lines, self.dist_vals = [], []
+        self.rpm_lines, self.rpm_vals = [], []
+        self.motion_lines, self.motion_vals = [], []  # G0~G3 插補模態
+        self.use_lines = []      # 主軸起動或切削單節 (轉速在此之前必須確定)
+        pending_t = None
+        for rel_idx, _, words in iter_modal_blocks(text):
+            idx = base_line + rel_idx
+            g_codes = [v for a, v in words if a == 'G']
+            m_codes = [v for a, v in words if a == 'M']
+            macro = any(g in _MACRO_G for g in g_codes)
+            t_word = s_word = None
+            for addr, val in words:
+                if addr == 'T' and t_word is None and not macro:
+                    t_word = val
+                elif addr == 'S' and s_word is None and not macro:
+                    s_word = val
+            if pending_t is not None:
+                # T 字單節的下一個模態單節為 M06：兩行合為一個換刀
+                t_line, tool = pending_t
+                pending_t = None
+                if 6.0 in m_codes and t_word is None:
+                    self.tool_changes.append((t_line, tool, idx))
+            if t_word is not None:
+                tool = str(int(t_word))
+                self.t_lines.append((idx, tool))
+                if 6.0 in m_codes:
+                    self.tool_changes.append((idx, tool, idx))
+                else:
+                    pending_t = (idx, tool)
+            for g in g_codes:
+                if g == 90 or g == 91:
+                    self.dist_lines.append(idx)
+                    self.dist_vals.append(g == 91)
+                elif g in (0.0, 1.0, 2.0, 3.0):
+                    self.motion_lines.append(idx)
+                    self.motion_vals.append(g)
+            if s_word is not None:
+                self.rpm_lines.append(idx)
+                self.rpm_vals.append(int(s_word))
+            if any(m in _SPINDLE_START_M for m in m_codes) or any(g in _CUTTING_G for g in g_codes):
+                self.use_lines.append(idx)
+            if any(m in _PROGRAM_END_M for m in m_codes):
+                self.end_lines.append(idx)
+
+
+def _is_comment_line(line):
+    stripped = line.strip()
+    return stripped.startswith('(') and not _T_WORD_RE.sub('', stripped.split('(', 1)[0]).strip()
+
+
+def build_operations(parser):
+    """
+    將 parser 已載入的程式切分為工序。
+    回傳 (工序列表, 程式結尾) ；程式結尾 (M30 之後的部分) 以 tool_id 為 None 的 Operation 表示，
+    沒有 M06 換刀時工序列表為空。
+    """
+    lines = parser.nc_lines
+    n = len(lines)
+    text = lines.text_range(0, n)
+    scan = _ProgramScan(text)
+    if not scan.tool_changes:
+        return [], None
+
+    first_change = scan.tool_changes[0][0]
+    k = bisect.bisect_right(scan.end_lines, first_change)
+    if k < len(scan.end_lines):
+        program_end = scan.end_lines[k]
+    else:
+        program_end = n
+        while program_end > first_change + 1 and lines[program_end - 1].strip() in ('', '%'):
+            program_end -= 1
+
+    ops = []
+    for change_line, tool, m06_line in scan.tool_changes:
+        if change_line >= program_end:
+            break
+        # 換刀單節正上方的註解行 (刀具說明) 屬於本工序
+        start = change_line
+        floor = ops[-1].m06_line + 1 if ops else 0
+        while start > floor and _is_comment_line(lines[start - 1]):
+            start -= 1
+        ops.append(Operation(tool, start, change_line, m06_line))
+    for op, nxt in zip(ops, ops[1:]):
+        op.end = nxt.start
+    ops[-1].end = program_end
+    tail = Operation(None, program_end, program_end, program_end)
+    tail.end = n
+
+    for t_line, tool in scan.t_lines:
+        j = bisect.bisect_right([op.start for op in ops], t_line) - 1
+        if j >= 0 and t_line < ops[j].end and t_line != ops[j].change_line:
+            ops[j].prestage_lines.append(t_line)
+
+    blocks = lex_motion_blocks(text)
+    active = blocks.flags != MOTION_IGNORE
+    rows = blocks.lines[active].tolist()
+    flags = blocks.flags[active].tolist()
+    both = (~np.isnan(blocks.xy[active])).all(axis=1).tolist()
+    for op in ops + [tail]:
+        first = op.change_line if op.tool_id is not None else op.start
+        r = bisect.bisect_left(rows, first)
+        first_motion = rows[r] if r < len(rows) and rows[r] < op.end else None
+        incremental = _mode_at(scan.dist_lines, scan.dist_vals, op.start, False)
+        rpm = _mode_at(scan.rpm_lines, scan.rpm_vals, op.start, 0)
+        op.entry = (incremental, rpm)
+        op.exit = (_mode_at(scan.dist_lines, scan.dist_vals, op.end, incremental),
+                   _mode_at(scan.rpm_lines, scan.rpm_vals, op.end, rpm))
+        if first_motion is None:
+            op.free_start = op.sets_distance = True
+        else:
+            at = first_motion + 1  # 同一單節的 G90/G91 先生效
+            op.sets_distance = bisect.bisect_left(scan.dist_lines, op.start) < bisect.bisect_left(scan.dist_lines, at)
+            if flags[r] == MOTION_NORMAL:
+                absolute = not _mode_at(scan.dist_lines, scan.dist_vals, at, False)
+                arc = _mode_at(scan.motion_lines, scan.motion_vals, at, 0.0) in (2.0, 3.0)
+                op.free_start = both[r] and absolute and not arc
+            else:
+                op.free_start = both[r]
+        u = bisect.bisect_left(scan.use_lines, op.start)
+        if u < len(scan.use_lines) and scan.use_lines[u] < op.end:
+            op.sets_spindle = (bisect.bisect_left(scan.rpm_lines, op.start)
+                               < bisect.bisect_right(scan.rpm_lines, scan.use_lines[u]))
+        else:
+            op.sets_spindle = True  # 不使用主軸，轉速不影響本工序
+
+    starts = [op.start for op in ops]
+    for rec in parser.tools_data:
+        j = bisect.bisect_right(starts, rec.line_index) - 1
+        end_line = rec.get('end_line')
+        if j >= 0 and end_line is not None and end_line >= ops[j].end:
+            ops[j].open_at_end = True
+    return ops, tail
+
+
+def plan_sequence(ops, tail, precedence=()):
+    """
+    決定工序的新順序：依原順序處理，可合法併入同刀號前一群組的工序搬到該群組之後。
+    回傳 (新順序的工序索引列表, 被合併 (刪除換刀) 的工序索引集合)。
+    """
+    closure = precedence_closure(precedence)
+    seq = []
+    merged = set()
+    for b, op in enumerate(ops):
+        follower = ops[b + 1] if b + 1 < len(ops) else tail
+        groups = [i for i, s in enumerate(seq) if ops[s].tool_id == op.tool_id]
+        pos = groups[-1] if groups else None
+        if pos is not None and _can_merge(ops, seq, pos, op, follower, closure):
+            seq.insert(pos + 1, b)
+            merged.add(b)
+        else:
+            seq.append(b)
+    return seq, merged
+
+
+def _can_merge(ops, seq, pos, op, follower, closure):
+    """將 op 搬到 seq[pos] 之後 (與其同刀號) 是否合法。"""
+    last = ops[seq[pos]]
+    if last.open_at_end:
+        return False
+    skipped = [ops[s] for s in seq[pos + 1:]]
+    if any((s.tool_id, op.tool_id) in closure for s in skipped):
+        return False
+    if not skipped:
+        return True  # 原本就緊接在同刀號工序之後，只刪除換刀
+    nxt, pred = skipped[0], skipped[-1]
+    return (op.free_start and op.accepts(last)
+            and nxt.free_start and nxt.accepts(op)
+            and follower.free_start and follower.accepts(pred))
+
+
+def _strip_tool_change(line, remove_t, remove_m06):
+    """刪除換刀單節中的 T 字 / M06，回傳改寫後的行 (沒有剩餘內容時回傳 None)。"""
+    cut = min([i for i in (line.find('('), line.find(';')) if i >= 0], default=len(line.rstrip('\r\n')))
+    code, rest = line[:cut], line[cut:].rstrip('\r\n')
+    if remove_t:
+        code = _T_WORD_RE.sub('', code, count=1)
+    if remove_m06:
+        code = _M06_RE.sub('', code, count=1)
+    code = " ".join(code.split())
+    if not code and not rest.strip():
+        return None
+    return " ".join(part for part in (code, rest.strip()) if part) + "\n"
+
+
+def _set_t_word(line, tool):
+    """將預選刀單節的 T 字改為 tool，保留原本的位數 (如 T05)。"""
+    def repl(m):
+        digits = m.group(1)
+        width = len(digits) if digits.startswith('0') else 0
+        return m.group(0).replace(digits, f"{int(tool):0{width}d}", 1)
+    cut = min([i for i in (line.find('('), line.find(';')) if i >= 0], default=len(line))
+    return _T_WORD_RE.sub(repl, line[:cut], count=1) + line[cut:]
+
+
+def _report(ops, seq, merged, tool_change_sec):
+    return {
+        'operations': len(ops),
+        'tool_changes': len(ops),
+        'tool_changes_after': len(ops) - len(merged),
+        'merged': len(merged),
+        'saved_time': len(merged) * tool_change_sec / 60.0,
+        'sequence': [{'tool_id': ops[i].tool_id, 'line': ops[i].change_line + 1, 'merged': i in merged}
+                     for i in seq],
+    }
+
+
+def plan_tool_changes(parser, precedence=(), tool_change_sec=DEFAULT_TOOL_CHANGE_SEC):
+    """
+    預覽換刀合併結果 (不修改程式)：
+        {'operations', 'tool_changes' / 'tool_changes_after' (合併前後的 M06 次數), 'merged',
+         'saved_time' (分鐘), 'sequence': [{'tool_id', 'line' (原換刀行號, 1 起算), 'merged'}, ...]}
+    precedence 為 (先, 後) 刀號列表，如 [('5', '1')] 表示 T5 中心鑽須先於 T1 鑽頭。
+    """
+    ops, tail = build_operations(parser)
+    seq, merged = plan_sequence(ops, tail, precedence)
+    return _report(ops, seq, merged, tool_change_sec)
+
+
+def consolidate_tool_changes(parser, precedence=(), tool_change_sec=DEFAULT_TOOL_CHANGE_SEC):
+    """
+    依 plan_tool_changes 的結果重排程式並刪除多餘的換刀，之後整份重新解析
+    (parser.tools_data 會重建)。回傳同 plan_tool_changes 的報告。
+    """
+    ops, tail = build_operations(parser)
+    seq, merged = plan_sequence(ops, tail, precedence)
+    report = _report(ops, seq, merged, tool_change_sec)
+    if not merged:
+        return report
+
+    lines = parser.nc_lines
+    edits = {}
+    for b in merged:
+        op = ops[b]
+        for idx in sorted({op.change_line, op.m06_line}):
+            text = _strip_tool_change(edits.get(idx, lines[idx]), idx == op.change_line, idx == op.m06_line)
+            edits[idx] = text
+    # 預選刀：改為新順序中下一個換刀工序的刀號
+    for pos, i in enumerate(seq):
+        if not ops[i].prestage_lines:
+            continue
+        old_next = ops[i + 1].tool_id if i + 1 < len(ops) else None
+        new_next = next((ops[j].tool_id for j in seq[pos + 1:] if j not in merged), None)
+        if new_next is not None and new_next != old_next:
+            for idx in ops[i].prestage_lines:
+                edits[idx] = _set_t_word(edits.get(idx, lines[idx]), new_next)
+
+    order = list(range(ops[0].start))
+    for i in seq:
+        order.extend(range(ops[i].start, ops[i].end))
+    order.extend(range(tail.start, tail.end))
+    eol = b'\r\n' if len(lines) and lines.raw_line(0).endswith(b'\r\n') else b'\n'
+    parts = []
+    for idx in order:
+        if idx in edits:
+            if edits[idx] is None:
+                continue
+            raw = lines.encode_line(idx, edits[idx])
+        else:
+            raw = bytes(lines.raw_line(idx))
+        if not raw.endswith(b'\n') and idx != order[-1]:
+            raw += eol  # 原本的最後一行被搬到中間
+        parts.append(raw)
+    # 串流模式的原檔映射由 parse_bytes 關閉
+    parser.parse_bytes(b''.join(parts))
+    return report
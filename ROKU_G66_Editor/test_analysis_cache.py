@@ -0,0 +1,47 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from analysis_engine import DrillingAnalysisEngine
+from config_manager import ConfigManager
+from analysis_cache import ConfigMemo, cache_stats
+
+class TestConfigMemo(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = ConfigManager(os.path.join(self.tmp_dir, "config.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_results_follow_config_version(self):
+        dri = DrillingAnalysisEngine.calculate_dri
+        dri.cache_clear()
+        first = dri(1.0, 5.0, 'SUS304', 'Oil', 'CARBIDE', self.config)
+        self.assertEqual(dri(1.0, 5.0, 'SUS304', 'Oil', 'CARBIDE', self.config), first)
+        self.assertEqual((dri.cache_info()['hits'], dri.cache_info()['misses']), (1, 1))
+        self.config.data['dri_factors']['material']['SUS304'] *= 2
+        self.assertTrue(self.config.save_config())
+        self.assertAlmostEqual(dri(1.0, 5.0, 'SUS304', 'Oil', 'CARBIDE', self.config), first * 2)
+        self.config.reset_to_defaults()
+        self.assertAlmostEqual(dri(1.0, 5.0, 'SUS304', 'Oil', 'CARBIDE', self.config), first)
+        self.assertEqual(dri.cache_info()['misses'], 3)
+        self.assertIn('DrillingAnalysisEngine.calculate_dri', cache_stats())
+
+    def test_mutable_results_are_copied(self):
+        segments = DrillingAnalysisEngine.calc_g66_segments(0.5, -6.0, 80.0, config=self.config)
+        segments[0]['J'] = 99.0
+        self.assertNotEqual(DrillingAnalysisEngine.calc_g66_segments(0.5, -6.0, 80.0, config=self.config)[0]['J'], 99.0)
+
+    def test_lru_eviction(self):
+        calls = []
+        memo = ConfigMemo(lambda x, table: calls.append(x) or x * table['k'], maxsize=2)
+        for x in (1, 2, 1, 3, 2):
+            memo(x, {'k': 10})
+        self.assertEqual(calls, [1, 2, 3, 2])  # 3 淘汰最久未用的 2
+        self.assertEqual(memo.info(), {'hits': 1, 'misses': 4, 'size': 2, 'maxsize': 2})
+        self.assertEqual(memo(4, {'k': [1]}), [1, 1, 1, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import random
+
+import numpy as np
+
+from nc_parser import RokuNCParser
+from nc_peck import PeckLimitError
+from analysis_engine import DrillingAnalysisEngine, _round_np
+from config_manager import ConfigManager
+from legacy_timing import legacy_drilling_time, legacy_g66_drilling_time
+
+class TestClosedFormTime(unittest.TestCase):
+    """等差級數封閉解必須與逐跳迴圈的結果一致 (誤差 1e-9 以內)。"""
+    def test_matches_loop_versions(self):
+        rng = random.Random(21)
+        parser = RokuNCParser()
+        for _ in range(300):
+            r_point = rng.uniform(-1.0, 3.0)
+            feed, g0 = rng.uniform(5.0, 200.0), rng.uniform(1000.0, 20000.0)
+            clearance = rng.choice([0.1, 0.0, 0.5])
+            params = {'R': r_point, 'Z': r_point - rng.uniform(0.0, 8.0), 'Q': rng.choice([0.01, 0.05, 0.3, 2.0]),
+                      'I': rng.uniform(0.05, 1.0), 'J': rng.uniform(0.0, 0.2), 'K': rng.uniform(0.01, 0.1)}
+            ijk = parser._g83_to_ijk(params, 'G83', rng.random() < 0.5)
+            ijk += [{'I': rng.uniform(-0.5, 0.5)} for _ in range(rng.randrange(3))]
+            self.assertAlmostEqual(DrillingAnalysisEngine.calc_drilling_time(ijk, feed, r_point, g0, False, clearance),
+                                   legacy_drilling_time(ijk, feed, r_point, g0, False, clearance), delta=1e-9)
+            z, segments = r_point, []
+            for _ in range(rng.randrange(1, 4)):
+                z += rng.uniform(-5.0, 0.5)
+                segments.append({'I': z, 'J': rng.choice([0.0, 0.01, 0.07, 0.4, 3.0]), 'K': rng.uniform(10.0, 100.0)})
+            self.assertAlmostEqual(DrillingAnalysisEngine.calc_g66_drilling_time(segments, r_point, g0, clearance),
+                                   legacy_g66_drilling_time(segments, r_point, g0, clearance), delta=1e-9)
+
+class TestOptimizeBatch(unittest.TestCase):
+    """批次最佳化必須與逐筆呼叫 calculate_optimized_params 的結果完全相同。"""
+    def test_rounding_is_vectorized(self):
+        # 依乘 10^n 後的浮點數取位 (ties-to-even)：2.675 進位為 2.68，Python round 為 2.67
+        self.assertEqual(_round_np(np.array([2.675, 0.5, 1.5]), np.array([2, 0, 0])).tolist(), [2.68, 0.0, 2.0])
+
+    def test_matches_scalar_path(self):
+        rng = random.Random(23)
+        n = 300
+        dia = [rng.choice([0.0, -1.0, 0.1, 0.45, 0.5, rng.uniform(0.05, 12.0)]) for _ in range(n)]
+        target_z = [-rng.uniform(0.0, 60.0) for _ in range(n)]
+        materials = [rng.choice(['AL6061', 'SUS304', 'SUS420', 'TI6AL4V', 'CERAMIC', 'UNKNOWN']) for _ in range(n)]
+        coolants = [rng.choice(['Oil', 'Air', 'Internal', 'Dry']) for _ in range(n)]
+        tools = [rng.choice(['CARBIDE', 'HSS']) for _ in range(n)]
+        current_s = [rng.choice([0.0, 0.0, rng.uniform(500.0, 30000.0)]) for _ in range(n)]
+        chamfer = [rng.choice([0.0, 0.0, rng.uniform(0.1, 2.0)]) for _ in range(n)]
+        for config in (None, ConfigManager()):
+            for prefer_ijk in (None, True, False):
+                batch = DrillingAnalysisEngine.calculate_optimized_params_batch(
+                    dia, target_z, materials, tools, current_s=current_s, material_thickness=3.0,
+                    exit_chamfer=chamfer, config=config, coolant_mode=coolants, prefer_ijk=prefer_ijk)
+                for row in range(n):
+                    scalar = DrillingAnalysisEngine.calculate_optimized_params(
+                        dia[row], target_z[row], materials[row], tools[row], current_s=current_s[row],
+                        material_thickness=3.0, exit_chamfer=chamfer[row], config=config,
+                        coolant_mode=coolants[row], prefer_ijk=prefer_ijk)
+                    for key in ('S', 'F', 'Q', 'I', 'J', 'K', 'Z', 'use_ijk', 'dri', 'strategy', 'life_index', 'score'):
+                        self.assertEqual(batch[key][row], scalar[key], (row, key))
+
+class TestDynamicPecks(unittest.TestCase):
+    def test_limit_uses_real_peck_count(self):
+        # 以實際跳數判定上限：K0 時最壞情況 ceil(20 / 1e-6) 跳，實際為 461 跳
+        self.assertEqual(len(DrillingAnalysisEngine.calc_g83_dynamic_pecks(1.0, 0.0, 20.0)), 461)
+        self.assertEqual(len(DrillingAnalysisEngine.calc_g83_dynamic_pecks(1.0, 0.0, 20.0, max_pecks=461)), 461)
+        with self.assertRaises(PeckLimitError):
+            DrillingAnalysisEngine.calc_g83_dynamic_pecks(1.0, 0.0, 20.0, max_pecks=460)
+        with self.assertRaises(PeckLimitError):
+            DrillingAnalysisEngine.calc_g83_dynamic_pecks(1.0, 0.0, 1000.0)  # 23420 跳
+        pecks = DrillingAnalysisEngine.calc_g83_dynamic_pecks(1.0, 0.2, 20.0)
+        self.assertAlmostEqual(-sum(p['I'] for p in pecks), 20.0, places=3)
+        # 與原本相同以 Python round 取位 (np.round 在進位邊界得到 0.8808)
+        self.assertEqual(DrillingAnalysisEngine.calc_g83_dynamic_pecks(0.88085, 0.88085, 0.88085), [{'I': -0.8809}])
+
+if __name__ == '__main__':
+    unittest.main()
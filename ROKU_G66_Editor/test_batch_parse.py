@@ -0,0 +1,33 @@
+import unittest
+import os
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+
+class TestBatchParse(unittest.TestCase):
+    def test_batch_json_lines_without_gui(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for name in ("a.nc", "b.TAP"):
+                with open(os.path.join(tmp_dir, name), "w") as f:
+                    f.write("T5 M06\nS6000 M03\nG83 R1. Z-2. Q.5\nX1. Y1.\nG80\n")
+            with open(os.path.join(tmp_dir, "notes.md"), "w") as f:
+                f.write("G83\n")
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_parse.py")
+            code = ("import sys, runpy; sys.argv = ['batch_parse.py', %r, '--workers', '2']\n"
+                    "try:\n    runpy.run_path(%r, run_name='__main__')\n"
+                    "except SystemExit:\n    pass\n"
+                    "assert 'PyQt6' not in sys.modules and 'matplotlib' not in sys.modules\n") % (tmp_dir, script)
+            out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+            results = sorted((json.loads(line) for line in out.splitlines()), key=lambda r: r['file'])
+            self.assertEqual([os.path.basename(r['file']) for r in results], ["a.nc", "b.TAP"])
+            self.assertEqual(results[0]['tools'], ["5"])
+            self.assertEqual(results[0]['total_holes'], 2)
+            self.assertEqual(results[0]['cycles'][0]['rpm'], 6000)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
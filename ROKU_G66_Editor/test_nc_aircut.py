@@ -0,0 +1,35 @@
+import unittest
+import math
+
+from nc_parser import RokuNCParser
+from nc_aircut import StockMap, plan_air_cuts, apply_air_cuts
+
+class TestAirCut(unittest.TestCase):
+    PROGRAM = (b"T1 M06\nG90 G0 X0 Y0 Z10.\nG1 Z5. F100\nX20.\nZ-1.\nX30.\n"
+               b"G2 X40. I5. J0\nZ5.\nG3 X50. I5.\nG0 Z20.\nM30\n")
+
+    def test_plate_detect_and_rewrite(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(self.PROGRAM)
+        plan = plan_air_cuts(parser, StockMap.plate(0.0), g0_speed=5000.0)
+        self.assertEqual([(r['start'], r['end'], r['moves']) for r in plan['runs']], [(2, 3, 2), (8, 8, 1)])
+        self.assertAlmostEqual(plan['air_time'], 0.25 + 5 * math.pi / 100.0)
+        self.assertEqual(plan['restore'], {4: 'G1'})
+        apply_air_cuts(parser, plan)
+        self.assertEqual([parser.nc_lines[i].strip() for i in (2, 3, 4, 8)],
+                         ["G0 Z5. F100", "G0 X20.", "G1 Z-1.", "G0 X50."])
+        self.assertEqual(plan_air_cuts(parser, StockMap.plate(0.0))['air_moves'], 0)
+
+    def test_heightmap_blocks_rapid(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(b"T1 M06\nG90 G0 X0 Y0 Z3.\nG1 X30. F100\nG0 Z20.\nM30\n")
+        # X10~20 有一塊高 2.5 的凸台：直線移動高於凸台 0.5，但不足以改為 G0
+        stock = StockMap([[0.0, 2.5, 0.0]], origin=(0.0, -5.0), cell=10.0)
+        plan = plan_air_cuts(parser, stock, clearance=0.1, rapid_clearance=1.0)
+        self.assertEqual(plan['air_moves'], 1)
+        self.assertFalse(plan['runs'][0]['rapid'])
+        self.assertEqual(plan['rewrite'], [])
+        self.assertEqual(plan_air_cuts(parser, stock, clearance=1.0)['air_moves'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
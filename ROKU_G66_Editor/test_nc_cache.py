@@ -0,0 +1,47 @@
+import unittest
+import os
+import tempfile
+
+from nc_parser import RokuNCParser, PARSER_VERSION
+from nc_cache import ParseCache
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.test_file = os.path.join(self.tmp_dir.name, "test_sample.nc")
+        with open(self.test_file, "w") as f:
+            f.write("%\nO1000\nT10 M06\nG0 G90 G54 X0 Y0 M03 S8000\nG43 H10 Z10.\n"
+                    "G66 P9131 R-.2 Z-2.9 I-2.9 J.45 K100. I0. J0. K0. I-1.0 J0.2 K50.\n"
+                    "X10. Y10.\nG67\nM30\n%\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        os.mkdir(cache_dir, 0o700)
+        cache = ParseCache(cache_dir)
+        first = RokuNCParser(cache=cache).parse_file(self.test_file)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        cached_parser = RokuNCParser(cache=cache)
+        self.assertEqual(cached_parser.parse_file(self.test_file), first)
+        self.assertEqual(cached_parser.nc_lines[5], "G66 P9131 R-.2 Z-2.9 I-2.9 J.45 K100. I0. J0. K0. I-1.0 J0.2 K50.\n")
+        # 標頭記錄的鍵或解析器版本不符 (如項目被改名或替換) 時不載入
+        name = os.listdir(cache_dir)[0]
+        os.replace(os.path.join(cache_dir, name), os.path.join(cache_dir, "1" * 40 + ".pkl"))
+        self.assertIsNone(cache.get("1" * 40, PARSER_VERSION))
+        cache.put("2" * 40, "old", {})
+        self.assertIsNone(cache.get("2" * 40, "new"))
+        self.assertEqual(cache.get("2" * 40, "old"), {})
+        if os.name == 'posix':
+            # 其他使用者可寫入的目錄不使用快取
+            os.chmod(cache_dir, 0o777)
+            self.assertIsNone(cache.get("2" * 40, "old"))
+            os.chmod(cache_dir, 0o700)
+        # 超過大小上限時淘汰最舊的項目
+        cache.max_bytes = 0
+        cache.put("0" * 40, "old", {})
+        self.assertEqual(os.listdir(cache_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
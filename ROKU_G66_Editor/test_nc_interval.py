@@ -0,0 +1,20 @@
+import unittest
+
+from nc_parser import RokuNCParser
+
+class TestCycleIntervals(unittest.TestCase):
+    def test_cycle_and_modal_state_at_line(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(b"T5 M06\nS3000 M03\nG90 G0 X0 Y0\nG99 G83 X0. Y0. Z-.2 R1. Q.2 F100\nX10.\nG80\n"
+                           b"T1 M06\nS2000\nG91\nG83 X0. Y0. Z-2. R1. Q.2 F50\nX10.\nG80\nM30\n")
+        self.assertEqual([parser.cycle_at(i) for i in range(13)],
+                         [None, None, None, 0, 0, None, None, None, None, 1, 1, None, None])
+        self.assertEqual(list(parser.cycles_in(4, 10)), [0, 1])
+        self.assertEqual(list(parser.cycles_in(5, 9)), [])
+        modal = parser.modal_at(8)
+        self.assertEqual((modal['cycle'], modal['tool_id'], modal['rpm'], modal['rpm_line']), (None, "1", 2000, 7))
+        self.assertEqual((modal['incremental'], modal['retract']), (True, 'G99'))
+        self.assertFalse(parser.modal_at(4)['incremental'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+from nc_lexer import tokenize_block, iter_modal_blocks, DWordIndex
+
+class TestNCLexer(unittest.TestCase):
+    def test_tokenize_skips_comments(self):
+        words = tokenize_block("G66 P9131 R-.2 Z-2.9 (T5 D0.1 X9.) K10.\n")
+        self.assertEqual(words, [('G', 66.0), ('P', 9131.0), ('R', -0.2), ('Z', -2.9), ('K', 10.0)])
+
+    def test_modal_blocks(self):
+        text = "T1 M06\n(X1. Y1.)\nS8000 M03\nX1. Y2.\nG83 X1. Z-1. R1. Q.5\n"
+        blocks = [(idx, [w[0] for w in words]) for idx, _, words in iter_modal_blocks(text)]
+        self.assertEqual(blocks, [(0, ['T', 'M']), (2, ['S', 'M']), (4, ['G'])])
+
+    def test_d_word_index(self):
+        index = DWordIndex()
+        index.index_text("T1 M6\n(D0 D.5 DRILL)\nX1.\n", 0)
+        index.index_text("D1.2\n", 3)
+        self.assertEqual(index.end_line, 4)
+        self.assertEqual(index.first_in_range(0, 4), 0.5)
+        self.assertEqual(index.first_in_range(2, 4), 1.2)
+        self.assertIsNone(index.first_in_range(2, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from nc_linestore import LineStore, detect_encoding, decode_text
+
+class TestLineStore(unittest.TestCase):
+    def test_splice_edits_keep_offsets(self):
+        store = LineStore(b"G66 P9131\r\nX1. Y1.\r\nX2. Y2.\r\nG67\r\n")
+        store[0] = "G66 P9131 R-0.5 Z-3\n"
+        store[2] = "X2.\n"
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store[1], "X1. Y1.\n")
+        self.assertEqual(store[3], "G67\n")
+        # 修改行沿用原始的 CRLF 行尾
+        self.assertEqual(bytes(store._buf), b"G66 P9131 R-0.5 Z-3\r\nX1. Y1.\r\nX2.\r\nG67\r\n")
+
+    def test_mixed_encoding_lines(self):
+        data = "(程式)\n".encode('utf-8') + "S8000 M03 (主軸)\n".encode('cp950') + b"(\xff)\n"
+        self.assertEqual(detect_encoding(data), 'cp950')
+        store = LineStore(data, detect_encoding(data))
+        # 每行各自以可解碼的編碼讀取，不合法位元組以 U+FFFD 取代而非略過
+        self.assertEqual(decode_text(data, 'cp950'), "(程式)\nS8000 M03 (主軸)\n(\ufffd)\n")
+        self.assertEqual(store[0], "(程式)\n")
+        store[1] = "S9000 M03 (主軸)\n"
+        self.assertEqual(store.raw_line(1), "S9000 M03 (主軸)\n".encode('cp950'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from nc_parser import RokuNCParser
+from nc_lexer import tokenize_block
+from nc_macro import compile_macro, macro_arguments, MacroError
+from nc_subprog import expand_program_time
+from nc_timing import _cycle_hole_time
+from analysis_engine import DrillingAnalysisEngine
+
+class TestMacroInterpreter(unittest.TestCase):
+    # 依 P9131 說明書：R → S 以 #953 下降，第二次啄鑽起退回 R 後下降至上次深度 + 0.1 再進給
+    MACRO = ("O9131\nG90 G00 Z#18\nG01 Z#19 F#953\n#30=#19\n#31=0\n#32=0\n"
+             "WHILE [#32 LT 4] DO1\n#33=#[4+#32*3]\nIF [#33 EQ #0] GOTO 90\n"
+             "WHILE [#30 GT #33] DO2\n#29=#30-ABS[#[5+#32*3]]\nIF [#29 LT #33] THEN #29=#33\n"
+             "IF [#31 EQ 0] GOTO 50\nG00 Z[#30+0.1]\nN50 G01 Z#29 F#[6+#32*3]\nG00 Z#18\n"
+             "#30=#29\n#31=#31+1\nEND2\nN90 #32=#32+1\nEND1\nM99\n")
+    G66 = "G66 P9131 R2. Z-2.9 S1. I-1. J.1 K5. I-2.9 J.05 K3."
+
+    def test_peck_count_and_time(self):
+        macro = compile_macro(self.MACRO.splitlines(), 9131, {953: 5000.0})
+        run = macro.run(macro_arguments(tokenize_block(self.G66)), 5000.0, init_z=2.0)
+        # 20 次 0.1 + 38 次 0.05 (累加的浮點誤差不多出一次啄鑽)
+        self.assertEqual(run.pecks, 58)
+        self.assertAlmostEqual(run.feed_length, 1.0 + 2.0 + 1.9 + 57 * 0.1)
+        self.assertAlmostEqual(run.final_z, 2.0)
+        self.assertIs(macro.run(macro_arguments(tokenize_block(self.G66)), 5000.0, init_z=2.0), run)
+
+    def test_program_uses_in_file_macro(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(("O1000\nT1 M06\nG90 G0 X0 Y0 Z2.\n" + self.G66 + "\nX0. Y0.\nX5. Y0.\nG67\nM30\n"
+                            + self.MACRO).encode())
+        res = expand_program_time(parser, macro_variables={'953': 5000.0})
+        run = compile_macro(self.MACRO.splitlines(), 9131, {953: 5000.0}).run(
+            macro_arguments(tokenize_block(self.G66)), 5000.0, init_z=2.0)
+        self.assertEqual((res['macros'], res['holes'], res['programs']), ([9131], 2, {1000: 1}))
+        self.assertAlmostEqual(res['cycle_time'], 2 * run.time)
+
+    def test_goto_missing_label(self):
+        for lines, args in ((["IF [#18 GT 0] GOTO 10", "M99"], {18: 1.0}), (["GOTO #18", "N2 M99"], {18: 1.0})):
+            with self.assertRaisesRegex(MacroError, "GOTO 找不到 N"):
+                compile_macro(lines).run(args, 5000.0)
+        # 條件不成立時不跳躍，不檢查標籤
+        run = compile_macro(["IF [#18 GT 0] GOTO 10", "G01 Z-1. F100", "M99"]).run({18: -1.0}, 5000.0)
+        self.assertAlmostEqual(run.final_z, -1.0)
+
+    def test_nested_while(self):
+        macro = compile_macro(["#1=0", "WHILE [#1 LT 3] DO1", "#2=0", "WHILE [#2 LT 2] DO2",
+                               "G91 G01 Z-.5 F100", "#2=#2+1", "END2", "#1=#1+1", "END1", "M99"])
+        run = macro.run({}, 5000.0, init_z=0.0)
+        self.assertAlmostEqual(run.feed_length, 3 * 2 * 0.5)
+        self.assertAlmostEqual(run.final_z, -3.0)
+        self.assertEqual(run.pecks, 1)  # 連續下降視為同一次啄鑽
+        with self.assertRaisesRegex(MacroError, "END2 沒有對應的 DO2"):
+            compile_macro(["WHILE [1 EQ 1] DO1", "END2", "END1"])
+        with self.assertRaisesRegex(MacroError, "DO1 沒有對應的 END"):
+            compile_macro(["WHILE [1 EQ 1] DO1"])
+
+    def test_infinite_loop_stops_at_max_steps(self):
+        with self.assertRaisesRegex(MacroError, "超過上限"):
+            compile_macro(["WHILE [1 EQ 1] DO1", "END1"]).run({}, 5000.0)
+
+    def test_alarm(self):
+        macro = compile_macro(["IF [#18 LT 0] THEN #3000=7 (R MUST BE POSITIVE)", "G01 Z#18 F100", "M99"])
+        self.assertAlmostEqual(macro.run({18: 1.0}, 5000.0).final_z, 1.0)
+        with self.assertRaisesRegex(MacroError, "#3000 警報 7"):
+            macro.run({18: -1.0}, 5000.0)
+
+    def test_cycle_time_falls_back_when_macro_fails(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(("T1 M06\nG90 G0 X0 Y0 Z2.\n" + self.G66 + "\nX0. Y0.\nG67\nM30\n").encode())
+        rec = parser.tools_data[0]
+        words = tokenize_block(self.G66)
+        alarm = compile_macro(["#3000=1"])
+        static, dynamic = rec.current_params()
+        expected = DrillingAnalysisEngine.calc_g66_drilling_time(dynamic, static['R'], 5000.0)
+        self.assertAlmostEqual(_cycle_hole_time(rec, 100.0, 5000.0, (alarm, words), 2.0), expected)
+        macro = compile_macro(self.MACRO.splitlines(), 9131, {953: 5000.0})
+        self.assertAlmostEqual(_cycle_hole_time(rec, 100.0, 5000.0, (macro, words), 2.0),
+                               macro.run(macro_arguments(words), 5000.0, init_z=2.0, feed=100.0).time)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from nc_parser import RokuNCParser
+from nc_lexer import lex_motion_blocks
+
+class TestModalInterpreter(unittest.TestCase):
+    def _holes(self, program):
+        return RokuNCParser().parse_bytes(program.encode())
+
+    def test_absolute_incremental_and_repeats(self):
+        data = self._holes(
+            "T1 M06\nG90 G0 X1. Y1.\n"
+            "G99 G83 Z-1. R1. Q.5\n"   # 指令行於目前位置鑽孔
+            "X2.\n"                     # Y 沿用
+            "G91 X1. K3\n"              # 增量重複 3 次
+            "Y-1. K0\n"                 # K0 不移動不鑽孔
+            "G80\n"
+            "G90 G66 P9131 R-.2 Z-1. I-.5 J.1 K1. L2\n"  # G66 行不鑽孔，每次呼叫 L2
+            "X5. Y5.\n"
+            "G91 G28 X0. Y0.\n"         # 回參考點後位置未知
+            "G90 Y6.\n"
+            "G92 X0 Y0\n"
+            "X1.\n"
+            "G67\n")
+        self.assertEqual([rec['retract_mode'] for rec in data], ['G99', 'G99'])
+        self.assertEqual(data[0]['holes'].tolist(), [[1, 1], [2, 1], [3, 1], [4, 1], [5, 1]])
+        holes = data[1]['holes']
+        self.assertEqual(data[1]['hole_count'], 6)
+        self.assertEqual(holes[:2].tolist(), [[5, 5], [5, 5]])
+        self.assertTrue(np.isnan(holes[2:4, 0]).all())
+        self.assertEqual(holes[2:4, 1].tolist(), [6, 6])
+        self.assertEqual(holes[4:].tolist(), [[1, 0], [1, 0]])
+
+    def test_motion_blocks_skip_comments(self):
+        blocks = lex_motion_blocks("(X9.)\nG04 X1.\nX-.5 Y2. K3 (Y8.)\nZ1.\n;X4.\nY 1.25 X.5\n", 10)
+        self.assertEqual(blocks.lines.tolist(), [11, 12, 15])
+        self.assertEqual(blocks.xy[1:].tolist(), [[-0.5, 2.0], [0.5, 1.25]])
+        self.assertEqual(blocks.k_words[1], 3.0)
+        self.assertEqual(blocks.flags.tolist(), [1, 0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from nc_parser import RokuNCParser
+from nc_optimize import build_jobs, iter_optimize_program, apply_results
+from analysis_engine import DrillingAnalysisEngine
+
+class TestOptimizeProgram(unittest.TestCase):
+    SETTINGS = {'material_key': 'SUS304', 'tool_mat_key': 'CARBIDE', 'coolant_mode': 'Oil'}
+
+    def test_optimize_and_apply_all_cycles(self):
+        pad = b"(----)\n" * 12  # 各刀號的 D 值搜尋範圍互不重疊
+        parser = RokuNCParser()
+        parser.parse_bytes(b"T1 M06\n(D0.5 DRILL)\nS8000 M03\nG83 X0 Y0 R1. Z-3. Q.3 F50\nX1.\nG80\n" + pad +
+                           b"T2 M06\n(D1. DRILL)\nS6000 M03\nG66 P9131 R-.2 Z-2.9 I-1. J.3 K50.\nX0 Y0\nG67\n" + pad +
+                           b"T3 M06\nG83 X0 R1. Z-2. Q.5 F40\nG80\nM30\n")
+        jobs = build_jobs(parser)
+        self.assertEqual([job['tool_dia'] for job in jobs], [0.5, 1.0, 0.0])
+        sequential = list(iter_optimize_program(jobs, self.SETTINGS, workers=1))
+        pooled = sorted(iter_optimize_program(jobs, self.SETTINGS, workers=2), key=lambda r: r['index'])
+        self.assertEqual(pooled, sequential)
+        self.assertIn('error', sequential[2])
+
+        g83 = sequential[0]
+        scalar = DrillingAnalysisEngine.calculate_optimized_params(
+            0.5, -3.0, current_s=8000.0, prefer_ijk=False, **self.SETTINGS)
+        self.assertEqual((g83['static']['F'], g83['rpm']), (scalar['F'], 8000))
+        self.assertLessEqual(g83['static']['Q'], scalar['Q'])
+
+        t3_line = parser.tools_data[2]['line_index']
+        t3_text = parser.nc_lines[t3_line]
+        self.assertEqual(apply_results(parser, sequential), {'applied': 2, 'rpm_conflicts': []})
+        self.assertEqual(parser.nc_lines[t3_line], t3_text)
+        rec = parser.tools_data[0]
+        self.assertAlmostEqual(rec['static_params']['Q'], g83['static']['Q'])
+        self.assertAlmostEqual(rec['static_params']['F'], g83['static']['F'])
+        self.assertEqual(len(rec['dynamic_params']), len(g83['dynamic']))
+        self.assertTrue(parser.nc_lines[parser.tools_data[1]['line_index']].startswith("G66 P9131 R-0.2 Z-2.9"))
+        written = parser.tools_data[1]['dynamic_params']
+        self.assertEqual(len(written), len(sequential[1]['dynamic']))
+        for got, want in zip(written, sequential[1]['dynamic']):
+            for key in 'IJK':
+                self.assertAlmostEqual(got[key], want[key], places=4)
+
+    def test_apply_reports_shared_spindle_line_conflicts(self):
+        source = (b"T1 M06\n(D0.5 DRILL)\nS8000 M03\nG83 X0 Y0 R1. Z-3. Q.3 F50\nG80\n"
+                  b"G83 X5. Y0 R1. Z-1. Q.3 F50\nG80\nM30\n")
+        parser = RokuNCParser()
+        parser.parse_bytes(source)
+        results = list(iter_optimize_program(build_jobs(parser), self.SETTINGS, workers=1))
+        results[0]['rpm'], results[1]['rpm'] = 9000, 10000
+        report = apply_results(parser, results)
+        self.assertEqual(report['applied'], 2)
+        self.assertEqual(report['rpm_conflicts'], [{'line': 2, 'rpms': {0: 9000, 1: 10000}}])
+        self.assertEqual(parser.nc_lines[2], "S8000 M03\n")
+        self.assertEqual([rec['rpm'] for rec in parser.tools_data], [8000, 8000])
+
+        parser = RokuNCParser()
+        parser.parse_bytes(source.replace(b"M30", b"G98 G83 X9. Y0 R1. Z-2. Q.3 F50 L3 M08\nG80\nM30"))
+        results = list(iter_optimize_program(build_jobs(parser), self.SETTINGS, workers=1))
+        for res in results:
+            res['rpm'] = 9000
+        calls = []
+        reparse = parser.reparse_lines
+        parser.reparse_lines = lambda *args: calls.append(args) or reparse(*args)
+        self.assertEqual(apply_results(parser, results)['rpm_conflicts'], [])
+        self.assertEqual(calls, [])  # G98 / L3 / M08 保留在原位，不需重新解析
+        line = parser.nc_lines[parser.tools_data[2]['line_index']]
+        self.assertTrue(line.startswith("G98 G83 X9. Y0 "))
+        self.assertTrue(line.endswith(" L3 M08\n"))
+        self.assertEqual(parser.tools_data[2]['hole_count'], 3)
+        self.assertEqual(parser.nc_lines[2], "S9000 M03\n")
+        self.assertEqual([rec['rpm'] for rec in parser.tools_data], [9000, 9000, 9000])
+
+if __name__ == '__main__':
+    unittest.main()
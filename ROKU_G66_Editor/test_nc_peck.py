@@ -0,0 +1,63 @@
+import unittest
+import random
+
+import numpy as np
+
+from nc_parser import RokuNCParser
+from nc_timing import estimate_program_time
+from nc_peck import PeckSchedule, PeckLimitError
+from analysis_engine import DrillingAnalysisEngine
+
+class TestPeckSchedule(unittest.TestCase):
+    def test_matches_loop_schedule(self):
+        rng = random.Random(22)
+        for _ in range(300):
+            r_point = rng.uniform(-1.0, 3.0)
+            z_bottom = r_point + rng.choice([-1, 1]) * rng.uniform(0.0, 8.0)
+            first, reduction = rng.uniform(0.01, 1.0), rng.choice([0.0, 0.1, rng.uniform(0.0, 0.3)])
+            minimum = rng.choice([0.0, 0.1, rng.uniform(0.01, 0.2)])
+            schedule = PeckSchedule(r_point, z_bottom, first, reduction, minimum, max_pecks=None)
+            incs, z, peck = [], r_point, first
+            sign = -1.0 if z_bottom < r_point else 1.0
+            while abs(z_bottom - z) >= 1e-6 and peck >= 1e-6:
+                step = min(peck, abs(z_bottom - z))
+                incs.append(step)
+                z += sign * step
+                peck = max(peck - reduction, minimum)
+            self.assertEqual(schedule.count, len(incs))
+            np.testing.assert_allclose(schedule.increments(), incs, atol=1e-9)
+            np.testing.assert_allclose(schedule.z_positions()[-1:], [z] if incs else [], atol=1e-9)
+            expanded = [inc for inc, n in schedule.runs() for _ in range(n)]
+            np.testing.assert_allclose(np.abs(expanded), incs, atol=1e-9)
+
+    def test_tiny_peck_is_counted_without_expanding(self):
+        schedule = PeckSchedule(0.0, -20.0, 1.0, 0.1, 1e-5)
+        self.assertEqual(schedule.count, 10 + 1450000)  # 1.0, 0.9 ... 0.1 後每跳 1e-5
+        self.assertTrue(schedule.exceeds_limit)
+        with self.assertRaises(PeckLimitError):
+            schedule.increments()
+        # J 遞減至 0 且無 K 下限：啄鑽量歸零後停止
+        self.assertEqual(PeckSchedule(0.0, -20.0, 1.0, 0.3, 0.0).count, 4)
+        parser = RokuNCParser()
+        self.assertEqual(parser._g83_to_ijk({'R': 0.0, 'Z': -20.0, 'Q': 1e-5}), [])
+        self.assertEqual(len(parser._g83_to_ijk({'R': 0.0, 'Z': -20.0, 'Q': 0.01})), 2000)
+
+    def test_over_limit_cycle_is_timed_from_runs(self):
+        parser = RokuNCParser()
+        data = parser.parse_bytes(b"T1 M06\nG83 X0 Y0 Z-20. R1. Q.001 F50\nG80\nM30\n")
+        self.assertEqual(data[0]['dynamic_params'], [])  # 21000 跳，超過展開上限
+        schedule = parser.peck_schedule(data[0]['static_params'])
+        self.assertEqual(schedule.count, 21000)
+        per_hole = DrillingAnalysisEngine.calc_peck_runs_time(schedule.runs(), 50, 1.0, 5000.0)
+        self.assertGreater(per_hole, 0.0)
+        result = estimate_program_time(parser, g0_speed=5000.0)
+        self.assertAlmostEqual(result['tools']['1']['cycle_time'], per_hole)
+        res = DrillingAnalysisEngine.compare_efficiency(
+            {'schedule': schedule, 'feedrate': 50, 'r_point': 1.0},
+            {'schedule': parser.peck_schedule({'R': 1.0, 'Z': -20.0, 'Q': 0.5}), 'feedrate': 50, 'r_point': 1.0},
+            'G83', 5000.0)
+        self.assertEqual((res['curr_pecks'], res['init_pecks']), (21000, 42))
+        self.assertLess(res['save_pct'], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+from nc_record import CycleRecord, FrozenParams
+
+class TestCycleRecord(unittest.TestCase):
+    def test_dict_interface_and_lazy_params(self):
+        initial = FrozenParams({'Z': -2.9, 'R': -0.2})
+        rec = CycleRecord(tool_id='T5', line_index=3, initial_static=initial, initial_dynamic=())
+        self.assertEqual(rec['tool_id'], 'T5')
+        self.assertNotIn('rpm', rec)
+        self.assertIn('static_params', rec)
+        with self.assertRaises(TypeError):
+            initial['Z'] = 0.0
+        # 修改 static_params 不影響共用的初始快照
+        rec['static_params']['Z'] = -3.0
+        self.assertEqual(initial['Z'], -2.9)
+        rec['current_life_index'] = 1
+        self.assertEqual(rec.get('current_life_index'), 1)
+        copied = rec.copy()
+        copied['static_params']['Z'] = -4.0
+        self.assertEqual(rec['static_params']['Z'], -3.0)
+        self.assertEqual(copied['initial_static'], {'Z': -2.9, 'R': -0.2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from nc_parser import RokuNCParser
+from nc_retract import optimize_retract
+
+class TestRetractPlan(unittest.TestCase):
+    PROGRAM = (b"T1 M06\nG90 G0 X0 Y0\nG43 H1 Z20.\nS8000 M03\n"
+               b"G99 G83 X0. Y0. Z-3. R2. Q.5 F100\nX10. Y0.\nX20. Y0.\nX20. Y30.\nG80\nG0 Z50.\n"
+               b"G66 P9131 R2. Z-2.9 S1. I-1. J.1 K5.\nX0. Y0.\nX5. Y0.\nG67\nM30\n")
+
+    def setUp(self):
+        self.parser = RokuNCParser()
+        self.parser.parse_bytes(self.PROGRAM)
+
+    def test_g83_obstacle_row_uses_g98(self):
+        # 夾具擋在 X20 Y0 → X20 Y30 之間：只有該孔以 G98 退回起始點，其餘降低 R 後以 G99 移動
+        plan = optimize_retract(self.parser, 0, 0.0, [[18., 10., 22., 20., 5.]])
+        self.assertEqual(plan['R'], (2.0, 0.3))
+        self.assertEqual(plan['modes'], ['G99', 'G99', 'G98', 'G99'])
+        lines = [line.strip() for line in self.parser.nc_lines]
+        self.assertEqual(lines[4:8], ["G99 G83 X0. Y0. Z-3. R0.3 Q.5 F100", "X10. Y0.", "G98 X20. Y0.", "G99 X20. Y30."])
+        data = self.parser.tools_data[0]
+        self.assertEqual((data['hole_count'], data['static_params']['R'], data['retract_mode']), (4, 0.3, 'G99'))
+
+    def test_g66_lowers_r_and_s(self):
+        plan = optimize_retract(self.parser, 1, 0.0)
+        self.assertEqual((plan['R'], plan['S']), ((2.0, 0.3), (1.0, 0.1)))
+        self.assertGreater(plan['saved_time'], 0)
+        self.assertEqual(self.parser.nc_lines[10].strip(), "G66 P9131 R0.3 Z-2.9 S0.1 I-1. J.1 K5.")
+
+if __name__ == '__main__':
+    unittest.main()
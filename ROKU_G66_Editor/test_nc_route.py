@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+
+from nc_parser import RokuNCParser
+from nc_route import optimize_order, path_length
+
+class TestHoleOrder(unittest.TestCase):
+    def test_optimize_order_keeps_endpoints(self):
+        rng = np.random.default_rng(0)
+        pts = rng.uniform(0, 100, (200, 2))
+        order = optimize_order(pts, fixed_end=True)
+        self.assertEqual(sorted(order.tolist()), list(range(200)))
+        self.assertEqual((order[0], order[-1]), (0, 199))
+        self.assertLess(path_length(pts, order), 0.5 * path_length(pts))
+
+    def test_reorder_cycle_body(self):
+        parser = RokuNCParser()
+        data = parser.parse_bytes(b"T1 M06\nG90 G0 X0 Y0\nG83 X0. Y0. Z-5. R1. Q1. F100\n"
+                                  b"X50. Y50.\nX10. (C)\nY10.\nX40. Y40. K2\nX20. Y20.\nG80\nG0 X0 Y0\nM30\n")
+        holes = sorted(map(tuple, data[0]['holes'].tolist()))
+        res = parser.reorder_cycle_holes(0, g0_speed=5000.0)
+        self.assertLess(res['after_length'], res['before_length'])
+        self.assertAlmostEqual(res['saved_time'], (res['before_length'] - res['after_length']) / 5000.0)
+        self.assertEqual(parser.nc_lines[2], "G83 X0. Y0. Z-5. R1. Q1. F100\n")
+        # 重排後各單節改寫為完整的 X、Y，保留 K 與註解
+        self.assertIn("X10. Y50. (C)\n", list(parser.nc_lines))
+        self.assertIn("X40. Y40. K2\n", list(parser.nc_lines))
+        self.assertEqual(sorted(map(tuple, data[0]['holes'].tolist())), holes)
+        self.assertEqual(data[0]['hole_count'], 7)
+
+if __name__ == '__main__':
+    unittest.main()
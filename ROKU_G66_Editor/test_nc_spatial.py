@@ -0,0 +1,22 @@
+import unittest
+
+from nc_parser import RokuNCParser
+
+class TestHoleIndex(unittest.TestCase):
+    def test_duplicates_chains_and_nearest(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(b"T5 M06\nG90 G0 X0 Y0\nG83 X0. Y0. Z-.2 R1. Q.2 F100\nX10.\nG80\n"
+                           b"T1 M06\nG83 X0. Y0. Z-2. R1. Q.2 F50\nX10.\nX20.\nX10.0001\nG80\nM30\n")
+        index = parser.hole_index()
+        self.assertIs(parser.hole_index(), index)
+        self.assertEqual(len(index), 6)
+        # T1 在 X10 重複鑽孔 (容許誤差 0.001 內)；T5 中心鑽 → T1 鑽頭的位置
+        self.assertEqual([(d['tool_id'], d['holes']) for d in index.duplicates()], [("1", [(1, 1), (1, 3)])])
+        self.assertEqual(index.chain_summary(), {("5", "1"): 1, ("5", "1", "1"): 1})
+        idx, dist = index.nearest(19., 0., k=2)
+        self.assertEqual(index.location(idx[0]), (1, 2))
+        self.assertAlmostEqual(dist[1], 8.9999, places=6)
+        self.assertEqual(sorted(index.location(i) for i in index.within(10., 0., 0.01)), [(0, 1), (1, 1), (1, 3)])
+
+if __name__ == '__main__':
+    unittest.main()
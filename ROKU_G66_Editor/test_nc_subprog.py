@@ -0,0 +1,30 @@
+import unittest
+import os
+import tempfile
+
+from nc_parser import RokuNCParser
+from nc_timing import estimate_program_time
+from nc_subprog import expand_program_time
+
+class TestSubprogram(unittest.TestCase):
+    def test_calls_multiply_holes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            main = os.path.join(tmp_dir, "main.nc")
+            with open(main, "w") as f:
+                f.write("%\nO1000\nT1 M06\nG90 G0 X0 Y0\nS8000 M03\nM98 P2000 L3\nM98 P43000\n"
+                        "G65 P9131 R1. Z-2.\nM98 P5555\nM30\n"
+                        "O2000\nG99 G83 X0. Y0. Z-3. R1. Q.5 F100\nX10.\nG80\nM98 P3000 L2\nM99\n%\n")
+            # 子程式資料夾中的 O3000 沒有換刀：孔數歸於呼叫端的 T1
+            with open(os.path.join(tmp_dir, "O3000.nc"), "w") as f:
+                f.write("O3000\nG99 G83 X5. Y5. Z-3. R1. Q.5 F100\nG80\nM99\n")
+            parser = RokuNCParser()
+            parser.parse_file(main)
+            res = expand_program_time(parser, tmp_dir)
+            self.assertEqual(res['programs'], {1000: 1, 2000: 3, 3000: 10})
+            self.assertEqual((res['holes'], res['calls'], res['unresolved']), (16, 13, [5555]))
+            self.assertEqual(list(res['tools']), ["1"])
+            single = estimate_program_time(parser)
+            self.assertAlmostEqual(res['cycle_time'], single['cycle_time'] / 2 * 16)
+
+if __name__ == '__main__':
+    unittest.main()
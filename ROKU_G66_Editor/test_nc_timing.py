@@ -0,0 +1,118 @@
+import math
+import unittest
+
+import numpy as np
+
+import nc_timing
+from nc_parser import RokuNCParser
+from nc_peck import PeckSchedule
+from nc_timing import estimate_program_time, iter_move_windows, _cycle_hole_time
+from analysis_engine import DrillingAnalysisEngine
+
+class TestProgramTime(unittest.TestCase):
+    def test_moves_arcs_dwell_and_cycles(self):
+        parser = RokuNCParser()
+        data = parser.parse_bytes(b"T1 M06\nG90 G0 X0 Y0 Z10.\n"  # 程式開頭位置未知，第一個定位不計時
+                                  b"G1 Z0 F100\nX30.\n"
+                                  b"G3 X30. Y0 Z-2. I-10. J0\n"  # 整圓螺旋
+                                  b"G04 P1500\nG0 Z10.\n"
+                                  b"T2 M06\nG83 X10. Z-1. R1. Q.5 F50\nX20.\nG80\nM30\n")
+        self.assertEqual([rec['end_line'] for rec in data], [10])
+        result = estimate_program_time(parser, g0_speed=5000.0, tool_change_sec=6.0)
+        t1, t2 = result['tools']['1'], result['tools']['2']
+        helix = np.hypot(20 * np.pi, 2.0)
+        self.assertAlmostEqual(t1['feed_time'], (10 + 30 + helix) / 100)
+        self.assertAlmostEqual(t1['rapid_time'], 12 / 5000)
+        self.assertAlmostEqual(t1['dwell_time'], 1.5 / 60)
+        per_hole = DrillingAnalysisEngine.calc_drilling_time(data[0]['dynamic_params'], 50, 1.0, 5000.0, False)
+        self.assertAlmostEqual(t2['cycle_time'], 2 * per_hole)
+        self.assertAlmostEqual(t2['rapid_time'], 30 / 5000)  # (30, 0) → (10, 0) → (20, 0)
+        self.assertEqual((t2['holes'], result['tool_changes'], result['unknown_moves']), (2, 2, 1))
+        self.assertAlmostEqual(result['total_time'], t1['total_time'] + t2['total_time'])
+        self.assertAlmostEqual(t1['total_time'], t1['feed_time'] + t1['rapid_time'] + t1['dwell_time'] + 0.1)
+
+    def _estimate(self, source):
+        parser = RokuNCParser()
+        parser.parse_bytes(source)
+        return parser, estimate_program_time(parser, g0_speed=5000.0, tool_change_sec=6.0)
+
+    def test_incremental_moves(self):
+        _, result = self._estimate(b"T1 M06\nG90 G0 X0 Y0 Z0\nG91 G1 X10. F100\nX10. Y10.\nG90 G0 X0 Y0\nM30\n")
+        t1 = result['tools']['1']
+        self.assertAlmostEqual(t1['feed_time'], (10 + np.hypot(10, 10)) / 100)
+        self.assertAlmostEqual(t1['rapid_time'], np.hypot(20, 10) / 5000)  # (20, 10) → (0, 0)
+        self.assertEqual(result['unknown_moves'], 1)  # 程式開頭的第一個定位
+
+    def test_reference_return_makes_axis_unknown(self):
+        # G28 本身與其後第一個 Z 移動無法計時；X/Y 不受影響，Z 有絕對值後恢復
+        _, result = self._estimate(b"T1 M06\nG90 G0 X0 Y0 Z0\nG91 G28 Z0\nG90 G0 X10. Y0\n"
+                                   b"G1 Z-1. F100\nG0 Z5.\nM30\n")
+        t1 = result['tools']['1']
+        self.assertAlmostEqual(t1['rapid_time'], (10 + 6) / 5000)
+        self.assertEqual(t1['feed_time'], 0.0)
+        self.assertEqual(result['unknown_moves'], 3)
+
+    def test_set_position_is_not_a_move(self):
+        _, result = self._estimate(b"T1 M06\nG92 X0 Y0 Z0\nG0 X5.\nG10 L2 P1 X9.\nG04 X2.\nG1 X6.\nM30\n")
+        t1 = result['tools']['1']
+        self.assertAlmostEqual(t1['rapid_time'], 5 / 5000)
+        self.assertAlmostEqual(t1['dwell_time'], 2 / 60)
+        self.assertEqual(t1['feed_time'], 0.0)
+        self.assertEqual(result['unknown_moves'], 1)  # G1 沒有進給速度
+
+    def test_arcs_in_each_plane(self):
+        # R 格式：弦長 10、R10 為 60 度；R-10 為大於 180 度的 300 度。最後一個為 G19 整圓加 X 螺旋
+        _, result = self._estimate(b"T1 M06\nG92 X0 Y0 Z0\nG2 X10. R10. F100\nG2 X20. R-10.\n"
+                                   b"G18 G3 X30. Z0 I5. K0\nG19 G2 Y10. Z0 J5. K0\nG19 G2 Y10. Z0 X33. J0 K-2.\nM30\n")
+        arcs = [10 * math.pi / 3, 50 * math.pi / 3, 5 * math.pi, 5 * math.pi, math.hypot(4 * math.pi, 3)]
+        self.assertAlmostEqual(result['tools']['1']['feed_time'], sum(arcs) / 100)
+        self.assertEqual(result['unknown_moves'], 0)
+
+    def test_windows_carry_modal_state(self):
+        source = (b"T1 M06\nG92 X0 Y0 Z0\n(COMMENT)\n(COMMENT)\nG91 G1 X1. F100\nX1.\nG18\nG2 X2. I1. K0\n"
+                  b"G90 G0 Z5.\nG83 X1. Y0 R1. Z-1. Q.5 F50\nX2.\nG80\nM30\n")
+        _, expected = self._estimate(source)
+        window = nc_timing._WINDOW_LINES
+        nc_timing._WINDOW_LINES = 2
+        try:
+            parser, result = self._estimate(source)
+            windows = list(iter_move_windows(parser))
+        finally:
+            nc_timing._WINDOW_LINES = window
+        self.assertEqual(result, expected)
+        self.assertEqual(len(windows), 6)  # 只有註解的視窗沒有單節
+        rows = np.concatenate([win.rows for win in windows])
+        cutting = np.concatenate([win.cutting for win in windows])
+        self.assertEqual(rows[cutting].tolist(), [4, 5, 7])
+        self.assertFalse(np.concatenate([win.rapid for win in windows])[rows >= 9].any())  # 循環本體不是移動
+
+    def test_cycle_hole_time_branches(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(b"T1 M06\nG90 G0 X0 Y0 Z5.\n"
+                           b"G66 P9131 Z-2.9 I-1. J.1 K5.\nX0.\nG67\n"
+                           b"G66 P9131 R-.2 Z-2.9 I-1. J.1 K5.\nX1.\nG67\n"
+                           b"G83 X2. Y0 R1. Z-2. Q.5\nG80\n"
+                           b"G83 X3. R1. Z-20. Q.001 F50\nG80\n"
+                           b"G83 X4. R1. Z-20. I.001 J.000000001 K.0001 F50\nG80\nM30\n")
+        no_r, g66, g83, over, decrease = parser.tools_data
+        self.assertIsNone(_cycle_hole_time(no_r, 80.0, 5000.0))
+        static, dynamic = g66.current_params()
+        self.assertAlmostEqual(_cycle_hole_time(g66, 80.0, 5000.0),
+                               DrillingAnalysisEngine.calc_g66_drilling_time(dynamic, -0.2, 5000.0))
+        # 循環行沒有 F 時使用模態進給；兩者皆無或不可計時則為 None
+        static, dynamic = g83.current_params()
+        self.assertAlmostEqual(_cycle_hole_time(g83, 80.0, 5000.0),
+                               DrillingAnalysisEngine.calc_drilling_time(dynamic, 80.0, 1.0, 5000.0, False))
+        self.assertIsNone(_cycle_hole_time(g83, math.nan, 5000.0))
+        self.assertIsNone(_cycle_hole_time(g83, 5e-324, 5000.0))
+        # 超過展開上限：以啄鑽排程的連續段計時；遞減段本身超過上限時無法計時
+        static, dynamic = over.current_params()
+        self.assertEqual(len(dynamic), 0)
+        runs = PeckSchedule.from_params(static).runs()
+        self.assertAlmostEqual(_cycle_hole_time(over, 80.0, 5000.0),
+                               DrillingAnalysisEngine.calc_peck_runs_time(runs, 50.0, 1.0, 5000.0))
+        self.assertEqual(len(decrease.current_params()[1]), 0)
+        self.assertIsNone(_cycle_hole_time(decrease, 80.0, 5000.0))
+
+if __name__ == '__main__':
+    unittest.main()
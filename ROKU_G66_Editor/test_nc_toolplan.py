@@ -0,0 +1,38 @@
+import unittest
+
+from nc_parser import RokuNCParser
+from nc_toolplan import plan_tool_changes, consolidate_tool_changes
+
+class TestToolChangePlan(unittest.TestCase):
+    PROGRAM = (b"G90 G54\n"
+               b"(SPOT)\nT5 M06\nG0 G90 X0 Y0\nS3000 M03\nG81 X0 Y0 Z-.2 R1. F100\nG80\nG91 G28 Z0\n"
+               b"(DRILL)\nT1 M06\nG0 G90 X0 Y0\nS8000 M03\nG83 X0 Y0 Z-2. R1. Q.2 F50\nX10.\nG80\nG91 G28 Z0\n"
+               b"T5\nM06\nG0 G90 X50. Y0\nS3000 M03\nG81 X50. Y0 Z-.2 R1. F100\nG80\nG91 G28 Z0\n"
+               b"T1 M06 (AGAIN)\nG0 G90 X50. Y0\nS8000 M03\nG83 X50. Y0 Z-2. R1. Q.2 F50\nG80\nG91 G28 Z0\nM30\n")
+
+    def _parse(self):
+        parser = RokuNCParser()
+        parser.parse_bytes(self.PROGRAM)
+        return parser
+
+    def test_merge_repeated_tools(self):
+        parser = self._parse()
+        report = consolidate_tool_changes(parser, tool_change_sec=6.0)
+        self.assertEqual([s['tool_id'] for s in report['sequence']], ['5', '5', '1', '1'])
+        self.assertEqual((report['tool_changes_after'], report['saved_time']), (2, 0.2))
+        lines = [line.strip() for line in parser.nc_lines]
+        self.assertEqual(lines.count("T5 M06") + lines.count("T1 M06"), 2)
+        self.assertNotIn("M06", lines)
+        self.assertIn("(AGAIN)", lines)
+        self.assertEqual(lines[-1], "M30")
+        self.assertEqual([(d['line_index'], d['hole_count']) for d in parser.tools_data],
+                         [(lines.index("G83 X0 Y0 Z-2. R1. Q.2 F50"), 2), (len(lines) - 4, 1)])
+
+    def test_precedence_blocks_move(self):
+        # T1 必須先於 T5：第二個 T5 不能搬到 T1 之前，只有第二個 T1 可以往前合併
+        plan = plan_tool_changes(self._parse(), precedence=[("T1", "5")])
+        self.assertEqual([(s['tool_id'], s['merged']) for s in plan['sequence']],
+                         [('5', False), ('1', False), ('1', True), ('5', False)])
+
+if __name__ == '__main__':
+    unittest.main()
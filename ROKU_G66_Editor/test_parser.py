@@ -1,6 +1,9 @@
 import unittest
 import os
-from nc_parser import RokuNCParser
+import random
+import shutil
+import tempfile
+from nc_parser import RokuNCParser, PARALLEL_MIN_CHUNK_BYTES, auto_parse_workers
 
 class TestRokuParser(unittest.TestCase):
     def setUp(self):
@@ -68,10 +71,133 @@ class TestRokuParser(unittest.TestCase):
         with open("test_output.nc", "r") as f:
             content = f.read()
             
-        # [修正] :g 格式會移除尾端 .0 (如 -3.0 → -3, 20.0 → 20)
+        # 寫回時移除尾端 .0 (如 -3.0 → -3, 20.0 → 20)
         # 全零組 (I0 J0 K0) 會被 _is_zero_set 過濾而不輸出
         expected_fragment = "G66 P9131 R-0.5 Z-3 S0.05 I-1.5 J0.1 K20"
         self.assertIn(expected_fragment, content)
 
+    def test_incremental_reparse(self):
+        data = self.parser.parse_file(self.test_file)
+        # G66 指令行本身不呼叫宏程式，本體 X10. Y10. 計 1 孔
+        self.assertEqual(data[0]['hole_count'], 1)
+        self.assertEqual(data[0]['holes'].tolist(), [[10.0, 10.0]])
+        # 刪除循環本體的孔位 (改為取消指令)：只重新解析受影響範圍，孔數就地更新
+        self.parser.nc_lines[6] = "G80\n"
+        self.assertTrue(self.parser.reparse_lines(6))
+        self.assertIs(self.parser.tools_data, data)
+        self.assertEqual(data[0]['hole_count'], 0)
+
+        self.parser.update_spindle_speed(0, 9000)
+        self.assertEqual(data[0]['rpm'], 9000)
+        self.assertEqual(data[0]['initial_rpm'], 8000)
+
+    def test_edits_update_records_in_place(self):
+        parser = RokuNCParser()
+        data = parser.parse_bytes(b"T1 M06\nS8000 M03\nG83 X0 Y0 Z-2. R1. Q.5 F50\nG80\n"
+                                  b"G98 G83 X5. Y0 Z-3. R1. Q.5 F50 L2\nG80\nM30\n")
+        revision = parser._revision
+        static = dict(data[0]['static_params'], Z=-2.123456789, Q=1 / 3)
+        parser.update_g66_line(0, static, [])
+        self.assertEqual(parser.nc_lines[2], "G83 X0 Y0 Z-2.123457 R1 Q0.333333 F50\n")
+        self.assertEqual(parser._revision, revision)  # 只改循環參數：不重新解析
+        self.assertEqual(data[0]['static_params']['Q'], 1 / 3)
+        # 同一 S 指令下的循環一併更新
+        parser.update_spindle_speed(0, 9000)
+        self.assertEqual([rec['rpm'] for rec in data], [9000, 9000])
+        self.assertEqual(parser._revision, revision)
+        # G98 與 L2 保留在原位：孔數不變，也不需重新解析
+        static = dict(data[1]['static_params'], Q=1 / 7)
+        parser.update_g66_line(1, static, [])
+        self.assertEqual(parser.nc_lines[4], "G98 G83 X5. Y0 Z-3 R1 Q0.142857 F50 L2\n")
+        self.assertEqual(parser._revision, revision)
+        self.assertEqual(data[1]['hole_count'], 2)
+        self.assertEqual(data[1]['static_params']['Q'], 1 / 7)
+        self.assertEqual(data[0]['static_params']['Q'], 1 / 3)
+
+    def test_streaming_matches_full_parse(self):
+        full = RokuNCParser().parse_file(self.test_file)
+        streaming_parser = RokuNCParser()
+        # 極小區塊大小，強制循環跨越多個區塊
+        records = list(streaming_parser.iter_parse(self.test_file, chunk_bytes=16))
+        self.assertEqual(len(records), len(full))
+        self.assertEqual(records[0]['hole_count'], full[0]['hole_count'])
+        self.assertEqual(records[0]['dynamic_params'], full[0]['dynamic_params'])
+
+        streaming_parser.update_g66_line(0, {'R': -0.5, 'Z': -3.0}, [{'I': -1.5, 'J': 0.1, 'K': 20.0}])
+        # 修改的行暫存於 overlay，依需求讀取
+        self.assertEqual(streaming_parser.nc_lines[5], "G66 P9131 R-0.5 Z-3 I-1.5 J0.1 K20\n")
+        streaming_parser.save_file("test_output.nc")
+        with open("test_output.nc", "r") as f:
+            self.assertIn("G66 P9131 R-0.5 Z-3 I-1.5 J0.1 K20", f.read())
+        # 重新解析時關閉前一個檔案映射；with 結束時關閉目前的映射
+        mapped = streaming_parser.nc_lines
+        streaming_parser.parse_file(self.test_file, streaming=False)
+        self.assertTrue(mapped._file.closed)
+        with RokuNCParser() as parser:
+            list(parser.iter_parse(self.test_file))
+        self.assertTrue(parser.nc_lines._file.closed)
+
+class TestParallelParse(unittest.TestCase):
+    """平行分區塊解析的結果必須與單程序解析完全相同。"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, content, encoding='utf-8'):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            f.write(content)
+        return path
+
+    def _random_program(self, seed, n_lines=1500):
+        rng = random.Random(seed)
+        lines = []
+        for i in range(n_lines):
+            r = rng.random()
+            if r < 0.04: lines.append(f"T{rng.randrange(1, 8)} M06\n")
+            elif r < 0.07: lines.append(f"(D{rng.choice(['0', '0.5', '1.', '.25'])} DRILL)\n")
+            elif r < 0.10: lines.append(f"G83 R1. Z-{rng.randrange(1, 9)}. Q0.5 F100\n")
+            elif r < 0.12: lines.append("G66 P9131 R-.2 Z-2.9 S.1 T200 I-1. J.1 K5.\n")
+            elif r < 0.14: lines.append(rng.choice(["G80\n", "G67\n", "G0 X1.\n", "M30\n"]))
+            elif r < 0.17: lines.append(f"S{rng.randrange(1000, 9000)} M03\n")
+            elif r < 0.18: lines.append("G83 X1. K0 Z-1. R1. Q.5\n")
+            elif r < 0.19: lines.append("(X1. Y1. COMMENT)\n")
+            else: lines.append(f"X{i}. Y{i}.\n")
+        return ''.join(lines)
+
+    def _assert_same(self, path, chunk_sizes):
+        sequential = RokuNCParser()
+        expected = sequential.parse_file(path, workers=1)
+        for chunk_bytes in chunk_sizes:
+            parallel = RokuNCParser()
+            self.assertEqual(parallel.parse_file(path, workers=2, chunk_bytes=chunk_bytes), expected)
+            self.assertEqual(parallel.tool_diameters, sequential.tool_diameters)
+            self.assertEqual(parallel.file_encoding, sequential.file_encoding)
+
+    def test_random_programs(self):
+        for seed in range(3):
+            path = self._write(f"rand{seed}.nc", self._random_program(seed))
+            self._assert_same(path, (64, 700, 1 << 20))
+
+    def test_cycle_and_diameter_across_chunk_boundary(self):
+        body = "X1. Y1.\n" * 50
+        program = "T1 M06\nS5000 M03\nG83 R1. Z-2. Q.5\n" + body + "T2 M06\n" + body + "(D0.3 DRILL)\nG80\n"
+        path = self._write("boundary.nc", program)
+        self._assert_same(path, (16, 100, 333))
+
+    def test_auto_workers_need_cores_and_chunks(self):
+        # 單核心或不足兩個區塊時不建立程序池；程序數不超過核心數與區塊數
+        self.assertEqual(auto_parse_workers(64 * PARALLEL_MIN_CHUNK_BYTES, cpu_count=1), 1)
+        self.assertEqual(auto_parse_workers(2 * PARALLEL_MIN_CHUNK_BYTES - 1, cpu_count=8), 1)
+        self.assertEqual(auto_parse_workers(3 * PARALLEL_MIN_CHUNK_BYTES, cpu_count=8), 3)
+        self.assertEqual(auto_parse_workers(64 * PARALLEL_MIN_CHUNK_BYTES, cpu_count=4), 4)
+
+    def test_cp950_program(self):
+        program = "(鑽孔 程式)\r\nT3 M06\r\nS8000 M03\r\nG66 P9131 R-.2 Z-1. I-.5 J.1 K1.\r\nX1. Y1.\r\nG67\r\n"
+        path = self._write("big5.nc", program * 20, encoding='cp950')
+        self._assert_same(path, (50, 400))
+
 if __name__ == '__main__':
     unittest.main()
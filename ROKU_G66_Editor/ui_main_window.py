@@ -6,14 +6,48 @@ from PyQt6.QtWidgets import (
     QGroupBox, QLabel, QLineEdit, QPushButton, QFileDialog, 
     QTableWidget, QTableWidgetItem, QMessageBox, QComboBox, 
     QDoubleSpinBox, QFormLayout, QSplitter, QHeaderView, QAbstractItemView,
-    QSpinBox, QListWidget, QTextEdit
+    QSpinBox, QListWidget, QTextEdit, QToolTip, QProgressDialog
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QEvent, QThread, pyqtSignal
+from PyQt6.QtGui import QCursor
 
 from nc_parser import RokuNCParser
+from nc_cache import ParseCache
 from ui_components import DrillingPlot, ParamTable
 from analysis_engine import DrillingAnalysisEngine
 from config_manager import ConfigManager
+from nc_timing import DEFAULT_G0_SPEED, DEFAULT_TOOL_CHANGE_SEC
+from nc_toolplan import plan_tool_changes, consolidate_tool_changes
+from nc_retract import optimize_retract, stock_top_z
+from nc_subprog import expand_program_time
+from nc_aircut import StockMap, plan_air_cuts, apply_air_cuts
+from nc_peck import PeckSchedule, PeckLimitError
+from nc_optimize import build_jobs, iter_optimize_program, apply_results
+
+class OptimizeWorker(QThread):
+    """
+    「全部最佳化」的背景執行緒：驅動 iter_optimize_program (程序池) 並回報進度，不修改 parser。
+    requestInterruption() 後於下一個結果到達時停止 (尚未開始的工作隨即取消)。
+    """
+    progressChanged = pyqtSignal(int)  # 已完成的循環數
+
+    def __init__(self, jobs, settings, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self.settings = settings
+        self.results = []
+        self.error = None
+
+    def run(self):
+        try:
+            for res in iter_optimize_program(self.jobs, self.settings):
+                self.results.append(res)
+                self.progressChanged.emit(len(self.results))
+                if self.isInterruptionRequested():
+                    break
+        except Exception as e:
+            self.error = e
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -21,11 +55,13 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("ROKU-ROKU G66 參數編輯器 (微細孔專用)")
         self.resize(1200, 750)
         
-        self.parser = RokuNCParser()
+        self.parse_cache = ParseCache()
+        self.parser = RokuNCParser(cache=self.parse_cache)
         self.analysis_engine = DrillingAnalysisEngine()
         self.current_file = None
         self.current_tool_index = -1
         self.parsed_data = []
+        self.optimize_worker = None
         
         self.setup_ui()
         
@@ -53,6 +89,39 @@ class MainWindow(QMainWindow):
         
         self.lbl_file = QLabel("尚未載入檔案")
         left_layout.addWidget(self.lbl_file)
+
+        self.lbl_run_time = QLabel("預估加工時間: --")
+        left_layout.addWidget(self.lbl_run_time)
+
+        self.btn_reorder = QPushButton("最佳化孔位順序")
+        self.btn_reorder.setToolTip("重新排列目前循環內的孔位加工順序，縮短 G0 定位距離")
+        self.btn_reorder.clicked.connect(self.on_reorder_holes_clicked)
+        self.btn_reorder.setEnabled(False)
+        left_layout.addWidget(self.btn_reorder)
+
+        self.btn_merge_tools = QPushButton("合併重複換刀")
+        self.btn_merge_tools.setToolTip("同一刀號多次呼叫時重排工序，每把刀只換一次")
+        self.btn_merge_tools.clicked.connect(self.on_merge_tool_changes_clicked)
+        self.btn_merge_tools.setEnabled(False)
+        left_layout.addWidget(self.btn_merge_tools)
+
+        self.btn_retract = QPushButton("最佳化退刀高度")
+        self.btn_retract.setToolTip("依工件上面與夾具位置降低 R / S 點，並逐孔選擇 G98 / G99 退刀")
+        self.btn_retract.clicked.connect(self.on_optimize_retract_clicked)
+        self.btn_retract.setEnabled(False)
+        left_layout.addWidget(self.btn_retract)
+
+        self.btn_check_holes = QPushButton("檢查孔位")
+        self.btn_check_holes.setToolTip("找出同一刀號重複加工的孔位，並統計不同刀號在同一位置的加工順序")
+        self.btn_check_holes.clicked.connect(self.on_check_holes_clicked)
+        self.btn_check_holes.setEnabled(False)
+        left_layout.addWidget(self.btn_check_holes)
+
+        self.btn_air_cut = QPushButton("偵測空切削")
+        self.btn_air_cut.setToolTip("找出全程在素材上方的 G1/G2/G3 進給移動，並可改寫為 G0 快速位移")
+        self.btn_air_cut.clicked.connect(self.on_air_cut_clicked)
+        self.btn_air_cut.setEnabled(False)
+        left_layout.addWidget(self.btn_air_cut)
         
         # Vertical Splitter for List and Preview
         left_splitter = QSplitter(Qt.Orientation.Vertical)
@@ -77,6 +146,8 @@ class MainWindow(QMainWindow):
         self.txt_nc_preview = QTextEdit()
         self.txt_nc_preview.setReadOnly(True)
         self.txt_nc_preview.setStyleSheet("background-color: #ffffff; font-family: Consolas, monospace; font-size: 11px;")
+        # 點選預覽中的上下文行：選取該行所屬的循環
+        self.txt_nc_preview.viewport().installEventFilter(self)
         layout_preview.addWidget(self.txt_nc_preview)
         left_splitter.addWidget(container_preview)
         
@@ -234,6 +305,16 @@ class MainWindow(QMainWindow):
         self.btn_optimize.clicked.connect(self.on_optimize_clicked)
         btn_smart_layout.addWidget(self.btn_optimize)
 
+        self.btn_optimize_all = QPushButton("⚡ 全部最佳化")
+        self.btn_optimize_all.setToolTip("以目前的材質、冷卻與刀具設定最佳化程式中的所有循環 (含 Q/J 微調)")
+        self.btn_optimize_all.setStyleSheet("""
+            QPushButton { background-color: #28a745; color: white; font-weight: bold; padding: 6px; }
+            QPushButton:hover { background-color: #218838; }
+        """)
+        self.btn_optimize_all.clicked.connect(self.on_optimize_all_clicked)
+        self.btn_optimize_all.setEnabled(False)
+        btn_smart_layout.addWidget(self.btn_optimize_all)
+
         # [新增] 單獨的微調按鈕：只微調 Q/J，不動 F
         self.btn_refine_peck = QPushButton("🪄 微調 Q/J")
         self.btn_refine_peck.setStyleSheet("""
@@ -354,7 +435,7 @@ class MainWindow(QMainWindow):
         form_machine = QFormLayout()
         self.spin_g0_speed = QDoubleSpinBox()
         self.spin_g0_speed.setRange(100, 40000)
-        self.spin_g0_speed.setValue(5000)
+        self.spin_g0_speed.setValue(self.config_manager.data.get('machine', {}).get('g0_speed', DEFAULT_G0_SPEED))
         self.spin_g0_speed.setSuffix(" mm/min")
         self.spin_g0_speed.valueChanged.connect(self.on_param_changed)
         self.lbl_g0_speed = QLabel("機台快速位移速度 (G0):")
@@ -462,30 +543,186 @@ class MainWindow(QMainWindow):
         path, _ = QFileDialog.getOpenFileName(self, "開啟 NC 檔案", "", "NC Files (*.nc *.tap *.txt)")
         if not path: return
         try:
+            self.parser.max_pecks = int(self.config_manager.get_limit('max_pecks'))
             self.parsed_data = self.parser.parse_file(path)
             self.current_file = path
             self.lbl_file.setText(os.path.basename(path))
-            self.tool_list.clear()
-            for item in self.parsed_data:
-                hole_count = item.get('hole_count', 0)
-                label = f"{item['tool_id']} (行 {item['line_index'] + 1}) - {hole_count} 孔"
-                self.tool_list.addItem(label)
+            self.refresh_tool_list()
+            self.update_run_time()
+            self.btn_merge_tools.setEnabled(True)
+            self.btn_air_cut.setEnabled(True)
             if self.parsed_data:
                 self.tool_list.setCurrentRow(0)
                 self.btn_close.setEnabled(True)
+                self.btn_reorder.setEnabled(True)
+                self.btn_optimize_all.setEnabled(True)
+                self.btn_retract.setEnabled(True)
+                self.btn_check_holes.setEnabled(True)
             else:
                 QMessageBox.warning(self, "提示", "檔案中未發現 G66 P9131 或 G83 循環。")
         except Exception as e:
             QMessageBox.critical(self, "錯誤", f"無法讀取檔案: {str(e)}")
 
+    def refresh_tool_list(self):
+        self.tool_list.clear()
+        for item in self.parsed_data:
+            hole_count = item.get('hole_count', 0)
+            label = f"{item['tool_id']} (行 {item['line_index'] + 1}) - {hole_count} 孔"
+            self.tool_list.addItem(label)
+
+    def update_run_time(self):
+        """整份程式 (展開子程式呼叫) 的預估加工時間，各刀號明細於提示文字。"""
+        machine = self.config_manager.data.get('machine', {})
+        library_dir = self.config_manager.data.get('subprogram_dir') or (
+            os.path.dirname(self.current_file) if self.current_file else None)
+        res = expand_program_time(self.parser, library_dir, self.spin_g0_speed.value(),
+                                  machine.get('tool_change_sec', DEFAULT_TOOL_CHANGE_SEC), cache=self.parse_cache,
+                                  macro_variables=self.config_manager.data.get('macro_variables'))
+        self.lbl_run_time.setText(f"預估加工時間: {res['total_time']:.1f} 分")
+        tips = [f"T{tool_id}: {t['total_time']:.1f} 分 ({t['holes']} 孔)" for tool_id, t in res['tools'].items()]
+        if res['calls']:
+            tips.append(f"子程式呼叫: {res['calls']} 次 (總孔數 {res['holes']})")
+        if res['macros']:
+            tips.append("G66 以宏程式本體計時: " + ", ".join(f"O{n}" for n in res['macros']))
+        if res['macro_errors']:
+            tips.append("無法解析的宏程式 (改用近似模型): " + ", ".join(f"O{n}" for n in res['macro_errors']))
+        if res['unresolved']:
+            tips.append("找不到的子程式: " + ", ".join(f"O{n}" for n in res['unresolved']))
+        if res['recursive']:
+            tips.append("遞迴呼叫 (未計入): " + ", ".join(f"O{n}" for n in res['recursive']))
+        if res['unknown_moves']:
+            tips.append(f"無法計時的移動: {res['unknown_moves']}")
+        self.lbl_run_time.setToolTip("\n".join(tips))
+
+    def on_reorder_holes_clicked(self):
+        """最佳化目前循環的孔位順序並回報節省的定位時間。"""
+        if self.current_tool_index == -1: return
+        res = self.parser.reorder_cycle_holes(self.current_tool_index, self.spin_g0_speed.value())
+        if res is None:
+            QMessageBox.warning(self, "提示", "此循環無法自動重排 (增量座標、循環內含其他指令或孔位不足)。")
+            return
+        self.txt_nc_preview.setHtml(self.parser.generate_html(self.current_tool_index))
+        self.update_run_time()
+        QMessageBox.information(
+            self, "孔位順序",
+            f"{res['holes']} 孔\n定位距離: {res['before_length']:.1f} → {res['after_length']:.1f} mm\n"
+            f"節省時間: {res['saved_time'] * 60:.1f} 秒")
+
+    def on_optimize_retract_clicked(self):
+        """依目前的原點設定 (工件上面) 與設定檔的障礙物降低退刀高度並回報節省的時間。"""
+        if self.current_tool_index == -1: return
+        options = dict(self.config_manager.data.get('retract', {}))
+        obstacles = options.pop('obstacles', [])
+        top = stock_top_z(self.get_visual_params()['origin_z_shift'])
+        res = optimize_retract(self.parser, self.current_tool_index, top, obstacles,
+                               g0_speed=self.spin_g0_speed.value(), **options)
+        if res is None or res['saved_time'] <= 0:
+            QMessageBox.information(self, "退刀高度", "此循環的退刀高度已是最佳或無法自動調整。")
+            return
+        self.on_tool_selected(self.current_tool_index)
+        self.txt_nc_preview.setHtml(self.parser.generate_html(self.current_tool_index))
+        self.update_run_time()
+        lines = [f"R: {res['R'][0]:.3f} → {res['R'][1]:.3f}"]
+        if res['S'] is not None:
+            lines.append(f"S: {res['S'][0]:.3f} → {res['S'][1]:.3f}")
+        if res['modes'] is not None:
+            lines.append(f"G98 退刀孔位: {res['g98_rows']}")
+        lines.append(f"節省移動距離: {res['saved_distance']:.1f} mm")
+        lines.append(f"節省時間: {res['saved_time'] * 60:.1f} 秒")
+        QMessageBox.information(self, "退刀高度", "\n".join(lines))
+
+    def on_check_holes_clicked(self):
+        """以孔位空間索引回報重複加工的孔位與各刀號在同一位置的加工順序。"""
+        if not self.parsed_data: return
+        index = self.parser.hole_index()
+        duplicates = index.duplicates()
+        lines = [f"孔位總數: {len(index)}", f"同刀號重複加工: {len(duplicates)} 處"]
+        for dup in duplicates[:10]:
+            where = ", ".join(f"行 {self.parsed_data[c]['line_index'] + 1}" for c, _ in dup['holes'])
+            lines.append(f"  T{dup['tool_id']} X{dup['xy'][0]:.4f} Y{dup['xy'][1]:.4f} ({where})")
+        if len(duplicates) > 10:
+            lines.append(f"  ... 其餘 {len(duplicates) - 10} 處")
+        chains = index.chain_summary()
+        if chains:
+            lines.append("")
+            lines.append("同一位置的刀具順序:")
+            for tools, count in sorted(chains.items(), key=lambda item: -item[1]):
+                lines.append(f"  {' → '.join('T' + t for t in tools)}: {count} 孔")
+        QMessageBox.information(self, "孔位檢查", "\n".join(lines))
+
+    def on_air_cut_clicked(self):
+        """以素材高度圖 (設定檔的檔案或原點設定的素材上面) 偵測空切削，確認後將可安全改寫的移動改為 G0。"""
+        if self.current_file is None: return
+        options = dict(self.config_manager.data.get('air_cut', {}))
+        stock_path = options.pop('stock_map', '')
+        try:
+            stock = StockMap.load(stock_path) if stock_path else \
+                StockMap.plate(stock_top_z(self.get_visual_params()['origin_z_shift']))
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "錯誤", f"無法讀取素材高度圖: {e}")
+            return
+        plan = plan_air_cuts(self.parser, stock, g0_speed=self.spin_g0_speed.value(), **options)
+        if not plan['air_moves']:
+            QMessageBox.information(self, "空切削", "沒有全程在素材上方的進給移動。")
+            return
+        lines = [f"空切削移動: {plan['air_moves']} 單節 ({len(plan['runs'])} 段)",
+                 f"進給時間: {plan['air_time'] * 60:.1f} 秒，浪費時間: {plan['wasted_time'] * 60:.1f} 秒"]
+        for run in plan['runs'][:10]:
+            lines.append(f"  T{run['tool_id']} 行 {run['start'] + 1}~{run['end'] + 1}: {run['length']:.1f} mm, "
+                         f"{run['wasted_time'] * 60:.1f} 秒" + ("" if run['rapid'] else " (不可改為 G0)"))
+        if len(plan['runs']) > 10:
+            lines.append(f"  ... 其餘 {len(plan['runs']) - 10} 段")
+        if not plan['rewrite']:
+            QMessageBox.information(self, "空切削", "\n".join(lines + ["", "沒有可安全改寫為 G0 的移動。"]))
+            return
+        lines += ["", f"可改寫為 G0: {len(plan['rewrite'])} 單節，節省 {plan['saved_time'] * 60:.1f} 秒", "是否改寫程式？"]
+        reply = QMessageBox.question(self, "空切削", "\n".join(lines))
+        if reply != QMessageBox.StandardButton.Yes: return
+        apply_air_cuts(self.parser, plan)
+        self.parsed_data = self.parser.tools_data
+        if self.current_tool_index != -1:
+            self.txt_nc_preview.setHtml(self.parser.generate_html(self.current_tool_index))
+        self.update_run_time()
+
+    def on_merge_tool_changes_clicked(self):
+        """預覽換刀合併結果，確認後重排程式並重新載入刀具清單。"""
+        if self.current_file is None: return
+        precedence = self.config_manager.data.get('tool_precedence', [])
+        tool_change_sec = self.config_manager.data.get('machine', {}).get('tool_change_sec', DEFAULT_TOOL_CHANGE_SEC)
+        plan = plan_tool_changes(self.parser, precedence, tool_change_sec)
+        if not plan['merged']:
+            QMessageBox.information(self, "合併換刀", "沒有可安全合併的重複換刀。")
+            return
+        order = " → ".join(f"T{step['tool_id']}" + ("*" if step['merged'] else "") for step in plan['sequence'])
+        reply = QMessageBox.question(
+            self, "合併換刀",
+            f"換刀次數: {plan['tool_changes']} → {plan['tool_changes_after']}\n"
+            f"節省時間: {plan['saved_time'] * 60:.0f} 秒\n\n新順序 (* 為合併): {order}\n\n是否重排程式？")
+        if reply != QMessageBox.StandardButton.Yes: return
+        consolidate_tool_changes(self.parser, precedence, tool_change_sec)
+        self.parsed_data = self.parser.tools_data
+        self.current_tool_index = -1
+        self.refresh_tool_list()
+        self.update_run_time()
+        if self.parsed_data:
+            self.tool_list.setCurrentRow(0)
+
     def close_file(self):
         self.parsed_data, self.current_file, self.current_tool_index = [], None, -1
-        self.parser = RokuNCParser()
+        self.parser.close()
+        self.parser = RokuNCParser(cache=self.parse_cache)
         self.tool_list.clear()
         self.txt_nc_preview.clear()
         self.lbl_file.setText("尚未載入檔案")
+        self.lbl_run_time.setText("預估加工時間: --"); self.lbl_run_time.setToolTip("")
         self.lbl_cycle_type.setText("")
         self.btn_close.setEnabled(False)
+        self.btn_reorder.setEnabled(False)
+        self.btn_optimize_all.setEnabled(False)
+        self.btn_merge_tools.setEnabled(False)
+        self.btn_retract.setEnabled(False)
+        self.btn_check_holes.setEnabled(False)
+        self.btn_air_cut.setEnabled(False)
         self.spin_r.blockSignals(True); self.spin_z.blockSignals(True)
         self.spin_r.setValue(0.0); self.spin_z.setValue(0.0); self.spin_s.setValue(0.0)
         self.spin_t.setValue(0.0); self.spin_q.setValue(0.0); self.spin_f.setValue(0.0)
@@ -497,6 +734,28 @@ class MainWindow(QMainWindow):
         self.combo_cycle.setVisible(False); self.table_ijk.setRowCount(0)
         self.update_visualization()
 
+    def eventFilter(self, obj, event):
+        if obj is self.txt_nc_preview.viewport() and event.type() == QEvent.Type.MouseButtonRelease:
+            href = self.txt_nc_preview.anchorAt(event.position().toPoint())
+            if href.startswith('line:'):
+                self.on_preview_line_clicked(int(href[5:]))
+        return super().eventFilter(obj, event)
+
+    def on_preview_line_clicked(self, line_idx):
+        """以循環區間索引找出該行所屬的循環並選取；不在循環模態中時顯示該行的模態狀態。"""
+        if not self.parsed_data: return
+        row = self.parser.cycle_at(line_idx)
+        if row is not None:
+            if row != self.current_tool_index:
+                self.tool_list.setCurrentRow(row)
+            return
+        modal = self.parser.modal_at(line_idx)
+        if modal is None: return
+        QToolTip.showText(QCursor.pos(),
+                          f"行 {line_idx + 1}: T{modal['tool_id']} S{modal['rpm']} "
+                          f"{'G91' if modal['incremental'] else 'G90'} {modal['retract']} (不在循環模態中)",
+                          self.txt_nc_preview)
+
     def on_tool_selected(self, row):
         if row < 0 or row >= len(self.parsed_data): return
         self.current_tool_index = row
@@ -580,6 +839,9 @@ class MainWindow(QMainWindow):
 
         # 刀具直徑處理
         detected_dia = data.get('detected_diameter')
+        if not detected_dia:
+            # 換刀行附近未標示 D 值時，改以 D 字索引查詢循環行附近的標示
+            detected_dia = self.parser.diameter_near(data['line_index'])
         if detected_dia is not None and detected_dia > 0:
             self.spin_tool_dia.setValue(detected_dia)
         
@@ -839,12 +1101,30 @@ class MainWindow(QMainWindow):
         if self.current_tool_index == -1: return
         data = self.parsed_data[self.current_tool_index]
         if data.get('cycle_type') != 'G83': return
-        params = {'R': self.spin_r.value(), 'Z': self.spin_z.value(), 'Q': self.spin_q.value(),
-                  'I': self.spin_g83_i.value(), 'J': self.spin_g83_j.value(), 'K': self.spin_g83_k.value()}
-        new_ijk = self.parser._g83_to_ijk(params, 'G83', data.get('use_ijk_mode', False))
+        schedule = self.current_peck_schedule()
+        if schedule.exceeds_limit:
+            # 超過展開上限：不列出每跳明細，跳數與時間改由排程計算 (update_visualization)
+            new_ijk = []
+            self.lbl_table_items.setText(f"鑽孔階段分解預覽 (共 {schedule.count} 跳，超過上限 {schedule.max_pecks}，不展開):")
+            self.lbl_table_items.setStyleSheet("color: #d9534f;")
+        else:
+            new_ijk = schedule.ijk_list()
+            self.lbl_table_items.setText("鑽孔階段分解預覽 (計算結果):")
+            self.lbl_table_items.setStyleSheet("")
         self.table_ijk.blockSignals(True); self.table_ijk.load_data(new_ijk); self.table_ijk.blockSignals(False)
         self.update_internal_data(); self.update_visualization()
 
+    def peck_schedule(self, params, use_ijk_mode):
+        """G83 啄鑽排程，展開上限取自設定檔 limits.max_pecks。"""
+        return PeckSchedule.from_params(params, use_ijk_mode, int(self.config_manager.get_limit('max_pecks')))
+
+    def current_peck_schedule(self):
+        """目前 G83 參數 (數值欄位) 的啄鑽排程。"""
+        data = self.parsed_data[self.current_tool_index]
+        params = {'R': self.spin_r.value(), 'Z': self.spin_z.value(), 'Q': self.spin_q.value(),
+                  'I': self.spin_g83_i.value(), 'J': self.spin_g83_j.value(), 'K': self.spin_g83_k.value()}
+        return self.peck_schedule(params, data.get('use_ijk_mode', False))
+
     def on_table_row_clicked(self, row, col):
         if self.current_tool_index == -1: return
         self.plot_widget.update_plot(self.spin_r.value(), self.spin_z.value(), self.table_ijk.get_data(), self.get_visual_params(), highlight_peck_idx=row)
@@ -903,14 +1183,23 @@ class MainWindow(QMainWindow):
             init_s = data.get('initial_static', {})
             
             if cycle_type == 'G83':
-                curr_p = {'ijk_list': ijk, 'feedrate': self.spin_f.value(), 'r_point': r_val, 'is_ijk_mode': data.get('use_ijk_mode', False)}
-                init_p = {'ijk_list': data.get('initial_dynamic', []), 'feedrate': init_s.get('F', 0.0), 'r_point': init_s.get('R', r_val), 'is_ijk_mode': data.get('initial_use_ijk_mode', False)}
+                # 以啄鑽排程比較：跳數超過展開上限 (表格未展開) 時仍以實際跳數與時間計算
+                init_sched = self.peck_schedule(init_s, data.get('initial_use_ijk_mode', False))
+                curr_p = {'schedule': self.current_peck_schedule(), 'feedrate': self.spin_f.value(), 'r_point': r_val}
+                init_p = {'schedule': init_sched, 'feedrate': init_s.get('F', 0.0), 'r_point': init_s.get('R', r_val)}
             else:
                 # G66 模式：傳入 segments 進行對比
                 curr_p = {'segments': ijk, 'r_point': r_val}
                 init_p = {'segments': data.get('initial_dynamic', []), 'r_point': init_s.get('R', r_val)}
                 
-            res = self.analysis_engine.compare_efficiency(curr_p, init_p, cycle_type, self.spin_g0_speed.value())
+            try:
+                res = self.analysis_engine.compare_efficiency(curr_p, init_p, cycle_type, self.spin_g0_speed.value())
+            except PeckLimitError as e:
+                self.grp_efficiency.setVisible(True)
+                self.lbl_eff_pecks.setText(f"無法比較: {e}")
+                self.lbl_eff_time.setText("預估效率: --")
+                self.lbl_eff_time.setStyleSheet("font-size: 15px; font-weight: bold; color: #666;")
+                return
             self.grp_efficiency.setVisible(True)
             
             peck_t = f"跳數變化: {res['init_pecks']} -> {res['curr_pecks']}"
@@ -1062,6 +1351,74 @@ class MainWindow(QMainWindow):
         self._update_life_analysis_ui(result)
         QMessageBox.information(self, "成功", "參數已優化完成！（含自動微調 Q/J）")
 
+    def on_optimize_all_clicked(self):
+        """以背景執行緒 (多程序) 最佳化所有循環並顯示進度，完成後一次寫回程式並更新預覽。"""
+        if not self.parsed_data or self.optimize_worker is not None: return
+        settings = {
+            'material_key': self.combo_work_mat.currentData(),
+            'tool_mat_key': self.combo_tool_mat.currentData(),
+            'coolant_mode': self.combo_coolant.currentData(),
+            'material_thickness': self.spin_thickness.value(),
+            'exit_chamfer': self.spin_exit_chamfer.value(),
+            'tip_angle': self.spin_tip_angle.value(),
+            'config': self.config_manager,
+            'taylor_n': self.spin_life_n.value(),
+        }
+        jobs = build_jobs(self.parser)
+        progress = QProgressDialog("最佳化循環參數...", "取消", 0, len(jobs), self)
+        progress.setWindowTitle("全部最佳化")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+
+        worker = OptimizeWorker(jobs, settings, self)
+        worker.progressChanged.connect(progress.setValue)
+        progress.canceled.connect(worker.requestInterruption)
+        worker.finished.connect(lambda: self.on_optimize_all_finished(worker, progress))
+        self.optimize_worker = worker
+        self.btn_optimize_all.setEnabled(False)
+        worker.start()
+
+    def closeEvent(self, event):
+        # 背景最佳化仍在執行時先停止並等待結束，避免執行緒在視窗銷毀後仍存取視窗
+        if self.optimize_worker is not None:
+            self.optimize_worker.finished.disconnect()
+            self.optimize_worker.requestInterruption()
+            self.optimize_worker.wait()
+        self.parser.close()
+        super().closeEvent(event)
+
+    def on_optimize_all_finished(self, worker, progress):
+        """背景最佳化結束 (完成、取消或失敗)：完成時才將結果寫回程式。"""
+        self.optimize_worker = None
+        self.btn_optimize_all.setEnabled(bool(self.parsed_data))
+        canceled = progress.wasCanceled()
+        progress.close()
+        worker.deleteLater()
+        jobs, results = worker.jobs, worker.results
+        if worker.error is not None:
+            QMessageBox.critical(self, "全部最佳化", f"最佳化失敗，程式未修改：\n{worker.error}")
+            return
+        if canceled or len(results) < len(jobs):
+            QMessageBox.information(self, "全部最佳化", "已取消，程式未修改。")
+            return
+
+        report = apply_results(self.parser, results)
+        self.parsed_data = self.parser.tools_data
+        if self.current_tool_index != -1:
+            self.on_tool_selected(self.current_tool_index)
+        self.update_run_time()
+        skipped = [self.parsed_data[res['index']] for res in results if 'error' in res]
+        lines = [f"已最佳化 {report['applied']} / {len(jobs)} 個循環。"]
+        if skipped:
+            lines.append("無法取得刀具直徑 (未修改): " + ", ".join(
+                f"T{rec['tool_id']} (行 {rec['line_index'] + 1})" for rec in skipped[:10]))
+        for conflict in report['rpm_conflicts'][:10]:
+            rpms = ", ".join(f"T{self.parsed_data[i]['tool_id']} (行 {self.parsed_data[i]['line_index'] + 1}): S{rpm}"
+                             for i, rpm in conflict['rpms'].items())
+            lines.append(f"第 {conflict['line'] + 1} 行的 S 指令由多個循環共用，建議轉速不同 (未修改): {rpms}")
+        QMessageBox.information(self, "全部最佳化", "\n".join(lines))
+
     def _run_refine_silent(self):
         """
         靜默執行微調邏輯 (不彈出對話框)。